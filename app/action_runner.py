@@ -1,12 +1,13 @@
 from __future__ import annotations
 
+import asyncio
 import json
 import subprocess
 import sys
 from pathlib import Path
 from typing import Any
 
-from .claude_agent_sdk_runner import run_structured_json_schema
+from .claude_agent_sdk_runner import run_structured_json_schema, run_structured_json_schema_async
 from .settings import get_settings
 
 
@@ -46,6 +47,76 @@ def _resolve_agent_path(agent_name: str) -> str:
     return f"app/agents/{agent_name}.md"
 
 
+def _command_argv(handler_target: str | None) -> list[str]:
+    commands_path = get_settings().app_commands_path
+    full_path = _safe_relpath(commands_path)
+    if not full_path.exists():
+        raise RuntimeError(f"Missing commands file: {commands_path}")
+
+    commands = json.loads(full_path.read_text(encoding="utf-8"))
+    if not isinstance(commands, dict):
+        raise RuntimeError("commands.json must be an object mapping name -> argv list")
+
+    if not handler_target:
+        raise RuntimeError("handler_target required for command mode")
+    argv = commands.get(handler_target)
+    if not isinstance(argv, list) or not all(isinstance(x, str) for x in argv):
+        raise RuntimeError(f"Unknown or invalid command target: {handler_target!r}")
+    return argv
+
+
+def _command_stdin(action: str, router: dict[str, Any], event_payload: dict[str, Any]) -> bytes:
+    return json.dumps(
+        {"action": action, "router": router, "payload": event_payload},
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def _agent_argv(handler_target: str | None) -> list[str]:
+    if not handler_target:
+        raise RuntimeError("handler_target required for agent mode")
+    prompt_path = handler_target
+    if not (prompt_path.endswith(".md") or "/" in prompt_path):
+        # Resolve agent name to path, checking .claude/agents/ first
+        prompt_path = _resolve_agent_path(handler_target)
+
+    full_prompt_path = _safe_relpath(prompt_path)
+    return [sys.executable, "-m", "app.agent_cli", "--agent", str(full_prompt_path)]
+
+
+def _agent_stdin(action: str, router: dict[str, Any], event_payload: dict[str, Any]) -> bytes:
+    prompt_obj = {"action": action, "router": router, "payload": event_payload}
+    return json.dumps(prompt_obj, ensure_ascii=False).encode("utf-8")
+
+
+def _subprocess_result(returncode: int, stdout: bytes, stderr: bytes, *, failure: str) -> dict[str, Any]:
+    out = stdout.decode("utf-8", errors="replace").strip()
+    err = stderr.decode("utf-8", errors="replace").strip()
+    if returncode != 0:
+        raise RuntimeError(f"{failure} (exit {returncode}): {err or out}")
+    try:
+        return json.loads(out) if out else {"stdout": out, "stderr": err}
+    except json.JSONDecodeError:
+        return {"stdout": out, "stderr": err}
+
+
+def _llm_request(action: str, router: dict[str, Any], event_payload: dict[str, Any]) -> dict[str, Any]:
+    schema = {
+        "type": "object",
+        "additionalProperties": True,
+    }
+    prompt = (
+        "Given an event payload and an action name, produce JSON arguments for the action.\n"
+        "Return ONLY JSON."
+    )
+    return {
+        "system_prompt": get_settings().llm_system_prompt or prompt,
+        "prompt": json.dumps({"action": action, "router": router, "payload": event_payload}, ensure_ascii=False),
+        "json_schema": schema,
+    }
+
+
 def run_action(
     *,
     handler_mode: str,
@@ -61,79 +132,82 @@ def run_action(
         return {"mode": "noop", "action": action}
 
     if mode == "command":
-        commands_path = settings.app_commands_path
-        full_path = _safe_relpath(commands_path)
-        if not full_path.exists():
-            raise RuntimeError(f"Missing commands file: {commands_path}")
-
-        commands = json.loads(full_path.read_text(encoding="utf-8"))
-        if not isinstance(commands, dict):
-            raise RuntimeError("commands.json must be an object mapping name -> argv list")
-
-        if not handler_target:
-            raise RuntimeError("handler_target required for command mode")
-        argv = commands.get(handler_target)
-        if not isinstance(argv, list) or not all(isinstance(x, str) for x in argv):
-            raise RuntimeError(f"Unknown or invalid command target: {handler_target!r}")
-
-        stdin_payload = json.dumps(
-            {"action": action, "router": router, "payload": event_payload},
-            ensure_ascii=False,
-            separators=(",", ":"),
-        ).encode("utf-8")
-
-        proc = subprocess.run(argv, input=stdin_payload, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
-        out = proc.stdout.decode("utf-8", errors="replace").strip()
-        err = proc.stderr.decode("utf-8", errors="replace").strip()
-        if proc.returncode != 0:
-            raise RuntimeError(f"command failed (exit {proc.returncode}): {err or out}")
-        try:
-            return json.loads(out) if out else {"stdout": out, "stderr": err}
-        except json.JSONDecodeError:
-            return {"stdout": out, "stderr": err}
+        argv = _command_argv(handler_target)
+        proc = subprocess.run(
+            argv,
+            input=_command_stdin(action, router, event_payload),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=False,
+        )
+        return _subprocess_result(proc.returncode, proc.stdout, proc.stderr, failure="command failed")
 
     if mode == "agent":
-        if not handler_target:
-            raise RuntimeError("handler_target required for agent mode")
-        prompt_path = handler_target
-        if not (prompt_path.endswith(".md") or "/" in prompt_path):
-            # Resolve agent name to path, checking .claude/agents/ first
-            prompt_path = _resolve_agent_path(handler_target)
-
-        full_prompt_path = _safe_relpath(prompt_path)
-        prompt_obj = {"action": action, "router": router, "payload": event_payload}
-
-        timeout_seconds = settings.action_agent_timeout_seconds
+        argv = _agent_argv(handler_target)
         proc = subprocess.run(
-            [sys.executable, "-m", "app.agent_cli", "--agent", str(full_prompt_path)],
-            input=json.dumps(prompt_obj, ensure_ascii=False).encode("utf-8"),
+            argv,
+            input=_agent_stdin(action, router, event_payload),
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             check=False,
-            timeout=timeout_seconds,
+            timeout=settings.action_agent_timeout_seconds,
         )
-        out = proc.stdout.decode("utf-8", errors="replace").strip()
-        err = proc.stderr.decode("utf-8", errors="replace").strip()
-        if proc.returncode != 0:
-            raise RuntimeError(f"agent subprocess failed (exit {proc.returncode}): {err or out}")
+        return _subprocess_result(proc.returncode, proc.stdout, proc.stderr, failure="agent subprocess failed")
+
+    if mode == "llm":
+        return run_structured_json_schema(**_llm_request(action, router, event_payload))
+
+    raise RuntimeError(f"Unsupported handler_mode: {handler_mode!r}")
+
+
+async def _run_subprocess_async(argv: list[str], stdin: bytes, *, timeout: float | None) -> tuple[int, bytes, bytes]:
+    proc = await asyncio.create_subprocess_exec(
+        *argv, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(stdin), timeout=timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        proc.kill()
+        await proc.wait()
+        raise
+    return int(proc.returncode or 0), stdout, stderr
+
+
+async def run_action_async(
+    *,
+    handler_mode: str,
+    handler_target: str | None,
+    action: str,
+    event_payload: dict[str, Any],
+    router: dict[str, Any],
+) -> dict[str, Any]:
+    """
+    `run_action` for the asyncio worker: subprocesses via `asyncio.create_subprocess_exec` and the
+    Claude Agent SDK awaited directly, so no thread is parked per in-flight handler.
+    """
+    settings = get_settings()
+    mode = (handler_mode or "noop").strip().lower()
+
+    if mode in {"", "noop", "none"}:
+        return {"mode": "noop", "action": action}
+
+    if mode == "command":
+        argv = _command_argv(handler_target)
+        rc, out, err = await _run_subprocess_async(argv, _command_stdin(action, router, event_payload), timeout=None)
+        return _subprocess_result(rc, out, err, failure="command failed")
+
+    if mode == "agent":
+        argv = _agent_argv(handler_target)
+        timeout_seconds = settings.action_agent_timeout_seconds
         try:
-            return json.loads(out) if out else {"stdout": out, "stderr": err}
-        except json.JSONDecodeError:
-            return {"stdout": out, "stderr": err}
+            rc, out, err = await _run_subprocess_async(
+                argv, _agent_stdin(action, router, event_payload), timeout=timeout_seconds
+            )
+        except asyncio.TimeoutError as e:
+            raise subprocess.TimeoutExpired(argv, timeout_seconds) from e
+        return _subprocess_result(rc, out, err, failure="agent subprocess failed")
 
     if mode == "llm":
-        schema = {
-            "type": "object",
-            "additionalProperties": True,
-        }
-        prompt = (
-            "Given an event payload and an action name, produce JSON arguments for the action.\n"
-            "Return ONLY JSON."
-        )
-        return run_structured_json_schema(
-            system_prompt=settings.llm_system_prompt or prompt,
-            prompt=json.dumps({"action": action, "router": router, "payload": event_payload}, ensure_ascii=False),
-            json_schema=schema,
-        )
+        return await run_structured_json_schema_async(**_llm_request(action, router, event_payload))
 
     raise RuntimeError(f"Unsupported handler_mode: {handler_mode!r}")
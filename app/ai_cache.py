@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import Any
+
+
+# Bounds on the JSON skeleton, so fingerprinting a huge or deeply nested body stays cheap.
+SKELETON_MAX_DEPTH = 6
+SKELETON_MAX_KEYS = 200
+
+# Headers most senders (or the proxies in front of us) set; they say nothing about who sent the event.
+GENERIC_HEADERS = frozenset(
+    {
+        "accept",
+        "accept-encoding",
+        "accept-language",
+        "authorization",
+        "cache-control",
+        "cdn-loop",
+        "connection",
+        "content-length",
+        "content-type",
+        "cookie",
+        "forwarded",
+        "host",
+        "origin",
+        "referer",
+        "traceparent",
+        "tracestate",
+        "user-agent",
+        "via",
+        "x-real-ip",
+        "x-request-id",
+        "x-request-start",
+    }
+)
+GENERIC_HEADER_PREFIXES = ("x-forwarded-", "cf-", "x-amzn-", "x-railway-", "x-envoy-", "x-b3-")
+# JSON paths a signature requires: the event type and id paths, then top-level keys up to the maximum.
+# A shape without a distinctive header needs at least the minimum, or any small envelope would match.
+SIGNATURE_MAX_JSON_KEYS = 8
+SIGNATURE_MIN_JSON_KEYS_WITHOUT_HEADER = 5
+
+PROPOSED = "proposed"
+INSTALLED = "installed"
+REJECTED = "rejected"
+
+
+@dataclass(frozen=True)
+class ShapeClassification:
+    """
+    AI provider classification cached for one payload shape (`payload_fingerprint`).
+
+    Only shape-level facts are kept: the event type and id are read from each event at
+    `event_type_path` / `event_id_path`. `misses` counts the classifier calls made for the shape
+    (the first one, then one per expiry or re-verification), `hits` the events that found it
+    unexpired (a re-verified event counts as both).
+    """
+
+    fingerprint: str
+    provider: str
+    confidence: float
+    event_type_path: str | None = None
+    event_id_path: str | None = None
+    hits: int = 0
+    misses: int = 0
+    expires_epoch: float = 0.0
+    updated_at: str = ""
+    # The `payload_shape` the classification was made for, how many classifier answers in a row agreed
+    # on provider and event type path, and whether a signature was already derived from it.
+    shape: dict[str, Any] | None = None
+    agreements: int = 0
+    promoted: bool = False
+    # When `agreements` last grew (or restarted), and when the model may next be asked to re-verify.
+    agreed_epoch: float = 0.0
+    verify_after_epoch: float = 0.0
+
+
+@dataclass(frozen=True)
+class ProviderSignature:
+    """
+    A deterministic provider detector learned from AI classifications of one payload shape.
+
+    `conditions` use the routing rule syntax (an `all` block of `path_equals`, `content_type_equals`,
+    `header_present` and `json_path_exists`).
+    `detect_provider` evaluates `installed` signatures; `proposed` ones wait for review
+    (`mapping_cli signature-review`), `rejected` ones are kept so the shape is not proposed again.
+    """
+
+    name: str
+    provider: str
+    confidence: float
+    conditions: dict[str, Any]
+    event_type_path: str | None = None
+    event_id_path: str | None = None
+    status: str = PROPOSED
+    fingerprint: str = ""
+    created_at: str = ""
+    updated_at: str = ""
+
+
+def _skeleton(obj: Any, depth: int) -> Any:
+    if isinstance(obj, dict):
+        if depth <= 0:
+            return "{}"
+        keys = sorted(obj, key=str)[:SKELETON_MAX_KEYS]
+        return {str(k): _skeleton(obj[k], depth - 1) for k in keys}
+    if isinstance(obj, list):
+        # Lists are one shape whatever their length: the first element stands for the rest.
+        return [_skeleton(obj[0], depth - 1)] if obj and depth > 0 else []
+    return None
+
+
+def payload_shape(payload: dict[str, Any]) -> dict[str, Any]:
+    """
+    A payload's structure: sorted header names, the JSON key skeleton (keys only, no values), the
+    content type without parameters and the request path.
+    """
+    headers = payload.get("headers")
+    names = sorted({str(k).strip().lower() for k in headers}) if isinstance(headers, dict) else []
+    return {
+        "headers": names,
+        "json": _skeleton(payload.get("json"), SKELETON_MAX_DEPTH),
+        "content_type": str(payload.get("content_type") or "").split(";", 1)[0].strip().lower(),
+        "path": payload.get("path"),
+    }
+
+
+def payload_fingerprint(payload: dict[str, Any], shape: dict[str, Any] | None = None) -> str:
+    """
+    Hash of `payload_shape`. Events a sender emits for the same kind of notification share it.
+    """
+    shape = payload_shape(payload) if shape is None else shape
+    return hashlib.sha256(json.dumps(shape, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def _distinctive_header(name: str) -> bool:
+    return bool(name) and name not in GENERIC_HEADERS and not name.startswith(GENERIC_HEADER_PREFIXES)
+
+
+def signature_conditions(
+    shape: dict[str, Any], *, event_type_path: str | None, event_id_path: str | None
+) -> dict[str, Any] | None:
+    """
+    Conditions that recognise payloads of `shape`: its request path and content type, its non-generic
+    header names, the event type and id paths and a few more top-level JSON keys. None when the shape
+    is too generic to tell a sender apart: no distinctive header and fewer than
+    `SIGNATURE_MIN_JSON_KEYS_WITHOUT_HEADER` JSON paths.
+    """
+    headers = [h for h in shape.get("headers") or [] if _distinctive_header(str(h))]
+    body = shape.get("json") if isinstance(shape.get("json"), dict) else {}
+    paths = [p for p in dict.fromkeys([event_type_path, event_id_path]) if p]
+    for key in sorted(body):
+        if len(paths) >= SIGNATURE_MAX_JSON_KEYS:
+            break
+        if key not in paths and "." not in key:
+            paths.append(key)
+    if not headers and len(paths) < SIGNATURE_MIN_JSON_KEYS_WITHOUT_HEADER:
+        return None
+    conditions: list[dict[str, Any]] = []
+    if isinstance(shape.get("path"), str):
+        conditions.append({"op": "path_equals", "value": shape["path"]})
+    if shape.get("content_type"):
+        conditions.append({"op": "content_type_equals", "value": shape["content_type"]})
+    conditions += [{"op": "header_present", "name": h} for h in headers]
+    conditions += [{"op": "json_path_exists", "path": p} for p in paths]
+    return {"all": conditions}
+
+
+def promotion_candidate(shape: ShapeClassification, *, min_confidence: float) -> bool:
+    """
+    Whether a cached classification could become a provider signature once it proved stable: not
+    promoted yet, a known provider with an event type path at `min_confidence` or more.
+    """
+    return (
+        not shape.promoted
+        and shape.shape is not None
+        and shape.provider not in ("", "unknown")
+        and shape.event_type_path is not None
+        and shape.confidence >= min_confidence
+    )
+
+
+def promotion_ready(
+    shape: ShapeClassification, *, min_agreements: int, min_confidence: float, min_events: int
+) -> bool:
+    """
+    Whether a cached classification is stable enough to become a provider signature: a
+    `promotion_candidate` given by `min_agreements` classifier answers in a row, for a shape seen on at
+    least `min_events` events.
+    """
+    return (
+        min_agreements > 0
+        and promotion_candidate(shape, min_confidence=min_confidence)
+        and shape.agreements >= min_agreements
+        and shape.hits + shape.misses >= min_events
+    )
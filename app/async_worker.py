@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+import asyncio
+import signal
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from .db import Event
+from .notify import WakeupChannel, open_wakeup_channel
+from .processor import HandlerDeferred, process_event_async
+from .queue_store import QueueStore, open_queue_store
+from .retention import start_store_retention
+from .worker import (
+    LeaseHeartbeat,
+    _record_deferral,
+    _record_failure,
+    _record_success,
+    claim_weights,
+    default_lease_owner,
+)
+
+
+class _DbThreads:
+    """
+    A few threads that run the blocking store calls for the event loop. Each thread opens its own
+    store on first use, since a SQLite connection must not be used from two threads at once.
+    """
+
+    def __init__(self, *, db_path: str, shards: str | None, threads: int, name: str = "async-db") -> None:
+        self._db_path = db_path
+        self._shards = shards
+        self._local = threading.local()
+        self._stores: list[QueueStore] = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix=name)
+
+    def _store(self) -> QueueStore:
+        store = getattr(self._local, "store", None)
+        if store is None:
+            store = open_queue_store(db_path=self._db_path, shards=self._shards)
+            self._local.store = store
+            with self._lock:
+                self._stores.append(store)
+        return store
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Await `fn(store, *args, **kwargs)` on one of these threads.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: fn(self._store(), *args, **kwargs))
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        for store in self._stores:
+            store.close()
+
+
+async def run_async_worker(
+    *,
+    db_path: str,
+    max_in_flight: int = 100,
+    db_threads: int = 4,
+    route_threads: int = 4,
+    poll_interval: float = 1.0,
+    run_once: bool = False,
+    max_attempts: int = 8,
+    batch_size: int = 10,
+    lease_seconds: float = 120.0,
+    reap_interval: float = 30.0,
+    lease_owner: str | None = None,
+    retention_interval: float = 0.0,
+    shards: str | None = None,
+    wakeup: WakeupChannel | None = None,
+    idle_timeout: float = 30.0,
+    stop_event: threading.Event | None = None,
+    claim_mode: str | None = None,
+    fair_weights: str | None = None,
+) -> None:
+    """
+    Asyncio counterpart of `run_worker`: keeps up to `max_in_flight` events in flight in one process.
+
+    Store calls run on `db_threads` database threads. Routing runs on `route_threads` threads of its
+    own: with `MAPPER_USE_AI` it may block on a classifier call for a new payload shape, which must not
+    hold up claims, acks and lease renewals queued behind it. Handlers are awaited on the
+    loop (`run_action_async`: asyncio subprocesses for command/agent mode, the Claude Agent SDK for
+    llm mode), so a slow agent call costs a coroutine instead of a thread. The worker claims whenever
+    a slot is free, and a semaphore bounds the handlers that run at once.
+
+    When `stop_event` is set the worker stops claiming, waits for in-flight events to finish and
+    returns. Whoever sets it should also notify `wakeup`. With `run_once`, it claims one batch,
+    drains it and returns.
+    """
+    weights = claim_weights(claim_mode, fair_weights)
+    max_in_flight = max(1, max_in_flight)
+    db = _DbThreads(db_path=db_path, shards=shards, threads=db_threads)
+    router = _DbThreads(db_path=db_path, shards=shards, threads=route_threads, name="async-route")
+    backend = await db.run(lambda store: (store.init(), store.backend)[1])
+
+    retention_stop = threading.Event()
+    if retention_interval > 0 and not run_once:
+        start_store_retention(
+            backend=backend, db_path=db_path, shards=shards, interval=retention_interval, stop_event=retention_stop
+        )
+
+    wakeup = wakeup or open_wakeup_channel()
+    listener = wakeup.listen() if wakeup is not None and not run_once else None
+    owner = lease_owner or default_lease_owner()
+    heartbeat = LeaseHeartbeat(db_path=db_path, lease_owner=owner, lease_seconds=lease_seconds, shards=shards)
+    heartbeat.start()
+
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max_in_flight)
+    in_flight: set[asyncio.Task[None]] = set()
+    waker: asyncio.Future[bool] | None = None
+    last_reap = 0.0
+
+    async def handle(event: Event) -> None:
+        async with semaphore:
+            try:
+                result = await process_event_async(event, run_db=db.run, run_route=router.run)
+                await db.run(_record_success, event, result, lease_owner=owner)
+            except HandlerDeferred as deferred:
+                await db.run(_record_deferral, event, deferred, lease_owner=owner)
+            except Exception as e:
+                err = f"{type(e).__name__}: {e}\n{traceback.format_exc(limit=5)}"
+                await db.run(_record_failure, event, err, max_attempts=max_attempts, lease_owner=owner)
+            finally:
+                heartbeat.drop(event.id)
+
+    try:
+        while stop_event is None or not stop_event.is_set():
+            if time.monotonic() - last_reap >= reap_interval:
+                reaped = await db.run(
+                    lambda store: store.reap_expired_leases(max_attempts=max_attempts, stale_after_seconds=lease_seconds)
+                )
+                if reaped:
+                    print(f"[reaper] re-queued {reaped} event(s) with expired leases")
+                last_reap = time.monotonic()
+
+            free = max_in_flight - len(in_flight)
+            requested = min(max(1, batch_size), free)
+            events: list[Event] = []
+            if free > 0:
+                events = await db.run(
+                    lambda store: store.claim_events(
+                        limit=requested, lease_owner=owner, lease_seconds=lease_seconds, fair_weights=weights
+                    )
+                )
+            if events:
+                heartbeat.hold([e.id for e in events])
+                for event in events:
+                    task = asyncio.create_task(handle(event))
+                    in_flight.add(task)
+                    task.add_done_callback(in_flight.discard)
+
+            if run_once:
+                break
+            if events and len(events) == requested and len(in_flight) < max_in_flight:
+                continue  # More may be ready; keep filling free slots.
+
+            # Wait for a free slot, new work (wakeup or the next due retry) or the next reaper pass.
+            reap_due_in = reap_interval - (time.monotonic() - last_reap)
+            if len(in_flight) >= max_in_flight:
+                timeout = reap_due_in
+            else:
+                timeout = idle_timeout if listener is not None else poll_interval
+                ready_at = await db.run(lambda store: store.next_ready_at())
+                if ready_at is not None:
+                    timeout = min(timeout, ready_at - time.time())
+                timeout = min(timeout, reap_due_in)
+            timeout = max(0.05, timeout)
+
+            waits: set[asyncio.Future[Any]] = set(in_flight)
+            if listener is not None:
+                if waker is None or waker.done():
+                    waker = loop.run_in_executor(None, listener.wait, timeout)
+                waits.add(waker)
+            if waits:
+                await asyncio.wait(waits, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            else:
+                await asyncio.sleep(timeout)
+
+        if in_flight:
+            await asyncio.gather(*in_flight, return_exceptions=True)
+    finally:
+        if waker is not None and not waker.done() and wakeup is not None:
+            wakeup.notify()
+            await asyncio.wait({waker}, timeout=5)
+        retention_stop.set()
+        heartbeat.stop()
+        if listener is not None:
+            listener.close()
+        router.close()
+        db.close()
+
+
+def run_async_worker_until_signalled(**kwargs: Any) -> None:
+    """
+    Run `run_async_worker` with SIGTERM/SIGINT mapped to a graceful drain (the CLI entry point).
+    """
+    stop_event = threading.Event()
+    wakeup = kwargs.pop("wakeup", None) or open_wakeup_channel()
+
+    async def main() -> None:
+        loop = asyncio.get_running_loop()
+
+        def drain() -> None:
+            stop_event.set()
+            if wakeup is not None:
+                wakeup.notify()
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, drain)
+        await run_async_worker(stop_event=stop_event, wakeup=wakeup, **kwargs)
+
+    asyncio.run(main())
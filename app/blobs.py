@@ -0,0 +1,266 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import zlib
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Iterable
+
+from .settings import get_settings
+
+
+# Documents smaller than this are stored uncompressed; compression would not pay for its header.
+MIN_COMPRESS_BYTES = 128
+
+BLOB_REF_KEY = "$blob"
+
+
+def init_blob_store(conn: sqlite3.Connection) -> None:
+    """
+    Content-addressed JSON store shared by `events` and `action_runs`.
+
+    Rows are keyed by a SHA-256 of the document, so identical payloads (retries, replays, the
+    payload copied into an action run's input) are stored once. `refs` counts the rows pointing at
+    a blob; `release_json` drops blobs whose count reaches zero.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS blobs (
+          hash TEXT PRIMARY KEY,
+          kind TEXT NOT NULL DEFAULT 'json',
+          codec TEXT NOT NULL,
+          size INTEGER NOT NULL,
+          data BLOB NOT NULL,
+          created_at TEXT NOT NULL,
+          refs INTEGER NOT NULL DEFAULT 1
+        );
+        """
+    )
+    existing = {str(r[1]) for r in conn.execute("PRAGMA table_info(blobs);").fetchall()}
+    if "refs" not in existing:
+        # Shared blobs are undercounted until `backfill_refs` has run (schema version 8).
+        conn.execute("ALTER TABLE blobs ADD COLUMN refs INTEGER NOT NULL DEFAULT 1;")
+
+
+@lru_cache(maxsize=1)
+def _zstd() -> Any:
+    try:
+        import zstandard
+    except ImportError as e:
+        raise RuntimeError("blob codec 'zstd' requires the `zstandard` package") from e
+    return zstandard
+
+
+def _compress(raw: bytes, codec: str) -> tuple[str, bytes]:
+    if len(raw) < MIN_COMPRESS_BYTES or codec == "none":
+        return "none", raw
+    if codec == "zstd":
+        return "zstd", _zstd().ZstdCompressor(level=6).compress(raw)
+    if codec == "zlib":
+        return "zlib", zlib.compress(raw, 6)
+    raise ValueError(f"Unsupported blob codec: {codec!r}")
+
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    if codec == "none":
+        return bytes(data)
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "zstd":
+        return _zstd().ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unsupported blob codec: {codec!r}")
+
+
+def _dumps(obj: Any) -> str:
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+def _put_text(conn: sqlite3.Connection, text: str, *, kind: str) -> str:
+    raw = text.encode("utf-8")
+    digest = hashlib.sha256(kind.encode("ascii") + b"\0" + raw).hexdigest()
+    codec, data = _compress(raw, get_settings().blob_codec)
+    conn.execute(
+        """
+        INSERT INTO blobs (hash, kind, codec, size, data, created_at, refs)
+        VALUES (?, ?, ?, ?, ?, ?, 1)
+        ON CONFLICT(hash) DO UPDATE SET refs = refs + 1
+        """,
+        (digest, kind, codec, len(raw), data, datetime.now(timezone.utc).replace(microsecond=0).isoformat()),
+    )
+    return digest
+
+
+def put_json(conn: sqlite3.Connection, obj: Any, *, split: bool = False) -> str:
+    """
+    Store a JSON document (or take another reference to an identical one) and return its hash.
+
+    With `split=True`, each object/array value of a top-level dict is stored as its own blob and the
+    row keeps a small manifest of references. Envelopes such as `{"router": ..., "payload": ...}`
+    then share storage with the payload stored on the event itself.
+    """
+    if split and isinstance(obj, dict):
+        manifest = {
+            k: ({BLOB_REF_KEY: put_json(conn, v)} if isinstance(v, (dict, list)) else v) for k, v in obj.items()
+        }
+        return _put_text(conn, _dumps(manifest), kind="manifest")
+    return _put_text(conn, _dumps(obj), kind="json")
+
+
+def _load_rows(conn: sqlite3.Connection, hashes: Iterable[str], *, kind: str | None = None) -> dict[str, sqlite3.Row]:
+    wanted = sorted({h for h in hashes if h})
+    kind_sql = " AND kind = ?" if kind is not None else ""
+    kind_args = (kind,) if kind is not None else ()
+    rows: dict[str, sqlite3.Row] = {}
+    # Stay well below SQLITE_MAX_VARIABLE_NUMBER on older builds.
+    for i in range(0, len(wanted), 500):
+        chunk = wanted[i : i + 500]
+        placeholders = ",".join("?" for _ in chunk)
+        for row in conn.execute(
+            f"SELECT hash, kind, codec, data FROM blobs WHERE hash IN ({placeholders}){kind_sql}", (*chunk, *kind_args)
+        ).fetchall():
+            rows[str(row["hash"])] = row
+    return rows
+
+
+def get_json_texts(conn: sqlite3.Connection, hashes: Iterable[str]) -> dict[str, str]:
+    """
+    Resolve blob hashes to their JSON text (manifests are expanded). Missing hashes are omitted.
+    """
+    rows = _load_rows(conn, hashes)
+    texts: dict[str, str] = {}
+    manifests: dict[str, dict[str, Any]] = {}
+    for digest, row in rows.items():
+        text = _decompress(row["data"], str(row["codec"])).decode("utf-8")
+        if row["kind"] == "manifest":
+            manifests[digest] = json.loads(text)
+        else:
+            texts[digest] = text
+
+    if manifests:
+        refs = {
+            v[BLOB_REF_KEY] for m in manifests.values() for v in m.values() if isinstance(v, dict) and BLOB_REF_KEY in v
+        }
+        parts = get_json_texts(conn, refs)
+        for digest, manifest in manifests.items():
+            expanded: dict[str, Any] = {}
+            for k, v in manifest.items():
+                if isinstance(v, dict) and BLOB_REF_KEY in v:
+                    ref = v[BLOB_REF_KEY]
+                    expanded[k] = json.loads(parts[ref]) if ref in parts else None
+                else:
+                    expanded[k] = v
+            texts[digest] = _dumps(expanded)
+    return texts
+
+
+def get_json_text(conn: sqlite3.Connection, digest: str) -> str | None:
+    return get_json_texts(conn, [digest]).get(digest)
+
+
+def resolve_json_columns(conn: sqlite3.Connection, rows: list[dict[str, Any]], columns: dict[str, str]) -> None:
+    """
+    For each `text_key -> hash_key` in `columns`, replace `row[text_key]` with the stored document
+    when the row references a blob via `row[hash_key]`. Rows without a hash keep their inline JSON.
+    """
+    hashes = [row.get(hash_key) for row in rows for hash_key in columns.values()]
+    texts = get_json_texts(conn, [h for h in hashes if h])
+    for row in rows:
+        for text_key, hash_key in columns.items():
+            digest = row.get(hash_key)
+            if digest:
+                row[text_key] = texts.get(digest)
+
+
+def release_json(conn: sqlite3.Connection, hashes: Iterable[str | None]) -> int:
+    """
+    Drop one reference per hash (manifests release their parts too). Returns the number of blobs deleted.
+    """
+    pending = [h for h in hashes if h]
+    deleted = 0
+    while pending:
+        manifests = _load_rows(conn, pending, kind="manifest")
+        parts: list[str] = []
+        for digest in pending:
+            row = manifests.get(digest)
+            if row is None:
+                continue
+            # A manifest took one reference on each part every time it was stored.
+            manifest = json.loads(_decompress(row["data"], str(row["codec"])).decode("utf-8"))
+            parts.extend(v[BLOB_REF_KEY] for v in manifest.values() if isinstance(v, dict) and BLOB_REF_KEY in v)
+        for digest in pending:
+            conn.execute("UPDATE blobs SET refs = refs - 1 WHERE hash = ?", (digest,))
+        for i in range(0, len(pending), 500):
+            chunk = sorted(set(pending[i : i + 500]))
+            placeholders = ",".join("?" for _ in chunk)
+            deleted += conn.execute(f"DELETE FROM blobs WHERE hash IN ({placeholders}) AND refs <= 0", chunk).rowcount
+        pending = parts
+    return deleted
+
+
+def _manifest_parts(row: sqlite3.Row) -> list[str]:
+    manifest = json.loads(_decompress(row["data"], str(row["codec"])).decode("utf-8"))
+    return [v[BLOB_REF_KEY] for v in manifest.values() if isinstance(v, dict) and BLOB_REF_KEY in v]
+
+
+def _column_refs(conn: sqlite3.Connection, hashes_sql: str, args: tuple[Any, ...]) -> dict[str, int]:
+    """
+    Event and action run columns pointing at each hash selected by `hashes_sql`.
+    """
+    rows = conn.execute(
+        f"""
+        SELECT h, COUNT(*) FROM (
+          SELECT payload_hash AS h FROM events WHERE payload_hash IN ({hashes_sql})
+          UNION ALL SELECT result_hash FROM events WHERE result_hash IN ({hashes_sql})
+          UNION ALL SELECT input_hash FROM action_runs WHERE input_hash IN ({hashes_sql})
+          UNION ALL SELECT output_hash FROM action_runs WHERE output_hash IN ({hashes_sql})
+        )
+        GROUP BY h
+        """,
+        args * 4,
+    ).fetchall()
+    return {str(r[0]): int(r[1]) for r in rows}
+
+
+def backfill_refs(conn: sqlite3.Connection, after_id: int, up_to_id: int) -> None:
+    """
+    Recount `refs` for the blobs with `after_id < rowid <= up_to_id` (a `Backfill` over `blobs`).
+
+    A blob is referenced by the event / action run columns holding its hash, plus once per part by each
+    of those references to a manifest naming it. Parts are stored before their manifests, so in rowid
+    order a part is recounted again whenever a manifest naming it comes by; `blob_manifest_parts`
+    remembers the manifests seen so far. Counts are only raised: writers running meanwhile keep `refs`
+    current, and a database whose `refs` column was added with every blob at 1 gets its shared blobs
+    counted before retention releases them.
+    """
+    batch = (after_id, up_to_id)
+    counts = _column_refs(conn, "SELECT hash FROM blobs WHERE rowid > ? AND rowid <= ?", batch)
+    conn.executemany("UPDATE blobs SET refs = MAX(refs, ?) WHERE hash = ?", [(n, h) for h, n in counts.items()])
+
+    touched: set[str] = set()
+    for row in conn.execute(
+        "SELECT hash, codec, data FROM blobs WHERE rowid > ? AND rowid <= ? AND kind = 'manifest'", batch
+    ).fetchall():
+        parts = _manifest_parts(row)
+        conn.executemany(
+            "INSERT OR REPLACE INTO blob_manifest_parts (manifest_hash, part_hash, n) VALUES (?, ?, ?)",
+            [(str(row["hash"]), part, parts.count(part)) for part in set(parts)],
+        )
+        touched.update(parts)
+
+    wanted = sorted(touched)
+    for i in range(0, len(wanted), 500):
+        chunk = tuple(wanted[i : i + 500])
+        placeholders = ",".join("?" for _ in chunk)
+        links = conn.execute(
+            f"SELECT manifest_hash, part_hash, n FROM blob_manifest_parts WHERE part_hash IN ({placeholders})", chunk
+        ).fetchall()
+        manifest_refs = _column_refs(
+            conn, f"SELECT manifest_hash FROM blob_manifest_parts WHERE part_hash IN ({placeholders})", chunk
+        )
+        totals = _column_refs(conn, placeholders, chunk)
+        for link in links:
+            part = str(link["part_hash"])
+            totals[part] = totals.get(part, 0) + manifest_refs.get(str(link["manifest_hash"]), 0) * int(link["n"])
+        conn.executemany("UPDATE blobs SET refs = MAX(refs, ?) WHERE hash = ?", [(n, h) for h, n in totals.items()])
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import dataclasses
+from dataclasses import dataclass
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+@dataclass(frozen=True)
+class CircuitBreaker:
+    """
+    Shared breaker state for one handler, keyed on `(handler_mode, handler_target)`.
+
+    `closed`: calls run and `consecutive_failures` counts failures (timeouts included) since the last success.
+    `open`: calls are deferred until `open_until` (epoch seconds) without running.
+    `half_open`: one probe call (`probe_event_row_id`, until `probe_expires`) decides whether to close again.
+    `open_seconds` is the current cool-down; it doubles every time a probe fails.
+    """
+
+    handler_mode: str
+    handler_target: str
+    state: str = CLOSED
+    consecutive_failures: int = 0
+    open_until: float = 0.0
+    open_seconds: float = 0.0
+    probe_event_row_id: int | None = None
+    probe_expires: float = 0.0
+    last_error: str | None = None
+    updated_at: str = ""
+
+
+def breaker_target(handler_target: str | None) -> str:
+    return handler_target or ""
+
+
+def admit_call(
+    breaker: CircuitBreaker | None, *, event_row_id: int, now: float, probe_lease: float
+) -> tuple[float | None, CircuitBreaker | None]:
+    """
+    Whether `event_row_id` may call the handler now.
+
+    Returns `(retry_epoch, updated)`: `retry_epoch` is None when the call may run, else when to try again.
+    `updated` is the state to store, or None when nothing changed (always the case for a closed breaker).
+    """
+    if breaker is None or breaker.state == CLOSED:
+        return None, None
+    if breaker.state == OPEN and now < breaker.open_until:
+        return breaker.open_until, None
+    if breaker.state == HALF_OPEN:
+        if breaker.probe_event_row_id == event_row_id:
+            return None, None
+        if now < breaker.probe_expires:
+            return min(breaker.probe_expires, now + max(1.0, breaker.open_seconds)), None
+    # Cool-down over (or the last probe's worker went away): this call is the probe.
+    probe = dataclasses.replace(
+        breaker, state=HALF_OPEN, probe_event_row_id=event_row_id, probe_expires=now + probe_lease
+    )
+    return None, probe
+
+
+def record_call(
+    breaker: CircuitBreaker | None,
+    *,
+    handler_mode: str,
+    handler_target: str,
+    ok: bool,
+    event_row_id: int,
+    now: float,
+    failure_threshold: int,
+    open_seconds: float,
+    max_open_seconds: float,
+    error: str | None = None,
+) -> CircuitBreaker | None:
+    """
+    Fold one call's outcome into the breaker. Returns the state to store, or None when nothing changed.
+
+    A success closes the breaker. A failure trips a closed breaker once `failure_threshold` failures
+    in a row have been seen, and re-opens a half-open one with twice the cool-down (up to
+    `max_open_seconds`) when the probe fails. Failures of calls that started before the breaker
+    opened only update the counters.
+    """
+    if ok:
+        if breaker is None or (breaker.state == CLOSED and breaker.consecutive_failures == 0):
+            return None
+        return dataclasses.replace(
+            breaker,
+            state=CLOSED,
+            consecutive_failures=0,
+            open_until=0.0,
+            open_seconds=0.0,
+            probe_event_row_id=None,
+            probe_expires=0.0,
+        )
+
+    current = breaker or CircuitBreaker(handler_mode=handler_mode, handler_target=handler_target)
+    failures = current.consecutive_failures + 1
+    if current.state == HALF_OPEN and current.probe_event_row_id == event_row_id:
+        cool_down = min(max_open_seconds, max(open_seconds, current.open_seconds * 2))
+    elif current.state == CLOSED and failures >= max(1, failure_threshold):
+        cool_down = open_seconds
+    else:
+        return dataclasses.replace(current, consecutive_failures=failures, last_error=error)
+    return dataclasses.replace(
+        current,
+        state=OPEN,
+        consecutive_failures=failures,
+        open_until=now + cool_down,
+        open_seconds=cool_down,
+        probe_event_row_id=None,
+        probe_expires=0.0,
+        last_error=error,
+    )
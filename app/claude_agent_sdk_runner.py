@@ -18,6 +18,20 @@ def run_structured_json_schema(
     prompt: str,
     json_schema: dict[str, Any],
 ) -> dict[str, Any]:
+    return asyncio.run(
+        run_structured_json_schema_async(system_prompt=system_prompt, prompt=prompt, json_schema=json_schema)
+    )
+
+
+async def run_structured_json_schema_async(
+    *,
+    system_prompt: str | None,
+    prompt: str,
+    json_schema: dict[str, Any],
+) -> dict[str, Any]:
+    """
+    Same as `run_structured_json_schema`, awaited on the caller's event loop (used by `app.async_worker`).
+    """
     from claude_agent_sdk import query
     from claude_agent_sdk.types import ClaudeAgentOptions, ResultMessage
 
@@ -59,7 +73,7 @@ def run_structured_json_schema(
 
     timeout_seconds = get_settings().claude_agent_timeout_seconds
     try:
-        out = asyncio.run(asyncio.wait_for(_run(), timeout=timeout_seconds))
+        out = await asyncio.wait_for(_run(), timeout=timeout_seconds)
     except asyncio.TimeoutError as e:
         raise RuntimeError(f"Claude Agent SDK timed out after {timeout_seconds}s") from e
     if out is None:
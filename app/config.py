@@ -2,11 +2,12 @@ from __future__ import annotations
 
 import json
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Any
 
-from .db import init_db, upsert_provider_mapping, upsert_routing_rule
+from .handler_limits import HandlerLimit, parse_limits
+from .queue_store import as_queue_store
 from .settings import get_settings
 
 
@@ -15,6 +16,7 @@ class AppConfig:
     version: int
     mappings: list[dict[str, Any]]
     rules: list[dict[str, Any]]
+    limits: list[HandlerLimit] = field(default_factory=list)
 
 
 def load_config(path: str | None = None) -> AppConfig | None:
@@ -37,24 +39,27 @@ def load_config(path: str | None = None) -> AppConfig | None:
     if not isinstance(rules, list) or not all(isinstance(x, dict) for x in rules):
         raise ValueError("config.rules must be a list of objects.")
 
-    return AppConfig(version=version, mappings=mappings, rules=rules)
+    limits = parse_limits(obj.get("limits"))
+
+    return AppConfig(version=version, mappings=mappings, rules=rules, limits=limits)
 
 
 def apply_config(conn: Any, config: AppConfig) -> None:
-    init_db(conn)
+    store = as_queue_store(conn)
+    store.init()
 
     for m in config.mappings:
         provider = str(m.get("provider") or "").strip().lower()
         action = str(m.get("action") or "").strip()
         if not provider or not action:
             continue
-        upsert_provider_mapping(
-            conn,
+        store.upsert_provider_mapping(
             provider=provider,
             action=action,
             handler_mode=str(m.get("handler_mode") or "noop"),
             handler_target=m.get("handler_target"),
             enabled=bool(m.get("enabled", True)),
+            queue_priority=None if m.get("queue_priority") is None else int(m["queue_priority"]),
         )
 
     for r in config.rules:
@@ -68,8 +73,7 @@ def apply_config(conn: Any, config: AppConfig) -> None:
         if not isinstance(conditions, dict):
             continue
 
-        upsert_routing_rule(
-            conn,
+        store.upsert_routing_rule(
             provider=provider,
             name=name,
             priority=int(r.get("priority", 100)),
@@ -79,3 +83,13 @@ def apply_config(conn: Any, config: AppConfig) -> None:
             handler_target=r.get("handler_target"),
             enabled=bool(r.get("enabled", True)),
         )
+
+    for limit in config.limits:
+        store.upsert_handler_limit(
+            limit_key=limit.limit_key,
+            max_concurrency=limit.max_concurrency,
+            rate_per_sec=limit.rate_per_sec,
+            burst=limit.burst,
+        )
+
+    store.set_config_version(version=config.version)
@@ -1,10 +1,11 @@
 from __future__ import annotations
 
 import argparse
-import os
 from datetime import datetime, timezone
 
-from .db import enqueue_event, init_db, open_db
+from .mapper import enqueue_priority
+from .notify import open_wakeup_channel
+from .queue_store import open_queue_store
 from .settings import get_settings
 
 
@@ -15,17 +16,26 @@ def main() -> None:
     parser = argparse.ArgumentParser(description="Enqueue a scheduled (cron) job into the same event queue.")
     parser.add_argument("--db", default=DEFAULT_DB_PATH)
     parser.add_argument("--job", required=True, help="Job name, e.g. daily-digest, pipeline-sweep")
+    parser.add_argument(
+        "--priority", type=int, default=None, help="Queue lane (lower is claimed first; default: the cron mapping's)"
+    )
     args = parser.parse_args()
 
-    db_dir = os.path.dirname(args.db)
-    if db_dir:
-        os.makedirs(db_dir, exist_ok=True)
-    conn = open_db(args.db)
-    init_db(conn)
-
-    now = datetime.now(timezone.utc).replace(microsecond=0)
-    event_id = f"cron:{args.job}:{now.isoformat()}"
-    row_id = enqueue_event(conn, source="cron", event_id=event_id, payload={"job": args.job, "scheduled_at": now.isoformat()})
+    store = open_queue_store(db_path=args.db)
+    try:
+        store.init()
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        event_id = f"cron:{args.job}:{now.isoformat()}"
+        payload = {"job": args.job, "scheduled_at": now.isoformat()}
+        priority = args.priority
+        if priority is None:
+            priority = enqueue_priority(store, source="cron", payload=payload)
+        row_id = store.enqueue_event(source="cron", event_id=event_id, payload=payload, priority=priority)
+    finally:
+        store.close()
+    wakeup = open_wakeup_channel()
+    if wakeup is not None:
+        wakeup.notify()
     print(f"queued row_id={row_id} event_id={event_id}")
 
 
@@ -1,19 +1,76 @@
 from __future__ import annotations
 
 import json
+import math
 import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
 from dataclasses import dataclass
-from datetime import datetime, timezone
-from typing import Any
+from datetime import datetime, timedelta, timezone
+from typing import Any, Iterable, Iterator, Mapping
+
+from .blobs import backfill_refs, init_blob_store, put_json, release_json, resolve_json_columns
+from .ai_cache import INSTALLED, ProviderSignature, ShapeClassification
+from .circuit_breaker import CircuitBreaker, admit_call, record_call
+from .fair_share import pick_fair
+from .handler_limits import HandlerLimit, PermitDecision, decide_permit
+from .migrations import Backfill, Migration, migrate
+
+
+DEFAULT_LEASE_SECONDS = 120.0
+# Queue priority: lower is claimed first (same convention as routing rule priority).
+DEFAULT_PRIORITY = 100
+# Retry backoff (`retry_backoff_seconds`), shared by handler failures and expired leases.
+RETRY_BACKOFF_MAX_EXPONENT = 6
+RETRY_BACKOFF_MAX_SECONDS = 60
 
 
 def utc_now_iso() -> str:
     return datetime.now(timezone.utc).replace(microsecond=0).isoformat()
 
 
+def _utc_iso_in(seconds: float) -> str:
+    return (datetime.now(timezone.utc) + timedelta(seconds=seconds)).replace(microsecond=0).isoformat()
+
+
+def retry_backoff_seconds(attempt_count: int) -> int:
+    """
+    Delay before the next try of an event that has failed `attempt_count` times: 2, 4, 8 ... seconds,
+    at most `RETRY_BACKOFF_MAX_SECONDS`.
+    """
+    return min(RETRY_BACKOFF_MAX_SECONDS, 2 ** min(attempt_count, RETRY_BACKOFF_MAX_EXPONENT))
+
+
+def _add_missing_columns(conn: sqlite3.Connection, table: str, columns: dict[str, str]) -> None:
+    existing = {str(r["name"]) for r in conn.execute(f"PRAGMA table_info({table});").fetchall()}
+    for name, decl in columns.items():
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl};")
+
+
+@contextmanager
+def write_transaction(conn: sqlite3.Connection) -> Iterator[None]:
+    """
+    Group the statements in the block into one write transaction (joins an already open one).
+    """
+    if conn.in_transaction:
+        yield
+        return
+    conn.execute("BEGIN IMMEDIATE;")
+    try:
+        yield
+    except BaseException:
+        conn.execute("ROLLBACK;")
+        raise
+    conn.execute("COMMIT;")
+
+
 def open_db(db_path: str) -> sqlite3.Connection:
     conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    # Only takes effect on a new database (must precede WAL); lets retention shrink the file incrementally.
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
     conn.execute("PRAGMA journal_mode=WAL;")
     conn.execute("PRAGMA synchronous=NORMAL;")
     conn.execute("PRAGMA busy_timeout=3000;")
@@ -21,6 +78,19 @@ def open_db(db_path: str) -> sqlite3.Connection:
 
 
 def init_db(conn: sqlite3.Connection) -> None:
+    """
+    Create or upgrade the schema (see `SCHEMA_MIGRATIONS`). On a current database this is a single
+    `PRAGMA user_version` read, so every CLI and worker can call it on startup.
+    """
+    migrate(conn, SCHEMA_MIGRATIONS)
+
+
+def _schema_v1(conn: sqlite3.Connection) -> None:
+    """
+    Baseline schema. Databases created before versioning (user_version 0) are upgraded in place:
+    every statement is idempotent and missing columns are added.
+    """
+    init_blob_store(conn)
     conn.execute(
         """
         CREATE TABLE IF NOT EXISTS events (
@@ -35,10 +105,26 @@ def init_db(conn: sqlite3.Connection) -> None:
           processed_at TEXT,
           payload_json TEXT NOT NULL,
           result_json TEXT,
-          last_error TEXT
+          last_error TEXT,
+          lease_owner TEXT,
+          lease_expires_at TEXT,
+          payload_hash TEXT,
+          result_hash TEXT,
+          priority INTEGER NOT NULL DEFAULT 100
         );
         """
     )
+    _add_missing_columns(
+        conn,
+        "events",
+        {
+            "lease_owner": "TEXT",
+            "lease_expires_at": "TEXT",
+            "payload_hash": "TEXT",
+            "result_hash": "TEXT",
+            "priority": f"INTEGER NOT NULL DEFAULT {DEFAULT_PRIORITY}",
+        },
+    )
     conn.execute(
         """
         CREATE UNIQUE INDEX IF NOT EXISTS events_source_event_id_uq
@@ -52,6 +138,32 @@ def init_db(conn: sqlite3.Connection) -> None:
         ON events(status, next_attempt_at);
         """
     )
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS events_processing_lease_idx
+        ON events(lease_expires_at)
+        WHERE status = 'processing';
+        """
+    )
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS events_finished_idx
+        ON events(processed_at)
+        WHERE status IN ('done', 'error');
+        """
+    )
+    _init_ready_queue(conn)
+    _init_queue_stats(conn)
+    _init_dead_letters(conn)
+    # Round-robin credit per source for fair-share claims (see `app/fair_share.py`).
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS fair_share_credits (
+          source TEXT PRIMARY KEY,
+          credit REAL NOT NULL
+        ) WITHOUT ROWID;
+        """
+    )
     conn.execute(
         """
         CREATE TABLE IF NOT EXISTS provider_mappings (
@@ -60,10 +172,12 @@ def init_db(conn: sqlite3.Connection) -> None:
           handler_mode TEXT NOT NULL DEFAULT 'noop',
           handler_target TEXT,
           enabled INTEGER NOT NULL DEFAULT 1,
-          updated_at TEXT NOT NULL
+          updated_at TEXT NOT NULL,
+          queue_priority INTEGER
         );
         """
     )
+    _add_missing_columns(conn, "provider_mappings", {"queue_priority": "INTEGER"})
     conn.execute(
         """
         CREATE TABLE IF NOT EXISTS routing_rules (
@@ -102,10 +216,13 @@ def init_db(conn: sqlite3.Connection) -> None:
           input_json TEXT NOT NULL,
           output_json TEXT,
           error TEXT,
+          input_hash TEXT,
+          output_hash TEXT,
           FOREIGN KEY(event_row_id) REFERENCES events(id)
         );
         """
     )
+    _add_missing_columns(conn, "action_runs", {"input_hash": "TEXT", "output_hash": "TEXT"})
     conn.execute(
         """
         CREATE INDEX IF NOT EXISTS action_runs_event_idx
@@ -121,6 +238,462 @@ def init_db(conn: sqlite3.Connection) -> None:
     )
 
 
+def _table_exists(conn: sqlite3.Connection, name: str) -> bool:
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone()
+    return row is not None
+
+
+_READY_STATUSES_SQL = "('pending', 'retry')"
+_READY_ROW_VALUES_SQL = """
+  NEW.id,
+  NEW.source,
+  NEW.priority,
+  CAST(strftime('%s', NEW.received_at) AS INTEGER),
+  CAST(strftime('%s', NEW.next_attempt_at) AS INTEGER)
+"""
+
+
+def _init_ready_queue(conn: sqlite3.Connection) -> None:
+    """
+    `ready_queue` holds only claimable (pending/retry) events with integer epoch timestamps.
+
+    Triggers on `events` keep it in sync, so claims never touch the history in `events`.
+    The table is derived data: a copy missing a column added since is dropped and rebuilt.
+    """
+    if _table_exists(conn, "ready_queue"):
+        columns = {str(r[1]) for r in conn.execute("PRAGMA table_info(ready_queue);").fetchall()}
+        if not {"source", "priority"} <= columns:
+            for trigger in ("events_ready_insert", "events_ready_update"):
+                conn.execute(f"DROP TRIGGER IF EXISTS {trigger};")
+            conn.execute("DROP TABLE ready_queue;")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ready_queue (
+          event_row_id INTEGER PRIMARY KEY,
+          source TEXT NOT NULL,
+          priority INTEGER NOT NULL,
+          received_epoch INTEGER NOT NULL,
+          ready_epoch INTEGER NOT NULL
+        );
+        """
+    )
+    # Matches the claim ordering exactly (priority, then FIFO) and covers the readiness filter.
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS ready_queue_claim_idx
+        ON ready_queue(priority, received_epoch, event_row_id, ready_epoch);
+        """
+    )
+    # Same ordering per source, for fair-share claims (`claim_events(..., fair_weights=...)`).
+    conn.execute(
+        """
+        CREATE INDEX IF NOT EXISTS ready_queue_source_idx
+        ON ready_queue(source, priority, received_epoch, event_row_id, ready_epoch);
+        """
+    )
+    # Lets idle workers find the next retry time (`next_ready_at`) without scanning the queue.
+    conn.execute("CREATE INDEX IF NOT EXISTS ready_queue_ready_idx ON ready_queue(ready_epoch);")
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS events_ready_insert
+        AFTER INSERT ON events
+        WHEN NEW.status IN {_READY_STATUSES_SQL}
+        BEGIN
+          INSERT OR REPLACE INTO ready_queue (event_row_id, source, priority, received_epoch, ready_epoch)
+          VALUES ({_READY_ROW_VALUES_SQL});
+        END;
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS events_ready_update
+        AFTER UPDATE OF status, next_attempt_at, priority ON events
+        WHEN NEW.status IN {_READY_STATUSES_SQL}
+        BEGIN
+          INSERT OR REPLACE INTO ready_queue (event_row_id, source, priority, received_epoch, ready_epoch)
+          VALUES ({_READY_ROW_VALUES_SQL});
+        END;
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS events_unready_update
+        AFTER UPDATE OF status ON events
+        WHEN NEW.status NOT IN {_READY_STATUSES_SQL}
+        BEGIN
+          DELETE FROM ready_queue WHERE event_row_id = OLD.id;
+        END;
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS events_ready_delete
+        AFTER DELETE ON events
+        BEGIN
+          DELETE FROM ready_queue WHERE event_row_id = OLD.id;
+        END;
+        """
+    )
+
+
+def _backfill_ready_queue(conn: sqlite3.Connection, after_id: int, up_to_id: int) -> None:
+    conn.execute(
+        f"""
+        INSERT OR IGNORE INTO ready_queue (event_row_id, source, priority, received_epoch, ready_epoch)
+        SELECT id, source, priority, CAST(strftime('%s', received_at) AS INTEGER),
+               CAST(strftime('%s', next_attempt_at) AS INTEGER)
+        FROM events
+        WHERE id > ? AND id <= ? AND status IN {_READY_STATUSES_SQL}
+        """,
+        (after_id, up_to_id),
+    )
+
+
+def _init_queue_stats(conn: sqlite3.Connection) -> None:
+    """
+    `queue_stats` holds one counter row per (source, status), kept current by triggers on `events`,
+    so monitoring reads a handful of rows instead of scanning the event history.
+    """
+    created = not _table_exists(conn, "queue_stats")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS queue_stats (
+          source TEXT NOT NULL,
+          status TEXT NOT NULL,
+          count INTEGER NOT NULL,
+          PRIMARY KEY (source, status)
+        ) WITHOUT ROWID;
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS events_stats_insert
+        AFTER INSERT ON events
+        BEGIN
+          INSERT INTO queue_stats (source, status, count) VALUES (NEW.source, NEW.status, 1)
+          ON CONFLICT(source, status) DO UPDATE SET count = count + 1;
+        END;
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS events_stats_update
+        AFTER UPDATE OF status ON events
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+          UPDATE queue_stats SET count = count - 1 WHERE source = OLD.source AND status = OLD.status;
+          INSERT INTO queue_stats (source, status, count) VALUES (NEW.source, NEW.status, 1)
+          ON CONFLICT(source, status) DO UPDATE SET count = count + 1;
+        END;
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS events_stats_delete
+        AFTER DELETE ON events
+        BEGIN
+          UPDATE queue_stats SET count = count - 1 WHERE source = OLD.source AND status = OLD.status;
+        END;
+        """
+    )
+    if created:
+        conn.execute(
+            """
+            INSERT INTO queue_stats (source, status, count)
+            SELECT source, status, COUNT(*) FROM events GROUP BY source, status
+            """
+        )
+
+
+def _init_dead_letters(conn: sqlite3.Connection) -> None:
+    """
+    `dead_letters` indexes every event in `status='error'` (from `mark_error` or the lease reaper).
+    Triggers add the row when an event dead-letters and drop it when the event is requeued or
+    deleted. Inspection and requeue never have to scan `events`.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS dead_letters (
+          event_row_id INTEGER PRIMARY KEY,
+          source TEXT NOT NULL,
+          event_id TEXT,
+          attempt_count INTEGER NOT NULL,
+          error TEXT,
+          dead_at TEXT NOT NULL
+        );
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS dead_letters_dead_at_idx ON dead_letters(dead_at, event_row_id);")
+    conn.execute("CREATE INDEX IF NOT EXISTS dead_letters_source_idx ON dead_letters(source, dead_at, event_row_id);")
+    dead_letter_values = """
+          NEW.id, NEW.source, NEW.event_id, NEW.attempt_count, NEW.last_error,
+          COALESCE(NEW.processed_at, strftime('%Y-%m-%dT%H:%M:%S+00:00', 'now'))
+    """
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS events_dead_letter_insert
+        AFTER INSERT ON events
+        WHEN NEW.status = 'error'
+        BEGIN
+          INSERT OR REPLACE INTO dead_letters (event_row_id, source, event_id, attempt_count, error, dead_at)
+          VALUES ({dead_letter_values});
+        END;
+        """
+    )
+    conn.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS events_dead_letter_update
+        AFTER UPDATE OF status ON events
+        WHEN NEW.status = 'error'
+        BEGIN
+          INSERT OR REPLACE INTO dead_letters (event_row_id, source, event_id, attempt_count, error, dead_at)
+          VALUES ({dead_letter_values});
+        END;
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS events_dead_letter_clear
+        AFTER UPDATE OF status ON events
+        WHEN OLD.status = 'error' AND NEW.status != 'error'
+        BEGIN
+          DELETE FROM dead_letters WHERE event_row_id = OLD.id;
+        END;
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS events_dead_letter_delete
+        AFTER DELETE ON events
+        WHEN OLD.status = 'error'
+        BEGIN
+          DELETE FROM dead_letters WHERE event_row_id = OLD.id;
+        END;
+        """
+    )
+
+
+def _backfill_dead_letters(conn: sqlite3.Connection, after_id: int, up_to_id: int) -> None:
+    conn.execute(
+        """
+        INSERT OR IGNORE INTO dead_letters (event_row_id, source, event_id, attempt_count, error, dead_at)
+        SELECT id, source, event_id, attempt_count, last_error, COALESCE(processed_at, received_at)
+        FROM events
+        WHERE id > ? AND id <= ? AND status = 'error'
+        """,
+        (after_id, up_to_id),
+    )
+
+
+def _schema_v2(conn: sqlite3.Connection) -> None:
+    """
+    Per-handler limits (`handler_limits`) and the slots events hold under them (`handler_permits`).
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS handler_limits (
+          limit_key TEXT PRIMARY KEY,
+          max_concurrency INTEGER,
+          rate_per_sec REAL,
+          burst REAL,
+          tat REAL NOT NULL DEFAULT 0,
+          updated_at TEXT NOT NULL
+        );
+        """
+    )
+    # state: 'running' holds a concurrency slot; 'reserved' holds a future rate-limit slot (`not_before`).
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS handler_permits (
+          limit_key TEXT NOT NULL,
+          event_row_id INTEGER NOT NULL,
+          state TEXT NOT NULL,
+          not_before REAL NOT NULL,
+          expires_epoch REAL NOT NULL,
+          PRIMARY KEY (limit_key, event_row_id)
+        ) WITHOUT ROWID;
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS handler_permits_event_idx ON handler_permits(event_row_id);")
+
+
+def _schema_v3(conn: sqlite3.Connection) -> None:
+    """
+    Circuit breaker state per `(handler_mode, handler_target)`, shared by every worker on the database.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS circuit_breakers (
+          handler_mode TEXT NOT NULL,
+          handler_target TEXT NOT NULL,
+          state TEXT NOT NULL,
+          consecutive_failures INTEGER NOT NULL DEFAULT 0,
+          open_until REAL NOT NULL DEFAULT 0,
+          open_seconds REAL NOT NULL DEFAULT 0,
+          probe_event_row_id INTEGER,
+          probe_expires REAL NOT NULL DEFAULT 0,
+          last_error TEXT,
+          updated_at TEXT NOT NULL,
+          PRIMARY KEY (handler_mode, handler_target)
+        );
+        """
+    )
+
+
+def _schema_v4(conn: sqlite3.Connection) -> None:
+    """
+    Route decisions kept per event (reused on retry and replay) and `app_meta` for the config version.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS route_decisions (
+          event_row_id INTEGER PRIMARY KEY,
+          config_version INTEGER,
+          decision_json TEXT NOT NULL,
+          routed_at TEXT NOT NULL
+        );
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS events_route_delete
+        AFTER DELETE ON events
+        BEGIN
+          DELETE FROM route_decisions WHERE event_row_id = OLD.id;
+        END;
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS app_meta (
+          key TEXT PRIMARY KEY,
+          value TEXT NOT NULL,
+          updated_at TEXT NOT NULL
+        );
+        """
+    )
+
+
+def _schema_v5(conn: sqlite3.Connection) -> None:
+    """
+    Seed the routing rules revision, so workers can cache compiled rules before the next rule change.
+    """
+    _bump_revision(conn, "routing_rules_revision", only_if_missing=True)
+
+
+def _schema_v6(conn: sqlite3.Connection) -> None:
+    """
+    AI provider classifications cached per payload shape.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ai_shape_cache (
+          fingerprint TEXT PRIMARY KEY,
+          provider TEXT NOT NULL,
+          confidence REAL NOT NULL,
+          event_type_path TEXT,
+          event_id_path TEXT,
+          hits INTEGER NOT NULL DEFAULT 0,
+          misses INTEGER NOT NULL DEFAULT 0,
+          expires_epoch REAL NOT NULL,
+          updated_at TEXT NOT NULL
+        ) WITHOUT ROWID;
+        """
+    )
+
+
+def _schema_v7(conn: sqlite3.Connection) -> None:
+    """
+    Provider signatures learned from stable AI classifications, and what the cache needs to find them.
+    """
+    _add_missing_columns(
+        conn,
+        "ai_shape_cache",
+        {
+            "shape_json": "TEXT",
+            "agreements": "INTEGER NOT NULL DEFAULT 0",
+            "promoted": "INTEGER NOT NULL DEFAULT 0",
+        },
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS provider_signatures (
+          name TEXT PRIMARY KEY,
+          provider TEXT NOT NULL,
+          confidence REAL NOT NULL,
+          conditions_json TEXT NOT NULL,
+          event_type_path TEXT,
+          event_id_path TEXT,
+          status TEXT NOT NULL,
+          fingerprint TEXT NOT NULL,
+          created_at TEXT NOT NULL,
+          updated_at TEXT NOT NULL
+        );
+        """
+    )
+
+
+def _schema_v8(conn: sqlite3.Connection) -> None:
+    """
+    Blob reference recount (`backfill_refs`): databases from before `refs` existed got every blob at 1,
+    so a blob shared by several events was released, and deleted, with the first of them.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS blob_manifest_parts (
+          manifest_hash TEXT NOT NULL,
+          part_hash TEXT NOT NULL,
+          n INTEGER NOT NULL,
+          PRIMARY KEY (manifest_hash, part_hash)
+        ) WITHOUT ROWID;
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS blob_manifest_parts_part_idx ON blob_manifest_parts(part_hash);")
+
+
+def _schema_v9(conn: sqlite3.Connection) -> None:
+    """
+    When a cached classification last counted as an agreement, and when it may next be re-verified.
+    """
+    _add_missing_columns(
+        conn,
+        "ai_shape_cache",
+        {
+            "agreed_epoch": "REAL NOT NULL DEFAULT 0",
+            "verify_after_epoch": "REAL NOT NULL DEFAULT 0",
+        },
+    )
+
+
+# Ordered schema steps, applied once each by `init_db`. Add new steps at the end with the next version;
+# never edit a released one. Derived tables that trigger-maintenance keeps in sync are filled by
+# batched backfills, so large `events` tables are migrated without one long write lock.
+SCHEMA_MIGRATIONS: tuple[Migration, ...] = (
+    Migration(
+        version=1,
+        name="baseline",
+        apply=_schema_v1,
+        backfills=(
+            Backfill(name="ready_queue", table="events", run=_backfill_ready_queue),
+            Backfill(name="dead_letters", table="events", run=_backfill_dead_letters),
+        ),
+    ),
+    Migration(version=2, name="handler_limits", apply=_schema_v2),
+    Migration(version=3, name="circuit_breakers", apply=_schema_v3),
+    Migration(version=4, name="route_decisions", apply=_schema_v4),
+    Migration(version=5, name="routing_rules_revision", apply=_schema_v5),
+    Migration(version=6, name="ai_shape_cache", apply=_schema_v6),
+    Migration(version=7, name="provider_signatures", apply=_schema_v7),
+    Migration(
+        version=8,
+        name="blob_refs",
+        apply=_schema_v8,
+        backfills=(Backfill(name="blob_refs", table="blobs", run=backfill_refs),),
+    ),
+    Migration(version=9, name="ai_shape_verification", apply=_schema_v9),
+)
+
+
 @dataclass(frozen=True)
 class ProviderMapping:
     provider: str
@@ -129,6 +702,8 @@ class ProviderMapping:
     handler_target: str | None
     enabled: bool
     updated_at: str
+    # Default queue lane for this provider's events (None = `DEFAULT_PRIORITY`).
+    queue_priority: int | None = None
 
 
 @dataclass(frozen=True)
@@ -153,27 +728,29 @@ def upsert_provider_mapping(
     handler_mode: str = "noop",
     handler_target: str | None = None,
     enabled: bool = True,
+    queue_priority: int | None = None,
 ) -> None:
     now = utc_now_iso()
     conn.execute(
         """
-        INSERT INTO provider_mappings (provider, action, handler_mode, handler_target, enabled, updated_at)
-        VALUES (?, ?, ?, ?, ?, ?)
+        INSERT INTO provider_mappings (provider, action, handler_mode, handler_target, enabled, updated_at, queue_priority)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
         ON CONFLICT(provider) DO UPDATE SET
           action=excluded.action,
           handler_mode=excluded.handler_mode,
           handler_target=excluded.handler_target,
           enabled=excluded.enabled,
-          updated_at=excluded.updated_at
+          updated_at=excluded.updated_at,
+          queue_priority=excluded.queue_priority
         """,
-        (provider, action, handler_mode, handler_target, 1 if enabled else 0, now),
+        (provider, action, handler_mode, handler_target, 1 if enabled else 0, now, queue_priority),
     )
 
 
 def get_provider_mapping(conn: sqlite3.Connection, *, provider: str) -> ProviderMapping | None:
     row = conn.execute(
         """
-        SELECT provider, action, handler_mode, handler_target, enabled, updated_at
+        SELECT provider, action, handler_mode, handler_target, enabled, updated_at, queue_priority
         FROM provider_mappings
         WHERE provider = ?
         """,
@@ -188,6 +765,7 @@ def get_provider_mapping(conn: sqlite3.Connection, *, provider: str) -> Provider
         handler_target=row["handler_target"],
         enabled=bool(int(row["enabled"])),
         updated_at=str(row["updated_at"]),
+        queue_priority=None if row["queue_priority"] is None else int(row["queue_priority"]),
     )
 
 
@@ -204,34 +782,60 @@ def upsert_routing_rule(
     enabled: bool = True,
 ) -> None:
     now = utc_now_iso()
+    with write_transaction(conn):
+        conn.execute(
+            """
+            INSERT INTO routing_rules
+              (provider, name, priority, conditions_json, action, handler_mode, handler_target, enabled, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(provider, name) DO UPDATE SET
+              priority=excluded.priority,
+              conditions_json=excluded.conditions_json,
+              action=excluded.action,
+              handler_mode=excluded.handler_mode,
+              handler_target=excluded.handler_target,
+              enabled=excluded.enabled,
+              updated_at=excluded.updated_at
+            """,
+            (
+                provider,
+                name,
+                int(priority),
+                json.dumps(conditions, separators=(",", ":"), ensure_ascii=False),
+                action,
+                handler_mode,
+                handler_target,
+                1 if enabled else 0,
+                now,
+            ),
+        )
+        _bump_revision(conn, "routing_rules_revision")
+
+
+def _bump_revision(conn: sqlite3.Connection, key: str, *, only_if_missing: bool = False) -> None:
+    conflict = "NOTHING" if only_if_missing else "UPDATE SET value=excluded.value, updated_at=excluded.updated_at"
     conn.execute(
-        """
-        INSERT INTO routing_rules
-          (provider, name, priority, conditions_json, action, handler_mode, handler_target, enabled, updated_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ON CONFLICT(provider, name) DO UPDATE SET
-          priority=excluded.priority,
-          conditions_json=excluded.conditions_json,
-          action=excluded.action,
-          handler_mode=excluded.handler_mode,
-          handler_target=excluded.handler_target,
-          enabled=excluded.enabled,
-          updated_at=excluded.updated_at
+        f"""
+        INSERT INTO app_meta (key, value, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(key) DO {conflict}
         """,
-        (
-            provider,
-            name,
-            int(priority),
-            json.dumps(conditions, separators=(",", ":"), ensure_ascii=False),
-            action,
-            handler_mode,
-            handler_target,
-            1 if enabled else 0,
-            now,
-        ),
+        (key, uuid.uuid4().hex, utc_now_iso()),
     )
 
 
+def _get_revision(conn: sqlite3.Connection, key: str) -> str | None:
+    row = conn.execute("SELECT value FROM app_meta WHERE key = ?", (key,)).fetchone()
+    return None if row is None else str(row["value"])
+
+
+def get_routing_rules_revision(conn: sqlite3.Connection) -> str | None:
+    """
+    Opaque token that changes whenever a routing rule is written (None on a database that never had one).
+    Random rather than a counter, so caches keyed on it cannot mix up two databases.
+    """
+    return _get_revision(conn, "routing_rules_revision")
+
+
 def list_routing_rules(conn: sqlite3.Connection, *, provider: str) -> list[RoutingRule]:
     rows = conn.execute(
         """
@@ -261,82 +865,380 @@ def list_routing_rules(conn: sqlite3.Connection, *, provider: str) -> list[Routi
     return rules
 
 
-def create_action_run(
+def upsert_handler_limit(
     conn: sqlite3.Connection,
     *,
-    event_row_id: int,
-    provider: str | None,
-    action: str | None,
-    handler_mode: str | None,
-    handler_target: str | None,
-    input_obj: dict[str, Any],
-) -> int:
-    input_json = json.dumps(input_obj, separators=(",", ":"), ensure_ascii=False)
-    try:
-        cur = conn.execute(
-            """
-            INSERT INTO action_runs
-              (event_row_id, started_at, status, provider, action, handler_mode, handler_target, input_json)
-            VALUES (?, ?, 'running', ?, ?, ?, ?, ?)
-            """,
-            (event_row_id, utc_now_iso(), provider, action, handler_mode, handler_target, input_json),
-        )
-        return int(cur.lastrowid)
-    except sqlite3.IntegrityError:
-        row = conn.execute(
-            """
-            SELECT id
-            FROM action_runs
-            WHERE event_row_id = ? AND action = ?
-            ORDER BY id DESC
-            LIMIT 1
-            """,
-            (event_row_id, action),
-        ).fetchone()
-        if row is None:
-            raise
-        return int(row["id"])
-
-
-def get_action_run(conn: sqlite3.Connection, *, run_id: int) -> dict[str, Any] | None:
-    row = conn.execute(
+    limit_key: str,
+    max_concurrency: int | None = None,
+    rate_per_sec: float | None = None,
+    burst: float | None = None,
+) -> None:
+    conn.execute(
         """
-        SELECT id, event_row_id, started_at, finished_at, status, provider, action, handler_mode, handler_target, input_json, output_json, error
-        FROM action_runs
-        WHERE id = ?
+        INSERT INTO handler_limits (limit_key, max_concurrency, rate_per_sec, burst, updated_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(limit_key) DO UPDATE SET
+          max_concurrency=excluded.max_concurrency,
+          rate_per_sec=excluded.rate_per_sec,
+          burst=excluded.burst,
+          updated_at=excluded.updated_at
         """,
-        (run_id,),
-    ).fetchone()
-    if row is None:
-        return None
-    return dict(row)
+        (limit_key, max_concurrency, rate_per_sec, burst, utc_now_iso()),
+    )
 
 
-def get_action_run_for_event_action(conn: sqlite3.Connection, *, event_row_id: int, action: str) -> dict[str, Any] | None:
-    row = conn.execute(
-        """
-        SELECT id, event_row_id, started_at, finished_at, status, provider, action, handler_mode, handler_target, input_json, output_json, error
-        FROM action_runs
-        WHERE event_row_id = ? AND action = ?
-        ORDER BY id DESC
+def _handler_limit_from_row(row: sqlite3.Row) -> HandlerLimit:
+    return HandlerLimit(
+        limit_key=str(row["limit_key"]),
+        max_concurrency=None if row["max_concurrency"] is None else int(row["max_concurrency"]),
+        rate_per_sec=None if row["rate_per_sec"] is None else float(row["rate_per_sec"]),
+        burst=None if row["burst"] is None else float(row["burst"]),
+        updated_at=str(row["updated_at"]),
+    )
+
+
+def list_handler_limits(conn: sqlite3.Connection) -> list[HandlerLimit]:
+    rows = conn.execute(
+        "SELECT limit_key, max_concurrency, rate_per_sec, burst, updated_at FROM handler_limits ORDER BY limit_key"
+    ).fetchall()
+    return [_handler_limit_from_row(r) for r in rows]
+
+
+def acquire_handler_permit(
+    conn: sqlite3.Connection,
+    *,
+    limit_keys: Iterable[str],
+    event_row_id: int,
+    lease_seconds: float = DEFAULT_LEASE_SECONDS,
+) -> PermitDecision | None:
+    """
+    Take a slot for `event_row_id` under every limit configured for `limit_keys` (see `decide_permit`).
+
+    Returns None when no key has a limit. Otherwise the `PermitDecision`: when it is not `admitted`,
+    `blocked_by` is the limit that blocked the event and `retry_at` when to try again. Concurrency slots expire
+    `lease_seconds` after they are taken unless `renew_handler_permits` extends them, so a worker
+    that dies does not hold a slot forever; `release_handler_permits` frees them when the handler ends.
+    A blocked event keeps its re-check slot on a full concurrency limit as a 'waiting' permit.
+    """
+    keys = list(dict.fromkeys(str(k) for k in limit_keys))
+    if not keys:
+        return None
+    placeholders = ",".join("?" for _ in keys)
+    # Unlimited handlers (the common case) cost one read and no write lock.
+    if conn.execute(f"SELECT 1 FROM handler_limits WHERE limit_key IN ({placeholders}) LIMIT 1", keys).fetchone() is None:
+        return None
+
+    now = time.time()
+    with write_transaction(conn):
+        rows = conn.execute(
+            f"""
+            SELECT limit_key, max_concurrency, rate_per_sec, burst, tat, updated_at
+            FROM handler_limits
+            WHERE limit_key IN ({placeholders})
+            """,
+            keys,
+        ).fetchall()
+        limits = [_handler_limit_from_row(r) for r in rows if r["max_concurrency"] is not None or r["rate_per_sec"]]
+        if not limits:
+            return None
+        conn.execute(f"DELETE FROM handler_permits WHERE limit_key IN ({placeholders}) AND expires_epoch < ?", (*keys, now))
+        mine = {
+            str(r["limit_key"]): (str(r["state"]), float(r["not_before"]))
+            for r in conn.execute(
+                f"SELECT limit_key, state, not_before FROM handler_permits WHERE event_row_id = ? AND limit_key IN ({placeholders})",
+                (event_row_id, *keys),
+            )
+        }
+        running = {
+            str(r["limit_key"]): int(r["n"])
+            for r in conn.execute(
+                f"""
+                SELECT limit_key, COUNT(*) AS n
+                FROM handler_permits
+                WHERE limit_key IN ({placeholders}) AND state = 'running' AND event_row_id != ?
+                GROUP BY limit_key
+                """,
+                (*keys, event_row_id),
+            )
+        }
+        waiting = {
+            str(r["limit_key"]): float(r["tail"])
+            for r in conn.execute(
+                f"""
+                SELECT limit_key, MAX(not_before) AS tail
+                FROM handler_permits
+                WHERE limit_key IN ({placeholders}) AND state = 'waiting' AND event_row_id != ?
+                GROUP BY limit_key
+                """,
+                (*keys, event_row_id),
+            )
+        }
+        decision = decide_permit(
+            limits,
+            tats={str(r["limit_key"]): float(r["tat"]) for r in rows},
+            running=running,
+            reservations={key: not_before for key, (state, not_before) in mine.items() if state == "reserved"},
+            now=now,
+            waiting=waiting,
+        )
+        conn.executemany(
+            "UPDATE handler_limits SET tat = ? WHERE limit_key = ?",
+            [(tat, key) for key, tat in decision.tats.items()],
+        )
+        if decision.admitted:
+            permits = [(limit.limit_key, "running", now, now + lease_seconds) for limit in limits]
+        else:
+            permits = [
+                (key, "reserved", not_before, not_before + lease_seconds)
+                for key, not_before in decision.reservations.items()
+            ]
+            permits += [
+                (key, "waiting", recheck, recheck + lease_seconds)
+                for key, recheck in decision.waits.items()
+                if key not in decision.reservations
+            ]
+        conn.executemany(
+            """
+            INSERT OR REPLACE INTO handler_permits (limit_key, event_row_id, state, not_before, expires_epoch)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [(key, event_row_id, state, not_before, expires) for key, state, not_before, expires in permits],
+        )
+    return decision
+
+
+def renew_handler_permits(
+    conn: sqlite3.Connection, *, event_ids: Iterable[int], lease_seconds: float = DEFAULT_LEASE_SECONDS
+) -> int:
+    ids = [int(i) for i in event_ids]
+    if not ids:
+        return 0
+    placeholders = ",".join("?" for _ in ids)
+    cur = conn.execute(
+        f"UPDATE handler_permits SET expires_epoch = ? WHERE event_row_id IN ({placeholders}) AND state = 'running'",
+        (time.time() + lease_seconds, *ids),
+    )
+    return cur.rowcount
+
+
+def release_handler_permits(conn: sqlite3.Connection, *, event_row_id: int) -> None:
+    conn.execute("DELETE FROM handler_permits WHERE event_row_id = ?", (event_row_id,))
+
+
+_CIRCUIT_BREAKER_COLUMNS = """
+  handler_mode, handler_target, state, consecutive_failures, open_until, open_seconds, probe_event_row_id,
+  probe_expires, last_error, updated_at
+"""
+
+
+def _circuit_breaker_from_row(row: sqlite3.Row | None) -> CircuitBreaker | None:
+    if row is None:
+        return None
+    return CircuitBreaker(
+        handler_mode=str(row["handler_mode"]),
+        handler_target=str(row["handler_target"]),
+        state=str(row["state"]),
+        consecutive_failures=int(row["consecutive_failures"]),
+        open_until=float(row["open_until"]),
+        open_seconds=float(row["open_seconds"]),
+        probe_event_row_id=None if row["probe_event_row_id"] is None else int(row["probe_event_row_id"]),
+        probe_expires=float(row["probe_expires"]),
+        last_error=row["last_error"],
+        updated_at=str(row["updated_at"]),
+    )
+
+
+def get_circuit_breaker(conn: sqlite3.Connection, *, handler_mode: str, handler_target: str) -> CircuitBreaker | None:
+    row = conn.execute(
+        f"SELECT {_CIRCUIT_BREAKER_COLUMNS} FROM circuit_breakers WHERE handler_mode = ? AND handler_target = ?",
+        (handler_mode, handler_target),
+    ).fetchone()
+    return _circuit_breaker_from_row(row)
+
+
+def list_circuit_breakers(conn: sqlite3.Connection) -> list[CircuitBreaker]:
+    rows = conn.execute(
+        f"SELECT {_CIRCUIT_BREAKER_COLUMNS} FROM circuit_breakers ORDER BY handler_mode, handler_target"
+    ).fetchall()
+    return [b for b in (_circuit_breaker_from_row(r) for r in rows) if b is not None]
+
+
+def _save_circuit_breaker(conn: sqlite3.Connection, breaker: CircuitBreaker) -> None:
+    conn.execute(
+        f"""
+        INSERT OR REPLACE INTO circuit_breakers ({_CIRCUIT_BREAKER_COLUMNS})
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            breaker.handler_mode,
+            breaker.handler_target,
+            breaker.state,
+            breaker.consecutive_failures,
+            breaker.open_until,
+            breaker.open_seconds,
+            breaker.probe_event_row_id,
+            breaker.probe_expires,
+            breaker.last_error,
+            utc_now_iso(),
+        ),
+    )
+
+
+def check_circuit(
+    conn: sqlite3.Connection,
+    *,
+    handler_mode: str,
+    handler_target: str,
+    event_row_id: int,
+    lease_seconds: float = DEFAULT_LEASE_SECONDS,
+) -> float | None:
+    """
+    None when `event_row_id` may call the handler, else the epoch time to retry (see `admit_call`).
+    A closed breaker costs one read; only the switch to half-open writes.
+    """
+    breaker = get_circuit_breaker(conn, handler_mode=handler_mode, handler_target=handler_target)
+    if breaker is None or breaker.state == "closed":
+        return None
+    with write_transaction(conn):
+        breaker = get_circuit_breaker(conn, handler_mode=handler_mode, handler_target=handler_target)
+        retry_at, updated = admit_call(breaker, event_row_id=event_row_id, now=time.time(), probe_lease=lease_seconds)
+        if updated is not None:
+            _save_circuit_breaker(conn, updated)
+    return retry_at
+
+
+def record_circuit_result(
+    conn: sqlite3.Connection,
+    *,
+    handler_mode: str,
+    handler_target: str,
+    event_row_id: int,
+    ok: bool,
+    failure_threshold: int,
+    open_seconds: float,
+    max_open_seconds: float,
+    error: str | None = None,
+) -> CircuitBreaker | None:
+    """
+    Record a handler call's outcome (see `record_call`). Returns the breaker when its state changed
+    (it opened, or a probe closed it), else None.
+    A success on a healthy handler costs one read.
+    """
+    kwargs = {
+        "handler_mode": handler_mode,
+        "handler_target": handler_target,
+        "ok": ok,
+        "event_row_id": event_row_id,
+        "failure_threshold": failure_threshold,
+        "open_seconds": open_seconds,
+        "max_open_seconds": max_open_seconds,
+        "error": error,
+    }
+    if ok:
+        breaker = get_circuit_breaker(conn, handler_mode=handler_mode, handler_target=handler_target)
+        if record_call(breaker, now=time.time(), **kwargs) is None:
+            return None
+    with write_transaction(conn):
+        breaker = get_circuit_breaker(conn, handler_mode=handler_mode, handler_target=handler_target)
+        updated = record_call(breaker, now=time.time(), **kwargs)
+        if updated is not None:
+            _save_circuit_breaker(conn, updated)
+    if updated is None or updated.state == (breaker.state if breaker is not None else "closed"):
+        return None
+    return updated
+
+
+def create_action_run(
+    conn: sqlite3.Connection,
+    *,
+    event_row_id: int,
+    provider: str | None,
+    action: str | None,
+    handler_mode: str | None,
+    handler_target: str | None,
+    input_obj: dict[str, Any],
+) -> int:
+    with write_transaction(conn):
+        input_hash = put_json(conn, input_obj, split=True)
+        try:
+            cur = conn.execute(
+                """
+                INSERT INTO action_runs
+                  (event_row_id, started_at, status, provider, action, handler_mode, handler_target, input_json, input_hash)
+                VALUES (?, ?, 'running', ?, ?, ?, ?, '', ?)
+                """,
+                (event_row_id, utc_now_iso(), provider, action, handler_mode, handler_target, input_hash),
+            )
+            return int(cur.lastrowid)
+        except sqlite3.IntegrityError:
+            # Only the failed INSERT is undone; give back the reference taken above.
+            release_json(conn, [input_hash])
+            row = conn.execute(
+                """
+                SELECT id
+                FROM action_runs
+                WHERE event_row_id = ? AND action = ?
+                ORDER BY id DESC
+                LIMIT 1
+                """,
+                (event_row_id, action),
+            ).fetchone()
+            if row is None:
+                raise
+            return int(row["id"])
+
+
+def _action_run_dicts(conn: sqlite3.Connection, rows: list[sqlite3.Row]) -> list[dict[str, Any]]:
+    out = [dict(r) for r in rows]
+    resolve_json_columns(conn, out, {"input_json": "input_hash", "output_json": "output_hash"})
+    return out
+
+
+def get_action_run(conn: sqlite3.Connection, *, run_id: int) -> dict[str, Any] | None:
+    row = conn.execute(
+        """
+        SELECT id, event_row_id, started_at, finished_at, status, provider, action, handler_mode, handler_target, input_json, output_json, error,
+               input_hash, output_hash
+        FROM action_runs
+        WHERE id = ?
+        """,
+        (run_id,),
+    ).fetchone()
+    if row is None:
+        return None
+    return _action_run_dicts(conn, [row])[0]
+
+
+def get_action_run_for_event_action(conn: sqlite3.Connection, *, event_row_id: int, action: str) -> dict[str, Any] | None:
+    row = conn.execute(
+        """
+        SELECT id, event_row_id, started_at, finished_at, status, provider, action, handler_mode, handler_target, input_json, output_json, error,
+               input_hash, output_hash
+        FROM action_runs
+        WHERE event_row_id = ? AND action = ?
+        ORDER BY id DESC
         LIMIT 1
         """,
         (event_row_id, action),
     ).fetchone()
     if row is None:
         return None
-    return dict(row)
+    return _action_run_dicts(conn, [row])[0]
 
 
 def restart_action_run(conn: sqlite3.Connection, *, run_id: int) -> None:
-    conn.execute(
-        """
-        UPDATE action_runs
-        SET started_at=?, finished_at=NULL, status='running', output_json=NULL, error=NULL
-        WHERE id=?
-        """,
-        (utc_now_iso(), run_id),
-    )
+    with write_transaction(conn):
+        row = conn.execute("SELECT output_hash FROM action_runs WHERE id=?", (run_id,)).fetchone()
+        conn.execute(
+            """
+            UPDATE action_runs
+            SET started_at=?, finished_at=NULL, status='running', output_json=NULL, output_hash=NULL, error=NULL
+            WHERE id=?
+            """,
+            (utc_now_iso(), run_id),
+        )
+        if row is not None:
+            release_json(conn, [row["output_hash"]])
 
 
 def finish_action_run(
@@ -347,17 +1249,16 @@ def finish_action_run(
     output_obj: dict[str, Any] | None = None,
     error: str | None = None,
 ) -> None:
-    output_json = None
-    if output_obj is not None:
-        output_json = json.dumps(output_obj, separators=(",", ":"), ensure_ascii=False)
-    conn.execute(
-        """
-        UPDATE action_runs
-        SET finished_at=?, status=?, output_json=?, error=?
-        WHERE id=?
-        """,
-        (utc_now_iso(), status, output_json, error, run_id),
-    )
+    with write_transaction(conn):
+        output_hash = put_json(conn, output_obj) if output_obj is not None else None
+        conn.execute(
+            """
+            UPDATE action_runs
+            SET finished_at=?, status=?, output_json=NULL, output_hash=?, error=?
+            WHERE id=?
+            """,
+            (utc_now_iso(), status, output_hash, error, run_id),
+        )
 
 
 @dataclass(frozen=True)
@@ -370,6 +1271,9 @@ class Event:
     attempt_count: int
     next_attempt_at: str
     payload: dict[str, Any]
+    lease_owner: str | None = None
+    lease_expires_at: str | None = None
+    priority: int = DEFAULT_PRIORITY
 
 
 def enqueue_event(
@@ -378,124 +1282,826 @@ def enqueue_event(
     source: str,
     event_id: str | None,
     payload: dict[str, Any],
+    priority: int | None = None,
 ) -> int:
+    """
+    Enqueue one event. `priority` picks its lane (lower is claimed first); None means
+    `DEFAULT_PRIORITY`. Callers resolve per-provider defaults with `mapper.enqueue_priority`.
+    """
     received_at = utc_now_iso()
     next_attempt_at = received_at
-    payload_json = json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
-    cur = conn.execute(
-        """
-        INSERT INTO events (source, event_id, received_at, status, next_attempt_at, payload_json)
-        VALUES (?, ?, ?, 'pending', ?, ?)
-        """,
-        (source, event_id, received_at, next_attempt_at, payload_json),
+    with write_transaction(conn):
+        payload_hash = put_json(conn, payload)
+        cur = conn.execute(
+            """
+            INSERT INTO events (source, event_id, received_at, status, next_attempt_at, payload_json, payload_hash, priority)
+            VALUES (?, ?, ?, 'pending', ?, '', ?, ?)
+            """,
+            (source, event_id, received_at, next_attempt_at, payload_hash, _priority(priority)),
+        )
+        return int(cur.lastrowid)
+
+
+def _priority(priority: int | None) -> int:
+    return DEFAULT_PRIORITY if priority is None else int(priority)
+
+
+@dataclass(frozen=True)
+class NewEvent:
+    source: str
+    event_id: str | None
+    payload: dict[str, Any]
+    priority: int | None = None
+
+
+@dataclass(frozen=True)
+class EnqueueResult:
+    row_id: int
+    inserted: bool
+
+
+def enqueue_events(conn: sqlite3.Connection, items: Iterable[NewEvent]) -> list[EnqueueResult]:
+    """
+    Enqueue a batch of events in one write transaction.
+
+    Duplicates of an existing `(source, event_id)` (including repeats within the batch) are skipped
+    with `ON CONFLICT DO NOTHING`; their result carries the existing row id and `inserted=False`.
+    Results are returned in the order of `items`.
+    """
+    results: list[EnqueueResult] = []
+    received_at = utc_now_iso()
+    with write_transaction(conn):
+        for item in items:
+            payload_hash = put_json(conn, item.payload)
+            row = conn.execute(
+                """
+                INSERT INTO events (source, event_id, received_at, status, next_attempt_at, payload_json, payload_hash, priority)
+                VALUES (?, ?, ?, 'pending', ?, '', ?, ?)
+                ON CONFLICT DO NOTHING
+                RETURNING id
+                """,
+                (item.source, item.event_id, received_at, received_at, payload_hash, _priority(item.priority)),
+            ).fetchone()
+            if row is not None:
+                results.append(EnqueueResult(row_id=int(row["id"]), inserted=True))
+                continue
+            release_json(conn, [payload_hash])
+            existing = conn.execute(
+                "SELECT id FROM events WHERE source = ? AND event_id = ?",
+                (item.source, item.event_id),
+            ).fetchone()
+            results.append(EnqueueResult(row_id=int(existing["id"]), inserted=False))
+    return results
+
+
+def _events_from_rows(conn: sqlite3.Connection, rows: list[sqlite3.Row]) -> list[Event]:
+    resolved = [dict(r) for r in rows]
+    resolve_json_columns(conn, resolved, {"payload_json": "payload_hash"})
+    return [_event_from_row(r) for r in resolved]
+
+
+def _event_from_row(row: dict[str, Any]) -> Event:
+    return Event(
+        id=int(row["id"]),
+        source=str(row["source"]),
+        event_id=row["event_id"],
+        received_at=str(row["received_at"]),
+        status=str(row["status"]),
+        attempt_count=int(row["attempt_count"]),
+        next_attempt_at=str(row["next_attempt_at"]),
+        payload=json.loads(row["payload_json"]),
+        lease_owner=row["lease_owner"],
+        lease_expires_at=row["lease_expires_at"],
+        priority=int(row["priority"]),
     )
-    return int(cur.lastrowid)
 
 
-def claim_next_event(conn: sqlite3.Connection) -> Event | None:
+def claim_events(
+    conn: sqlite3.Connection,
+    *,
+    limit: int = 1,
+    lease_owner: str | None = None,
+    lease_seconds: float = DEFAULT_LEASE_SECONDS,
+    fair_weights: Mapping[str, float] | None = None,
+) -> list[Event]:
+    """
+    Claim up to `limit` ready events in a single write transaction.
+
+    Each claimed event is leased to `lease_owner` until `lease_expires_at`; the owner must
+    renew the lease (see `renew_leases`) while it works, or `reap_expired_leases` re-queues it.
+    Events are returned in claim order: lowest `priority` first, then oldest first
+    (by `received_at`, then row id).
+
+    With `fair_weights` (a possibly empty {source: weight} map) claims are shared between sources
+    by weighted round-robin within each priority lane instead of global FIFO; see `_pick_fair_share`.
+    """
+    if limit <= 0:
+        return []
     now = utc_now_iso()
+    now_epoch = int(time.time())
+    lease_expires_at = _utc_iso_in(lease_seconds)
     conn.execute("BEGIN IMMEDIATE;")
     try:
-        row = conn.execute(
-            """
-            SELECT id, source, event_id, received_at, status, attempt_count, next_attempt_at, payload_json
-            FROM events
-            WHERE status IN ('pending', 'retry') AND next_attempt_at <= ?
-            ORDER BY received_at ASC
-            LIMIT 1
-            """,
-            (now,),
-        ).fetchone()
-        if row is None:
-            conn.execute("COMMIT;")
-            return None
-
-        conn.execute(
+        if fair_weights is None:
+            picked_sql = """
+              SELECT event_row_id
+              FROM ready_queue
+              WHERE ready_epoch <= ?
+              ORDER BY priority ASC, received_epoch ASC, event_row_id ASC
+              LIMIT ?
             """
+            picked_params: tuple[Any, ...] = (now_epoch, int(limit))
+        else:
+            picked = _pick_fair_share(conn, now_epoch=now_epoch, limit=int(limit), weights=fair_weights)
+            picked_sql = ", ".join("?" for _ in picked) or "NULL"
+            picked_params = tuple(picked)
+        # `+status` keeps the planner on rowid lookups instead of scanning the status index.
+        rows = conn.execute(
+            f"""
             UPDATE events
-            SET status='processing', processing_started_at=?
-            WHERE id=? AND status IN ('pending', 'retry')
+            SET status='processing', processing_started_at=?, lease_owner=?, lease_expires_at=?
+            WHERE id IN ({picked_sql})
+            AND +status IN ('pending', 'retry')
+            RETURNING id, source, event_id, received_at, status, attempt_count, next_attempt_at, payload_json,
+                      payload_hash, lease_owner, lease_expires_at, priority
             """,
-            (now, row["id"]),
-        )
+            (now, lease_owner, lease_expires_at, *picked_params),
+        ).fetchall()
         conn.execute("COMMIT;")
-
-        payload = json.loads(row["payload_json"])
-        return Event(
-            id=int(row["id"]),
-            source=str(row["source"]),
-            event_id=row["event_id"],
-            received_at=str(row["received_at"]),
-            status=str(row["status"]),
-            attempt_count=int(row["attempt_count"]),
-            next_attempt_at=str(row["next_attempt_at"]),
-            payload=payload,
-        )
     except Exception:
         conn.execute("ROLLBACK;")
         raise
 
+    # RETURNING does not guarantee row order.
+    if fair_weights is None:
+        rows.sort(key=lambda r: (int(r["priority"]), str(r["received_at"]), int(r["id"])))
+    else:
+        order = {event_row_id: i for i, event_row_id in enumerate(picked)}
+        rows.sort(key=lambda r: order[int(r["id"])])
+    return _events_from_rows(conn, rows)
+
+
+def _pick_fair_share(
+    conn: sqlite3.Connection, *, now_epoch: int, limit: int, weights: Mapping[str, float]
+) -> list[int]:
+    """
+    Pick event ids for a fair-share claim. Must run inside the claim's write transaction.
+
+    Sources with queued events come from the `queue_stats` counters; each one is a single probe of
+    `ready_queue_source_idx` for its next `limit` ready events. Round-robin credits are kept in
+    `fair_share_credits`, so every worker sharing the database takes part in the same rotation.
+    """
+    sources = [
+        str(r["source"])
+        for r in conn.execute(
+            "SELECT DISTINCT source FROM queue_stats WHERE status IN ('pending', 'retry') AND count > 0"
+        ).fetchall()
+    ]
+    candidates: dict[str, list[tuple[int, int]]] = {}
+    for source in sources:
+        rows = conn.execute(
+            """
+            SELECT event_row_id, priority
+            FROM ready_queue
+            WHERE source = ? AND ready_epoch <= ?
+            ORDER BY priority ASC, received_epoch ASC, event_row_id ASC
+            LIMIT ?
+            """,
+            (source, now_epoch, limit),
+        ).fetchall()
+        if rows:
+            candidates[source] = [(int(r["event_row_id"]), int(r["priority"])) for r in rows]
+
+    stored = {str(r["source"]): float(r["credit"]) for r in conn.execute("SELECT source, credit FROM fair_share_credits")}
+    picked, credits = pick_fair(candidates, stored, weights=weights, limit=limit)
+
+    conn.execute("DELETE FROM fair_share_credits;")
+    conn.executemany(
+        "INSERT INTO fair_share_credits (source, credit) VALUES (?, ?)",
+        sorted(credits.items()),
+    )
+    return picked
+
+
+def claim_next_event(conn: sqlite3.Connection) -> Event | None:
+    events = claim_events(conn, limit=1)
+    return events[0] if events else None
+
+
+def next_ready_at(conn: sqlite3.Connection) -> float | None:
+    """
+    Epoch seconds at which the earliest queued event becomes claimable (may be in the past), or None if empty.
+    """
+    row = conn.execute("SELECT MIN(ready_epoch) AS ready_epoch FROM ready_queue").fetchone()
+    return None if row is None or row["ready_epoch"] is None else float(row["ready_epoch"])
+
 
-def mark_done(conn: sqlite3.Connection, *, event_id: int, result: dict[str, Any]) -> None:
+def _lease_guard(lease_owner: str | None) -> tuple[str, tuple[Any, ...]]:
+    if lease_owner is None:
+        return "", ()
+    return " AND status='processing' AND lease_owner=?", (lease_owner,)
+
+
+def mark_done(
+    conn: sqlite3.Connection,
+    *,
+    event_id: int,
+    result: dict[str, Any],
+    lease_owner: str | None = None,
+) -> bool:
+    """
+    Mark an event done. When `lease_owner` is given, only applies if that owner still holds the lease.
+    """
     now = utc_now_iso()
-    result_json = json.dumps(result, separators=(",", ":"), ensure_ascii=False)
-    conn.execute(
-        """
+    guard_sql, guard_args = _lease_guard(lease_owner)
+    with write_transaction(conn):
+        previous = conn.execute("SELECT result_hash FROM events WHERE id=?", (event_id,)).fetchone()
+        # Split so the handler output is shared with the action run's `output_hash`.
+        result_hash = put_json(conn, result, split=True)
+        cur = conn.execute(
+            f"""
+            UPDATE events
+            SET status='done', processed_at=?, result_json=NULL, result_hash=?, last_error=NULL,
+                lease_owner=NULL, lease_expires_at=NULL
+            WHERE id=?{guard_sql}
+            """,
+            (now, result_hash, event_id, *guard_args),
+        )
+        if cur.rowcount == 0:
+            release_json(conn, [result_hash])
+            return False
+        # A replayed or retried event replaces its earlier result. Drop that reference even when the
+        # hash is the same: `put_json` took a new one above.
+        if previous is not None:
+            release_json(conn, [previous["result_hash"]])
+        return True
+
+
+def mark_retry(
+    conn: sqlite3.Connection,
+    *,
+    event_id: int,
+    attempt_count: int,
+    next_attempt_at: str,
+    error: str,
+    lease_owner: str | None = None,
+) -> bool:
+    guard_sql, guard_args = _lease_guard(lease_owner)
+    cur = conn.execute(
+        f"""
         UPDATE events
-        SET status='done', processed_at=?, result_json=?, last_error=NULL
-        WHERE id=?
+        SET status='retry', attempt_count=?, next_attempt_at=?, last_error=?, lease_owner=NULL, lease_expires_at=NULL
+        WHERE id=?{guard_sql}
         """,
-        (now, result_json, event_id),
+        (attempt_count, next_attempt_at, error, event_id, *guard_args),
     )
+    return cur.rowcount > 0
 
 
-def mark_retry(
+def mark_error(
     conn: sqlite3.Connection,
     *,
     event_id: int,
     attempt_count: int,
-    next_attempt_at: str,
     error: str,
+    lease_owner: str | None = None,
+) -> bool:
+    now = utc_now_iso()
+    guard_sql, guard_args = _lease_guard(lease_owner)
+    cur = conn.execute(
+        f"""
+        UPDATE events
+        SET status='error', attempt_count=?, processed_at=?, last_error=?, lease_owner=NULL, lease_expires_at=NULL
+        WHERE id=?{guard_sql}
+        """,
+        (attempt_count, now, error, event_id, *guard_args),
+    )
+    return cur.rowcount > 0
+
+
+def renew_leases(
+    conn: sqlite3.Connection,
+    *,
+    event_ids: Iterable[int],
+    lease_owner: str,
+    lease_seconds: float = DEFAULT_LEASE_SECONDS,
+) -> set[int]:
+    """
+    Extend the lease on events still held by `lease_owner`. Returns the ids that were renewed.
+    """
+    ids = [int(i) for i in event_ids]
+    if not ids:
+        return set()
+    placeholders = ",".join("?" for _ in ids)
+    rows = conn.execute(
+        f"""
+        UPDATE events
+        SET lease_expires_at=?
+        WHERE id IN ({placeholders}) AND status='processing' AND lease_owner=?
+        RETURNING id
+        """,
+        (_utc_iso_in(lease_seconds), *ids, lease_owner),
+    ).fetchall()
+    return {int(r["id"]) for r in rows}
+
+
+def release_events(conn: sqlite3.Connection, *, event_ids: Iterable[int], lease_owner: str) -> int:
+    """
+    Hand claimed-but-unstarted events back to the queue without counting an attempt.
+    """
+    ids = [int(i) for i in event_ids]
+    if not ids:
+        return 0
+    placeholders = ",".join("?" for _ in ids)
+    cur = conn.execute(
+        f"""
+        UPDATE events
+        SET status=CASE WHEN attempt_count > 0 THEN 'retry' ELSE 'pending' END,
+            processing_started_at=NULL, lease_owner=NULL, lease_expires_at=NULL
+        WHERE id IN ({placeholders}) AND status='processing' AND lease_owner=?
+        """,
+        (*ids, lease_owner),
+    )
+    return cur.rowcount
+
+
+def defer_event(
+    conn: sqlite3.Connection, *, event_id: int, retry_epoch: float, lease_owner: str | None = None
+) -> bool:
+    """
+    Put a claimed event back in the queue until `retry_epoch` without counting an attempt
+    (used when a handler limit is full).
+    """
+    # Round up: the ready queue has whole-second resolution, and an early retry would only be deferred again.
+    next_attempt_at = datetime.fromtimestamp(math.ceil(retry_epoch), timezone.utc).isoformat()
+    guard_sql, guard_args = _lease_guard(lease_owner)
+    cur = conn.execute(
+        f"""
+        UPDATE events
+        SET status=CASE WHEN attempt_count > 0 THEN 'retry' ELSE 'pending' END,
+            next_attempt_at=?, processing_started_at=NULL, lease_owner=NULL, lease_expires_at=NULL
+        WHERE id=?{guard_sql}
+        """,
+        (next_attempt_at, event_id, *guard_args),
+    )
+    return cur.rowcount > 0
+
+
+def reap_expired_leases(
+    conn: sqlite3.Connection,
+    *,
+    max_attempts: int,
+    stale_after_seconds: float = DEFAULT_LEASE_SECONDS,
+    limit: int = 500,
+) -> int:
+    """
+    Re-queue `processing` events whose lease has expired (the owning worker died or hung).
+
+    The expiry counts as a failed attempt, so an event that keeps killing or hanging its worker backs
+    off like a failed handler (`retry_backoff_seconds`) and ends up in `error` after `max_attempts`.
+    Rows claimed before leases existed (no `lease_expires_at`) are treated as expired once
+    `processing_started_at` is older than `stale_after_seconds`.
+    """
+    now = utc_now_iso()
+    stale_cutoff = _utc_iso_in(-stale_after_seconds)
+    # The next try per new attempt count; counts past the exponent cap share the last one.
+    due = [_utc_iso_in(retry_backoff_seconds(n)) for n in range(1, RETRY_BACKOFF_MAX_EXPONENT + 1)]
+    due_sql = " ".join(f"WHEN {n} THEN ?" for n in range(1, RETRY_BACKOFF_MAX_EXPONENT + 1))
+    conn.execute("BEGIN IMMEDIATE;")
+    try:
+        cur = conn.execute(
+            f"""
+            UPDATE events
+            SET status=CASE WHEN attempt_count + 1 >= ? THEN 'error' ELSE 'retry' END,
+                attempt_count=attempt_count + 1,
+                next_attempt_at=CASE MIN(attempt_count + 1, {RETRY_BACKOFF_MAX_EXPONENT}) {due_sql} END,
+                processed_at=CASE WHEN attempt_count + 1 >= ? THEN ? ELSE processed_at END,
+                last_error='lease expired (owner=' || COALESCE(lease_owner, '?') || ')',
+                lease_owner=NULL,
+                lease_expires_at=NULL
+            WHERE id IN (
+              SELECT id
+              FROM events
+              WHERE status = 'processing'
+                AND (lease_expires_at < ? OR (lease_expires_at IS NULL AND processing_started_at < ?))
+              LIMIT ?
+            )
+            """,
+            (int(max_attempts), *due, int(max_attempts), now, now, stale_cutoff, int(limit)),
+        )
+        conn.execute("COMMIT;")
+    except Exception:
+        conn.execute("ROLLBACK;")
+        raise
+    return cur.rowcount
+
+
+def get_queue_stats(conn: sqlite3.Connection) -> dict[str, Any]:
+    """
+    Event counts per source and status, status totals, and the `received_at` of the oldest event that
+    is claimable now. Reads the trigger-maintained `queue_stats` rows and `ready_queue`, so the cost
+    does not depend on how many finished events are stored.
+    """
+    by_source: dict[str, dict[str, int]] = {}
+    totals: dict[str, int] = {}
+    for row in conn.execute("SELECT source, status, count FROM queue_stats WHERE count != 0").fetchall():
+        by_source.setdefault(str(row["source"]), {})[str(row["status"])] = int(row["count"])
+        totals[str(row["status"])] = totals.get(str(row["status"]), 0) + int(row["count"])
+    oldest = conn.execute(
+        "SELECT MIN(received_epoch) AS received_epoch FROM ready_queue WHERE ready_epoch <= ?",
+        (int(time.time()),),
+    ).fetchone()
+    oldest_ready = None
+    if oldest["received_epoch"] is not None:
+        oldest_ready = datetime.fromtimestamp(int(oldest["received_epoch"]), timezone.utc).isoformat()
+    return {"by_source": by_source, "totals": totals, "oldest_ready_received_at": oldest_ready}
+
+
+def _dead_letter_filter(
+    *, source: str | None, error_prefix: str | None, since: str | None, until: str | None
+) -> tuple[str, list[Any]]:
+    clauses: list[str] = []
+    args: list[Any] = []
+    if source:
+        clauses.append("source = ?")
+        args.append(source)
+    if error_prefix:
+        clauses.append("substr(COALESCE(error, ''), 1, ?) = ?")
+        args.extend([len(error_prefix), error_prefix])
+    if since:
+        clauses.append("dead_at >= ?")
+        args.append(since)
+    if until:
+        clauses.append("dead_at < ?")
+        args.append(until)
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", args
+
+
+def list_dead_letters(
+    conn: sqlite3.Connection,
+    *,
+    source: str | None = None,
+    error_prefix: str | None = None,
+    since: str | None = None,
+    until: str | None = None,
+    limit: int = 100,
+) -> list[dict[str, Any]]:
+    """
+    Dead-lettered events matching the filters, oldest first. `since`/`until` bound `dead_at` (ISO, half-open).
+    """
+    where, args = _dead_letter_filter(source=source, error_prefix=error_prefix, since=since, until=until)
+    rows = conn.execute(
+        f"""
+        SELECT event_row_id, source, event_id, attempt_count, error, dead_at
+        FROM dead_letters{where}
+        ORDER BY dead_at ASC, event_row_id ASC
+        LIMIT ?
+        """,
+        (*args, int(limit)),
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def count_dead_letters(
+    conn: sqlite3.Connection,
+    *,
+    source: str | None = None,
+    error_prefix: str | None = None,
+    since: str | None = None,
+    until: str | None = None,
+) -> int:
+    where, args = _dead_letter_filter(source=source, error_prefix=error_prefix, since=since, until=until)
+    return int(conn.execute(f"SELECT COUNT(*) FROM dead_letters{where}", args).fetchone()[0])
+
+
+def requeue_dead_letters(conn: sqlite3.Connection, *, event_ids: Iterable[int], reroute: bool = False) -> int:
+    """
+    Put dead-lettered events back in the queue with a fresh attempt budget. Returns the number requeued.
+
+    `last_error` is kept for reference until the next attempt overwrites it. The stored route decision
+    is reused unless `reroute` is set, in which case it is dropped and the event is routed again.
+    """
+    ids = [int(i) for i in event_ids]
+    if not ids:
+        return 0
+    now = utc_now_iso()
+    placeholders = ",".join("?" for _ in ids)
+    with write_transaction(conn):
+        cur = conn.execute(
+            f"""
+            UPDATE events
+            SET status='pending', attempt_count=0, next_attempt_at=?, processed_at=NULL
+            WHERE id IN ({placeholders}) AND status='error'
+            """,
+            (now, *ids),
+        )
+        if reroute:
+            conn.execute(f"DELETE FROM route_decisions WHERE event_row_id IN ({placeholders})", ids)
+        return cur.rowcount
+
+
+def save_route_decision(
+    conn: sqlite3.Connection, *, event_row_id: int, decision: dict[str, Any], config_version: int | None = None
 ) -> None:
     conn.execute(
         """
-        UPDATE events
-        SET status='retry', attempt_count=?, next_attempt_at=?, last_error=?
-        WHERE id=?
+        INSERT OR REPLACE INTO route_decisions (event_row_id, config_version, decision_json, routed_at)
+        VALUES (?, ?, ?, ?)
         """,
-        (attempt_count, next_attempt_at, error, event_id),
+        (event_row_id, config_version, json.dumps(decision, separators=(",", ":")), utc_now_iso()),
     )
 
 
-def mark_error(conn: sqlite3.Connection, *, event_id: int, attempt_count: int, error: str) -> None:
-    now = utc_now_iso()
+def get_route_decision(conn: sqlite3.Connection, *, event_row_id: int) -> dict[str, Any] | None:
+    """
+    The decision stored for an event: `{"decision": {...}, "config_version": int | None, "routed_at": str}`.
+    """
+    row = conn.execute(
+        "SELECT config_version, decision_json, routed_at FROM route_decisions WHERE event_row_id = ?",
+        (event_row_id,),
+    ).fetchone()
+    if row is None:
+        return None
+    return {
+        "decision": json.loads(row["decision_json"]),
+        "config_version": row["config_version"],
+        "routed_at": str(row["routed_at"]),
+    }
+
+
+def get_config_version(conn: sqlite3.Connection) -> int | None:
+    """
+    `version` of the last routing config applied with `apply_config` (None if none was).
+    """
+    row = conn.execute("SELECT value FROM app_meta WHERE key = 'config_version'").fetchone()
+    return None if row is None else int(row["value"])
+
+
+def set_config_version(conn: sqlite3.Connection, *, version: int) -> None:
     conn.execute(
         """
-        UPDATE events
-        SET status='error', attempt_count=?, processed_at=?, last_error=?
-        WHERE id=?
+        INSERT INTO app_meta (key, value, updated_at) VALUES ('config_version', ?, ?)
+        ON CONFLICT(key) DO UPDATE SET value=excluded.value, updated_at=excluded.updated_at
         """,
-        (attempt_count, now, error, event_id),
+        (str(int(version)), utc_now_iso()),
+    )
+
+
+_SHAPE_COLUMNS = """
+  fingerprint, provider, confidence, event_type_path, event_id_path, hits, misses, expires_epoch, updated_at,
+  shape_json, agreements, promoted, agreed_epoch, verify_after_epoch
+"""
+
+
+def _shape_from_row(row: sqlite3.Row) -> ShapeClassification:
+    return ShapeClassification(
+        fingerprint=str(row["fingerprint"]),
+        provider=str(row["provider"]),
+        confidence=float(row["confidence"]),
+        event_type_path=row["event_type_path"],
+        event_id_path=row["event_id_path"],
+        hits=int(row["hits"]),
+        misses=int(row["misses"]),
+        expires_epoch=float(row["expires_epoch"]),
+        updated_at=str(row["updated_at"]),
+        shape=None if row["shape_json"] is None else json.loads(row["shape_json"]),
+        agreements=int(row["agreements"]),
+        promoted=bool(row["promoted"]),
+        agreed_epoch=float(row["agreed_epoch"]),
+        verify_after_epoch=float(row["verify_after_epoch"]),
     )
 
 
+def lookup_shape_classification(conn: sqlite3.Connection, *, fingerprint: str) -> ShapeClassification | None:
+    """
+    The unexpired cached classification for `fingerprint`, counting a hit; None on a miss.
+    """
+    row = conn.execute(
+        f"""
+        UPDATE ai_shape_cache SET hits = hits + 1
+        WHERE fingerprint = ? AND expires_epoch > ?
+        RETURNING {_SHAPE_COLUMNS}
+        """,
+        (fingerprint, time.time()),
+    ).fetchone()
+    return None if row is None else _shape_from_row(row)
+
+
+def save_shape_classification(
+    conn: sqlite3.Connection,
+    *,
+    fingerprint: str,
+    provider: str,
+    confidence: float,
+    event_type_path: str | None = None,
+    event_id_path: str | None = None,
+    ttl_seconds: float,
+    shape: dict[str, Any] | None = None,
+    agreement_interval_seconds: float = 0.0,
+) -> ShapeClassification:
+    """
+    Store a fresh classifier answer for `fingerprint` (counted as a miss), valid for `ttl_seconds`.
+
+    `agreements` grows while successive answers name the same provider and event type path, but by
+    one per `agreement_interval_seconds` at most: workers that miss the same new shape together all
+    ask the model, and their answers are one observation, not several. The next re-verification
+    (`claim_shape_verification`) is due an interval after the answer.
+    """
+    now = time.time()
+    interval = max(0.0, float(agreement_interval_seconds))
+    row = conn.execute(
+        f"""
+        INSERT INTO ai_shape_cache
+          (fingerprint, provider, confidence, event_type_path, event_id_path, hits, misses, expires_epoch, updated_at,
+           shape_json, agreements, agreed_epoch, verify_after_epoch)
+        VALUES (?, ?, ?, ?, ?, 0, 1, ?, ?, ?, 1, ?, ?)
+        ON CONFLICT(fingerprint) DO UPDATE SET
+          agreements=CASE
+            WHEN ai_shape_cache.provider != excluded.provider
+              OR ai_shape_cache.event_type_path IS NOT excluded.event_type_path THEN 1
+            WHEN ai_shape_cache.agreed_epoch + ? <= excluded.agreed_epoch THEN ai_shape_cache.agreements + 1
+            ELSE ai_shape_cache.agreements END,
+          agreed_epoch=CASE
+            WHEN ai_shape_cache.provider != excluded.provider
+              OR ai_shape_cache.event_type_path IS NOT excluded.event_type_path
+              OR ai_shape_cache.agreed_epoch + ? <= excluded.agreed_epoch THEN excluded.agreed_epoch
+            ELSE ai_shape_cache.agreed_epoch END,
+          verify_after_epoch=excluded.verify_after_epoch,
+          provider=excluded.provider,
+          confidence=excluded.confidence,
+          event_type_path=excluded.event_type_path,
+          event_id_path=excluded.event_id_path,
+          misses=ai_shape_cache.misses + 1,
+          expires_epoch=excluded.expires_epoch,
+          updated_at=excluded.updated_at,
+          shape_json=COALESCE(excluded.shape_json, ai_shape_cache.shape_json)
+        RETURNING {_SHAPE_COLUMNS}
+        """,
+        (
+            fingerprint,
+            provider,
+            float(confidence),
+            event_type_path,
+            event_id_path,
+            now + float(ttl_seconds),
+            utc_now_iso(),
+            None if shape is None else json.dumps(shape, separators=(",", ":"), sort_keys=True),
+            now,
+            now + interval,
+            interval,
+            interval,
+        ),
+    ).fetchone()
+    return _shape_from_row(row)
+
+
+def claim_shape_verification(conn: sqlite3.Connection, *, fingerprint: str, interval_seconds: float) -> bool:
+    """
+    Take the due re-verification of a cached, not yet promoted classification: True for the one
+    caller that should ask the model again, after which the next is due in `interval_seconds`.
+    """
+    now = time.time()
+    cur = conn.execute(
+        """
+        UPDATE ai_shape_cache SET verify_after_epoch = ?
+        WHERE fingerprint = ? AND promoted = 0 AND verify_after_epoch <= ?
+        """,
+        (now + max(0.0, float(interval_seconds)), fingerprint, now),
+    )
+    return cur.rowcount > 0
+
+
+def list_shape_classifications(conn: sqlite3.Connection, *, limit: int = 100) -> list[ShapeClassification]:
+    """
+    Cached shapes, most used first (expired ones included until they are refreshed).
+    """
+    rows = conn.execute(
+        f"SELECT {_SHAPE_COLUMNS} FROM ai_shape_cache ORDER BY hits + misses DESC, fingerprint LIMIT ?",
+        (max(1, int(limit)),),
+    ).fetchall()
+    return [_shape_from_row(r) for r in rows]
+
+
+def shape_cache_stats(conn: sqlite3.Connection) -> dict[str, int]:
+    row = conn.execute(
+        """
+        SELECT COUNT(*) AS shapes,
+               COALESCE(SUM(expires_epoch <= ?), 0) AS expired,
+               COALESCE(SUM(hits), 0) AS hits,
+               COALESCE(SUM(misses), 0) AS misses
+        FROM ai_shape_cache
+        """,
+        (time.time(),),
+    ).fetchone()
+    return {k: int(row[k]) for k in ("shapes", "expired", "hits", "misses")}
+
+
+_SIGNATURE_COLUMNS = """
+  name, provider, confidence, conditions_json, event_type_path, event_id_path, status, fingerprint, created_at,
+  updated_at
+"""
+
+
+def _signature_from_row(row: sqlite3.Row) -> ProviderSignature:
+    return ProviderSignature(
+        name=str(row["name"]),
+        provider=str(row["provider"]),
+        confidence=float(row["confidence"]),
+        conditions=json.loads(row["conditions_json"]),
+        event_type_path=row["event_type_path"],
+        event_id_path=row["event_id_path"],
+        status=str(row["status"]),
+        fingerprint=str(row["fingerprint"]),
+        created_at=str(row["created_at"]),
+        updated_at=str(row["updated_at"]),
+    )
+
+
+def add_provider_signature(conn: sqlite3.Connection, *, signature: ProviderSignature) -> bool:
+    """
+    Record a signature derived from the cached shape `signature.fingerprint` and mark the shape as
+    promoted, so it is derived once. Returns False when a signature of that name already exists.
+    """
+    now = utc_now_iso()
+    with write_transaction(conn):
+        cur = conn.execute(
+            f"""
+            INSERT INTO provider_signatures ({_SIGNATURE_COLUMNS})
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(name) DO NOTHING
+            """,
+            (
+                signature.name,
+                signature.provider,
+                float(signature.confidence),
+                json.dumps(signature.conditions, separators=(",", ":"), ensure_ascii=False),
+                signature.event_type_path,
+                signature.event_id_path,
+                signature.status,
+                signature.fingerprint,
+                now,
+                now,
+            ),
+        )
+        conn.execute("UPDATE ai_shape_cache SET promoted = 1 WHERE fingerprint = ?", (signature.fingerprint,))
+        if cur.rowcount and signature.status == INSTALLED:
+            _bump_revision(conn, "provider_signatures_revision")
+    return bool(cur.rowcount)
+
+
+def list_provider_signatures(conn: sqlite3.Connection, *, status: str | None = None) -> list[ProviderSignature]:
+    rows = conn.execute(
+        f"""
+        SELECT {_SIGNATURE_COLUMNS} FROM provider_signatures
+        WHERE ? IS NULL OR status = ?
+        ORDER BY provider, name
+        """,
+        (status, status),
+    ).fetchall()
+    return [_signature_from_row(r) for r in rows]
+
+
+def set_provider_signature_status(conn: sqlite3.Connection, *, name: str, status: str) -> bool:
+    with write_transaction(conn):
+        cur = conn.execute(
+            "UPDATE provider_signatures SET status = ?, updated_at = ? WHERE name = ? AND status != ?",
+            (status, utc_now_iso(), name, status),
+        )
+        if cur.rowcount:
+            _bump_revision(conn, "provider_signatures_revision")
+    return bool(cur.rowcount)
+
+
+def get_provider_signatures_revision(conn: sqlite3.Connection) -> str | None:
+    """
+    Token that changes whenever the set of installed provider signatures may have changed.
+    """
+    return _get_revision(conn, "provider_signatures_revision")
+
+
 def get_event_row(conn: sqlite3.Connection, *, event_row_id: int) -> dict[str, Any] | None:
     row = conn.execute(
         """
         SELECT id, source, event_id, received_at, status, attempt_count, next_attempt_at, processing_started_at, processed_at,
-               payload_json, result_json, last_error
+               payload_json, result_json, last_error, lease_owner, lease_expires_at, payload_hash, result_hash,
+               priority
         FROM events
         WHERE id = ?
         """,
         (event_row_id,),
     ).fetchone()
-    return dict(row) if row is not None else None
+    if row is None:
+        return None
+    out = dict(row)
+    resolve_json_columns(conn, [out], {"payload_json": "payload_hash", "result_json": "result_hash"})
+    return out
 
 
 def list_action_runs_for_event(conn: sqlite3.Connection, *, event_row_id: int, limit: int = 20) -> list[dict[str, Any]]:
     rows = conn.execute(
         """
-        SELECT id, event_row_id, started_at, finished_at, status, provider, action, handler_mode, handler_target, input_json, output_json, error
+        SELECT id, event_row_id, started_at, finished_at, status, provider, action, handler_mode, handler_target, input_json, output_json, error,
+               input_hash, output_hash
         FROM action_runs
         WHERE event_row_id = ?
         ORDER BY id DESC
@@ -503,4 +2109,4 @@ def list_action_runs_for_event(conn: sqlite3.Connection, *, event_row_id: int, l
         """,
         (event_row_id, int(limit)),
     ).fetchall()
-    return [dict(r) for r in rows]
+    return _action_run_dicts(conn, rows)
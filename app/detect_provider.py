@@ -2,7 +2,10 @@ from __future__ import annotations
 
 import re
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Iterable
+
+from .ai_cache import INSTALLED, ProviderSignature
+from .rule_eval import EventView, compile_conditions, get_path
 
 
 @dataclass(frozen=True)
@@ -10,6 +13,40 @@ class ProviderDetection:
     provider: str
     confidence: float
     signals: list[str]
+    # Set by a provider signature that knows where the event type lives.
+    event_type: str | None = None
+
+
+class SignatureSet:
+    """
+    Installed provider signatures, compiled. Signatures with more conditions are tried first, so the
+    most specific shape wins.
+    """
+
+    def __init__(self, signatures: Iterable[ProviderSignature]) -> None:
+        installed = [s for s in signatures if s.status == INSTALLED]
+        installed.sort(key=lambda s: (-len(s.conditions.get("all") or []), -s.confidence, s.name))
+        self.signatures = installed
+        self._predicates = [compile_conditions(s.conditions) for s in installed]
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def match(self, payload: dict[str, Any]) -> ProviderDetection | None:
+        if not self.signatures:
+            return None
+        view = EventView.of(payload)
+        for signature, predicate in zip(self.signatures, self._predicates):
+            if not predicate(view).matched:
+                continue
+            event_type = get_path(view.json, signature.event_type_path) if signature.event_type_path else None
+            return ProviderDetection(
+                provider=signature.provider,
+                confidence=signature.confidence,
+                signals=[f"signature:{signature.name}"],
+                event_type=event_type if isinstance(event_type, str) else None,
+            )
+        return None
 
 
 def _lower_headers(headers: dict[str, Any] | None) -> dict[str, str]:
@@ -26,7 +63,11 @@ def _lower_headers(headers: dict[str, Any] | None) -> dict[str, str]:
     return lowered
 
 
-def detect_provider(payload: dict[str, Any]) -> ProviderDetection:
+def detect_provider(payload: dict[str, Any], signatures: SignatureSet | None = None) -> ProviderDetection:
+    """
+    Provider from well-known headers and JSON shapes, then from learned `signatures` (see
+    `mapper.installed_signatures`); `unknown` with low confidence when nothing matches.
+    """
     headers = _lower_headers(payload.get("headers"))
     json_body = payload.get("json")
     signals: list[str] = []
@@ -75,4 +116,8 @@ def detect_provider(payload: dict[str, Any]) -> ProviderDetection:
             signals.append("json:slack_challenge_shape")
             return ProviderDetection(provider="slack", confidence=0.65, signals=signals)
 
+    learned = signatures.match(payload) if signatures is not None else None
+    if learned is not None:
+        return learned
+
     return ProviderDetection(provider="unknown", confidence=0.2, signals=signals)
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import argparse
+import time
+
+from .notify import open_wakeup_channel
+from .queue_store import open_queue_store
+from .settings import get_settings
+
+
+DEFAULT_DB_PATH = get_settings().app_db_path
+
+
+def _add_filters(cmd: argparse.ArgumentParser) -> None:
+    cmd.add_argument("--source", default=None)
+    cmd.add_argument("--error-prefix", default=None, help="Match dead letters whose error starts with this text")
+    cmd.add_argument("--since", default=None, help="Dead-lettered at or after this ISO time (UTC, +00:00)")
+    cmd.add_argument("--until", default=None, help="Dead-lettered before this ISO time")
+
+
+def _filters(args: argparse.Namespace) -> dict[str, str | None]:
+    return {
+        "source": args.source.strip() if args.source else None,
+        "error_prefix": args.error_prefix,
+        "since": args.since,
+        "until": args.until,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Inspect and requeue dead-lettered events.")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH)
+
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    list_cmd = sub.add_parser("list", help="List dead letters (oldest first)")
+    _add_filters(list_cmd)
+    list_cmd.add_argument("--limit", type=int, default=50)
+
+    count_cmd = sub.add_parser("count", help="Count dead letters matching the filters")
+    _add_filters(count_cmd)
+
+    requeue_cmd = sub.add_parser("requeue", help="Requeue matching dead letters in rate-limited batches")
+    _add_filters(requeue_cmd)
+    requeue_cmd.add_argument("--batch-size", type=int, default=50)
+    requeue_cmd.add_argument("--rate", type=float, default=5.0, help="Max events requeued per second (0 = no limit)")
+    requeue_cmd.add_argument("--max", type=int, default=None, help="Stop after requeueing this many events")
+    requeue_cmd.add_argument("--dry-run", action="store_true", help="Only report how many events would be requeued")
+    requeue_cmd.add_argument(
+        "--reroute",
+        action="store_true",
+        help="Drop the stored route decisions so the events are routed again (e.g. after a config fix)",
+    )
+
+    args = parser.parse_args()
+
+    store = open_queue_store(db_path=args.db)
+    try:
+        store.init()
+        filters = _filters(args)
+
+        if args.cmd == "list":
+            rows = store.list_dead_letters(limit=args.limit, **filters)
+            if not rows:
+                print("no dead letters")
+                return
+            for r in rows:
+                error = (r["error"] or "").replace("\n", " ")[:160]
+                print(
+                    f"id={r['event_row_id']} source={r['source']} event_id={r['event_id']} "
+                    f"attempts={r['attempt_count']} dead_at={r['dead_at']} error={error}"
+                )
+            return
+
+        if args.cmd == "count":
+            print(store.count_dead_letters(**filters))
+            return
+
+        if args.cmd == "requeue":
+            matching = store.count_dead_letters(**filters)
+            target = matching if args.max is None else min(matching, args.max)
+            if args.dry_run:
+                print(f"would requeue {target} of {matching} dead letter(s)")
+                return
+
+            wakeup = open_wakeup_channel()
+            batch_size = max(1, args.batch_size)
+            requeued = 0
+            while requeued < target:
+                started = time.monotonic()
+                batch = store.list_dead_letters(limit=min(batch_size, target - requeued), **filters)
+                if not batch:
+                    break
+                n = store.requeue_dead_letters(event_ids=[r["event_row_id"] for r in batch], reroute=args.reroute)
+                if n == 0:
+                    break
+                requeued += n
+                if wakeup is not None:
+                    wakeup.notify()
+                print(f"requeued {requeued}/{target}")
+                if args.rate > 0 and requeued < target:
+                    time.sleep(max(0.0, n / args.rate - (time.monotonic() - started)))
+            print(f"done requeued={requeued}")
+            return
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+from typing import Mapping
+
+
+DEFAULT_WEIGHT = 1.0
+
+
+def parse_weights(spec: str) -> dict[str, float]:
+    """
+    Parse `WORKER_FAIR_WEIGHTS` ("stripe=3,cron=0.5") into {source: weight}. Unlisted sources weigh 1.
+    """
+    weights: dict[str, float] = {}
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, sep, value = part.partition("=")
+        if not sep or not name.strip():
+            raise ValueError(f"invalid fair-share weight {part!r} (expected source=weight)")
+        weight = float(value)
+        if weight <= 0:
+            raise ValueError(f"fair-share weight for {name.strip()!r} must be > 0")
+        weights[name.strip()] = weight
+    return weights
+
+
+def pick_fair(
+    candidates: Mapping[str, list[tuple[int, int]]],
+    credits: Mapping[str, float],
+    *,
+    weights: Mapping[str, float],
+    limit: int,
+) -> tuple[list[int], dict[str, float]]:
+    """
+    Choose up to `limit` event ids from per-source candidate lists with smooth weighted round-robin.
+
+    `candidates[source]` is that source's ready `(id, priority)` pairs in claim order. Priority still
+    wins: each pick only considers sources whose next candidate is in the lowest pending lane. Among
+    those, every source earns its weight in credit, the richest one is picked and pays back the total
+    weight of the round. Over time each busy source gets `weight / sum(weights)` of the claims, and a
+    quiet source's event is picked within one round instead of queueing behind another source's burst.
+
+    `credits` carries the state between calls. The result holds credits for every source that had
+    candidates; callers drop sources with nothing ready, so an idle source does not hoard credit.
+    """
+    queues = {source: list(rows) for source, rows in candidates.items() if rows}
+    credit = {source: float(credits.get(source, 0.0)) for source in queues}
+    picked: list[int] = []
+    while len(picked) < limit and queues:
+        lane = min(rows[0][1] for rows in queues.values())
+        eligible = sorted(source for source, rows in queues.items() if rows[0][1] == lane)
+        total = 0.0
+        for source in eligible:
+            weight = float(weights.get(source, DEFAULT_WEIGHT))
+            credit[source] += weight
+            total += weight
+        chosen = max(eligible, key=lambda source: credit[source])
+        credit[chosen] -= total
+        picked.append(queues[chosen].pop(0)[0])
+        if not queues[chosen]:
+            del queues[chosen]
+    return picked, credit
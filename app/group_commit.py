@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from .db import open_db
+
+
+@dataclass
+class _Op:
+    fn: Callable[..., Any]
+    kwargs: dict[str, Any]
+    future: Future = field(default_factory=Future)
+
+
+class GroupCommitWriter:
+    """
+    Dedicated writer thread that commits queued SQLite writes in micro-batches.
+
+    Each submitted write is a `fn(conn, **kwargs)` call (e.g. `db.mark_done`). The thread takes
+    everything queued (up to `max_batch`), optionally lingering `max_delay` seconds for more, runs
+    each write in its own SAVEPOINT inside a single `BEGIN IMMEDIATE` transaction, and commits once.
+    Writes that arrive while a batch commits form the next batch, so batches grow with load even
+    without a linger. A write that raises is rolled back alone; the rest of the batch still
+    commits. The future returned by `submit` resolves only after the batch commits, so
+    `future.result()` waits for durability.
+    """
+
+    def __init__(self, db_path: str, *, max_batch: int = 100, max_delay: float = 0.0) -> None:
+        self.db_path = db_path
+        self.max_batch = max(1, int(max_batch))
+        self.max_delay = max(0.0, float(max_delay))
+        self.batches = 0
+        self.writes = 0
+        self._queue: queue.Queue[_Op | None] = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def start(self) -> GroupCommitWriter:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name="group-commit")
+                self._thread.start()
+        return self
+
+    def stop(self, timeout: float | None = 10.0) -> None:
+        """
+        Commit everything already submitted, then stop the thread.
+        """
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+
+    def submit(self, fn: Callable[..., Any], **kwargs: Any) -> Future:
+        op = _Op(fn=fn, kwargs=kwargs)
+        with self._lock:
+            if self._stopped:
+                raise RuntimeError("group-commit writer is stopped")
+            self._queue.put(op)
+        return op.future
+
+    def call(self, fn: Callable[..., Any], **kwargs: Any) -> Any:
+        """
+        Submit a write and wait for its batch to commit; returns `fn`'s result or re-raises its error.
+        """
+        return self.submit(fn, **kwargs).result()
+
+    def _run(self) -> None:
+        conn = open_db(self.db_path)
+        try:
+            stopping = False
+            while not stopping:
+                op = self._queue.get()
+                if op is None:
+                    break
+                batch = [op]
+                deadline = time.monotonic() + self.max_delay
+                while len(batch) < self.max_batch:
+                    try:
+                        remaining = deadline - time.monotonic()
+                        nxt = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if nxt is None:
+                        stopping = True
+                        break
+                    batch.append(nxt)
+                self._commit(conn, batch)
+        finally:
+            conn.close()
+
+    def _commit(self, conn: sqlite3.Connection, batch: list[_Op]) -> None:
+        outcomes: list[tuple[bool, Any]] = []
+        try:
+            conn.execute("BEGIN IMMEDIATE;")
+            for op in batch:
+                conn.execute("SAVEPOINT gc_op;")
+                try:
+                    value = op.fn(conn, **op.kwargs)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO gc_op;")
+                    conn.execute("RELEASE gc_op;")
+                    outcomes.append((False, e))
+                else:
+                    conn.execute("RELEASE gc_op;")
+                    outcomes.append((True, value))
+            conn.execute("COMMIT;")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK;")
+            for op in batch:
+                op.future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.writes += len(batch)
+        for op, (ok, value) in zip(batch, outcomes):
+            if ok:
+                op.future.set_result(value)
+            else:
+                op.future.set_exception(value)
+
+
+_writers: dict[str, GroupCommitWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_group_commit_writer(db_path: str, *, max_batch: int = 100, max_delay: float = 0.0) -> GroupCommitWriter:
+    """
+    Process-wide writer for `db_path`, started on first use and flushed at interpreter exit.
+    """
+    with _writers_lock:
+        writer = _writers.get(db_path)
+        if writer is None:
+            writer = _writers[db_path] = GroupCommitWriter(db_path, max_batch=max_batch, max_delay=max_delay).start()
+        return writer
+
+
+def stop_group_commit_writers() -> None:
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.stop()
+
+
+atexit.register(stop_group_commit_writers)
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Any, Mapping, Sequence
+
+
+# Events waiting on a full concurrency limit re-check in turn, `max_concurrency` of them per this many
+# seconds, instead of all of them every second.
+CONCURRENCY_RECHECK_SECONDS = 1.0
+
+
+@dataclass(frozen=True)
+class HandlerLimit:
+    """
+    Backpressure for one handler key: a `handler_target` or `provider/action`.
+
+    `max_concurrency` caps the events running against the key at once (across every worker sharing the
+    database). `rate_per_sec` and `burst` form a token bucket: at most `burst` starts back to back, then
+    `rate_per_sec` per second. None means no limit of that kind; `burst` defaults to one second's worth.
+    """
+
+    limit_key: str
+    max_concurrency: int | None = None
+    rate_per_sec: float | None = None
+    burst: float | None = None
+    updated_at: str = ""
+
+    @property
+    def bucket_size(self) -> float:
+        if self.burst is not None:
+            return max(1.0, float(self.burst))
+        return max(1.0, float(self.rate_per_sec or 0.0))
+
+
+@dataclass(frozen=True)
+class PermitDecision:
+    """
+    Result of `decide_permit`. When not `admitted`, the event should retry at `retry_at` (epoch seconds);
+    `blocked_by` names the limit that pushed it furthest out.
+
+    `tats` holds the new bucket state for every key whose token this event took, and `reservations` the
+    start times to keep for the event on each rate-limited key when it is deferred, so it is not charged
+    again when it comes back. `waits` are the re-check slots the event took on each full concurrency key.
+    """
+
+    admitted: bool
+    retry_at: float = 0.0
+    blocked_by: str | None = None
+    tats: dict[str, float] = field(default_factory=dict)
+    reservations: dict[str, float] = field(default_factory=dict)
+    waits: dict[str, float] = field(default_factory=dict)
+
+
+def limit_keys(*, handler_target: str | None, provider: str | None, action: str | None) -> list[str]:
+    """
+    Keys a routed event is limited under, most specific first.
+    """
+    keys: list[str] = []
+    if handler_target:
+        keys.append(str(handler_target))
+    if provider and action:
+        key = f"{provider}/{action}"
+        if key not in keys:
+            keys.append(key)
+    return keys
+
+
+def parse_limits(obj: Any) -> list[HandlerLimit]:
+    """
+    Parse the `limits` section of the routing config:
+    `{"<handler_target or provider/action>": {"max_concurrency": 4, "rate_per_sec": 2, "burst": 5}}`.
+    """
+    if obj is None:
+        return []
+    if not isinstance(obj, dict):
+        raise ValueError("config.limits must be an object keyed by handler_target or provider/action.")
+    limits: list[HandlerLimit] = []
+    for key, spec in obj.items():
+        key = str(key).strip()
+        if not key:
+            continue
+        if not isinstance(spec, dict):
+            raise ValueError(f"config.limits[{key!r}] must be an object.")
+        unknown = set(spec) - {"max_concurrency", "rate_per_sec", "burst"}
+        if unknown:
+            raise ValueError(f"config.limits[{key!r}] has unknown field(s): {', '.join(sorted(unknown))}")
+        max_concurrency = None if spec.get("max_concurrency") is None else int(spec["max_concurrency"])
+        rate = None if spec.get("rate_per_sec") is None else float(spec["rate_per_sec"])
+        burst = None if spec.get("burst") is None else float(spec["burst"])
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError(f"config.limits[{key!r}].max_concurrency must be >= 1")
+        if rate is not None and rate <= 0:
+            raise ValueError(f"config.limits[{key!r}].rate_per_sec must be > 0")
+        if burst is not None and (burst < 1 or rate is None):
+            raise ValueError(f"config.limits[{key!r}].burst must be >= 1 and needs rate_per_sec")
+        limits.append(HandlerLimit(limit_key=key, max_concurrency=max_concurrency, rate_per_sec=rate, burst=burst))
+    return limits
+
+
+def decide_permit(
+    limits: Sequence[HandlerLimit],
+    *,
+    tats: Mapping[str, float],
+    running: Mapping[str, int],
+    reservations: Mapping[str, float],
+    now: float,
+    waiting: Mapping[str, float] | None = None,
+) -> PermitDecision:
+    """
+    Decide whether an event may start now under every limit in `limits` (all or nothing).
+
+    The token bucket is kept as a GCRA "theoretical arrival time" per key (`tats`): each start moves it
+    `1 / rate_per_sec` ahead, and a start is allowed while it is less than `burst` intervals ahead of
+    `now`. An event that has to wait takes the next free slot straight away (a reservation), so a
+    backlog is spread over time in order instead of every deferred event retrying at once.
+    `running` counts the other events holding a concurrency slot; `reservations` are the slots this
+    event reserved on an earlier attempt.
+
+    A full concurrency limit queues its waiters the same way: `waiting` is the last re-check slot other
+    events took on each key, and this event re-checks `CONCURRENCY_RECHECK_SECONDS / max_concurrency`
+    after it (at least `CONCURRENCY_RECHECK_SECONDS` from now). However long the backlog, a key then
+    sees about `max_concurrency` re-checks per `CONCURRENCY_RECHECK_SECONDS`.
+    """
+    waiting = waiting or {}
+    retry_at = now
+    blocked_by: str | None = None
+    new_tats: dict[str, float] = {}
+    ready_at: dict[str, float] = {}
+    waits: dict[str, float] = {}
+
+    for limit in limits:
+        key = limit.limit_key
+        if limit.rate_per_sec:
+            if key in reservations:
+                ready_at[key] = float(reservations[key])
+            else:
+                interval = 1.0 / float(limit.rate_per_sec)
+                tat = max(float(tats.get(key, 0.0)), now)
+                ready_at[key] = max(now, tat - (limit.bucket_size - 1.0) * interval)
+                new_tats[key] = tat + interval
+            if ready_at[key] > retry_at:
+                retry_at, blocked_by = ready_at[key], key
+        if limit.max_concurrency is not None and int(running.get(key, 0)) >= limit.max_concurrency:
+            spacing = CONCURRENCY_RECHECK_SECONDS / limit.max_concurrency
+            waits[key] = max(now + CONCURRENCY_RECHECK_SECONDS, float(waiting.get(key, 0.0)) + spacing)
+            if waits[key] > retry_at:
+                retry_at, blocked_by = waits[key], key
+
+    if blocked_by is None:
+        return PermitDecision(admitted=True, tats=new_tats)
+    return PermitDecision(
+        admitted=False,
+        retry_at=retry_at,
+        blocked_by=blocked_by,
+        tats=new_tats,
+        reservations=ready_at,
+        waits=waits,
+    )
@@ -2,8 +2,10 @@ from __future__ import annotations
 
 import argparse
 import base64
+import dataclasses
 import hmac
 import json
+import time
 from contextlib import asynccontextmanager
 from typing import Any
 
@@ -13,8 +15,11 @@ from fastapi.responses import JSONResponse
 
 from .agent_executor import execute_agent
 from .config import apply_config, load_config
-from .db import enqueue_event, get_event_row, init_db, list_action_runs_for_event, open_db
 from .logger import get_logger
+from .mapper import enqueue_priority
+from .notify import WakeupChannel, open_wakeup_channel
+from .queue_store import open_queue_store
+from .retention import get_archived_event, shard_archive_dir
 from .settings import Settings, get_settings
 from .webhook_utils import verify_hmac_sha256_signature
 
@@ -40,26 +45,28 @@ def _require_secret(request: Request, *, secret: str, header_name: str) -> JSONR
     return None
 
 
-def create_app(*, db_path: str | None = None, bootstrap: bool = True, settings: Settings | None = None) -> FastAPI:
+def create_app(
+    *,
+    db_path: str | None = None,
+    bootstrap: bool = True,
+    settings: Settings | None = None,
+    wakeup: WakeupChannel | None = None,
+) -> FastAPI:
     settings = settings or get_settings()
     resolved_db_path = db_path or settings.app_db_path
+    wakeup = wakeup or open_wakeup_channel(settings)
 
     @asynccontextmanager
     async def lifespan(_app: FastAPI):
         if bootstrap:
-            import os
-
-            db_dir = os.path.dirname(resolved_db_path)
-            if db_dir:
-                os.makedirs(db_dir, exist_ok=True)
-            conn = open_db(resolved_db_path)
+            store = open_queue_store(db_path=resolved_db_path, settings=settings)
             try:
-                init_db(conn)
+                store.init()
                 cfg = load_config()
                 if cfg is not None:
-                    apply_config(conn, cfg)
+                    apply_config(store, cfg)
             finally:
-                conn.close()
+                store.close()
         yield
 
     app = FastAPI(title="Context Foundation", version="0.3", lifespan=lifespan)
@@ -78,18 +85,78 @@ def create_app(*, db_path: str | None = None, bootstrap: bool = True, settings:
         if not event_row_id.isdigit():
             return _json(400, {"ok": False, "error": "invalid event id"})
 
-        conn = open_db(resolved_db_path)
+        store = open_queue_store(db_path=resolved_db_path, settings=settings)
         try:
             row_id = int(event_row_id)
-            event_row = get_event_row(conn, event_row_id=row_id)
+            event_row = store.get_event_row(event_row_id=row_id)
             if event_row is None:
-                return _json(404, {"ok": False, "error": "not found"})
-            runs = list_action_runs_for_event(conn, event_row_id=row_id, limit=10)
+                if store.backend == "sqlite_sharded":
+                    # Shards archive separately, by shard-local id (`local_id * N + shard` is the global id).
+                    archived = get_archived_event(
+                        shard_archive_dir(settings.retention_archive_dir, row_id % settings.queue_shards),
+                        event_row_id=row_id // settings.queue_shards,
+                    )
+                else:
+                    archived = get_archived_event(settings.retention_archive_dir, event_row_id=row_id)
+                if archived is None:
+                    return _json(404, {"ok": False, "error": "not found"})
+                return _json(
+                    200,
+                    {
+                        "ok": True,
+                        "archived": True,
+                        "event": archived["event"],
+                        "action_runs": list(reversed(archived["action_runs"]))[:10],
+                    },
+                )
+            runs = store.list_action_runs_for_event(event_row_id=row_id, limit=10)
         finally:
-            conn.close()
+            store.close()
 
         return _json(200, {"ok": True, "event": event_row, "action_runs": runs})
 
+    @app.get("/admin/queue-stats")
+    def queue_stats(request: Request) -> JSONResponse:
+        auth = _require_secret(request, secret=settings.admin_secret, header_name="X-Admin-Secret")
+        if auth is not None:
+            return auth
+
+        store = open_queue_store(db_path=resolved_db_path, settings=settings)
+        try:
+            stats = store.get_queue_stats()
+        finally:
+            store.close()
+
+        return _json(200, {"ok": True, **stats})
+
+    @app.get("/admin/circuit-breakers")
+    def circuit_breakers(request: Request) -> JSONResponse:
+        auth = _require_secret(request, secret=settings.admin_secret, header_name="X-Admin-Secret")
+        if auth is not None:
+            return auth
+
+        store = open_queue_store(db_path=resolved_db_path, settings=settings)
+        try:
+            breakers = store.list_circuit_breakers()
+        finally:
+            store.close()
+
+        now = time.time()
+        return _json(
+            200,
+            {
+                "ok": True,
+                "failure_threshold": settings.circuit_failure_threshold,
+                "breakers": [
+                    {
+                        **dataclasses.asdict(b),
+                        "retry_in": round(max(0.0, b.open_until - now), 1) if b.state == "open" else None,
+                    }
+                    for b in breakers
+                ],
+            },
+        )
+
     @app.post("/cron/enqueue")
     def cron_enqueue(request: Request) -> JSONResponse:
         auth = _require_secret(request, secret=settings.ingress_secret, header_name="X-Ingress-Secret")
@@ -103,12 +170,22 @@ def create_app(*, db_path: str | None = None, bootstrap: bool = True, settings:
         job = (request.query_params.get("job") or "").strip()
         if not job:
             return _json(400, {"ok": False, "error": "missing job"})
+        priority_param = (request.query_params.get("priority") or "").strip()
+        try:
+            priority = int(priority_param) if priority_param else None
+        except ValueError:
+            return _json(400, {"ok": False, "error": "invalid priority"})
 
-        conn = open_db(resolved_db_path)
+        payload = {"job": job, "source_hint": "cron"}
+        store = open_queue_store(db_path=resolved_db_path, settings=settings)
         try:
-            row_id = enqueue_event(conn, source="cron", event_id=None, payload={"job": job, "source_hint": "cron"})
+            if priority is None:
+                priority = enqueue_priority(store, source="cron", payload=payload)
+            row_id = store.enqueue_event(source="cron", event_id=None, payload=payload, priority=priority)
         finally:
-            conn.close()
+            store.close()
+        if wakeup is not None:
+            wakeup.notify()
 
         return _json(200, {"ok": True, "status": "queued", "row_id": row_id})
 
@@ -197,7 +274,7 @@ app = create_app(db_path=_settings.app_db_path, bootstrap=True, settings=_settin
 
 def main() -> None:
     settings = get_settings()
-    parser = argparse.ArgumentParser(description="Webhook ingestion server (queues events in SQLite).")
+    parser = argparse.ArgumentParser(description="Webhook ingestion server (queues events in SQLite or PostgreSQL).")
     parser.add_argument("--host", default=settings.host)
     parser.add_argument("--port", type=int, default=settings.port)
     parser.add_argument("--db", default=settings.app_db_path)
@@ -1,12 +1,28 @@
 from __future__ import annotations
 
+import dataclasses
+import threading
+import time
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Iterator
 
-from .db import ProviderMapping, RoutingRule, get_provider_mapping, list_routing_rules
-from .detect_provider import ProviderDetection, detect_provider
+from .db import ProviderMapping
+from .detect_provider import ProviderDetection, SignatureSet, detect_provider
+from .ai_cache import (
+    INSTALLED,
+    PROPOSED,
+    ProviderSignature,
+    ShapeClassification,
+    payload_fingerprint,
+    payload_shape,
+    promotion_candidate,
+    promotion_ready,
+    signature_conditions,
+)
 from .ai_classifier import ai_detect_provider
-from .rule_eval import rule_matches
+from .queue_store import as_queue_store
+from .rule_eval import EventView, RuleSet, get_path
 from .settings import get_settings
 
 
@@ -24,6 +40,31 @@ class RouteDecision:
     reasons: list[str]
 
 
+def decision_to_dict(decision: RouteDecision) -> dict[str, Any]:
+    return dataclasses.asdict(decision)
+
+
+def decision_from_dict(obj: dict[str, Any]) -> RouteDecision:
+    detection = obj.get("detection") or {}
+    return RouteDecision(
+        provider=str(obj.get("provider") or ""),
+        confidence=float(obj.get("confidence") or 0.0),
+        detection=ProviderDetection(
+            provider=str(detection.get("provider") or ""),
+            confidence=float(detection.get("confidence") or 0.0),
+            signals=list(detection.get("signals") or []),
+            event_type=detection.get("event_type"),
+        ),
+        ai_detection=obj.get("ai_detection"),
+        event_type=obj.get("event_type"),
+        matched_rule=obj.get("matched_rule"),
+        action=obj.get("action"),
+        handler_mode=obj.get("handler_mode"),
+        handler_target=obj.get("handler_target"),
+        reasons=list(obj.get("reasons") or []),
+    )
+
+
 def _best_provider_hint(payload: dict[str, Any]) -> tuple[str | None, float]:
     hint = payload.get("source_hint")
     if hint is None:
@@ -34,24 +75,233 @@ def _best_provider_hint(payload: dict[str, Any]) -> tuple[str | None, float]:
     return hint_s, 0.6
 
 
-def _choose_provider(payload: dict[str, Any]) -> ProviderDetection:
+# provider signatures revision -> installed signatures, compiled (one entry: the current revision).
+_signature_sets: dict[str, SignatureSet] = {}
+
+
+def installed_signatures(conn: Any) -> SignatureSet | None:
+    """
+    The installed provider signatures, compiled once per signatures revision.
+    """
+    store = as_queue_store(conn)
+    revision = store.get_provider_signatures_revision()
+    if revision is None:
+        return None
+    signature_set = _signature_sets.get(revision)
+    if signature_set is None:
+        signature_set = SignatureSet(store.list_provider_signatures(status=INSTALLED))
+        _signature_sets.clear()
+        _signature_sets[revision] = signature_set
+    return signature_set
+
+
+def _choose_provider(store: Any, payload: dict[str, Any]) -> ProviderDetection:
     hint, hint_conf = _best_provider_hint(payload)
-    detection = detect_provider(payload)
+    detection = detect_provider(payload, installed_signatures(store))
     if hint and hint_conf > detection.confidence:
         return ProviderDetection(provider=hint, confidence=hint_conf, signals=["path:source_hint"])
     return detection
 
 
+def enqueue_priority(conn: Any, *, source: str, payload: dict[str, Any]) -> int | None:
+    """
+    Queue lane for a new event: the `queue_priority` of the mapping for the detected provider,
+    else of the mapping named after `source`. None means the store default.
+
+    Uses the header/hint heuristics only (no AI call), so it is cheap enough for ingress.
+    """
+    store = as_queue_store(conn)
+    candidates = [_choose_provider(store, payload).provider, source.strip().lower()]
+    for provider in dict.fromkeys(p for p in candidates if p and p != "unknown"):
+        mapping = store.get_provider_mapping(provider=provider)
+        if mapping is not None and mapping.queue_priority is not None:
+            return mapping.queue_priority
+    return None
+
+
+def _from_shape(shape: ShapeClassification, payload: dict[str, Any]) -> dict[str, Any]:
+    body = payload.get("json")
+
+    def at(path: str | None) -> str | None:
+        value = get_path(body, path) if path and isinstance(body, dict) else None
+        return None if value is None or isinstance(value, (dict, list)) else str(value)
+
+    return {
+        "provider": shape.provider,
+        "confidence": shape.confidence,
+        "event_type": at(shape.event_type_path),
+        "event_type_path": shape.event_type_path,
+        "event_id": at(shape.event_id_path),
+        "event_id_path": shape.event_id_path,
+        "notes": f"cached classification for shape {shape.fingerprint[:12]}",
+    }
+
+
+# fingerprint -> (lock, threads holding or waiting for it): one classifier call per new shape per process.
+_classify_locks: dict[str, tuple[threading.Lock, int]] = {}
+_classify_locks_guard = threading.Lock()
+
+
+@contextmanager
+def _single_flight(fingerprint: str) -> Iterator[None]:
+    with _classify_locks_guard:
+        lock, users = _classify_locks.get(fingerprint, (None, 0))
+        lock = lock or threading.Lock()
+        _classify_locks[fingerprint] = (lock, users + 1)
+    try:
+        with lock:
+            yield
+    finally:
+        with _classify_locks_guard:
+            lock, users = _classify_locks[fingerprint]
+            if users <= 1:
+                del _classify_locks[fingerprint]
+            else:
+                _classify_locks[fingerprint] = (lock, users - 1)
+
+
+def classify_payload(conn: Any, payload: dict[str, Any]) -> tuple[dict[str, Any], bool]:
+    """
+    `ai_detect_provider`, cached per payload shape (`payload_fingerprint`) for
+    `mapper_ai_cache_ttl_seconds`. Returns the classification and whether it came from the cache.
+
+    Only the first event of a shape (and the first after the entry expires) calls the model; the
+    others get its provider and confidence, with the event type and id read from their own body at
+    the paths the model named. Threads of one process that miss the same shape together wait for the
+    first one's answer instead of each calling the model. Failed calls are not cached. While the shape
+    could still become a provider signature, one event per `mapper_promote_verify_interval_seconds` is
+    classified again (`_verification_due`), so a busy shape builds up agreements without waiting for
+    the cache to expire.
+    """
+    store = as_queue_store(conn)
+    settings = get_settings()
+    ttl = settings.mapper_ai_cache_ttl_seconds
+    if ttl <= 0:
+        return ai_detect_provider(payload), False
+    shape_obj = payload_shape(payload)
+    fingerprint = payload_fingerprint(payload, shape_obj)
+    shape = store.lookup_shape_classification(fingerprint=fingerprint)
+    if shape is None:
+        with _single_flight(fingerprint):
+            # Whoever held the lock may have just classified the shape.
+            shape = store.lookup_shape_classification(fingerprint=fingerprint)
+            if shape is None:
+                return _classify_and_save(store, payload, fingerprint=fingerprint, shape_obj=shape_obj), False
+    if not _verification_due(store, shape):
+        _maybe_promote(store, shape)
+        return _from_shape(shape, payload), True
+    return _classify_and_save(store, payload, fingerprint=fingerprint, shape_obj=shape_obj), False
+
+
+def _classify_and_save(
+    store: Any, payload: dict[str, Any], *, fingerprint: str, shape_obj: dict[str, Any]
+) -> dict[str, Any]:
+    settings = get_settings()
+    ai_out = ai_detect_provider(payload)
+
+    def path_of(key: str) -> str | None:
+        value = ai_out.get(key)
+        return value.strip() if isinstance(value, str) and value.strip() else None
+
+    saved = store.save_shape_classification(
+        fingerprint=fingerprint,
+        provider=str(ai_out.get("provider") or "unknown").strip().lower(),
+        confidence=float(ai_out.get("confidence") or 0.0),
+        event_type_path=path_of("event_type_path"),
+        event_id_path=path_of("event_id_path"),
+        ttl_seconds=settings.mapper_ai_cache_ttl_seconds,
+        shape=shape_obj,
+        agreement_interval_seconds=settings.mapper_promote_verify_interval_seconds,
+    )
+    _maybe_promote(store, saved)
+    return ai_out
+
+
+def _verification_due(store: Any, shape: ShapeClassification) -> bool:
+    """
+    Whether this event should re-verify the cached `shape` with the model: promotion is enabled, the
+    shape is a `promotion_candidate` and its verification is due. Of the workers that see it due at
+    once, only the one that claims it (`claim_shape_verification`) asks.
+    """
+    settings = get_settings()
+    interval = settings.mapper_promote_verify_interval_seconds
+    if settings.mapper_promote_min_agreements <= 0 or interval <= 0 or shape.verify_after_epoch > time.time():
+        return False
+    if not promotion_candidate(shape, min_confidence=settings.mapper_promote_min_confidence):
+        return False
+    return bool(store.claim_shape_verification(fingerprint=shape.fingerprint, interval_seconds=interval))
+
+
+def _maybe_promote(store: Any, shape: ShapeClassification) -> None:
+    """
+    Turn a stable cached classification into a provider signature (see `promotion_ready`): proposed
+    for review, or installed right away with `mapper_promote_install`. Each shape is promoted once.
+    """
+    settings = get_settings()
+    ready = promotion_ready(
+        shape,
+        min_agreements=settings.mapper_promote_min_agreements,
+        min_confidence=settings.mapper_promote_min_confidence,
+        min_events=settings.mapper_promote_min_events,
+    )
+    if not ready or shape.shape is None:
+        return
+    conditions = signature_conditions(
+        shape.shape, event_type_path=shape.event_type_path, event_id_path=shape.event_id_path
+    )
+    if conditions is None:
+        return
+    signature = ProviderSignature(
+        name=f"{shape.provider}-{shape.fingerprint[:12]}",
+        provider=shape.provider,
+        confidence=shape.confidence,
+        conditions=conditions,
+        event_type_path=shape.event_type_path,
+        event_id_path=shape.event_id_path,
+        status=INSTALLED if settings.mapper_promote_install else PROPOSED,
+        fingerprint=shape.fingerprint,
+    )
+    if store.add_provider_signature(signature=signature):
+        print(
+            f"[signature] {signature.status} {signature.name}: provider={signature.provider} "
+            f"event_type_path={signature.event_type_path} after {shape.agreements} matching classification(s)"
+        )
+
+
+# provider -> (routing rules revision, compiled rules), shared by every worker thread in the process.
+_rule_sets: dict[str, tuple[str, RuleSet]] = {}
+
+
+def provider_rule_set(conn: Any, provider: str) -> RuleSet:
+    """
+    The compiled enabled rules for `provider`. Cached in-process and rebuilt when the store's routing
+    rules revision changes (any rule write, including `apply_config`), so a current cache costs one
+    primary-key read instead of a rules query and a JSON parse per rule.
+    """
+    store = as_queue_store(conn)
+    revision = store.get_routing_rules_revision()
+    cached = _rule_sets.get(provider)
+    if revision is not None and cached is not None and cached[0] == revision:
+        return cached[1]
+    rule_set = RuleSet(store.list_routing_rules(provider=provider))
+    if revision is not None:
+        _rule_sets[provider] = (revision, rule_set)
+    return rule_set
+
+
 def route_event(conn: Any, payload: dict[str, Any]) -> RouteDecision:
+    store = as_queue_store(conn)
     settings = get_settings()
-    detection = _choose_provider(payload)
+    detection = _choose_provider(store, payload)
     reasons: list[str] = list(detection.signals)
 
     ai_out: dict[str, Any] | None = None
-    event_type: str | None = None
+    event_type: str | None = detection.event_type
     if settings.mapper_use_ai and detection.confidence < settings.mapper_ai_threshold:
         try:
-            ai_out = ai_detect_provider(payload)
+            ai_out, cached = classify_payload(store, payload)
+            if cached:
+                reasons.append("ai:cache_hit")
             ai_provider = str(ai_out.get("provider") or "").strip().lower()
             ai_conf = float(ai_out.get("confidence") or 0.0)
             if ai_provider and ai_provider != "unknown" and ai_conf >= detection.confidence:
@@ -62,30 +312,26 @@ def route_event(conn: Any, payload: dict[str, Any]) -> RouteDecision:
             reasons.append(f"ai:error:{type(e).__name__}")
 
     provider = detection.provider
-    rules: list[RoutingRule] = []
-    if provider:
-        rules = [r for r in list_routing_rules(conn, provider=provider) if r.enabled]
-
-    for rule in rules:
-        match = rule_matches(payload, rule.conditions)
-        if match.matched:
-            reasons.extend([f"rule:{rule.name}"] + match.reasons)
-            return RouteDecision(
-                provider=provider,
-                confidence=detection.confidence,
-                detection=detection,
-                ai_detection=ai_out,
-                event_type=event_type,
-                matched_rule=rule.name,
-                action=rule.action,
-                handler_mode=rule.handler_mode,
-                handler_target=rule.handler_target,
-                reasons=reasons,
-            )
+    found = provider_rule_set(store, provider).first_match(EventView.of(payload)) if provider else None
+    if found is not None:
+        rule, match = found
+        reasons.extend([f"rule:{rule.name}"] + match.reasons)
+        return RouteDecision(
+            provider=provider,
+            confidence=detection.confidence,
+            detection=detection,
+            ai_detection=ai_out,
+            event_type=event_type,
+            matched_rule=rule.name,
+            action=rule.action,
+            handler_mode=rule.handler_mode,
+            handler_target=rule.handler_target,
+            reasons=reasons,
+        )
 
     mapping: ProviderMapping | None = None
     if provider:
-        mapping = get_provider_mapping(conn, provider=provider)
+        mapping = store.get_provider_mapping(provider=provider)
         if mapping and mapping.enabled:
             reasons.append("fallback:provider_mapping")
             return RouteDecision(
@@ -113,3 +359,32 @@ def route_event(conn: Any, payload: dict[str, Any]) -> RouteDecision:
         handler_target=None,
         reasons=reasons,
     )
+
+
+def route_stored_event(conn: Any, *, event_row_id: int, payload: dict[str, Any]) -> RouteDecision:
+    """
+    `route_event` for a queued event, made once and reused.
+
+    The first successful routing is stored with the current config version; retries, deferrals and
+    replays reuse it, so detection, the rule lookups and any AI classification are not repeated. The
+    decision is made again when it was dropped (`requeue_dead_letters(..., reroute=True)`), or when
+    `mapper_reroute_on_config_change` is on and the config version has changed since. A decision
+    whose AI classification failed is not stored, so the next attempt tries the classifier again.
+    """
+    store = as_queue_store(conn)
+    stored = store.get_route_decision(event_row_id=event_row_id)
+    version: int | None = None
+    if stored is not None:
+        reroute = get_settings().mapper_reroute_on_config_change
+        if reroute:
+            version = store.get_config_version()
+        if not reroute or stored["config_version"] == version:
+            decision = decision_from_dict(stored["decision"])
+            return dataclasses.replace(decision, reasons=decision.reasons + ["route:stored"])
+    else:
+        version = store.get_config_version()
+
+    decision = route_event(store, payload)
+    if not any(r.startswith("ai:error:") for r in decision.reasons):
+        store.save_route_decision(event_row_id=event_row_id, decision=decision_to_dict(decision), config_version=version)
+    return decision
@@ -3,16 +3,11 @@ from __future__ import annotations
 import argparse
 import os
 import json
+import time
 
-from .db import (
-    get_provider_mapping,
-    init_db,
-    list_routing_rules,
-    open_db,
-    upsert_provider_mapping,
-    upsert_routing_rule,
-)
+from .ai_cache import INSTALLED, PROPOSED, REJECTED
 from .config import apply_config, load_config
+from .queue_store import open_queue_store
 from .settings import get_settings
 
 
@@ -31,6 +26,9 @@ def main() -> None:
     set_cmd.add_argument("--handler-mode", default="noop", choices=["noop", "llm", "command", "agent"])
     set_cmd.add_argument("--handler-target", default=None)
     set_cmd.add_argument("--disabled", action="store_true")
+    set_cmd.add_argument(
+        "--queue-priority", type=int, default=None, help="Queue lane for this provider's events (lower is claimed first)"
+    )
 
     get_cmd = sub.add_parser("get", help="Fetch a mapping")
     get_cmd.add_argument("--provider", required=True)
@@ -55,38 +53,49 @@ def main() -> None:
     apply_cfg = sub.add_parser("apply-config", help="Apply mappings/rules from a JSON config file")
     apply_cfg.add_argument("--config", required=True, help="Path to config JSON (see app/config.example.json)")
 
+    ai_cache = sub.add_parser("ai-cache", help="Show the AI classification cache (hit/miss counters per payload shape)")
+    ai_cache.add_argument("--limit", type=int, default=20)
+
+    sig_list = sub.add_parser("signature-list", help="List provider signatures learned from AI classifications")
+    sig_list.add_argument("--status", default=None, choices=[PROPOSED, INSTALLED, REJECTED])
+    sig_list.add_argument("--verbose", action="store_true", help="Also print each signature's conditions")
+
+    sig_review = sub.add_parser("signature-review", help="Install or reject a provider signature")
+    sig_review.add_argument("--name", required=True)
+    sig_review.add_argument("--decision", required=True, choices=["install", "reject"])
+
     args = parser.parse_args()
 
-    conn = open_db(args.db)
+    store = open_queue_store(db_path=args.db)
     try:
-        init_db(conn)
+        store.init()
         if args.cmd == "set":
-            upsert_provider_mapping(
-                conn,
+            store.upsert_provider_mapping(
                 provider=args.provider.strip().lower(),
                 action=args.action.strip(),
                 handler_mode=args.handler_mode,
                 handler_target=args.handler_target,
                 enabled=not args.disabled,
+                queue_priority=args.queue_priority,
             )
             print("ok")
             return
 
         if args.cmd == "get":
-            mapping = get_provider_mapping(conn, provider=args.provider.strip().lower())
+            mapping = store.get_provider_mapping(provider=args.provider.strip().lower())
             if mapping is None:
                 print("not found")
                 return
             print(
                 f"provider={mapping.provider} action={mapping.action} handler_mode={mapping.handler_mode} "
-                f"handler_target={mapping.handler_target} enabled={mapping.enabled} updated_at={mapping.updated_at}"
+                f"handler_target={mapping.handler_target} enabled={mapping.enabled} "
+                f"queue_priority={mapping.queue_priority} updated_at={mapping.updated_at}"
             )
             return
 
         if args.cmd == "rule-set":
             conditions = json.loads(args.conditions_json)
-            upsert_routing_rule(
-                conn,
+            store.upsert_routing_rule(
                 provider=args.provider.strip().lower(),
                 name=args.name.strip(),
                 priority=args.priority,
@@ -100,7 +109,7 @@ def main() -> None:
             return
 
         if args.cmd == "rule-list":
-            rules = list_routing_rules(conn, provider=args.provider.strip().lower())
+            rules = store.list_routing_rules(provider=args.provider.strip().lower())
             if not rules:
                 print("no rules")
                 return
@@ -111,15 +120,49 @@ def main() -> None:
                 )
             return
 
+        if args.cmd == "ai-cache":
+            stats = store.shape_cache_stats()
+            print(
+                f"shapes={stats['shapes']} expired={stats['expired']} hits={stats['hits']} misses={stats['misses']}"
+            )
+            now = time.time()
+            for shape in store.list_shape_classifications(limit=args.limit):
+                print(
+                    f"shape={shape.fingerprint[:12]} provider={shape.provider} confidence={shape.confidence:.2f} "
+                    f"event_type_path={shape.event_type_path} event_id_path={shape.event_id_path} "
+                    f"hits={shape.hits} misses={shape.misses} expires_in={max(0, int(shape.expires_epoch - now))}s"
+                )
+            return
+
+        if args.cmd == "signature-list":
+            signatures = store.list_provider_signatures(status=args.status)
+            if not signatures:
+                print("no signatures")
+                return
+            for sig in signatures:
+                print(
+                    f"name={sig.name} provider={sig.provider} status={sig.status} confidence={sig.confidence:.2f} "
+                    f"event_type_path={sig.event_type_path} event_id_path={sig.event_id_path} updated_at={sig.updated_at}"
+                )
+                if args.verbose:
+                    print(f"  conditions={json.dumps(sig.conditions, ensure_ascii=False)}")
+            return
+
+        if args.cmd == "signature-review":
+            status = INSTALLED if args.decision == "install" else REJECTED
+            changed = store.set_provider_signature_status(name=args.name.strip(), status=status)
+            print("ok" if changed else "not found (or already in that state)")
+            return
+
         if args.cmd == "apply-config":
             cfg = load_config(args.config)
             if cfg is None:
                 raise SystemExit("No config loaded.")
-            apply_config(conn, cfg)
+            apply_config(store, cfg)
             print("ok")
             return
     finally:
-        conn.close()
+        store.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import sqlite3
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Iterator, Sequence
+
+
+DEFAULT_BACKFILL_BATCH = 5000
+
+
+@dataclass(frozen=True)
+class Backfill:
+    """
+    Online data migration over `table`, walked in rowid order.
+
+    `run(conn, after_id, up_to_id)` handles the rows with `after_id < rowid <= up_to_id`. Each batch is
+    its own short write transaction, so it must be idempotent and must tolerate rows that triggers
+    already maintain (`INSERT OR IGNORE` into a derived table, for example).
+    """
+
+    name: str
+    table: str
+    run: Callable[[sqlite3.Connection, int, int], None]
+
+
+@dataclass(frozen=True)
+class Migration:
+    """
+    One schema step. `apply` runs in a single write transaction and must be idempotent (`IF NOT EXISTS`,
+    column checks): a process that loses the race re-runs it after the winner has committed.
+    """
+
+    version: int
+    name: str
+    apply: Callable[[sqlite3.Connection], None]
+    backfills: tuple[Backfill, ...] = ()
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return int(conn.execute("PRAGMA user_version;").fetchone()[0])
+
+
+@contextmanager
+def _immediate(conn: sqlite3.Connection) -> Iterator[None]:
+    conn.execute("BEGIN IMMEDIATE;")
+    try:
+        yield
+    except BaseException:
+        conn.execute("ROLLBACK;")
+        raise
+    conn.execute("COMMIT;")
+
+
+def migrate(
+    conn: sqlite3.Connection, migrations: Sequence[Migration], *, batch_size: int = DEFAULT_BACKFILL_BATCH
+) -> list[int]:
+    """
+    Bring the database to the last version in `migrations` (ordered by version) and return the versions
+    applied by this call.
+
+    `PRAGMA user_version` records the schema version, so a current database costs one pragma read and no
+    DDL. A migration's DDL commits in one `BEGIN IMMEDIATE` transaction; its backfills then run in
+    batches of `batch_size` rows, each in its own transaction, so other connections keep reading and
+    writing in between. `user_version` only moves once the backfills are done. Backfill progress is kept
+    in `schema_backfills`, so processes that start at the same time share the batches and a process
+    that dies mid-backfill is resumed by the next one.
+    """
+    if not migrations or schema_version(conn) >= migrations[-1].version:
+        return []
+
+    applied: list[int] = []
+    for migration in migrations:
+        if schema_version(conn) >= migration.version:
+            continue
+        with _immediate(conn):
+            if schema_version(conn) >= migration.version:
+                continue
+            migration.apply(conn)
+            if migration.backfills:
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS schema_backfills (
+                      version INTEGER NOT NULL,
+                      name TEXT NOT NULL,
+                      last_id INTEGER NOT NULL DEFAULT 0,
+                      done INTEGER NOT NULL DEFAULT 0,
+                      PRIMARY KEY (version, name)
+                    );
+                    """
+                )
+                conn.executemany(
+                    "INSERT OR IGNORE INTO schema_backfills (version, name) VALUES (?, ?)",
+                    [(migration.version, b.name) for b in migration.backfills],
+                )
+            else:
+                conn.execute(f"PRAGMA user_version = {int(migration.version)};")
+
+        if migration.backfills:
+            for backfill in migration.backfills:
+                _run_backfill(conn, migration.version, backfill, batch_size=batch_size)
+            with _immediate(conn):
+                if schema_version(conn) < migration.version:
+                    conn.execute("DELETE FROM schema_backfills WHERE version = ?", (migration.version,))
+                    conn.execute(f"PRAGMA user_version = {int(migration.version)};")
+        applied.append(migration.version)
+    return applied
+
+
+def _run_backfill(conn: sqlite3.Connection, version: int, backfill: Backfill, *, batch_size: int) -> None:
+    while True:
+        with _immediate(conn):
+            state = conn.execute(
+                "SELECT last_id, done FROM schema_backfills WHERE version = ? AND name = ?",
+                (version, backfill.name),
+            ).fetchone()
+            # Missing: another process finished the migration and cleaned up.
+            if state is None or int(state[1]):
+                return
+            last_id = int(state[0])
+            row = conn.execute(
+                f"""
+                SELECT MAX(rowid) FROM (
+                  SELECT rowid FROM {backfill.table} WHERE rowid > ? ORDER BY rowid LIMIT ?
+                )
+                """,
+                (last_id, max(1, int(batch_size))),
+            ).fetchone()
+            if row[0] is None:
+                conn.execute(
+                    "UPDATE schema_backfills SET done = 1 WHERE version = ? AND name = ?", (version, backfill.name)
+                )
+                return
+            up_to_id = int(row[0])
+            backfill.run(conn, last_id, up_to_id)
+            conn.execute(
+                "UPDATE schema_backfills SET last_id = ? WHERE version = ? AND name = ?",
+                (up_to_id, version, backfill.name),
+            )
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import itertools
+import os
+import select
+import socket
+import threading
+from pathlib import Path
+from typing import Protocol
+
+from .settings import Settings, get_settings
+
+
+class WakeupListener(Protocol):
+    def wait(self, timeout: float) -> bool:
+        """
+        Block until a notification arrives (True) or `timeout` seconds pass (False).
+
+        Notifications sent since the previous `wait` are not lost: the next call returns at once.
+        """
+        ...
+
+    def close(self) -> None: ...
+
+
+class WakeupChannel(Protocol):
+    """
+    Tells idle workers that new work is ready, so they can block instead of polling the queue.
+    """
+
+    def notify(self) -> None: ...
+
+    def listen(self) -> WakeupListener: ...
+
+
+class _InProcessListener:
+    def __init__(self, channel: InProcessChannel) -> None:
+        self._channel = channel
+        self._seen = channel._generation
+
+    def wait(self, timeout: float) -> bool:
+        ch = self._channel
+        with ch._cond:
+            woke = ch._cond.wait_for(lambda: ch._generation != self._seen, timeout=max(0.0, timeout))
+            self._seen = ch._generation
+        return woke
+
+    def close(self) -> None:
+        pass
+
+
+class InProcessChannel:
+    """
+    Condition-variable channel for an HTTP server and workers running in one process
+    (`app/railway_service.py`).
+    """
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition()
+        self._generation = 0
+
+    def notify(self) -> None:
+        with self._cond:
+            self._generation += 1
+            self._cond.notify_all()
+
+    def listen(self) -> WakeupListener:
+        return _InProcessListener(self)
+
+
+class _SocketListener:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        path.unlink(missing_ok=True)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(str(path))
+        self._sock.setblocking(False)
+
+    def wait(self, timeout: float) -> bool:
+        ready, _, _ = select.select([self._sock], [], [], max(0.0, timeout))
+        if not ready:
+            return False
+        # Coalesce everything that queued up while we were busy into one wakeup.
+        try:
+            while self._sock.recv(64):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self) -> None:
+        self._sock.close()
+        self.path.unlink(missing_ok=True)
+
+
+class UnixSocketChannel:
+    """
+    Cross-process channel: each listening worker binds a datagram socket in `directory`, and
+    `notify` sends one byte to every socket there.
+
+    Sockets left behind by dead workers are removed on the next notify. A full receive buffer
+    means the worker already has a wakeup pending, so that datagram is dropped.
+    """
+
+    _ids = itertools.count()
+
+    def __init__(self, directory: str) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._send = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._send.setblocking(False)
+        self._lock = threading.Lock()
+
+    def notify(self) -> None:
+        with self._lock:
+            for path in self.directory.glob("w-*.sock"):
+                try:
+                    self._send.sendto(b"1", str(path))
+                except (ConnectionRefusedError, FileNotFoundError):
+                    path.unlink(missing_ok=True)
+                except (BlockingIOError, OSError):
+                    pass
+
+    def listen(self) -> WakeupListener:
+        return _SocketListener(self.directory / f"w-{os.getpid()}-{next(self._ids)}.sock")
+
+
+def open_wakeup_channel(settings: Settings | None = None) -> WakeupChannel | None:
+    """
+    Cross-process channel from `Settings.worker_wakeup_dir`, or None when it is not configured.
+    """
+    settings = settings or get_settings()
+    if not settings.worker_wakeup_dir:
+        return None
+    return UnixSocketChannel(settings.worker_wakeup_dir)
@@ -0,0 +1,1504 @@
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Iterable, Mapping
+
+import psycopg
+from psycopg import sql
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+
+from .db import (
+    DEFAULT_LEASE_SECONDS,
+    DEFAULT_PRIORITY,
+    RETRY_BACKOFF_MAX_EXPONENT,
+    RETRY_BACKOFF_MAX_SECONDS,
+    EnqueueResult,
+    Event,
+    NewEvent,
+    ProviderMapping,
+    RoutingRule,
+)
+from .ai_cache import INSTALLED, ProviderSignature, ShapeClassification
+from .circuit_breaker import CircuitBreaker, admit_call, record_call
+from .fair_share import pick_fair
+from .handler_limits import HandlerLimit, PermitDecision, decide_permit
+
+
+SCHEMA_LOCK_KEY = 0x6366_7175  # pg_advisory_lock key held while migrating the schema
+FAIR_SHARE_LOCK_KEY = 0x6366_6673  # serializes fair-share claims so workers share one rotation
+
+
+@dataclass(frozen=True)
+class PgMigration:
+    """
+    One PostgreSQL schema step, the counterpart of `migrations.Migration`.
+
+    `statements` run in one transaction and must be idempotent (`IF NOT EXISTS`): databases created
+    before the schema was versioned run every step once against the tables they already have.
+    `indexes` are `CREATE INDEX CONCURRENTLY` / `DROP INDEX CONCURRENTLY` statements, run one at a time
+    after that transaction commits, so building them on a large `events` table does not block claims.
+    """
+
+    version: int
+    name: str
+    statements: tuple[str, ...]
+    indexes: tuple[str, ...] = ()
+
+
+PG_SCHEMA_MIGRATIONS: tuple[PgMigration, ...] = (
+    PgMigration(
+        version=1,
+        name="baseline",
+        statements=(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+              version INTEGER PRIMARY KEY,
+              name TEXT NOT NULL,
+              applied_at TIMESTAMPTZ NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS events (
+              id BIGSERIAL PRIMARY KEY,
+              source TEXT NOT NULL,
+              event_id TEXT,
+              received_at TIMESTAMPTZ NOT NULL,
+              status TEXT NOT NULL,
+              attempt_count INTEGER NOT NULL DEFAULT 0,
+              next_attempt_at TIMESTAMPTZ NOT NULL,
+              processing_started_at TIMESTAMPTZ,
+              processed_at TIMESTAMPTZ,
+              payload JSONB NOT NULL,
+              result JSONB,
+              last_error TEXT,
+              lease_owner TEXT,
+              lease_expires_at TIMESTAMPTZ
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS fair_share_credits (
+              source TEXT PRIMARY KEY,
+              credit DOUBLE PRECISION NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS provider_mappings (
+              provider TEXT PRIMARY KEY,
+              action TEXT NOT NULL,
+              handler_mode TEXT NOT NULL DEFAULT 'noop',
+              handler_target TEXT,
+              enabled BOOLEAN NOT NULL DEFAULT TRUE,
+              updated_at TIMESTAMPTZ NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS routing_rules (
+              id BIGSERIAL PRIMARY KEY,
+              provider TEXT NOT NULL,
+              name TEXT NOT NULL,
+              priority INTEGER NOT NULL DEFAULT 100,
+              conditions JSONB NOT NULL,
+              action TEXT NOT NULL,
+              handler_mode TEXT NOT NULL DEFAULT 'noop',
+              handler_target TEXT,
+              enabled BOOLEAN NOT NULL DEFAULT TRUE,
+              updated_at TIMESTAMPTZ NOT NULL,
+              UNIQUE(provider, name)
+            )
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS routing_rules_provider_priority_idx
+            ON routing_rules(provider, enabled, priority, id)
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS action_runs (
+              id BIGSERIAL PRIMARY KEY,
+              event_row_id BIGINT NOT NULL REFERENCES events(id) ON DELETE CASCADE,
+              started_at TIMESTAMPTZ NOT NULL,
+              finished_at TIMESTAMPTZ,
+              status TEXT NOT NULL,
+              provider TEXT,
+              action TEXT,
+              handler_mode TEXT,
+              handler_target TEXT,
+              input JSONB NOT NULL,
+              output JSONB,
+              error TEXT
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS handler_limits (
+              limit_key TEXT PRIMARY KEY,
+              max_concurrency INTEGER,
+              rate_per_sec DOUBLE PRECISION,
+              burst DOUBLE PRECISION,
+              tat DOUBLE PRECISION NOT NULL DEFAULT 0,
+              updated_at TIMESTAMPTZ NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS handler_permits (
+              limit_key TEXT NOT NULL,
+              event_row_id BIGINT NOT NULL,
+              state TEXT NOT NULL,
+              not_before DOUBLE PRECISION NOT NULL,
+              expires_epoch DOUBLE PRECISION NOT NULL,
+              PRIMARY KEY (limit_key, event_row_id)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS handler_permits_event_idx ON handler_permits(event_row_id)",
+            """
+            CREATE TABLE IF NOT EXISTS circuit_breakers (
+              handler_mode TEXT NOT NULL,
+              handler_target TEXT NOT NULL,
+              state TEXT NOT NULL,
+              consecutive_failures INTEGER NOT NULL DEFAULT 0,
+              open_until DOUBLE PRECISION NOT NULL DEFAULT 0,
+              open_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+              probe_event_row_id BIGINT,
+              probe_expires DOUBLE PRECISION NOT NULL DEFAULT 0,
+              last_error TEXT,
+              updated_at TIMESTAMPTZ NOT NULL,
+              PRIMARY KEY (handler_mode, handler_target)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS route_decisions (
+              event_row_id BIGINT PRIMARY KEY REFERENCES events(id) ON DELETE CASCADE,
+              config_version INTEGER,
+              decision JSONB NOT NULL,
+              routed_at TIMESTAMPTZ NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS app_meta (
+              key TEXT PRIMARY KEY,
+              value TEXT NOT NULL,
+              updated_at TIMESTAMPTZ NOT NULL
+            )
+            """,
+            """
+            INSERT INTO app_meta (key, value, updated_at) VALUES ('routing_rules_revision', md5(random()::text), now())
+            ON CONFLICT(key) DO NOTHING
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS ai_shape_cache (
+              fingerprint TEXT PRIMARY KEY,
+              provider TEXT NOT NULL,
+              confidence DOUBLE PRECISION NOT NULL,
+              event_type_path TEXT,
+              event_id_path TEXT,
+              hits BIGINT NOT NULL DEFAULT 0,
+              misses BIGINT NOT NULL DEFAULT 0,
+              expires_epoch DOUBLE PRECISION NOT NULL,
+              updated_at TIMESTAMPTZ NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS provider_signatures (
+              name TEXT PRIMARY KEY,
+              provider TEXT NOT NULL,
+              confidence DOUBLE PRECISION NOT NULL,
+              conditions JSONB NOT NULL,
+              event_type_path TEXT,
+              event_id_path TEXT,
+              status TEXT NOT NULL,
+              fingerprint TEXT NOT NULL,
+              created_at TIMESTAMPTZ NOT NULL,
+              updated_at TIMESTAMPTZ NOT NULL
+            )
+            """,
+        ),
+        indexes=(
+            """
+            CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS events_source_event_id_uq
+            ON events(source, event_id)
+            WHERE event_id IS NOT NULL
+            """,
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS events_processing_lease_idx
+            ON events(lease_expires_at)
+            WHERE status = 'processing'
+            """,
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS events_finished_idx
+            ON events(processed_at)
+            WHERE status IN ('done', 'error')
+            """,
+            # Partial index = the dead-letter partition.
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS events_dead_letter_idx
+            ON events(processed_at, id)
+            WHERE status = 'error'
+            """,
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS action_runs_event_idx
+            ON action_runs(event_row_id, id)
+            """,
+            """
+            CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS action_runs_event_action_uq
+            ON action_runs(event_row_id, action)
+            WHERE action IS NOT NULL
+            """,
+        ),
+    ),
+    PgMigration(
+        version=2,
+        name="priority_lanes",
+        statements=(
+            "ALTER TABLE events ADD COLUMN IF NOT EXISTS priority INTEGER NOT NULL DEFAULT 100",
+            "ALTER TABLE provider_mappings ADD COLUMN IF NOT EXISTS queue_priority INTEGER",
+        ),
+        # Partial indexes = the ready queue: only claimable rows, in claim order (priority lane, then FIFO).
+        indexes=(
+            "DROP INDEX CONCURRENTLY IF EXISTS events_ready_idx",
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS events_ready_priority_idx
+            ON events(priority, received_at, id)
+            WHERE status IN ('pending', 'retry')
+            """,
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS events_ready_source_idx
+            ON events(source, priority, received_at, id)
+            WHERE status IN ('pending', 'retry')
+            """,
+        ),
+    ),
+    PgMigration(
+        version=3,
+        name="ai_shape_promotion",
+        statements=(
+            "ALTER TABLE ai_shape_cache ADD COLUMN IF NOT EXISTS shape JSONB",
+            "ALTER TABLE ai_shape_cache ADD COLUMN IF NOT EXISTS agreements INTEGER NOT NULL DEFAULT 0",
+            "ALTER TABLE ai_shape_cache ADD COLUMN IF NOT EXISTS promoted BOOLEAN NOT NULL DEFAULT FALSE",
+            "ALTER TABLE ai_shape_cache ADD COLUMN IF NOT EXISTS agreed_epoch DOUBLE PRECISION NOT NULL DEFAULT 0",
+            "ALTER TABLE ai_shape_cache ADD COLUMN IF NOT EXISTS verify_after_epoch DOUBLE PRECISION NOT NULL DEFAULT 0",
+        ),
+    ),
+)
+
+
+_ACTION_RUN_COLUMNS = """
+  id, event_row_id, started_at, finished_at, status, provider, action, handler_mode, handler_target,
+  input::text AS input_json, output::text AS output_json, error
+"""
+
+
+def _iso(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.astimezone(timezone.utc).replace(microsecond=0).isoformat()
+    return value
+
+
+def _row_out(row: dict[str, Any]) -> dict[str, Any]:
+    return {k: _iso(v) for k, v in row.items()}
+
+
+def _handler_limit_from_row(row: dict[str, Any]) -> HandlerLimit:
+    return HandlerLimit(
+        limit_key=str(row["limit_key"]),
+        max_concurrency=row["max_concurrency"],
+        rate_per_sec=row["rate_per_sec"],
+        burst=row["burst"],
+        updated_at=_iso(row["updated_at"]),
+    )
+
+
+_CIRCUIT_BREAKER_COLUMNS = """
+  handler_mode, handler_target, state, consecutive_failures, open_until, open_seconds, probe_event_row_id,
+  probe_expires, last_error, updated_at
+"""
+
+
+_SHAPE_COLUMNS = """
+  fingerprint, provider, confidence, event_type_path, event_id_path, hits, misses, expires_epoch, updated_at,
+  shape, agreements, promoted, agreed_epoch, verify_after_epoch
+"""
+
+
+def _shape_from_row(row: dict[str, Any]) -> ShapeClassification:
+    return ShapeClassification(
+        fingerprint=str(row["fingerprint"]),
+        provider=str(row["provider"]),
+        confidence=float(row["confidence"]),
+        event_type_path=row["event_type_path"],
+        event_id_path=row["event_id_path"],
+        hits=int(row["hits"]),
+        misses=int(row["misses"]),
+        expires_epoch=float(row["expires_epoch"]),
+        updated_at=_iso(row["updated_at"]),
+        shape=row["shape"],
+        agreements=int(row["agreements"]),
+        promoted=bool(row["promoted"]),
+        agreed_epoch=float(row["agreed_epoch"]),
+        verify_after_epoch=float(row["verify_after_epoch"]),
+    )
+
+
+_SIGNATURE_COLUMNS = """
+  name, provider, confidence, conditions, event_type_path, event_id_path, status, fingerprint, created_at, updated_at
+"""
+
+
+def _signature_from_row(row: dict[str, Any]) -> ProviderSignature:
+    return ProviderSignature(
+        name=str(row["name"]),
+        provider=str(row["provider"]),
+        confidence=float(row["confidence"]),
+        conditions=row["conditions"],
+        event_type_path=row["event_type_path"],
+        event_id_path=row["event_id_path"],
+        status=str(row["status"]),
+        fingerprint=str(row["fingerprint"]),
+        created_at=_iso(row["created_at"]),
+        updated_at=_iso(row["updated_at"]),
+    )
+
+
+def _circuit_breaker_from_row(row: dict[str, Any] | None) -> CircuitBreaker | None:
+    if row is None:
+        return None
+    return CircuitBreaker(
+        handler_mode=str(row["handler_mode"]),
+        handler_target=str(row["handler_target"]),
+        state=str(row["state"]),
+        consecutive_failures=int(row["consecutive_failures"]),
+        open_until=float(row["open_until"]),
+        open_seconds=float(row["open_seconds"]),
+        probe_event_row_id=row["probe_event_row_id"],
+        probe_expires=float(row["probe_expires"]),
+        last_error=row["last_error"],
+        updated_at=_iso(row["updated_at"]),
+    )
+
+
+def _event_from_row(row: dict[str, Any]) -> Event:
+    return Event(
+        id=int(row["id"]),
+        source=str(row["source"]),
+        event_id=row["event_id"],
+        received_at=_iso(row["received_at"]),
+        status=str(row["status"]),
+        attempt_count=int(row["attempt_count"]),
+        next_attempt_at=_iso(row["next_attempt_at"]),
+        payload=row["payload"],
+        lease_owner=row["lease_owner"],
+        lease_expires_at=_iso(row["lease_expires_at"]),
+        priority=int(row["priority"]),
+    )
+
+
+class PostgresQueueStore:
+    """
+    `QueueStore` on PostgreSQL. Claims use `FOR UPDATE SKIP LOCKED`, so workers on any number of
+    hosts can pull from the same queue without blocking each other.
+
+    JSON documents are stored as JSONB (TOAST compresses large values), so there is no separate blob table.
+    """
+
+    backend = "postgres"
+
+    def __init__(self, conn: psycopg.Connection) -> None:
+        self.conn = conn
+
+    @classmethod
+    def connect(cls, dsn: str) -> PostgresQueueStore:
+        if not dsn:
+            raise RuntimeError("DATABASE_URL is required for queue_backend=postgres")
+        return cls(psycopg.connect(dsn, autocommit=True, row_factory=dict_row))
+
+    def schema_version(self) -> int:
+        try:
+            row = self.conn.execute("SELECT MAX(version) AS version FROM schema_migrations").fetchone()
+        except psycopg.errors.UndefinedTable:
+            return 0
+        return int(row["version"] or 0)
+
+    def init(self) -> None:
+        """
+        Apply the pending `PG_SCHEMA_MIGRATIONS`. A current database costs one query and no DDL or table
+        locks, so every worker, CLI and server start can call it.
+        """
+        if self.schema_version() >= PG_SCHEMA_MIGRATIONS[-1].version:
+            return
+        # A session lock polled with pg_try_advisory_lock: `CREATE INDEX CONCURRENTLY` waits for every
+        # running statement to finish, including another process's blocking pg_advisory_lock call.
+        while True:
+            if self.conn.execute("SELECT pg_try_advisory_lock(%s) AS locked", (SCHEMA_LOCK_KEY,)).fetchone()["locked"]:
+                break
+            time.sleep(0.1)
+        try:
+            for migration in PG_SCHEMA_MIGRATIONS:
+                if self.schema_version() >= migration.version:
+                    continue
+                with self.conn.transaction():
+                    for stmt in migration.statements:
+                        self.conn.execute(stmt)
+                if migration.indexes:
+                    self._drop_invalid_indexes()
+                for stmt in migration.indexes:
+                    self.conn.execute(stmt)
+                self.conn.execute(
+                    "INSERT INTO schema_migrations (version, name, applied_at) VALUES (%s, %s, now())",
+                    (migration.version, migration.name),
+                )
+        finally:
+            self.conn.execute("SELECT pg_advisory_unlock(%s)", (SCHEMA_LOCK_KEY,))
+
+    def _drop_invalid_indexes(self) -> None:
+        # A concurrent build interrupted by a crash leaves an invalid index that `IF NOT EXISTS` would keep.
+        rows = self.conn.execute(
+            """
+            SELECT c.relname
+            FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE NOT i.indisvalid AND c.relnamespace = current_schema()::regnamespace
+            """
+        ).fetchall()
+        for row in rows:
+            self.conn.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(row["relname"])))
+
+    def close(self) -> None:
+        self.conn.close()
+
+    # Queue
+
+    def enqueue_event(
+        self, *, source: str, event_id: str | None, payload: dict[str, Any], priority: int | None = None
+    ) -> int:
+        row = self.conn.execute(
+            """
+            INSERT INTO events (source, event_id, received_at, status, next_attempt_at, payload, priority)
+            VALUES (%s, %s, date_trunc('second', now()), 'pending', date_trunc('second', now()), %s, %s)
+            RETURNING id
+            """,
+            (source, event_id, Jsonb(payload), DEFAULT_PRIORITY if priority is None else int(priority)),
+        ).fetchone()
+        return int(row["id"])
+
+    def enqueue_events(self, items: Iterable[NewEvent]) -> list[EnqueueResult]:
+        results: list[EnqueueResult] = []
+        with self.conn.transaction():
+            for item in items:
+                while True:
+                    row = self.conn.execute(
+                        """
+                        INSERT INTO events (source, event_id, received_at, status, next_attempt_at, payload, priority)
+                        VALUES (%s, %s, date_trunc('second', now()), 'pending', date_trunc('second', now()), %s, %s)
+                        ON CONFLICT DO NOTHING
+                        RETURNING id
+                        """,
+                        (
+                            item.source,
+                            item.event_id,
+                            Jsonb(item.payload),
+                            DEFAULT_PRIORITY if item.priority is None else int(item.priority),
+                        ),
+                    ).fetchone()
+                    if row is not None:
+                        results.append(EnqueueResult(row_id=int(row["id"]), inserted=True))
+                        break
+                    existing = self.conn.execute(
+                        "SELECT id FROM events WHERE source = %s AND event_id = %s",
+                        (item.source, item.event_id),
+                    ).fetchone()
+                    if existing is not None:
+                        results.append(EnqueueResult(row_id=int(existing["id"]), inserted=False))
+                        break
+                    # The conflicting row was deleted (retention, a purge) between the two statements;
+                    # insert again.
+        return results
+
+    def claim_events(
+        self,
+        *,
+        limit: int = 1,
+        lease_owner: str | None = None,
+        lease_seconds: float = DEFAULT_LEASE_SECONDS,
+        fair_weights: Mapping[str, float] | None = None,
+    ) -> list[Event]:
+        if limit <= 0:
+            return []
+        if fair_weights is not None:
+            return self._claim_fair_share(
+                limit=limit, lease_owner=lease_owner, lease_seconds=lease_seconds, weights=fair_weights
+            )
+        rows = self.conn.execute(
+            """
+            WITH picked AS (
+              SELECT id
+              FROM events
+              WHERE status IN ('pending', 'retry') AND next_attempt_at <= now()
+              ORDER BY priority ASC, received_at ASC, id ASC
+              LIMIT %s
+              FOR UPDATE SKIP LOCKED
+            )
+            UPDATE events e
+            SET status='processing', processing_started_at=now(), lease_owner=%s,
+                lease_expires_at=now() + make_interval(secs => %s)
+            FROM picked
+            WHERE e.id = picked.id
+            RETURNING e.id, e.source, e.event_id, e.received_at, e.status, e.attempt_count, e.next_attempt_at,
+                      e.payload, e.lease_owner, e.lease_expires_at, e.priority
+            """,
+            (int(limit), lease_owner, float(lease_seconds)),
+        ).fetchall()
+        events = [_event_from_row(r) for r in rows]
+        events.sort(key=lambda e: (e.priority, e.received_at, e.id))
+        return events
+
+    def _claim_fair_share(
+        self, *, limit: int, lease_owner: str | None, lease_seconds: float, weights: Mapping[str, float]
+    ) -> list[Event]:
+        with self.conn.transaction():
+            self.conn.execute("SELECT pg_advisory_xact_lock(%s)", (FAIR_SHARE_LOCK_KEY,))
+            # Loose index scan over events_ready_source_idx: one probe per distinct ready source.
+            sources = self.conn.execute(
+                """
+                WITH RECURSIVE s AS (
+                  (SELECT source FROM events WHERE status IN ('pending', 'retry') ORDER BY source LIMIT 1)
+                  UNION ALL
+                  SELECT (
+                    SELECT e.source FROM events e
+                    WHERE e.status IN ('pending', 'retry') AND e.source > s.source
+                    ORDER BY e.source LIMIT 1
+                  )
+                  FROM s WHERE s.source IS NOT NULL
+                )
+                SELECT source FROM s WHERE source IS NOT NULL
+                """
+            ).fetchall()
+            candidates: dict[str, list[tuple[int, int]]] = {}
+            for r in sources:
+                rows = self.conn.execute(
+                    """
+                    SELECT id, priority
+                    FROM events
+                    WHERE source = %s AND status IN ('pending', 'retry') AND next_attempt_at <= now()
+                    ORDER BY priority ASC, received_at ASC, id ASC
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                    """,
+                    (r["source"], int(limit)),
+                ).fetchall()
+                if rows:
+                    candidates[str(r["source"])] = [(int(x["id"]), int(x["priority"])) for x in rows]
+
+            stored = {
+                str(r["source"]): float(r["credit"])
+                for r in self.conn.execute("SELECT source, credit FROM fair_share_credits").fetchall()
+            }
+            picked, credits = pick_fair(candidates, stored, weights=weights, limit=int(limit))
+            self.conn.execute("DELETE FROM fair_share_credits")
+            for source, credit in sorted(credits.items()):
+                self.conn.execute(
+                    "INSERT INTO fair_share_credits (source, credit) VALUES (%s, %s)", (source, credit)
+                )
+
+            rows = self.conn.execute(
+                """
+                UPDATE events
+                SET status='processing', processing_started_at=now(), lease_owner=%s,
+                    lease_expires_at=now() + make_interval(secs => %s)
+                WHERE id = ANY(%s)
+                RETURNING id, source, event_id, received_at, status, attempt_count, next_attempt_at,
+                          payload, lease_owner, lease_expires_at, priority
+                """,
+                (lease_owner, float(lease_seconds), picked),
+            ).fetchall()
+        order = {event_row_id: i for i, event_row_id in enumerate(picked)}
+        events = [_event_from_row(r) for r in rows]
+        events.sort(key=lambda e: order[e.id])
+        return events
+
+    def next_ready_at(self) -> float | None:
+        row = self.conn.execute(
+            """
+            SELECT EXTRACT(EPOCH FROM MIN(next_attempt_at)) AS ready_epoch
+            FROM events
+            WHERE status IN ('pending', 'retry')
+            """
+        ).fetchone()
+        return None if row is None or row["ready_epoch"] is None else float(row["ready_epoch"])
+
+    def renew_leases(
+        self, *, event_ids: Iterable[int], lease_owner: str, lease_seconds: float = DEFAULT_LEASE_SECONDS
+    ) -> set[int]:
+        ids = [int(i) for i in event_ids]
+        if not ids:
+            return set()
+        rows = self.conn.execute(
+            """
+            UPDATE events
+            SET lease_expires_at = now() + make_interval(secs => %s)
+            WHERE id = ANY(%s) AND status='processing' AND lease_owner=%s
+            RETURNING id
+            """,
+            (float(lease_seconds), ids, lease_owner),
+        ).fetchall()
+        return {int(r["id"]) for r in rows}
+
+    def release_events(self, *, event_ids: Iterable[int], lease_owner: str) -> int:
+        ids = [int(i) for i in event_ids]
+        if not ids:
+            return 0
+        cur = self.conn.execute(
+            """
+            UPDATE events
+            SET status=CASE WHEN attempt_count > 0 THEN 'retry' ELSE 'pending' END,
+                processing_started_at=NULL, lease_owner=NULL, lease_expires_at=NULL
+            WHERE id = ANY(%s) AND status='processing' AND lease_owner=%s
+            """,
+            (ids, lease_owner),
+        )
+        return cur.rowcount
+
+    def reap_expired_leases(
+        self, *, max_attempts: int, stale_after_seconds: float = DEFAULT_LEASE_SECONDS, limit: int = 500
+    ) -> int:
+        cur = self.conn.execute(
+            """
+            UPDATE events
+            SET status=CASE WHEN attempt_count + 1 >= %(max)s THEN 'error' ELSE 'retry' END,
+                attempt_count=attempt_count + 1,
+                next_attempt_at=now() + make_interval(
+                  secs => LEAST(%(backoff_max)s, power(2, LEAST(attempt_count + 1, %(backoff_exp)s)))
+                ),
+                processed_at=CASE WHEN attempt_count + 1 >= %(max)s THEN now() ELSE processed_at END,
+                last_error='lease expired (owner=' || COALESCE(lease_owner, '?') || ')',
+                lease_owner=NULL,
+                lease_expires_at=NULL
+            WHERE id IN (
+              SELECT id
+              FROM events
+              WHERE status = 'processing'
+                AND (lease_expires_at < now()
+                     OR (lease_expires_at IS NULL AND processing_started_at < now() - make_interval(secs => %(stale)s)))
+              LIMIT %(limit)s
+              FOR UPDATE SKIP LOCKED
+            )
+            """,
+            {
+                "max": int(max_attempts),
+                "stale": float(stale_after_seconds),
+                "limit": int(limit),
+                "backoff_max": RETRY_BACKOFF_MAX_SECONDS,
+                "backoff_exp": RETRY_BACKOFF_MAX_EXPONENT,
+            },
+        )
+        return cur.rowcount
+
+    def _lease_guard(self, lease_owner: str | None) -> tuple[str, tuple[Any, ...]]:
+        if lease_owner is None:
+            return "", ()
+        return " AND status='processing' AND lease_owner=%s", (lease_owner,)
+
+    def mark_done(self, *, event_id: int, result: dict[str, Any], lease_owner: str | None = None) -> bool:
+        guard_sql, guard_args = self._lease_guard(lease_owner)
+        cur = self.conn.execute(
+            f"""
+            UPDATE events
+            SET status='done', processed_at=now(), result=%s, last_error=NULL, lease_owner=NULL, lease_expires_at=NULL
+            WHERE id=%s{guard_sql}
+            """,
+            (Jsonb(result), event_id, *guard_args),
+        )
+        return cur.rowcount > 0
+
+    def mark_retry(
+        self,
+        *,
+        event_id: int,
+        attempt_count: int,
+        next_attempt_at: str,
+        error: str,
+        lease_owner: str | None = None,
+    ) -> bool:
+        guard_sql, guard_args = self._lease_guard(lease_owner)
+        cur = self.conn.execute(
+            f"""
+            UPDATE events
+            SET status='retry', attempt_count=%s, next_attempt_at=%s::timestamptz, last_error=%s,
+                lease_owner=NULL, lease_expires_at=NULL
+            WHERE id=%s{guard_sql}
+            """,
+            (attempt_count, next_attempt_at, error, event_id, *guard_args),
+        )
+        return cur.rowcount > 0
+
+    def mark_error(self, *, event_id: int, attempt_count: int, error: str, lease_owner: str | None = None) -> bool:
+        guard_sql, guard_args = self._lease_guard(lease_owner)
+        cur = self.conn.execute(
+            f"""
+            UPDATE events
+            SET status='error', attempt_count=%s, processed_at=now(), last_error=%s, lease_owner=NULL, lease_expires_at=NULL
+            WHERE id=%s{guard_sql}
+            """,
+            (attempt_count, error, event_id, *guard_args),
+        )
+        return cur.rowcount > 0
+
+    def defer_event(self, *, event_id: int, retry_epoch: float, lease_owner: str | None = None) -> bool:
+        guard_sql, guard_args = self._lease_guard(lease_owner)
+        cur = self.conn.execute(
+            f"""
+            UPDATE events
+            SET status=CASE WHEN attempt_count > 0 THEN 'retry' ELSE 'pending' END,
+                next_attempt_at=to_timestamp(%s), processing_started_at=NULL, lease_owner=NULL, lease_expires_at=NULL
+            WHERE id=%s{guard_sql}
+            """,
+            (float(retry_epoch), event_id, *guard_args),
+        )
+        return cur.rowcount > 0
+
+    # Dead letters (the `status = 'error'` partition of `events`)
+
+    @staticmethod
+    def _dead_letter_filter(
+        *, source: str | None, error_prefix: str | None, since: str | None, until: str | None
+    ) -> tuple[str, list[Any]]:
+        clauses = ["status = 'error'"]
+        args: list[Any] = []
+        if source:
+            clauses.append("source = %s")
+            args.append(source)
+        if error_prefix:
+            clauses.append("starts_with(COALESCE(last_error, ''), %s)")
+            args.append(error_prefix)
+        if since:
+            clauses.append("processed_at >= %s::timestamptz")
+            args.append(since)
+        if until:
+            clauses.append("processed_at < %s::timestamptz")
+            args.append(until)
+        return " WHERE " + " AND ".join(clauses), args
+
+    def list_dead_letters(
+        self,
+        *,
+        source: str | None = None,
+        error_prefix: str | None = None,
+        since: str | None = None,
+        until: str | None = None,
+        limit: int = 100,
+    ) -> list[dict[str, Any]]:
+        where, args = self._dead_letter_filter(source=source, error_prefix=error_prefix, since=since, until=until)
+        rows = self.conn.execute(
+            f"""
+            SELECT id AS event_row_id, source, event_id, attempt_count, last_error AS error, processed_at AS dead_at
+            FROM events{where}
+            ORDER BY processed_at ASC, id ASC
+            LIMIT %s
+            """,
+            (*args, int(limit)),
+        ).fetchall()
+        return [_row_out(r) for r in rows]
+
+    def count_dead_letters(
+        self,
+        *,
+        source: str | None = None,
+        error_prefix: str | None = None,
+        since: str | None = None,
+        until: str | None = None,
+    ) -> int:
+        where, args = self._dead_letter_filter(source=source, error_prefix=error_prefix, since=since, until=until)
+        return int(self.conn.execute(f"SELECT COUNT(*) AS n FROM events{where}", args).fetchone()["n"])
+
+    def requeue_dead_letters(self, *, event_ids: Iterable[int], reroute: bool = False) -> int:
+        ids = [int(i) for i in event_ids]
+        if not ids:
+            return 0
+        with self.conn.transaction():
+            cur = self.conn.execute(
+                """
+                UPDATE events
+                SET status='pending', attempt_count=0, next_attempt_at=date_trunc('second', now()), processed_at=NULL
+                WHERE id = ANY(%s) AND status='error'
+                """,
+                (ids,),
+            )
+            if reroute:
+                self.conn.execute("DELETE FROM route_decisions WHERE event_row_id = ANY(%s)", (ids,))
+        return cur.rowcount
+
+    # Route decisions
+
+    def save_route_decision(
+        self, *, event_row_id: int, decision: dict[str, Any], config_version: int | None = None
+    ) -> None:
+        self.conn.execute(
+            """
+            INSERT INTO route_decisions (event_row_id, config_version, decision, routed_at)
+            VALUES (%s, %s, %s, date_trunc('second', now()))
+            ON CONFLICT(event_row_id) DO UPDATE SET
+              config_version=excluded.config_version, decision=excluded.decision, routed_at=excluded.routed_at
+            """,
+            (event_row_id, config_version, Jsonb(decision)),
+        )
+
+    def get_route_decision(self, *, event_row_id: int) -> dict[str, Any] | None:
+        row = self.conn.execute(
+            "SELECT config_version, decision, routed_at FROM route_decisions WHERE event_row_id = %s",
+            (event_row_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        return {"decision": row["decision"], "config_version": row["config_version"], "routed_at": _iso(row["routed_at"])}
+
+    def get_config_version(self) -> int | None:
+        row = self.conn.execute("SELECT value FROM app_meta WHERE key = 'config_version'").fetchone()
+        return None if row is None else int(row["value"])
+
+    def set_config_version(self, *, version: int) -> None:
+        self.conn.execute(
+            """
+            INSERT INTO app_meta (key, value, updated_at) VALUES ('config_version', %s, now())
+            ON CONFLICT(key) DO UPDATE SET value=excluded.value, updated_at=excluded.updated_at
+            """,
+            (str(int(version)),),
+        )
+
+    # AI classification cache
+
+    def lookup_shape_classification(self, *, fingerprint: str) -> ShapeClassification | None:
+        row = self.conn.execute(
+            f"""
+            UPDATE ai_shape_cache SET hits = hits + 1
+            WHERE fingerprint = %s AND expires_epoch > EXTRACT(EPOCH FROM clock_timestamp())
+            RETURNING {_SHAPE_COLUMNS}
+            """,
+            (fingerprint,),
+        ).fetchone()
+        return None if row is None else _shape_from_row(row)
+
+    def save_shape_classification(
+        self,
+        *,
+        fingerprint: str,
+        provider: str,
+        confidence: float,
+        event_type_path: str | None = None,
+        event_id_path: str | None = None,
+        ttl_seconds: float,
+        shape: dict[str, Any] | None = None,
+        agreement_interval_seconds: float = 0.0,
+    ) -> ShapeClassification:
+        interval = max(0.0, float(agreement_interval_seconds))
+        row = self.conn.execute(
+            f"""
+            WITH now AS (SELECT EXTRACT(EPOCH FROM clock_timestamp())::double precision AS epoch)
+            INSERT INTO ai_shape_cache
+              (fingerprint, provider, confidence, event_type_path, event_id_path, hits, misses, expires_epoch, updated_at,
+               shape, agreements, agreed_epoch, verify_after_epoch)
+            SELECT %s, %s, %s, %s, %s, 0, 1, now.epoch + %s, now(), %s, 1, now.epoch, now.epoch + %s FROM now
+            ON CONFLICT(fingerprint) DO UPDATE SET
+              agreements=CASE
+                WHEN ai_shape_cache.provider != excluded.provider
+                  OR ai_shape_cache.event_type_path IS DISTINCT FROM excluded.event_type_path THEN 1
+                WHEN ai_shape_cache.agreed_epoch + %s <= excluded.agreed_epoch THEN ai_shape_cache.agreements + 1
+                ELSE ai_shape_cache.agreements END,
+              agreed_epoch=CASE
+                WHEN ai_shape_cache.provider != excluded.provider
+                  OR ai_shape_cache.event_type_path IS DISTINCT FROM excluded.event_type_path
+                  OR ai_shape_cache.agreed_epoch + %s <= excluded.agreed_epoch THEN excluded.agreed_epoch
+                ELSE ai_shape_cache.agreed_epoch END,
+              verify_after_epoch=excluded.verify_after_epoch,
+              provider=excluded.provider,
+              confidence=excluded.confidence,
+              event_type_path=excluded.event_type_path,
+              event_id_path=excluded.event_id_path,
+              misses=ai_shape_cache.misses + 1,
+              expires_epoch=excluded.expires_epoch,
+              updated_at=excluded.updated_at,
+              shape=COALESCE(excluded.shape, ai_shape_cache.shape)
+            RETURNING {_SHAPE_COLUMNS}
+            """,
+            (
+                fingerprint,
+                provider,
+                float(confidence),
+                event_type_path,
+                event_id_path,
+                float(ttl_seconds),
+                None if shape is None else Jsonb(shape),
+                interval,
+                interval,
+                interval,
+            ),
+        ).fetchone()
+        return _shape_from_row(row)
+
+    def claim_shape_verification(self, *, fingerprint: str, interval_seconds: float) -> bool:
+        cur = self.conn.execute(
+            """
+            UPDATE ai_shape_cache SET verify_after_epoch = EXTRACT(EPOCH FROM clock_timestamp()) + %s
+            WHERE fingerprint = %s AND NOT promoted AND verify_after_epoch <= EXTRACT(EPOCH FROM clock_timestamp())
+            """,
+            (max(0.0, float(interval_seconds)), fingerprint),
+        )
+        return cur.rowcount > 0
+
+    def list_shape_classifications(self, *, limit: int = 100) -> list[ShapeClassification]:
+        rows = self.conn.execute(
+            f"SELECT {_SHAPE_COLUMNS} FROM ai_shape_cache ORDER BY hits + misses DESC, fingerprint LIMIT %s",
+            (max(1, int(limit)),),
+        ).fetchall()
+        return [_shape_from_row(r) for r in rows]
+
+    def shape_cache_stats(self) -> dict[str, int]:
+        row = self.conn.execute(
+            """
+            SELECT COUNT(*) AS shapes,
+                   COUNT(*) FILTER (WHERE expires_epoch <= EXTRACT(EPOCH FROM clock_timestamp())) AS expired,
+                   COALESCE(SUM(hits), 0) AS hits,
+                   COALESCE(SUM(misses), 0) AS misses
+            FROM ai_shape_cache
+            """
+        ).fetchone()
+        return {k: int(row[k]) for k in ("shapes", "expired", "hits", "misses")}
+
+    def get_event_row(self, *, event_row_id: int) -> dict[str, Any] | None:
+        row = self.conn.execute(
+            """
+            SELECT id, source, event_id, received_at, status, attempt_count, next_attempt_at, processing_started_at,
+                   processed_at, payload::text AS payload_json, result::text AS result_json, last_error,
+                   lease_owner, lease_expires_at
+            FROM events
+            WHERE id = %s
+            """,
+            (event_row_id,),
+        ).fetchone()
+        return _row_out(row) if row is not None else None
+
+    def get_queue_stats(self) -> dict[str, Any]:
+        """
+        Same shape as `db.get_queue_stats`. Counted with GROUP BY rather than trigger-maintained
+        counters, which would make every state transition contend on a few hot rows.
+        """
+        by_source: dict[str, dict[str, int]] = {}
+        totals: dict[str, int] = {}
+        for row in self.conn.execute("SELECT source, status, COUNT(*) AS n FROM events GROUP BY source, status"):
+            by_source.setdefault(row["source"], {})[row["status"]] = int(row["n"])
+            totals[row["status"]] = totals.get(row["status"], 0) + int(row["n"])
+        oldest = self.conn.execute(
+            """
+            SELECT received_at
+            FROM events
+            WHERE status IN ('pending', 'retry') AND next_attempt_at <= now()
+            ORDER BY received_at ASC, id ASC
+            LIMIT 1
+            """
+        ).fetchone()
+        return {
+            "by_source": by_source,
+            "totals": totals,
+            "oldest_ready_received_at": _iso(oldest["received_at"]) if oldest else None,
+        }
+
+    # Action runs
+
+    def create_action_run(
+        self,
+        *,
+        event_row_id: int,
+        provider: str | None,
+        action: str | None,
+        handler_mode: str | None,
+        handler_target: str | None,
+        input_obj: dict[str, Any],
+    ) -> int:
+        row = self.conn.execute(
+            """
+            INSERT INTO action_runs
+              (event_row_id, started_at, status, provider, action, handler_mode, handler_target, input)
+            VALUES (%s, date_trunc('second', now()), 'running', %s, %s, %s, %s, %s)
+            ON CONFLICT (event_row_id, action) WHERE action IS NOT NULL DO NOTHING
+            RETURNING id
+            """,
+            (event_row_id, provider, action, handler_mode, handler_target, Jsonb(input_obj)),
+        ).fetchone()
+        if row is not None:
+            return int(row["id"])
+        existing = self.conn.execute(
+            "SELECT id FROM action_runs WHERE event_row_id = %s AND action = %s ORDER BY id DESC LIMIT 1",
+            (event_row_id, action),
+        ).fetchone()
+        if existing is None:
+            raise RuntimeError(f"action run for event {event_row_id} / {action!r} vanished")
+        return int(existing["id"])
+
+    def get_action_run(self, *, run_id: int) -> dict[str, Any] | None:
+        row = self.conn.execute(f"SELECT {_ACTION_RUN_COLUMNS} FROM action_runs WHERE id = %s", (run_id,)).fetchone()
+        return _row_out(row) if row is not None else None
+
+    def get_action_run_for_event_action(self, *, event_row_id: int, action: str) -> dict[str, Any] | None:
+        row = self.conn.execute(
+            f"""
+            SELECT {_ACTION_RUN_COLUMNS}
+            FROM action_runs
+            WHERE event_row_id = %s AND action = %s
+            ORDER BY id DESC
+            LIMIT 1
+            """,
+            (event_row_id, action),
+        ).fetchone()
+        return _row_out(row) if row is not None else None
+
+    def restart_action_run(self, *, run_id: int) -> None:
+        self.conn.execute(
+            """
+            UPDATE action_runs
+            SET started_at=date_trunc('second', now()), finished_at=NULL, status='running', output=NULL, error=NULL
+            WHERE id=%s
+            """,
+            (run_id,),
+        )
+
+    def finish_action_run(
+        self,
+        *,
+        run_id: int,
+        status: str,
+        output_obj: dict[str, Any] | None = None,
+        error: str | None = None,
+    ) -> None:
+        self.conn.execute(
+            """
+            UPDATE action_runs
+            SET finished_at=date_trunc('second', now()), status=%s, output=%s, error=%s
+            WHERE id=%s
+            """,
+            (status, Jsonb(output_obj) if output_obj is not None else None, error, run_id),
+        )
+
+    def list_action_runs_for_event(self, *, event_row_id: int, limit: int = 20) -> list[dict[str, Any]]:
+        rows = self.conn.execute(
+            f"""
+            SELECT {_ACTION_RUN_COLUMNS}
+            FROM action_runs
+            WHERE event_row_id = %s
+            ORDER BY id DESC
+            LIMIT %s
+            """,
+            (event_row_id, int(limit)),
+        ).fetchall()
+        return [_row_out(r) for r in rows]
+
+    # Routing config
+
+    def upsert_provider_mapping(
+        self,
+        *,
+        provider: str,
+        action: str,
+        handler_mode: str = "noop",
+        handler_target: str | None = None,
+        enabled: bool = True,
+        queue_priority: int | None = None,
+    ) -> None:
+        self.conn.execute(
+            """
+            INSERT INTO provider_mappings (provider, action, handler_mode, handler_target, enabled, updated_at, queue_priority)
+            VALUES (%s, %s, %s, %s, %s, date_trunc('second', now()), %s)
+            ON CONFLICT(provider) DO UPDATE SET
+              action=excluded.action,
+              handler_mode=excluded.handler_mode,
+              handler_target=excluded.handler_target,
+              enabled=excluded.enabled,
+              updated_at=excluded.updated_at,
+              queue_priority=excluded.queue_priority
+            """,
+            (provider, action, handler_mode, handler_target, bool(enabled), queue_priority),
+        )
+
+    def get_provider_mapping(self, *, provider: str) -> ProviderMapping | None:
+        row = self.conn.execute(
+            """
+            SELECT provider, action, handler_mode, handler_target, enabled, updated_at, queue_priority
+            FROM provider_mappings
+            WHERE provider = %s
+            """,
+            (provider,),
+        ).fetchone()
+        if row is None:
+            return None
+        return ProviderMapping(
+            provider=str(row["provider"]),
+            action=str(row["action"]),
+            handler_mode=str(row["handler_mode"]),
+            handler_target=row["handler_target"],
+            enabled=bool(row["enabled"]),
+            updated_at=_iso(row["updated_at"]),
+            queue_priority=row["queue_priority"],
+        )
+
+    def upsert_routing_rule(
+        self,
+        *,
+        provider: str,
+        name: str,
+        priority: int,
+        conditions: dict[str, Any],
+        action: str,
+        handler_mode: str = "noop",
+        handler_target: str | None = None,
+        enabled: bool = True,
+    ) -> None:
+        with self.conn.transaction():
+            self.conn.execute(
+                """
+                INSERT INTO routing_rules
+                  (provider, name, priority, conditions, action, handler_mode, handler_target, enabled, updated_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, date_trunc('second', now()))
+                ON CONFLICT(provider, name) DO UPDATE SET
+                  priority=excluded.priority,
+                  conditions=excluded.conditions,
+                  action=excluded.action,
+                  handler_mode=excluded.handler_mode,
+                  handler_target=excluded.handler_target,
+                  enabled=excluded.enabled,
+                  updated_at=excluded.updated_at
+                """,
+                (provider, name, int(priority), Jsonb(conditions), action, handler_mode, handler_target, bool(enabled)),
+            )
+            self.conn.execute(
+                """
+                INSERT INTO app_meta (key, value, updated_at) VALUES ('routing_rules_revision', md5(random()::text), now())
+                ON CONFLICT(key) DO UPDATE SET value=excluded.value, updated_at=excluded.updated_at
+                """
+            )
+
+    def list_routing_rules(self, *, provider: str) -> list[RoutingRule]:
+        rows = self.conn.execute(
+            """
+            SELECT id, provider, name, priority, conditions, action, handler_mode, handler_target, enabled, updated_at
+            FROM routing_rules
+            WHERE provider = %s
+            ORDER BY enabled DESC, priority ASC, id ASC
+            """,
+            (provider,),
+        ).fetchall()
+        return [
+            RoutingRule(
+                id=int(row["id"]),
+                provider=str(row["provider"]),
+                name=str(row["name"]),
+                priority=int(row["priority"]),
+                conditions=row["conditions"],
+                action=str(row["action"]),
+                handler_mode=str(row["handler_mode"]),
+                handler_target=row["handler_target"],
+                enabled=bool(row["enabled"]),
+                updated_at=_iso(row["updated_at"]),
+            )
+            for row in rows
+        ]
+
+    def get_routing_rules_revision(self) -> str | None:
+        row = self.conn.execute("SELECT value FROM app_meta WHERE key = 'routing_rules_revision'").fetchone()
+        return None if row is None else str(row["value"])
+
+    # Provider signatures
+
+    def _bump_signatures_revision(self) -> None:
+        self.conn.execute(
+            """
+            INSERT INTO app_meta (key, value, updated_at) VALUES ('provider_signatures_revision', md5(random()::text), now())
+            ON CONFLICT(key) DO UPDATE SET value=excluded.value, updated_at=excluded.updated_at
+            """
+        )
+
+    def add_provider_signature(self, *, signature: ProviderSignature) -> bool:
+        with self.conn.transaction():
+            cur = self.conn.execute(
+                f"""
+                INSERT INTO provider_signatures ({_SIGNATURE_COLUMNS})
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, now(), now())
+                ON CONFLICT(name) DO NOTHING
+                """,
+                (
+                    signature.name,
+                    signature.provider,
+                    float(signature.confidence),
+                    Jsonb(signature.conditions),
+                    signature.event_type_path,
+                    signature.event_id_path,
+                    signature.status,
+                    signature.fingerprint,
+                ),
+            )
+            self.conn.execute(
+                "UPDATE ai_shape_cache SET promoted = TRUE WHERE fingerprint = %s", (signature.fingerprint,)
+            )
+            if cur.rowcount and signature.status == INSTALLED:
+                self._bump_signatures_revision()
+        return bool(cur.rowcount)
+
+    def list_provider_signatures(self, *, status: str | None = None) -> list[ProviderSignature]:
+        rows = self.conn.execute(
+            f"""
+            SELECT {_SIGNATURE_COLUMNS} FROM provider_signatures
+            WHERE %(status)s::text IS NULL OR status = %(status)s
+            ORDER BY provider, name
+            """,
+            {"status": status},
+        ).fetchall()
+        return [_signature_from_row(r) for r in rows]
+
+    def set_provider_signature_status(self, *, name: str, status: str) -> bool:
+        with self.conn.transaction():
+            cur = self.conn.execute(
+                "UPDATE provider_signatures SET status = %s, updated_at = now() WHERE name = %s AND status != %s",
+                (status, name, status),
+            )
+            if cur.rowcount:
+                self._bump_signatures_revision()
+        return bool(cur.rowcount)
+
+    def get_provider_signatures_revision(self) -> str | None:
+        row = self.conn.execute("SELECT value FROM app_meta WHERE key = 'provider_signatures_revision'").fetchone()
+        return None if row is None else str(row["value"])
+
+    # Handler limits
+
+    def upsert_handler_limit(
+        self,
+        *,
+        limit_key: str,
+        max_concurrency: int | None = None,
+        rate_per_sec: float | None = None,
+        burst: float | None = None,
+    ) -> None:
+        self.conn.execute(
+            """
+            INSERT INTO handler_limits (limit_key, max_concurrency, rate_per_sec, burst, updated_at)
+            VALUES (%s, %s, %s, %s, date_trunc('second', now()))
+            ON CONFLICT(limit_key) DO UPDATE SET
+              max_concurrency=excluded.max_concurrency,
+              rate_per_sec=excluded.rate_per_sec,
+              burst=excluded.burst,
+              updated_at=excluded.updated_at
+            """,
+            (limit_key, max_concurrency, rate_per_sec, burst),
+        )
+
+    def list_handler_limits(self) -> list[HandlerLimit]:
+        rows = self.conn.execute(
+            "SELECT limit_key, max_concurrency, rate_per_sec, burst, updated_at FROM handler_limits ORDER BY limit_key"
+        ).fetchall()
+        return [_handler_limit_from_row(r) for r in rows]
+
+    def acquire_handler_permit(
+        self, *, limit_keys: Iterable[str], event_row_id: int, lease_seconds: float = DEFAULT_LEASE_SECONDS
+    ) -> PermitDecision | None:
+        keys = sorted(set(str(k) for k in limit_keys))
+        if not keys:
+            return None
+        if self.conn.execute("SELECT 1 FROM handler_limits WHERE limit_key = ANY(%s) LIMIT 1", (keys,)).fetchone() is None:
+            return None
+
+        with self.conn.transaction():
+            # Row locks in key order serialize workers on the same limits without a table lock.
+            rows = self.conn.execute(
+                """
+                SELECT limit_key, max_concurrency, rate_per_sec, burst, tat, updated_at,
+                       EXTRACT(EPOCH FROM clock_timestamp())::float8 AS now_epoch
+                FROM handler_limits
+                WHERE limit_key = ANY(%s)
+                ORDER BY limit_key
+                FOR UPDATE
+                """,
+                (keys,),
+            ).fetchall()
+            limits = [_handler_limit_from_row(r) for r in rows if r["max_concurrency"] is not None or r["rate_per_sec"]]
+            if not limits:
+                return None
+            now = float(rows[0]["now_epoch"])
+            self.conn.execute(
+                "DELETE FROM handler_permits WHERE limit_key = ANY(%s) AND expires_epoch < %s", (keys, now)
+            )
+            mine = self.conn.execute(
+                "SELECT limit_key, state, not_before FROM handler_permits WHERE event_row_id = %s AND limit_key = ANY(%s)",
+                (event_row_id, keys),
+            ).fetchall()
+            running = self.conn.execute(
+                """
+                SELECT limit_key, COUNT(*) AS n
+                FROM handler_permits
+                WHERE limit_key = ANY(%s) AND state = 'running' AND event_row_id != %s
+                GROUP BY limit_key
+                """,
+                (keys, event_row_id),
+            ).fetchall()
+            waiting = self.conn.execute(
+                """
+                SELECT limit_key, MAX(not_before) AS tail
+                FROM handler_permits
+                WHERE limit_key = ANY(%s) AND state = 'waiting' AND event_row_id != %s
+                GROUP BY limit_key
+                """,
+                (keys, event_row_id),
+            ).fetchall()
+            decision = decide_permit(
+                limits,
+                tats={str(r["limit_key"]): float(r["tat"]) for r in rows},
+                running={str(r["limit_key"]): int(r["n"]) for r in running},
+                reservations={str(r["limit_key"]): float(r["not_before"]) for r in mine if r["state"] == "reserved"},
+                now=now,
+                waiting={str(r["limit_key"]): float(r["tail"]) for r in waiting},
+            )
+            for key, tat in decision.tats.items():
+                self.conn.execute("UPDATE handler_limits SET tat = %s WHERE limit_key = %s", (tat, key))
+            if decision.admitted:
+                permits = [(limit.limit_key, "running", now, now + lease_seconds) for limit in limits]
+            else:
+                permits = [
+                    (key, "reserved", not_before, not_before + lease_seconds)
+                    for key, not_before in decision.reservations.items()
+                ]
+                permits += [
+                    (key, "waiting", recheck, recheck + lease_seconds)
+                    for key, recheck in decision.waits.items()
+                    if key not in decision.reservations
+                ]
+            for key, state, not_before, expires in permits:
+                self.conn.execute(
+                    """
+                    INSERT INTO handler_permits (limit_key, event_row_id, state, not_before, expires_epoch)
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON CONFLICT(limit_key, event_row_id) DO UPDATE SET
+                      state=excluded.state, not_before=excluded.not_before, expires_epoch=excluded.expires_epoch
+                    """,
+                    (key, event_row_id, state, not_before, expires),
+                )
+        return decision
+
+    def renew_handler_permits(self, *, event_ids: Iterable[int], lease_seconds: float = DEFAULT_LEASE_SECONDS) -> int:
+        ids = [int(i) for i in event_ids]
+        if not ids:
+            return 0
+        cur = self.conn.execute(
+            """
+            UPDATE handler_permits
+            SET expires_epoch = EXTRACT(EPOCH FROM clock_timestamp())::float8 + %s
+            WHERE event_row_id = ANY(%s) AND state = 'running'
+            """,
+            (float(lease_seconds), ids),
+        )
+        return cur.rowcount
+
+    def release_handler_permits(self, *, event_row_id: int) -> None:
+        self.conn.execute("DELETE FROM handler_permits WHERE event_row_id = %s", (event_row_id,))
+
+    # Circuit breakers
+
+    def _circuit_breaker(self, handler_mode: str, handler_target: str, *, lock: bool = False) -> CircuitBreaker | None:
+        row = self.conn.execute(
+            f"""
+            SELECT {_CIRCUIT_BREAKER_COLUMNS}
+            FROM circuit_breakers
+            WHERE handler_mode = %s AND handler_target = %s
+            {"FOR UPDATE" if lock else ""}
+            """,
+            (handler_mode, handler_target),
+        ).fetchone()
+        return _circuit_breaker_from_row(row)
+
+    def _save_circuit_breaker(self, breaker: CircuitBreaker) -> None:
+        self.conn.execute(
+            f"""
+            INSERT INTO circuit_breakers ({_CIRCUIT_BREAKER_COLUMNS})
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, now())
+            ON CONFLICT(handler_mode, handler_target) DO UPDATE SET
+              state=excluded.state,
+              consecutive_failures=excluded.consecutive_failures,
+              open_until=excluded.open_until,
+              open_seconds=excluded.open_seconds,
+              probe_event_row_id=excluded.probe_event_row_id,
+              probe_expires=excluded.probe_expires,
+              last_error=excluded.last_error,
+              updated_at=excluded.updated_at
+            """,
+            (
+                breaker.handler_mode,
+                breaker.handler_target,
+                breaker.state,
+                breaker.consecutive_failures,
+                breaker.open_until,
+                breaker.open_seconds,
+                breaker.probe_event_row_id,
+                breaker.probe_expires,
+                breaker.last_error,
+            ),
+        )
+
+    def _now_epoch(self) -> float:
+        return float(self.conn.execute("SELECT EXTRACT(EPOCH FROM clock_timestamp())::float8 AS now").fetchone()["now"])
+
+    def list_circuit_breakers(self) -> list[CircuitBreaker]:
+        rows = self.conn.execute(
+            f"SELECT {_CIRCUIT_BREAKER_COLUMNS} FROM circuit_breakers ORDER BY handler_mode, handler_target"
+        ).fetchall()
+        return [b for b in (_circuit_breaker_from_row(r) for r in rows) if b is not None]
+
+    def check_circuit(
+        self, *, handler_mode: str, handler_target: str, event_row_id: int, lease_seconds: float = DEFAULT_LEASE_SECONDS
+    ) -> float | None:
+        breaker = self._circuit_breaker(handler_mode, handler_target)
+        if breaker is None or breaker.state == "closed":
+            return None
+        with self.conn.transaction():
+            breaker = self._circuit_breaker(handler_mode, handler_target, lock=True)
+            retry_at, updated = admit_call(
+                breaker, event_row_id=event_row_id, now=self._now_epoch(), probe_lease=lease_seconds
+            )
+            if updated is not None:
+                self._save_circuit_breaker(updated)
+        return retry_at
+
+    def record_circuit_result(
+        self,
+        *,
+        handler_mode: str,
+        handler_target: str,
+        event_row_id: int,
+        ok: bool,
+        failure_threshold: int,
+        open_seconds: float,
+        max_open_seconds: float,
+        error: str | None = None,
+    ) -> CircuitBreaker | None:
+        kwargs = {
+            "handler_mode": handler_mode,
+            "handler_target": handler_target,
+            "ok": ok,
+            "event_row_id": event_row_id,
+            "failure_threshold": failure_threshold,
+            "open_seconds": open_seconds,
+            "max_open_seconds": max_open_seconds,
+            "error": error,
+        }
+        if ok:
+            breaker = self._circuit_breaker(handler_mode, handler_target)
+            if record_call(breaker, now=0.0, **kwargs) is None:
+                return None
+        with self.conn.transaction():
+            # Make sure there is a row to lock, so concurrent first failures are counted one after another.
+            self.conn.execute(
+                """
+                INSERT INTO circuit_breakers (handler_mode, handler_target, state, updated_at)
+                VALUES (%s, %s, 'closed', now())
+                ON CONFLICT DO NOTHING
+                """,
+                (handler_mode, handler_target),
+            )
+            breaker = self._circuit_breaker(handler_mode, handler_target, lock=True)
+            updated = record_call(breaker, now=self._now_epoch(), **kwargs)
+            if updated is not None:
+                self._save_circuit_breaker(updated)
+        if updated is None or breaker is None or updated.state == breaker.state:
+            return None
+        return updated
@@ -1,16 +1,71 @@
 from __future__ import annotations
 
 import json
+import time
+from dataclasses import dataclass
+from datetime import datetime
 from typing import Any
 
-from .db import Event
-from .db import create_action_run, finish_action_run, get_action_run_for_event_action, restart_action_run
-from .mapper import route_event
-from .action_runner import run_action
+from .circuit_breaker import OPEN, breaker_target
+from .db import DEFAULT_LEASE_SECONDS, Event
+from .handler_limits import limit_keys
+from .mapper import RouteDecision, route_stored_event
+from .action_runner import run_action, run_action_async
+from .queue_store import as_queue_store
+from .settings import get_settings
 
 
-def process_event(conn: Any, event: Event) -> dict[str, Any]:
-    decision = route_event(conn, event.payload)
+class HandlerDeferred(Exception):
+    """
+    Raised by `plan_event` when the handler may not run yet: one of its limits is full (`reason`
+    "limit") or its circuit breaker is open ("circuit"). The worker puts the event back in the queue
+    until `retry_epoch` without counting an attempt.
+    """
+
+    def __init__(self, key: str, retry_epoch: float, *, reason: str = "limit") -> None:
+        super().__init__(f"{reason} {key!r} is closed to new calls; retry at {retry_epoch:.0f}")
+        self.key = key
+        self.retry_epoch = retry_epoch
+        self.reason = reason
+
+
+@dataclass(frozen=True)
+class PlannedAction:
+    """
+    An action run recorded by `plan_event` and waiting for its handler to run.
+    """
+
+    run_id: int
+    decision: RouteDecision
+    router: dict[str, Any]
+    # True when the run holds handler-limit permits that `finish_event` must release.
+    limited: bool = False
+    # True when `finish_event` must report the outcome to the handler's circuit breaker.
+    breaker: bool = False
+
+
+def _remaining_lease(event: Event) -> float:
+    # Permits last as long as the claim's lease, and the lease heartbeat renews both together.
+    if event.lease_expires_at:
+        try:
+            remaining = datetime.fromisoformat(event.lease_expires_at).timestamp() - time.time()
+        except ValueError:
+            remaining = 0.0
+        if remaining > 0:
+            return remaining
+    return DEFAULT_LEASE_SECONDS
+
+
+def plan_event(conn: Any, event: Event) -> dict[str, Any] | PlannedAction:
+    """
+    Route `event` and record its action run. Returns the final result when there is nothing to run
+    (no mapping, or an idempotent replay of a finished run), else the run to execute.
+
+    Raises `HandlerDeferred` when the handler's circuit breaker is open, or when a limit configured
+    for the handler target or `provider/action` (config `limits`) has no free slot.
+    """
+    store = as_queue_store(conn)
+    decision = route_stored_event(store, event_row_id=event.id, payload=event.payload)
     router = {
         "provider": decision.provider,
         "confidence": decision.confidence,
@@ -26,7 +81,7 @@ def process_event(conn: Any, event: Event) -> dict[str, Any]:
     if not decision.action or not decision.handler_mode:
         return {"ok": True, "source": event.source, "event_id": event.event_id, "router": router, "result": {"note": "no mapping"}}
 
-    existing = get_action_run_for_event_action(conn, event_row_id=event.id, action=decision.action)
+    existing = store.get_action_run_for_event_action(event_row_id=event.id, action=decision.action)
     if existing is not None and existing.get("status") == "done":
         out = existing.get("output_json")
         if isinstance(out, str) and out:
@@ -49,30 +104,122 @@ def process_event(conn: Any, event: Event) -> dict[str, Any]:
                     "idempotent_replay": True,
                 }
 
-    run_id = create_action_run(
-        conn,
-        event_row_id=event.id,
-        provider=decision.provider,
-        action=decision.action,
-        handler_mode=decision.handler_mode,
-        handler_target=decision.handler_target,
-        input_obj={"router": router, "payload": event.payload},
-    )
+    lease_seconds = _remaining_lease(event)
+    breaker = get_settings().circuit_failure_threshold > 0 and decision.handler_mode != "noop"
+    if breaker:
+        target = breaker_target(decision.handler_target)
+        retry_at = store.check_circuit(
+            handler_mode=decision.handler_mode, handler_target=target, event_row_id=event.id, lease_seconds=lease_seconds
+        )
+        if retry_at is not None:
+            raise HandlerDeferred(f"{decision.handler_mode}:{target}", retry_at, reason="circuit")
 
-    try:
-        if existing is not None and existing.get("status") == "error" and int(existing.get("id")) == run_id:
-            restart_action_run(conn, run_id=run_id)
+    keys = limit_keys(handler_target=decision.handler_target, provider=decision.provider, action=decision.action)
+    permit = store.acquire_handler_permit(limit_keys=keys, event_row_id=event.id, lease_seconds=lease_seconds)
+    if permit is not None and not permit.admitted:
+        raise HandlerDeferred(str(permit.blocked_by), permit.retry_at)
 
-        output = run_action(
+    try:
+        run_id = store.create_action_run(
+            event_row_id=event.id,
+            provider=decision.provider,
+            action=decision.action,
             handler_mode=decision.handler_mode,
             handler_target=decision.handler_target,
-            action=decision.action,
-            event_payload=event.payload,
-            router=router,
+            input_obj={"router": router, "payload": event.payload},
         )
-        finish_action_run(conn, run_id=run_id, status="done", output_obj=output)
-        return {"ok": True, "source": event.source, "event_id": event.event_id, "router": router, "result": output}
+        if existing is not None and existing.get("status") == "error" and int(existing.get("id")) == run_id:
+            store.restart_action_run(run_id=run_id)
+    except BaseException:
+        if permit is not None:
+            store.release_handler_permits(event_row_id=event.id)
+        raise
+    return PlannedAction(run_id=run_id, decision=decision, router=router, limited=permit is not None, breaker=breaker)
+
+
+def finish_event(
+    conn: Any,
+    event: Event,
+    planned: PlannedAction,
+    *,
+    output: dict[str, Any] | None = None,
+    error: BaseException | None = None,
+) -> dict[str, Any]:
+    """
+    Record the outcome of `planned` (its handler's `output`, or the `error` it raised).
+    """
+    store = as_queue_store(conn)
+    if planned.limited:
+        store.release_handler_permits(event_row_id=event.id)
+    if planned.breaker:
+        _record_circuit(store, event, planned, error=error)
+    if error is None:
+        store.finish_action_run(run_id=planned.run_id, status="done", output_obj=output)
+        return {"ok": True, "source": event.source, "event_id": event.event_id, "router": planned.router, "result": output}
+    err = f"{type(error).__name__}: {error}"
+    store.finish_action_run(run_id=planned.run_id, status="error", error=err)
+    return {"ok": False, "source": event.source, "event_id": event.event_id, "router": planned.router, "error": err}
+
+
+def _record_circuit(store: Any, event: Event, planned: PlannedAction, *, error: BaseException | None) -> None:
+    settings = get_settings()
+    mode = str(planned.decision.handler_mode)
+    target = breaker_target(planned.decision.handler_target)
+    changed = store.record_circuit_result(
+        handler_mode=mode,
+        handler_target=target,
+        event_row_id=event.id,
+        ok=error is None,
+        error=None if error is None else f"{type(error).__name__}: {error}"[:500],
+        failure_threshold=settings.circuit_failure_threshold,
+        open_seconds=settings.circuit_open_seconds,
+        max_open_seconds=settings.circuit_max_open_seconds,
+    )
+    if changed is None:
+        return
+    if changed.state == OPEN:
+        print(
+            f"[circuit] {mode}:{target} open for {changed.open_seconds:.0f}s "
+            f"after {changed.consecutive_failures} failure(s) in a row"
+        )
+    else:
+        print(f"[circuit] {mode}:{target} {changed.state}")
+
+
+def _action_kwargs(event: Event, planned: PlannedAction) -> dict[str, Any]:
+    return {
+        "handler_mode": planned.decision.handler_mode,
+        "handler_target": planned.decision.handler_target,
+        "action": planned.decision.action,
+        "event_payload": event.payload,
+        "router": planned.router,
+    }
+
+
+def process_event(conn: Any, event: Event) -> dict[str, Any]:
+    store = as_queue_store(conn)
+    planned = plan_event(store, event)
+    if not isinstance(planned, PlannedAction):
+        return planned
+    try:
+        output = run_action(**_action_kwargs(event, planned))
+    except Exception as e:
+        return finish_event(store, event, planned, error=e)
+    return finish_event(store, event, planned, output=output)
+
+
+async def process_event_async(event: Event, *, run_db: Any, run_route: Any = None) -> dict[str, Any]:
+    """
+    `process_event` for the asyncio worker. `await run_db(fn, *args, **kwargs)` runs `fn(store, *args,
+    **kwargs)` on one of the worker's database threads; the handler itself is awaited on the event loop.
+    `plan_event` (routing, which may call the AI classifier) runs through `run_route` when given, so a
+    slow classifier call does not occupy a database thread.
+    """
+    planned = await (run_route or run_db)(plan_event, event)
+    if not isinstance(planned, PlannedAction):
+        return planned
+    try:
+        output = await run_action_async(**_action_kwargs(event, planned))
     except Exception as e:
-        err = f"{type(e).__name__}: {e}"
-        finish_action_run(conn, run_id=run_id, status="error", error=err)
-        return {"ok": False, "source": event.source, "event_id": event.event_id, "router": router, "error": err}
+        return await run_db(finish_event, event, planned, error=e)
+    return await run_db(finish_event, event, planned, output=output)
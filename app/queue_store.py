@@ -0,0 +1,505 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Mapping, Protocol
+
+from . import db
+from .db import DEFAULT_LEASE_SECONDS, EnqueueResult, Event, NewEvent, ProviderMapping, RoutingRule
+from .ai_cache import ProviderSignature, ShapeClassification
+from .circuit_breaker import CircuitBreaker
+from .handler_limits import HandlerLimit, PermitDecision
+from .settings import Settings, get_settings
+
+if TYPE_CHECKING:
+    from .group_commit import GroupCommitWriter
+
+
+class QueueStore(Protocol):
+    """
+    Storage used by the ingest server, worker and router: the event queue, action runs and routing config.
+
+    `SqliteQueueStore` wraps the functions in `app/db.py`; `app.pg_store.PostgresQueueStore` implements
+    the same operations on PostgreSQL.
+    """
+
+    backend: str
+
+    def init(self) -> None: ...
+
+    def close(self) -> None: ...
+
+    # Queue
+    def enqueue_event(
+        self, *, source: str, event_id: str | None, payload: dict[str, Any], priority: int | None = None
+    ) -> int: ...
+
+    def enqueue_events(self, items: Iterable[NewEvent]) -> list[EnqueueResult]: ...
+
+    def claim_events(
+        self,
+        *,
+        limit: int = 1,
+        lease_owner: str | None = None,
+        lease_seconds: float = DEFAULT_LEASE_SECONDS,
+        fair_weights: Mapping[str, float] | None = None,
+    ) -> list[Event]: ...
+
+    def next_ready_at(self) -> float | None: ...
+
+    def renew_leases(
+        self, *, event_ids: Iterable[int], lease_owner: str, lease_seconds: float = DEFAULT_LEASE_SECONDS
+    ) -> set[int]: ...
+
+    def release_events(self, *, event_ids: Iterable[int], lease_owner: str) -> int: ...
+
+    def reap_expired_leases(
+        self, *, max_attempts: int, stale_after_seconds: float = DEFAULT_LEASE_SECONDS, limit: int = 500
+    ) -> int: ...
+
+    def mark_done(self, *, event_id: int, result: dict[str, Any], lease_owner: str | None = None) -> bool: ...
+
+    def mark_retry(
+        self,
+        *,
+        event_id: int,
+        attempt_count: int,
+        next_attempt_at: str,
+        error: str,
+        lease_owner: str | None = None,
+    ) -> bool: ...
+
+    def mark_error(self, *, event_id: int, attempt_count: int, error: str, lease_owner: str | None = None) -> bool: ...
+
+    def defer_event(self, *, event_id: int, retry_epoch: float, lease_owner: str | None = None) -> bool: ...
+
+    def get_event_row(self, *, event_row_id: int) -> dict[str, Any] | None: ...
+
+    def get_queue_stats(self) -> dict[str, Any]: ...
+
+    # Dead letters
+    def list_dead_letters(
+        self,
+        *,
+        source: str | None = None,
+        error_prefix: str | None = None,
+        since: str | None = None,
+        until: str | None = None,
+        limit: int = 100,
+    ) -> list[dict[str, Any]]: ...
+
+    def count_dead_letters(
+        self,
+        *,
+        source: str | None = None,
+        error_prefix: str | None = None,
+        since: str | None = None,
+        until: str | None = None,
+    ) -> int: ...
+
+    def requeue_dead_letters(self, *, event_ids: Iterable[int], reroute: bool = False) -> int: ...
+
+    # Route decisions
+    def save_route_decision(
+        self, *, event_row_id: int, decision: dict[str, Any], config_version: int | None = None
+    ) -> None: ...
+
+    def get_route_decision(self, *, event_row_id: int) -> dict[str, Any] | None: ...
+
+    def get_config_version(self) -> int | None: ...
+
+    def set_config_version(self, *, version: int) -> None: ...
+
+    # AI classification cache (per payload shape)
+    def lookup_shape_classification(self, *, fingerprint: str) -> ShapeClassification | None: ...
+
+    def save_shape_classification(
+        self,
+        *,
+        fingerprint: str,
+        provider: str,
+        confidence: float,
+        event_type_path: str | None = None,
+        event_id_path: str | None = None,
+        ttl_seconds: float,
+        shape: dict[str, Any] | None = None,
+        agreement_interval_seconds: float = 0.0,
+    ) -> ShapeClassification: ...
+
+    def claim_shape_verification(self, *, fingerprint: str, interval_seconds: float) -> bool: ...
+
+    def list_shape_classifications(self, *, limit: int = 100) -> list[ShapeClassification]: ...
+
+    def shape_cache_stats(self) -> dict[str, int]: ...
+
+    # Provider signatures (promoted from the AI classification cache)
+    def add_provider_signature(self, *, signature: ProviderSignature) -> bool: ...
+
+    def list_provider_signatures(self, *, status: str | None = None) -> list[ProviderSignature]: ...
+
+    def set_provider_signature_status(self, *, name: str, status: str) -> bool: ...
+
+    def get_provider_signatures_revision(self) -> str | None: ...
+
+    # Action runs
+    def create_action_run(
+        self,
+        *,
+        event_row_id: int,
+        provider: str | None,
+        action: str | None,
+        handler_mode: str | None,
+        handler_target: str | None,
+        input_obj: dict[str, Any],
+    ) -> int: ...
+
+    def get_action_run(self, *, run_id: int) -> dict[str, Any] | None: ...
+
+    def get_action_run_for_event_action(self, *, event_row_id: int, action: str) -> dict[str, Any] | None: ...
+
+    def restart_action_run(self, *, run_id: int) -> None: ...
+
+    def finish_action_run(
+        self,
+        *,
+        run_id: int,
+        status: str,
+        output_obj: dict[str, Any] | None = None,
+        error: str | None = None,
+    ) -> None: ...
+
+    def list_action_runs_for_event(self, *, event_row_id: int, limit: int = 20) -> list[dict[str, Any]]: ...
+
+    # Routing config
+    def upsert_provider_mapping(
+        self,
+        *,
+        provider: str,
+        action: str,
+        handler_mode: str = "noop",
+        handler_target: str | None = None,
+        enabled: bool = True,
+        queue_priority: int | None = None,
+    ) -> None: ...
+
+    def get_provider_mapping(self, *, provider: str) -> ProviderMapping | None: ...
+
+    def upsert_routing_rule(
+        self,
+        *,
+        provider: str,
+        name: str,
+        priority: int,
+        conditions: dict[str, Any],
+        action: str,
+        handler_mode: str = "noop",
+        handler_target: str | None = None,
+        enabled: bool = True,
+    ) -> None: ...
+
+    def list_routing_rules(self, *, provider: str) -> list[RoutingRule]: ...
+
+    def get_routing_rules_revision(self) -> str | None: ...
+
+    # Handler limits
+    def upsert_handler_limit(
+        self,
+        *,
+        limit_key: str,
+        max_concurrency: int | None = None,
+        rate_per_sec: float | None = None,
+        burst: float | None = None,
+    ) -> None: ...
+
+    def list_handler_limits(self) -> list[HandlerLimit]: ...
+
+    def acquire_handler_permit(
+        self, *, limit_keys: Iterable[str], event_row_id: int, lease_seconds: float = DEFAULT_LEASE_SECONDS
+    ) -> PermitDecision | None: ...
+
+    def renew_handler_permits(self, *, event_ids: Iterable[int], lease_seconds: float = DEFAULT_LEASE_SECONDS) -> int: ...
+
+    def release_handler_permits(self, *, event_row_id: int) -> None: ...
+
+    # Circuit breakers
+    def list_circuit_breakers(self) -> list[CircuitBreaker]: ...
+
+    def check_circuit(
+        self, *, handler_mode: str, handler_target: str, event_row_id: int, lease_seconds: float = DEFAULT_LEASE_SECONDS
+    ) -> float | None: ...
+
+    def record_circuit_result(
+        self,
+        *,
+        handler_mode: str,
+        handler_target: str,
+        event_row_id: int,
+        ok: bool,
+        failure_threshold: int,
+        open_seconds: float,
+        max_open_seconds: float,
+        error: str | None = None,
+    ) -> CircuitBreaker | None: ...
+
+
+class SqliteQueueStore:
+    """
+    `QueueStore` over one SQLite connection; every method forwards to the function of the same name in `app/db.py`.
+
+    With a `writer`, state transitions (`mark_*` and the action-run writes) go through the shared
+    group-commit thread instead of committing on `conn`. `create_action_run` always waits for its
+    batch to commit because callers need the row id. The other writes wait only when
+    `wait_for_commit` is set. Without waiting, `mark_*` return True once the write is queued.
+    """
+
+    backend = "sqlite"
+
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        *,
+        db_path: str | None = None,
+        writer: GroupCommitWriter | None = None,
+        wait_for_commit: bool = True,
+    ) -> None:
+        self.conn = conn
+        self.db_path = db_path
+        self.writer = writer
+        self.wait_for_commit = wait_for_commit
+
+    @classmethod
+    def open(
+        cls, db_path: str, *, writer: GroupCommitWriter | None = None, wait_for_commit: bool = True
+    ) -> SqliteQueueStore:
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        return cls(db.open_db(db_path), db_path=db_path, writer=writer, wait_for_commit=wait_for_commit)
+
+    def _write(
+        self, fn: Callable[..., Any], kwargs: dict[str, Any], *, wait: bool | None = None, queued: Any = None
+    ) -> Any:
+        if self.writer is None:
+            return fn(self.conn, **kwargs)
+        future = self.writer.submit(fn, **kwargs)
+        if self.wait_for_commit if wait is None else wait:
+            return future.result()
+        future.add_done_callback(_report_failed_write(fn.__name__))
+        return queued
+
+    def init(self) -> None:
+        db.init_db(self.conn)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def enqueue_event(self, **kwargs: Any) -> int:
+        return db.enqueue_event(self.conn, **kwargs)
+
+    def enqueue_events(self, items: Iterable[NewEvent]) -> list[EnqueueResult]:
+        return db.enqueue_events(self.conn, items)
+
+    def claim_events(self, **kwargs: Any) -> list[Event]:
+        return db.claim_events(self.conn, **kwargs)
+
+    def next_ready_at(self) -> float | None:
+        return db.next_ready_at(self.conn)
+
+    def renew_leases(self, **kwargs: Any) -> set[int]:
+        return db.renew_leases(self.conn, **kwargs)
+
+    def release_events(self, **kwargs: Any) -> int:
+        return db.release_events(self.conn, **kwargs)
+
+    def reap_expired_leases(self, **kwargs: Any) -> int:
+        return db.reap_expired_leases(self.conn, **kwargs)
+
+    def mark_done(self, **kwargs: Any) -> bool:
+        return self._write(db.mark_done, kwargs, queued=True)
+
+    def mark_retry(self, **kwargs: Any) -> bool:
+        return self._write(db.mark_retry, kwargs, queued=True)
+
+    def mark_error(self, **kwargs: Any) -> bool:
+        return self._write(db.mark_error, kwargs, queued=True)
+
+    def defer_event(self, **kwargs: Any) -> bool:
+        return self._write(db.defer_event, kwargs, queued=True)
+
+    def get_event_row(self, **kwargs: Any) -> dict[str, Any] | None:
+        return db.get_event_row(self.conn, **kwargs)
+
+    def get_queue_stats(self) -> dict[str, Any]:
+        return db.get_queue_stats(self.conn)
+
+    def list_dead_letters(self, **kwargs: Any) -> list[dict[str, Any]]:
+        return db.list_dead_letters(self.conn, **kwargs)
+
+    def count_dead_letters(self, **kwargs: Any) -> int:
+        return db.count_dead_letters(self.conn, **kwargs)
+
+    def requeue_dead_letters(self, **kwargs: Any) -> int:
+        return db.requeue_dead_letters(self.conn, **kwargs)
+
+    def save_route_decision(self, **kwargs: Any) -> None:
+        self._write(db.save_route_decision, kwargs)
+
+    def get_route_decision(self, **kwargs: Any) -> dict[str, Any] | None:
+        return db.get_route_decision(self.conn, **kwargs)
+
+    def get_config_version(self) -> int | None:
+        return db.get_config_version(self.conn)
+
+    def set_config_version(self, **kwargs: Any) -> None:
+        db.set_config_version(self.conn, **kwargs)
+
+    def lookup_shape_classification(self, **kwargs: Any) -> ShapeClassification | None:
+        return db.lookup_shape_classification(self.conn, **kwargs)
+
+    def save_shape_classification(self, **kwargs: Any) -> ShapeClassification:
+        return db.save_shape_classification(self.conn, **kwargs)
+
+    def claim_shape_verification(self, **kwargs: Any) -> bool:
+        return db.claim_shape_verification(self.conn, **kwargs)
+
+    def list_shape_classifications(self, **kwargs: Any) -> list[ShapeClassification]:
+        return db.list_shape_classifications(self.conn, **kwargs)
+
+    def shape_cache_stats(self) -> dict[str, int]:
+        return db.shape_cache_stats(self.conn)
+
+    def add_provider_signature(self, **kwargs: Any) -> bool:
+        return db.add_provider_signature(self.conn, **kwargs)
+
+    def list_provider_signatures(self, **kwargs: Any) -> list[ProviderSignature]:
+        return db.list_provider_signatures(self.conn, **kwargs)
+
+    def set_provider_signature_status(self, **kwargs: Any) -> bool:
+        return db.set_provider_signature_status(self.conn, **kwargs)
+
+    def get_provider_signatures_revision(self) -> str | None:
+        return db.get_provider_signatures_revision(self.conn)
+
+    def create_action_run(self, **kwargs: Any) -> int:
+        return self._write(db.create_action_run, kwargs, wait=True)
+
+    def get_action_run(self, **kwargs: Any) -> dict[str, Any] | None:
+        return db.get_action_run(self.conn, **kwargs)
+
+    def get_action_run_for_event_action(self, **kwargs: Any) -> dict[str, Any] | None:
+        return db.get_action_run_for_event_action(self.conn, **kwargs)
+
+    def restart_action_run(self, **kwargs: Any) -> None:
+        self._write(db.restart_action_run, kwargs)
+
+    def finish_action_run(self, **kwargs: Any) -> None:
+        self._write(db.finish_action_run, kwargs)
+
+    def list_action_runs_for_event(self, **kwargs: Any) -> list[dict[str, Any]]:
+        return db.list_action_runs_for_event(self.conn, **kwargs)
+
+    def upsert_provider_mapping(self, **kwargs: Any) -> None:
+        db.upsert_provider_mapping(self.conn, **kwargs)
+
+    def get_provider_mapping(self, **kwargs: Any) -> ProviderMapping | None:
+        return db.get_provider_mapping(self.conn, **kwargs)
+
+    def upsert_routing_rule(self, **kwargs: Any) -> None:
+        db.upsert_routing_rule(self.conn, **kwargs)
+
+    def list_routing_rules(self, **kwargs: Any) -> list[RoutingRule]:
+        return db.list_routing_rules(self.conn, **kwargs)
+
+    def get_routing_rules_revision(self) -> str | None:
+        return db.get_routing_rules_revision(self.conn)
+
+    def upsert_handler_limit(self, **kwargs: Any) -> None:
+        db.upsert_handler_limit(self.conn, **kwargs)
+
+    def list_handler_limits(self) -> list[HandlerLimit]:
+        return db.list_handler_limits(self.conn)
+
+    def acquire_handler_permit(self, **kwargs: Any) -> PermitDecision | None:
+        return db.acquire_handler_permit(self.conn, **kwargs)
+
+    def renew_handler_permits(self, **kwargs: Any) -> int:
+        return db.renew_handler_permits(self.conn, **kwargs)
+
+    def release_handler_permits(self, **kwargs: Any) -> None:
+        db.release_handler_permits(self.conn, **kwargs)
+
+    def list_circuit_breakers(self) -> list[CircuitBreaker]:
+        return db.list_circuit_breakers(self.conn)
+
+    def check_circuit(self, **kwargs: Any) -> float | None:
+        return db.check_circuit(self.conn, **kwargs)
+
+    def record_circuit_result(self, **kwargs: Any) -> CircuitBreaker | None:
+        return db.record_circuit_result(self.conn, **kwargs)
+
+
+def _report_failed_write(name: str) -> Callable[[Future], None]:
+    def _callback(future: Future) -> None:
+        err = future.exception()
+        if err is not None:
+            print(f"[group-commit] {name} failed: {type(err).__name__}: {err}")
+
+    return _callback
+
+
+def as_queue_store(conn_or_store: Any) -> QueueStore:
+    """
+    Accept either a raw SQLite connection (legacy call sites and tests) or a `QueueStore`.
+    """
+    if isinstance(conn_or_store, sqlite3.Connection):
+        return SqliteQueueStore(conn_or_store)
+    return conn_or_store
+
+
+def _open_sqlite_store(db_path: str, settings: Settings) -> SqliteQueueStore:
+    writer = None
+    if settings.group_commit_enabled:
+        from .group_commit import get_group_commit_writer
+
+        writer = get_group_commit_writer(
+            db_path,
+            max_batch=settings.group_commit_max_batch,
+            max_delay=settings.group_commit_max_delay_ms / 1000,
+        )
+    return SqliteQueueStore.open(db_path, writer=writer, wait_for_commit=settings.group_commit_wait)
+
+
+def open_queue_store(
+    *, db_path: str | None = None, settings: Settings | None = None, shards: str | None = None
+) -> QueueStore:
+    """
+    Open the queue backend selected by `Settings.queue_backend` (`sqlite` or `postgres`).
+
+    `db_path` overrides `Settings.app_db_path` for the SQLite backend. With `Settings.queue_shards` > 1
+    the SQLite queue is split across shard files (see `app/sharding.py`); `shards` (e.g. `0,2`,
+    default `Settings.worker_shards`) picks the shards this process claims from.
+    """
+    settings = settings or get_settings()
+    backend = (settings.queue_backend or "sqlite").lower()
+    if backend == "sqlite":
+        db_path = db_path or settings.app_db_path
+        if settings.queue_shards <= 1:
+            return _open_sqlite_store(db_path, settings)
+
+        from .sharding import ShardedQueueStore, parse_shard_list, partition_key_fn, shard_paths
+
+        return ShardedQueueStore(
+            _open_sqlite_store(db_path, settings),
+            lambda path: _open_sqlite_store(path, settings),
+            paths=shard_paths(db_path, settings.queue_shards),
+            assigned=parse_shard_list(settings.worker_shards if shards is None else shards, settings.queue_shards),
+            partition_key=partition_key_fn(settings.queue_shard_key),
+        )
+    if backend in {"postgres", "postgresql"}:
+        try:
+            from .pg_store import PostgresQueueStore
+        except ImportError as e:
+            raise RuntimeError("queue_backend=postgres requires the `psycopg` package") from e
+        return PostgresQueueStore.connect(settings.database_url)
+    raise ValueError(f"Unsupported queue_backend: {settings.queue_backend!r}")
@@ -1,15 +1,15 @@
 from __future__ import annotations
 
-import os
 import threading
 
 import uvicorn
 
 from .config import apply_config, load_config
-from .db import init_db, open_db
 from .http_server import create_app
+from .notify import InProcessChannel, open_wakeup_channel
+from .queue_store import open_queue_store
 from .settings import get_settings
-from .worker import run_worker
+from .worker import run_worker_pool
 
 
 def main() -> None:
@@ -18,27 +18,33 @@ def main() -> None:
     port = settings.port
     db_path = settings.app_db_path
 
-    db_dir = os.path.dirname(db_path)
-    if db_dir:
-        os.makedirs(db_dir, exist_ok=True)
-    conn = open_db(db_path)
+    store = open_queue_store(db_path=db_path, settings=settings)
     try:
-        init_db(conn)
+        store.init()
         cfg = load_config()
         if cfg is not None:
-            apply_config(conn, cfg)
+            apply_config(store, cfg)
     finally:
-        conn.close()
+        store.close()
 
     stop_event = threading.Event()
+    # Enqueues from the HTTP server wake the worker thread directly; a configured
+    # WORKER_WAKEUP_DIR also reaches workers running in other processes.
+    wakeup = open_wakeup_channel(settings) or InProcessChannel()
 
     worker_thread = threading.Thread(
-        target=run_worker,
+        target=run_worker_pool,
         kwargs={
+            "concurrency": settings.worker_concurrency,
             "db_path": db_path,
             "poll_interval": settings.worker_poll_interval,
             "run_once": False,
             "max_attempts": settings.worker_max_attempts,
+            "batch_size": settings.worker_batch_size,
+            "lease_seconds": settings.worker_lease_seconds,
+            "retention_interval": settings.retention_interval_seconds,
+            "wakeup": wakeup,
+            "idle_timeout": settings.worker_idle_timeout,
             "stop_event": stop_event,
         },
         daemon=True,
@@ -46,12 +52,13 @@ def main() -> None:
     )
     worker_thread.start()
 
-    app = create_app(db_path=db_path, bootstrap=False, settings=settings)
+    app = create_app(db_path=db_path, bootstrap=False, settings=settings, wakeup=wakeup)
     server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, access_log=False))
     try:
         server.run()
     finally:
         stop_event.set()
+        wakeup.notify()
 
 
 if __name__ == "__main__":
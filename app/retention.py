@@ -0,0 +1,391 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any
+
+from .blobs import release_json, resolve_json_columns
+from .db import init_db, open_db, utc_now_iso, write_transaction
+from .settings import Settings, get_settings
+
+
+DEFAULT_DB_PATH = get_settings().app_db_path
+
+ARCHIVE_PREFIX = "events-"
+ARCHIVE_SUFFIX = ".sqlite3"
+
+
+@dataclass
+class RetentionResult:
+    archived_events: int = 0
+    archived_action_runs: int = 0
+    deleted_blobs: int = 0
+    partitions: set[str] = field(default_factory=set)
+
+
+def shard_archive_dir(archive_dir: str, shard: int) -> str:
+    """
+    Archive directory for one shard of a sharded queue. Its records are keyed by shard-local row id.
+    """
+    return str(Path(archive_dir) / f"shard-{shard}")
+
+
+def _archive_path(archive_dir: str, month: str) -> Path:
+    return Path(archive_dir) / f"{ARCHIVE_PREFIX}{month}{ARCHIVE_SUFFIX}"
+
+
+def _open_archive(path: Path) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path), isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS archived_events (
+          id INTEGER PRIMARY KEY,
+          source TEXT NOT NULL,
+          event_id TEXT,
+          status TEXT NOT NULL,
+          received_at TEXT NOT NULL,
+          processed_at TEXT,
+          archived_at TEXT NOT NULL,
+          record BLOB NOT NULL
+        );
+        """
+    )
+    return conn
+
+
+def _fetch_chunk(conn: sqlite3.Connection, ids: list[int]) -> tuple[list[dict[str, Any]], dict[int, list[dict[str, Any]]]]:
+    placeholders = ",".join("?" for _ in ids)
+    events = [
+        dict(r)
+        for r in conn.execute(
+            f"""
+            SELECT id, source, event_id, received_at, status, attempt_count, next_attempt_at, processing_started_at,
+                   processed_at, payload_json, result_json, last_error, payload_hash, result_hash
+            FROM events
+            WHERE id IN ({placeholders})
+            """,
+            ids,
+        ).fetchall()
+    ]
+    runs = [
+        dict(r)
+        for r in conn.execute(
+            f"""
+            SELECT id, event_row_id, started_at, finished_at, status, provider, action, handler_mode, handler_target,
+                   input_json, output_json, error, input_hash, output_hash
+            FROM action_runs
+            WHERE event_row_id IN ({placeholders})
+            ORDER BY id
+            """,
+            ids,
+        ).fetchall()
+    ]
+    resolve_json_columns(conn, events, {"payload_json": "payload_hash", "result_json": "result_hash"})
+    resolve_json_columns(conn, runs, {"input_json": "input_hash", "output_json": "output_hash"})
+    runs_by_event: dict[int, list[dict[str, Any]]] = {}
+    for run in runs:
+        runs_by_event.setdefault(int(run["event_row_id"]), []).append(run)
+    return events, runs_by_event
+
+
+def _public(row: dict[str, Any]) -> dict[str, Any]:
+    return {k: v for k, v in row.items() if not k.endswith("_hash")}
+
+
+def archive_finished_events(
+    conn: sqlite3.Connection,
+    *,
+    archive_dir: str,
+    older_than_days: float,
+    chunk_size: int = 500,
+    max_rows: int | None = None,
+) -> RetentionResult:
+    """
+    Move `done`/`error` events processed before the cutoff (and their action runs) into monthly archive files.
+
+    Each chunk is committed to the archive before it is deleted from the hot database, so an
+    interrupted run only leaves rows that the next run re-archives idempotently. The delete re-checks
+    status and cutoff, so an event requeued meanwhile stays in the hot database and out of the archive.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=older_than_days)).replace(microsecond=0).isoformat()
+    result = RetentionResult()
+    archives: dict[str, sqlite3.Connection] = {}
+    try:
+        while max_rows is None or result.archived_events < max_rows:
+            limit = chunk_size if max_rows is None else min(chunk_size, max_rows - result.archived_events)
+            ids = [
+                int(r["id"])
+                for r in conn.execute(
+                    """
+                    SELECT id
+                    FROM events
+                    WHERE status IN ('done', 'error') AND processed_at < ?
+                    ORDER BY processed_at ASC
+                    LIMIT ?
+                    """,
+                    (cutoff, int(limit)),
+                ).fetchall()
+            ]
+            if not ids:
+                break
+
+            events, runs_by_event = _fetch_chunk(conn, ids)
+            archived_at = utc_now_iso()
+            by_month: dict[str, list[tuple[Any, ...]]] = {}
+            for ev in events:
+                record = {
+                    "event": _public(ev),
+                    "action_runs": [_public(r) for r in runs_by_event.get(int(ev["id"]), [])],
+                }
+                blob = zlib.compress(json.dumps(record, separators=(",", ":"), ensure_ascii=False).encode("utf-8"), 6)
+                month = str(ev["received_at"])[:7]
+                by_month.setdefault(month, []).append(
+                    (ev["id"], ev["source"], ev["event_id"], ev["status"], ev["received_at"], ev["processed_at"], archived_at, blob)
+                )
+
+            for month, rows in by_month.items():
+                archive = archives.get(month)
+                if archive is None:
+                    archive = archives[month] = _open_archive(_archive_path(archive_dir, month))
+                archive.execute("BEGIN;")
+                archive.executemany(
+                    """
+                    INSERT OR REPLACE INTO archived_events
+                      (id, source, event_id, status, received_at, processed_at, archived_at, record)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    rows,
+                )
+                archive.execute("COMMIT;")
+                result.partitions.add(month)
+
+            # Re-check the status: an event requeued (or otherwise changed) since it was picked is live
+            # again and must stay, along with its runs and blobs.
+            placeholders = ",".join("?" for _ in ids)
+            with write_transaction(conn):
+                deleted = conn.execute(
+                    f"""
+                    DELETE FROM events
+                    WHERE id IN ({placeholders}) AND status IN ('done', 'error') AND processed_at < ?
+                    RETURNING id, payload_hash, result_hash
+                    """,
+                    (*ids, cutoff),
+                ).fetchall()
+                deleted_ids = [int(r["id"]) for r in deleted]
+                hashes = [r[k] for r in deleted for k in ("payload_hash", "result_hash")]
+                if deleted_ids:
+                    runs = conn.execute(
+                        f"""
+                        DELETE FROM action_runs WHERE event_row_id IN ({",".join("?" for _ in deleted_ids)})
+                        RETURNING input_hash, output_hash
+                        """,
+                        deleted_ids,
+                    ).fetchall()
+                    hashes += [r[k] for r in runs for k in ("input_hash", "output_hash")]
+                    result.archived_action_runs += len(runs)
+                result.deleted_blobs += release_json(conn, hashes)
+
+            # Drop the archived copies of events that were kept.
+            deleted_set = set(deleted_ids)
+            for ev in events:
+                if int(ev["id"]) not in deleted_set:
+                    archive = archives[str(ev["received_at"])[:7]]
+                    archive.execute("DELETE FROM archived_events WHERE id = ?", (ev["id"],))
+            result.archived_events += len(deleted_ids)
+    finally:
+        for archive in archives.values():
+            archive.close()
+    return result
+
+
+def reclaim_space(conn: sqlite3.Connection, *, max_pages: int | None = None) -> None:
+    """
+    Return free pages to the filesystem and truncate the WAL.
+
+    Incremental vacuum only works on databases created with `auto_vacuum=INCREMENTAL` (see `open_db`);
+    older files need a one-off `--full-vacuum`.
+    """
+    if max_pages is None:
+        conn.execute("PRAGMA incremental_vacuum;").fetchall()
+    else:
+        conn.execute(f"PRAGMA incremental_vacuum({int(max_pages)});").fetchall()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE);").fetchall()
+
+
+def get_archived_event(archive_dir: str, *, event_row_id: int) -> dict[str, Any] | None:
+    """
+    Look up an archived event (with its action runs) by row id, newest partition first.
+    """
+    base = Path(archive_dir)
+    if not base.is_dir():
+        return None
+    for path in sorted(base.glob(f"{ARCHIVE_PREFIX}*{ARCHIVE_SUFFIX}"), reverse=True):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            row = conn.execute("SELECT record FROM archived_events WHERE id = ?", (int(event_row_id),)).fetchone()
+        except sqlite3.OperationalError:
+            continue
+        finally:
+            conn.close()
+        if row is not None:
+            record = json.loads(zlib.decompress(row[0]).decode("utf-8"))
+            record["archive_partition"] = path.name
+            return record
+    return None
+
+
+def run_retention(conn: sqlite3.Connection, *, settings: Settings | None = None) -> RetentionResult:
+    settings = settings or get_settings()
+    result = archive_finished_events(
+        conn,
+        archive_dir=settings.retention_archive_dir,
+        older_than_days=settings.retention_days,
+        chunk_size=settings.retention_chunk_size,
+    )
+    if result.archived_events:
+        reclaim_space(conn)
+    return result
+
+
+def start_retention_thread(
+    *,
+    db_path: str,
+    interval: float,
+    stop_event: threading.Event,
+    settings: Settings | None = None,
+    name: str = "retention",
+) -> threading.Thread:
+    """
+    Run `run_retention` every `interval` seconds on a dedicated connection until `stop_event` is set.
+    """
+
+    def _loop() -> None:
+        conn = open_db(db_path)
+        try:
+            while not stop_event.wait(interval):
+                try:
+                    result = run_retention(conn, settings=settings)
+                except Exception as e:
+                    print(f"[retention] failed: {type(e).__name__}: {e}")
+                    continue
+                if result.archived_events:
+                    print(
+                        f"[retention] archived events={result.archived_events} action_runs={result.archived_action_runs} "
+                        f"blobs_freed={result.deleted_blobs} partitions={','.join(sorted(result.partitions))}"
+                    )
+        finally:
+            conn.close()
+
+    thread = threading.Thread(target=_loop, daemon=True, name=name)
+    thread.start()
+    return thread
+
+
+def start_store_retention(
+    *,
+    backend: str,
+    db_path: str,
+    shards: str | None,
+    interval: float,
+    stop_event: threading.Event,
+    settings: Settings | None = None,
+) -> list[threading.Thread]:
+    """
+    Start the retention threads for a worker's queue backend (`QueueStore.backend`).
+
+    A sharded queue gets one thread per shard the worker is assigned (`shards`, default
+    `Settings.worker_shards`), each archiving into `shard_archive_dir`. Other backends have no
+    retention; that is logged once instead of skipped silently.
+    """
+    settings = settings or get_settings()
+    if backend == "sqlite":
+        return [start_retention_thread(db_path=db_path, interval=interval, stop_event=stop_event, settings=settings)]
+    if backend == "sqlite_sharded":
+        from .sharding import parse_shard_list, shard_paths
+
+        paths = shard_paths(db_path, settings.queue_shards)
+        assigned = parse_shard_list(settings.worker_shards if shards is None else shards, settings.queue_shards)
+        return [
+            start_retention_thread(
+                db_path=paths[i],
+                interval=interval,
+                stop_event=stop_event,
+                settings=settings.model_copy(
+                    update={"retention_archive_dir": shard_archive_dir(settings.retention_archive_dir, i)}
+                ),
+                name=f"retention-shard-{i}",
+            )
+            for i in (range(len(paths)) if assigned is None else assigned)
+        ]
+    print(f"[retention] disabled: backend={backend} keeps finished events (RETENTION_INTERVAL_SECONDS ignored)")
+    return []
+
+
+def main() -> None:
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description="Archive and prune finished events (SQLite).")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    parser.add_argument("--archive-dir", default=settings.retention_archive_dir)
+
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    run_cmd = sub.add_parser("run", help="Archive done/error events older than the cutoff and delete them")
+    run_cmd.add_argument("--older-than-days", type=float, default=settings.retention_days)
+    run_cmd.add_argument("--chunk-size", type=int, default=settings.retention_chunk_size)
+    run_cmd.add_argument("--max-rows", type=int, default=None)
+    run_cmd.add_argument(
+        "--full-vacuum",
+        action="store_true",
+        help="Run a full VACUUM afterwards (one-off; also enables incremental vacuum on older databases)",
+    )
+
+    get_cmd = sub.add_parser("get", help="Look up an archived event by row id")
+    get_cmd.add_argument("--id", type=int, required=True)
+
+    args = parser.parse_args()
+
+    if args.cmd == "get":
+        record = get_archived_event(args.archive_dir, event_row_id=args.id)
+        if record is None:
+            print("not found")
+            return
+        print(json.dumps(record, ensure_ascii=False, indent=2))
+        return
+
+    db_dir = os.path.dirname(args.db)
+    if db_dir:
+        os.makedirs(db_dir, exist_ok=True)
+    conn = open_db(args.db)
+    try:
+        init_db(conn)
+        result = archive_finished_events(
+            conn,
+            archive_dir=args.archive_dir,
+            older_than_days=args.older_than_days,
+            chunk_size=args.chunk_size,
+            max_rows=args.max_rows,
+        )
+        if args.full_vacuum:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+            conn.execute("VACUUM;")
+        else:
+            reclaim_space(conn)
+        print(
+            f"archived events={result.archived_events} action_runs={result.archived_action_runs} "
+            f"blobs_freed={result.deleted_blobs} partitions={','.join(sorted(result.partitions)) or '-'}"
+        )
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
 from __future__ import annotations
 
 import re
+from collections import Counter
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Callable, Iterable, Sequence
+
+from .db import RoutingRule
 
 
 @dataclass(frozen=True)
@@ -11,89 +14,250 @@ class RuleMatch:
     reasons: list[str]
 
 
-def _get_path(obj: Any, path: str) -> Any:
+@dataclass(frozen=True)
+class EventView:
+    """
+    The parts of a payload that rule conditions look at, normalized once per event.
+    """
+
+    headers: dict[str, str]
+    json: dict[str, Any] | None
+    path: str | None = None
+    # Lowercased, without parameters ("application/json; charset=utf-8" -> "application/json").
+    content_type: str = ""
+
+    @classmethod
+    def of(cls, payload: dict[str, Any]) -> EventView:
+        headers = payload.get("headers")
+        headers_lc = {str(k).lower(): str(v) for k, v in headers.items()} if isinstance(headers, dict) else {}
+        json_body = payload.get("json")
+        path = payload.get("path")
+        return cls(
+            headers=headers_lc,
+            json=json_body if isinstance(json_body, dict) else None,
+            path=path if isinstance(path, str) else None,
+            content_type=str(payload.get("content_type") or "").split(";", 1)[0].strip().lower(),
+        )
+
+
+Predicate = Callable[[EventView], RuleMatch]
+
+
+def _split_path(path: str) -> tuple[tuple[str, int | None], ...]:
+    return tuple((part, int(part) if part.isdigit() else None) for part in path.split(".") if part != "")
+
+
+def _walk(obj: Any, parts: tuple[tuple[str, int | None], ...]) -> Any:
     cur = obj
-    for part in path.split("."):
-        if part == "":
-            continue
+    for key, idx in parts:
         if isinstance(cur, dict):
-            cur = cur.get(part)
+            cur = cur.get(key)
             continue
-        if isinstance(cur, list) and part.isdigit():
-            idx = int(part)
+        if isinstance(cur, list) and idx is not None:
             cur = cur[idx] if 0 <= idx < len(cur) else None
             continue
         return None
     return cur
 
 
-def _match_condition(payload: dict[str, Any], cond: dict[str, Any]) -> RuleMatch:
-    op = str(cond.get("op") or "").strip()
-    reasons: list[str] = []
+def get_path(obj: Any, path: str) -> Any:
+    """
+    Value at dot-separated `path` in `obj` (list items by index), or None.
+    """
+    return _walk(obj, _split_path(path))
 
-    headers = payload.get("headers") if isinstance(payload.get("headers"), dict) else {}
-    headers_lc = {str(k).lower(): str(v) for k, v in headers.items()} if isinstance(headers, dict) else {}
-    json_body = payload.get("json") if isinstance(payload.get("json"), dict) else None
 
-    if op == "header_present":
-        name = str(cond.get("name") or "").lower()
-        ok = bool(name) and name in headers_lc
-        return RuleMatch(ok, [f"header_present:{name}"] if ok else [f"missing_header:{name}"])
+def _compile_condition(cond: dict[str, Any]) -> Predicate:
+    op = str(cond.get("op") or "").strip()
 
-    if op == "header_equals":
+    if op in ("header_present", "header_equals"):
         name = str(cond.get("name") or "").lower()
+        if op == "header_present":
+            hit, miss = RuleMatch(True, [f"header_present:{name}"]), RuleMatch(False, [f"missing_header:{name}"])
+            return lambda view: hit if name and name in view.headers else miss
         expected = str(cond.get("value") or "")
-        got = headers_lc.get(name)
-        ok = got is not None and got == expected
-        return RuleMatch(ok, [f"header_equals:{name}"] if ok else [f"header_mismatch:{name}"])
+        hit, miss = RuleMatch(True, [f"header_equals:{name}"]), RuleMatch(False, [f"header_mismatch:{name}"])
+        return lambda view: hit if view.headers.get(name) == expected else miss
 
-    if op == "json_path_exists":
-        path = str(cond.get("path") or "")
-        ok = json_body is not None and _get_path(json_body, path) is not None
-        return RuleMatch(ok, [f"json_path_exists:{path}"] if ok else [f"json_path_missing:{path}"])
+    if op == "path_equals":
+        expected = str(cond.get("value") or "")
+        hit, miss = RuleMatch(True, [f"path_equals:{expected}"]), RuleMatch(False, [f"path_mismatch:{expected}"])
+        return lambda view: hit if view.path == expected else miss
 
-    if op == "json_path_equals":
-        path = str(cond.get("path") or "")
-        expected = cond.get("value")
-        got = _get_path(json_body, path) if json_body is not None else None
-        ok = got == expected
-        return RuleMatch(ok, [f"json_path_equals:{path}"] if ok else [f"json_path_mismatch:{path}"])
+    if op == "content_type_equals":
+        expected = str(cond.get("value") or "").lower()
+        hit = RuleMatch(True, [f"content_type_equals:{expected}"])
+        miss = RuleMatch(False, [f"content_type_mismatch:{expected}"])
+        return lambda view: hit if view.content_type == expected else miss
 
-    if op == "json_path_regex":
+    if op in ("json_path_exists", "json_path_equals", "json_path_regex"):
         path = str(cond.get("path") or "")
-        pattern = str(cond.get("pattern") or "")
-        got = _get_path(json_body, path) if json_body is not None else None
-        ok = got is not None and re.search(pattern, str(got)) is not None
-        return RuleMatch(ok, [f"json_path_regex:{path}"] if ok else [f"json_path_no_match:{path}"])
+        parts = _split_path(path)
 
-    return RuleMatch(False, [f"unknown_op:{op}"])
+        def got(view: EventView) -> Any:
+            return _walk(view.json, parts) if view.json is not None else None
 
+        if op == "json_path_exists":
+            hit, miss = RuleMatch(True, [f"json_path_exists:{path}"]), RuleMatch(False, [f"json_path_missing:{path}"])
+            return lambda view: hit if got(view) is not None else miss
+        if op == "json_path_equals":
+            expected = cond.get("value")
+            hit, miss = RuleMatch(True, [f"json_path_equals:{path}"]), RuleMatch(False, [f"json_path_mismatch:{path}"])
+            return lambda view: hit if got(view) == expected else miss
 
-def rule_matches(payload: dict[str, Any], rule_conditions: dict[str, Any]) -> RuleMatch:
+        hit, miss = RuleMatch(True, [f"json_path_regex:{path}"]), RuleMatch(False, [f"json_path_no_match:{path}"])
+        try:
+            regex = re.compile(str(cond.get("pattern") or ""))
+        except re.error as e:
+            # Raised when the rule is evaluated against a value, as before rules were compiled.
+            error = e
+
+            def broken(view: EventView) -> RuleMatch:
+                if got(view) is not None:
+                    raise error
+                return miss
+
+            return broken
+
+        def search(view: EventView) -> RuleMatch:
+            value = got(view)
+            return hit if value is not None and regex.search(str(value)) is not None else miss
+
+        return search
+
+    unknown = RuleMatch(False, [f"unknown_op:{op}"])
+    return lambda view: unknown
+
+
+def compile_conditions(rule_conditions: dict[str, Any]) -> Predicate:
+    """
+    Turn a rule's `conditions` into a predicate over an `EventView`: JSON paths are split and regexes
+    compiled once, here, instead of on every event. Matches and reasons are the same as `rule_matches`.
+    """
     if "all" in rule_conditions and isinstance(rule_conditions["all"], list):
-        reasons: list[str] = []
-        for cond in rule_conditions["all"]:
-            if not isinstance(cond, dict):
-                return RuleMatch(False, ["invalid_condition"])
-            match = _match_condition(payload, cond)
-            reasons.extend(match.reasons)
-            if not match.matched:
-                return RuleMatch(False, reasons)
-        return RuleMatch(True, reasons)
+        # None marks an invalid entry; it fails the rule once every condition before it has matched.
+        all_preds = [_compile_condition(c) if isinstance(c, dict) else None for c in rule_conditions["all"]]
+
+        def match_all(view: EventView) -> RuleMatch:
+            reasons: list[str] = []
+            for pred in all_preds:
+                if pred is None:
+                    return RuleMatch(False, ["invalid_condition"])
+                match = pred(view)
+                reasons.extend(match.reasons)
+                if not match.matched:
+                    return RuleMatch(False, reasons)
+            return RuleMatch(True, reasons)
+
+        return match_all
 
     if "any" in rule_conditions and isinstance(rule_conditions["any"], list):
-        reasons: list[str] = []
-        any_ok = False
-        for cond in rule_conditions["any"]:
-            if not isinstance(cond, dict):
-                continue
-            match = _match_condition(payload, cond)
-            reasons.extend(match.reasons)
-            any_ok = any_ok or match.matched
-        return RuleMatch(any_ok, reasons)
+        any_preds = [_compile_condition(c) for c in rule_conditions["any"] if isinstance(c, dict)]
+
+        def match_any(view: EventView) -> RuleMatch:
+            reasons: list[str] = []
+            any_ok = False
+            for pred in any_preds:
+                match = pred(view)
+                reasons.extend(match.reasons)
+                any_ok = any_ok or match.matched
+            return RuleMatch(any_ok, reasons)
+
+        return match_any
 
     if isinstance(rule_conditions.get("op"), str):
-        return _match_condition(payload, rule_conditions)  # single condition
+        return _compile_condition(rule_conditions)  # single condition
+
+    invalid = RuleMatch(False, ["invalid_rule_conditions"])
+    return lambda view: invalid
+
+
+def rule_matches(payload: dict[str, Any], rule_conditions: dict[str, Any]) -> RuleMatch:
+    return compile_conditions(rule_conditions)(EventView.of(payload))
+
+
+# How an indexed rule is found: ("header", lowercased name) or ("json", path), and the value it needs there.
+Dimension = tuple[str, str]
 
-    return RuleMatch(False, ["invalid_rule_conditions"])
 
+def _discriminators(rule_conditions: dict[str, Any]) -> list[tuple[Dimension, Any]]:
+    """
+    Equality conditions every match of the rule must satisfy: `header_equals` and `json_path_equals`
+    inside an `all` block, or as the rule's single condition.
+    """
+    if "all" in rule_conditions and isinstance(rule_conditions["all"], list):
+        conds = rule_conditions["all"]
+    elif "any" not in rule_conditions and isinstance(rule_conditions.get("op"), str):
+        conds = [rule_conditions]
+    else:
+        return []
+    found: list[tuple[Dimension, Any]] = []
+    for cond in conds:
+        if not isinstance(cond, dict):
+            continue
+        op = str(cond.get("op") or "").strip()
+        if op == "header_equals":
+            found.append((("header", str(cond.get("name") or "").lower()), str(cond.get("value") or "")))
+        elif op == "json_path_equals" and isinstance(cond.get("value"), (str, int, float, bool, type(None))):
+            found.append((("json", str(cond.get("path") or "")), cond.get("value")))
+    return found
+
+
+class RuleSet:
+    """
+    One provider's enabled routing rules, compiled, in `list_routing_rules` order (priority, then id).
+
+    Rules are indexed on one discriminator each (see `_discriminators`), picking the dimension most
+    rules share so an event probes as few header names / JSON paths as possible. `first_match` looks
+    up the event's value on every dimension and evaluates only the rules listed under it plus the
+    rules without a discriminator, still in priority order, so the result is the same as a linear scan.
+    """
+
+    def __init__(self, rules: Iterable[RoutingRule]) -> None:
+        self.rules: Sequence[RoutingRule] = [r for r in rules if r.enabled]
+        self._predicates = [compile_conditions(r.conditions) for r in self.rules]
+
+        per_rule = [_discriminators(r.conditions) for r in self.rules]
+        usage = Counter(dim for found in per_rule for dim in {d for d, _ in found})
+        self._index: dict[Dimension, dict[Any, list[int]]] = {}
+        self._unindexed: list[int] = []
+        for pos, found in enumerate(per_rule):
+            if not found:
+                self._unindexed.append(pos)
+                continue
+            dim, value = max(found, key=lambda f: usage[f[0]])
+            self._index.setdefault(dim, {}).setdefault(value, []).append(pos)
+        self._dimensions = [(dim, _split_path(dim[1]) if dim[0] == "json" else ()) for dim in self._index]
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def candidates(self, view: EventView) -> list[int]:
+        """
+        Positions of the rules that can match `view`, ascending.
+        """
+        if not self._index:
+            return list(range(len(self.rules)))
+        lists = [self._unindexed] if self._unindexed else []
+        for (kind, key), parts in self._dimensions:
+            if kind == "header":
+                value = view.headers.get(key)
+                if value is None:
+                    continue
+            else:
+                value = _walk(view.json, parts) if view.json is not None else None
+                if isinstance(value, (dict, list)):
+                    continue
+            hit = self._index[(kind, key)].get(value)
+            if hit:
+                lists.append(hit)
+        if len(lists) == 1:
+            return lists[0]
+        return sorted(set().union(*lists))
+
+    def first_match(self, view: EventView) -> tuple[RoutingRule, RuleMatch] | None:
+        for pos in self.candidates(view):
+            match = self._predicates[pos](view)
+            if match.matched:
+                return self.rules[pos], match
+        return None
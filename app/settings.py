@@ -13,7 +13,17 @@ class Settings(BaseSettings):
     host: str = "0.0.0.0"
     port: int = 8080
     app_db_path: str = "app/data/events.sqlite3"
+    # Queue backend: sqlite (app_db_path) or postgres (database_url, needs `psycopg`)
+    queue_backend: str = "sqlite"
+    database_url: str = ""
+    # SQLite sharding: >1 splits events across <db>.shard-N.sqlite3 files by a hash of queue_shard_key
+    # (source | event_id | payload.<dotted.path>). worker_shards: shards a worker claims ("" = all, "0,2", "0-3")
+    queue_shards: int = 1
+    queue_shard_key: str = "source"
+    worker_shards: str = ""
     app_config_path: str = ""
+    # JSON blob compression: zlib (stdlib), zstd (needs `zstandard`), or none
+    blob_codec: str = "zlib"
 
     # Auth (empty = disabled)
     ingress_secret: str = ""
@@ -27,10 +37,61 @@ class Settings(BaseSettings):
     # Worker
     worker_poll_interval: float = 1.0
     worker_max_attempts: int = 8
+    worker_batch_size: int = 10
+    worker_lease_seconds: float = 120.0
+    # Worker threads per process (each claims and processes on its own connection)
+    worker_concurrency: int = 1
+    # Engine: thread (run_worker / thread pool) or async (asyncio loop with up to worker_max_in_flight
+    # handlers awaited at once, store calls on worker_db_threads threads and routing, which may block on
+    # the AI classifier, on worker_route_threads threads)
+    worker_engine: str = "thread"
+    worker_max_in_flight: int = 100
+    worker_db_threads: int = 4
+    worker_route_threads: int = 4
+    # Supervisor mode (>1 = fork this many worker processes); liveness JSON path; seconds without a
+    # heartbeat before a child is killed and restarted
+    worker_processes: int = 1
+    worker_status_path: str = ""
+    worker_liveness_timeout: float = 60.0
+    # Push wakeups: directory for per-worker Unix sockets ("" = poll every worker_poll_interval)
+    worker_wakeup_dir: str = ""
+    worker_idle_timeout: float = 30.0
+    # Claim order: fifo (priority, then oldest first) or fair (weighted round-robin across sources
+    # within a priority lane). worker_fair_weights: "stripe=3,cron=0.5" (unlisted sources weigh 1)
+    worker_claim_mode: str = "fifo"
+    worker_fair_weights: str = ""
+
+    # Group commit (SQLite): batch state-transition writes on one writer thread
+    group_commit_enabled: bool = False
+    group_commit_max_batch: int = 100
+    # Extra time to wait for more writes before committing (0 = commit as soon as the queue drains)
+    group_commit_max_delay_ms: float = 0.0
+    group_commit_wait: bool = True
+
+    # Retention (archive finished events; interval 0 = no background task in the worker)
+    retention_archive_dir: str = "app/data/archive"
+    retention_days: float = 30.0
+    retention_chunk_size: int = 500
+    retention_interval_seconds: float = 0.0
 
     # Mapper AI fallback
     mapper_use_ai: bool = False
     mapper_ai_threshold: float = 0.65
+    # AI classifications are cached per payload shape (app/ai_cache.py) for this long; 0 disables the cache.
+    mapper_ai_cache_ttl_seconds: float = 7 * 24 * 3600.0
+    # A cached classification that the model repeated this many times in a row (0 disables), at this
+    # confidence, for a shape seen on this many events, becomes a provider signature: proposed for
+    # `mapping_cli signature-review`, or installed straight away with mapper_promote_install.
+    mapper_promote_min_agreements: int = 2
+    mapper_promote_min_confidence: float = 0.9
+    mapper_promote_min_events: int = 20
+    mapper_promote_install: bool = False
+    # While a shape is a promotion candidate, one cached event per interval is re-classified by the model
+    # to check the cached answer; answers count as agreements at most once per interval.
+    mapper_promote_verify_interval_seconds: float = 3600.0
+    # Route decisions are stored per event and reused on retry/replay. With this on, a decision made
+    # under an older config version (see apply_config) is discarded and the event is routed again.
+    mapper_reroute_on_config_change: bool = False
 
     # Cron helper (HTTP)
     api_base_url: str = ""
@@ -43,6 +104,12 @@ class Settings(BaseSettings):
     # Action runner
     app_commands_path: str = "app/commands.json"
     action_agent_timeout_seconds: float = 90.0
+    # Circuit breaker per (handler_mode, handler_target): opens after this many failures/timeouts in a row
+    # (0 = off), defers that handler's events for circuit_open_seconds, then lets one probe through.
+    # Each failed probe doubles the wait, up to circuit_max_open_seconds.
+    circuit_failure_threshold: int = 5
+    circuit_open_seconds: float = 30.0
+    circuit_max_open_seconds: float = 600.0
 
     # Claude Agent SDK
     claude_agent_permission_mode: str = "bypassPermissions"
@@ -61,6 +128,17 @@ class Settings(BaseSettings):
         "webhook_secret",
         "fireflies_webhook_secret",
         "app_config_path",
+        "queue_backend",
+        "database_url",
+        "queue_shard_key",
+        "worker_shards",
+        "worker_wakeup_dir",
+        "worker_status_path",
+        "worker_claim_mode",
+        "worker_engine",
+        "worker_fair_weights",
+        "blob_codec",
+        "retention_archive_dir",
         "api_base_url",
         "llm_mode",
         "llm_command",
@@ -0,0 +1,416 @@
+from __future__ import annotations
+
+import dataclasses
+import zlib
+from pathlib import Path
+from typing import Any, Callable, Iterable, Mapping
+
+from .db import DEFAULT_LEASE_SECONDS, EnqueueResult, Event, NewEvent, ProviderMapping, RoutingRule
+from .ai_cache import ProviderSignature, ShapeClassification
+from .circuit_breaker import CircuitBreaker
+from .handler_limits import HandlerLimit, PermitDecision
+from .queue_store import SqliteQueueStore
+
+
+PartitionKey = Callable[[str, "str | None", dict[str, Any]], str]
+
+
+def shard_paths(db_path: str, shards: int) -> list[str]:
+    """
+    `app/data/events.sqlite3` -> `app/data/events.shard-0.sqlite3`, `...shard-1.sqlite3`, ...
+    """
+    base = Path(db_path)
+    return [str(base.with_name(f"{base.stem}.shard-{i}{base.suffix}")) for i in range(shards)]
+
+
+def parse_shard_list(spec: str | None, shards: int) -> list[int] | None:
+    """
+    Parse a worker shard assignment like `0,2` or `0-3`. Empty means all shards (None).
+    """
+    if not spec or not spec.strip():
+        return None
+    picked: set[int] = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            lo, hi = part.split("-", 1)
+            picked.update(range(int(lo), int(hi) + 1))
+        else:
+            picked.add(int(part))
+    bad = sorted(i for i in picked if not 0 <= i < shards)
+    if bad:
+        raise ValueError(f"shard index out of range (queue has {shards} shards): {bad}")
+    return sorted(picked)
+
+
+def partition_key_fn(spec: str) -> PartitionKey:
+    """
+    Build the partition key function for `Settings.queue_shard_key`:
+
+    - `source` (default): all events from one source land on one shard (FIFO per source).
+    - `event_id`: spread one busy source across shards (falls back to `source` for events without an id).
+    - `payload.<dotted.path>`: a value from the payload, e.g. `payload.agent_name` or `payload.json.team_id`.
+    """
+    spec = (spec or "source").strip()
+    if spec == "source":
+        return lambda source, event_id, payload: source
+    if spec == "event_id":
+        return lambda source, event_id, payload: event_id if event_id is not None else source
+    if spec.startswith("payload."):
+        path = spec[len("payload.") :].split(".")
+
+        def _from_payload(source: str, event_id: str | None, payload: dict[str, Any]) -> str:
+            cur: Any = payload
+            for key in path:
+                if not isinstance(cur, dict) or key not in cur:
+                    return source
+                cur = cur[key]
+            return str(cur)
+
+        return _from_payload
+    raise ValueError(f"Unsupported queue_shard_key: {spec!r}")
+
+
+class ShardedQueueStore:
+    """
+    `QueueStore` that partitions events across several SQLite files so writers on different shards
+    never contend for the same lock.
+
+    Routing config (`provider_mappings`, `routing_rules`) stays in the base database. Each event and
+    its action runs live on one shard, chosen by a stable hash of the partition key. Row ids handed
+    out by this store are global: `local_id * shards + shard`. Every id-taking method works unchanged,
+    and an id can always be routed back to its shard.
+
+    `assigned` limits which shards `claim_events` and `reap_expired_leases` touch, so workers can
+    split the shards between them. Shard connections are opened on first use.
+    """
+
+    backend = "sqlite_sharded"
+
+    def __init__(
+        self,
+        control: SqliteQueueStore,
+        shard_opener: Callable[[str], SqliteQueueStore],
+        *,
+        paths: list[str],
+        assigned: list[int] | None = None,
+        partition_key: PartitionKey | None = None,
+    ) -> None:
+        if len(paths) < 2:
+            raise ValueError("ShardedQueueStore needs at least 2 shards")
+        self.control = control
+        self.paths = paths
+        self.assigned = list(range(len(paths))) if assigned is None else list(assigned)
+        self._open_shard = shard_opener
+        self._shards: dict[int, SqliteQueueStore] = {}
+        self._partition_key = partition_key or partition_key_fn("source")
+        self._next_claim = 0
+
+    @property
+    def shard_count(self) -> int:
+        return len(self.paths)
+
+    def shard(self, index: int) -> SqliteQueueStore:
+        store = self._shards.get(index)
+        if store is None:
+            store = self._shards[index] = self._open_shard(self.paths[index])
+        return store
+
+    def shard_for(self, *, source: str, event_id: str | None, payload: dict[str, Any]) -> int:
+        key = self._partition_key(source, event_id, payload)
+        return zlib.crc32(key.encode("utf-8")) % self.shard_count
+
+    # Global <-> local ids
+
+    def _global(self, index: int, local_id: int) -> int:
+        return int(local_id) * self.shard_count + index
+
+    def _split(self, global_id: int) -> tuple[int, int]:
+        return int(global_id) % self.shard_count, int(global_id) // self.shard_count
+
+    def _by_shard(self, global_ids: Iterable[int]) -> dict[int, list[int]]:
+        grouped: dict[int, list[int]] = {}
+        for gid in global_ids:
+            index, local_id = self._split(gid)
+            grouped.setdefault(index, []).append(local_id)
+        return grouped
+
+    def _event_out(self, index: int, event: Event) -> Event:
+        return dataclasses.replace(event, id=self._global(index, event.id))
+
+    def _row_out(self, index: int, row: dict[str, Any] | None, *id_keys: str) -> dict[str, Any] | None:
+        if row is None:
+            return None
+        for key in id_keys:
+            if row.get(key) is not None:
+                row[key] = self._global(index, row[key])
+        return row
+
+    # Lifecycle
+
+    def init(self) -> None:
+        self.control.init()
+        for index in range(self.shard_count):
+            self.shard(index).init()
+
+    def close(self) -> None:
+        for store in self._shards.values():
+            store.close()
+        self._shards.clear()
+        self.control.close()
+
+    # Queue
+
+    def enqueue_event(
+        self, *, source: str, event_id: str | None, payload: dict[str, Any], priority: int | None = None
+    ) -> int:
+        index = self.shard_for(source=source, event_id=event_id, payload=payload)
+        row_id = self.shard(index).enqueue_event(source=source, event_id=event_id, payload=payload, priority=priority)
+        return self._global(index, row_id)
+
+    def enqueue_events(self, items: Iterable[NewEvent]) -> list[EnqueueResult]:
+        items = list(items)
+        grouped: dict[int, list[int]] = {}
+        for pos, item in enumerate(items):
+            index = self.shard_for(source=item.source, event_id=item.event_id, payload=item.payload)
+            grouped.setdefault(index, []).append(pos)
+        results: list[EnqueueResult | None] = [None] * len(items)
+        for index, positions in grouped.items():
+            shard_results = self.shard(index).enqueue_events([items[p] for p in positions])
+            for pos, res in zip(positions, shard_results):
+                results[pos] = EnqueueResult(row_id=self._global(index, res.row_id), inserted=res.inserted)
+        return [r for r in results if r is not None]
+
+    def claim_events(
+        self,
+        *,
+        limit: int = 1,
+        lease_owner: str | None = None,
+        lease_seconds: float = DEFAULT_LEASE_SECONDS,
+        fair_weights: Mapping[str, float] | None = None,
+    ) -> list[Event]:
+        """
+        Claim up to `limit` events from the assigned shards, starting from a different shard each call.
+        Priority lanes and fair-share rotation apply within each shard.
+        """
+        claimed: list[Event] = []
+        if not self.assigned or limit <= 0:
+            return claimed
+        start = self._next_claim % len(self.assigned)
+        self._next_claim += 1
+        for index in self.assigned[start:] + self.assigned[:start]:
+            remaining = limit - len(claimed)
+            if remaining <= 0:
+                break
+            events = self.shard(index).claim_events(
+                limit=remaining, lease_owner=lease_owner, lease_seconds=lease_seconds, fair_weights=fair_weights
+            )
+            claimed.extend(self._event_out(index, e) for e in events)
+        return claimed
+
+    def next_ready_at(self) -> float | None:
+        times = [t for t in (self.shard(index).next_ready_at() for index in self.assigned) if t is not None]
+        return min(times) if times else None
+
+    def renew_leases(
+        self, *, event_ids: Iterable[int], lease_owner: str, lease_seconds: float = DEFAULT_LEASE_SECONDS
+    ) -> set[int]:
+        renewed: set[int] = set()
+        for index, local_ids in self._by_shard(event_ids).items():
+            kept = self.shard(index).renew_leases(
+                event_ids=local_ids, lease_owner=lease_owner, lease_seconds=lease_seconds
+            )
+            renewed.update(self._global(index, i) for i in kept)
+        return renewed
+
+    def release_events(self, *, event_ids: Iterable[int], lease_owner: str) -> int:
+        return sum(
+            self.shard(index).release_events(event_ids=local_ids, lease_owner=lease_owner)
+            for index, local_ids in self._by_shard(event_ids).items()
+        )
+
+    def reap_expired_leases(
+        self, *, max_attempts: int, stale_after_seconds: float = DEFAULT_LEASE_SECONDS, limit: int = 500
+    ) -> int:
+        return sum(
+            self.shard(index).reap_expired_leases(
+                max_attempts=max_attempts, stale_after_seconds=stale_after_seconds, limit=limit
+            )
+            for index in self.assigned
+        )
+
+    def mark_done(self, *, event_id: int, **kwargs: Any) -> bool:
+        index, local_id = self._split(event_id)
+        return self.shard(index).mark_done(event_id=local_id, **kwargs)
+
+    def mark_retry(self, *, event_id: int, **kwargs: Any) -> bool:
+        index, local_id = self._split(event_id)
+        return self.shard(index).mark_retry(event_id=local_id, **kwargs)
+
+    def mark_error(self, *, event_id: int, **kwargs: Any) -> bool:
+        index, local_id = self._split(event_id)
+        return self.shard(index).mark_error(event_id=local_id, **kwargs)
+
+    def defer_event(self, *, event_id: int, **kwargs: Any) -> bool:
+        index, local_id = self._split(event_id)
+        return self.shard(index).defer_event(event_id=local_id, **kwargs)
+
+    def get_event_row(self, *, event_row_id: int) -> dict[str, Any] | None:
+        index, local_id = self._split(event_row_id)
+        return self._row_out(index, self.shard(index).get_event_row(event_row_id=local_id), "id")
+
+    def get_queue_stats(self) -> dict[str, Any]:
+        """
+        Stats summed over every shard (not just the assigned ones).
+        """
+        by_source: dict[str, dict[str, int]] = {}
+        totals: dict[str, int] = {}
+        oldest: list[str] = []
+        for index in range(self.shard_count):
+            stats = self.shard(index).get_queue_stats()
+            for source, counts in stats["by_source"].items():
+                merged = by_source.setdefault(source, {})
+                for status, count in counts.items():
+                    merged[status] = merged.get(status, 0) + count
+            for status, count in stats["totals"].items():
+                totals[status] = totals.get(status, 0) + count
+            if stats["oldest_ready_received_at"] is not None:
+                oldest.append(stats["oldest_ready_received_at"])
+        return {"by_source": by_source, "totals": totals, "oldest_ready_received_at": min(oldest, default=None)}
+
+    # Dead letters (every shard)
+
+    def list_dead_letters(self, *, limit: int = 100, **filters: Any) -> list[dict[str, Any]]:
+        rows: list[dict[str, Any]] = []
+        for index in range(self.shard_count):
+            for row in self.shard(index).list_dead_letters(limit=limit, **filters):
+                rows.append(self._row_out(index, row, "event_row_id"))
+        rows.sort(key=lambda r: (r["dead_at"], r["event_row_id"]))
+        return rows[:limit]
+
+    def count_dead_letters(self, **filters: Any) -> int:
+        return sum(self.shard(index).count_dead_letters(**filters) for index in range(self.shard_count))
+
+    def requeue_dead_letters(self, *, event_ids: Iterable[int], reroute: bool = False) -> int:
+        return sum(
+            self.shard(index).requeue_dead_letters(event_ids=local_ids, reroute=reroute)
+            for index, local_ids in self._by_shard(event_ids).items()
+        )
+
+    # Route decisions (stored on the event's shard; the config version lives in the base database)
+
+    def save_route_decision(self, *, event_row_id: int, **kwargs: Any) -> None:
+        index, local_id = self._split(event_row_id)
+        self.shard(index).save_route_decision(event_row_id=local_id, **kwargs)
+
+    def get_route_decision(self, *, event_row_id: int) -> dict[str, Any] | None:
+        index, local_id = self._split(event_row_id)
+        return self.shard(index).get_route_decision(event_row_id=local_id)
+
+    def get_config_version(self) -> int | None:
+        return self.control.get_config_version()
+
+    def set_config_version(self, **kwargs: Any) -> None:
+        self.control.set_config_version(**kwargs)
+
+    def lookup_shape_classification(self, **kwargs: Any) -> ShapeClassification | None:
+        return self.control.lookup_shape_classification(**kwargs)
+
+    def save_shape_classification(self, **kwargs: Any) -> ShapeClassification:
+        return self.control.save_shape_classification(**kwargs)
+
+    def claim_shape_verification(self, **kwargs: Any) -> bool:
+        return self.control.claim_shape_verification(**kwargs)
+
+    def list_shape_classifications(self, **kwargs: Any) -> list[ShapeClassification]:
+        return self.control.list_shape_classifications(**kwargs)
+
+    def shape_cache_stats(self) -> dict[str, int]:
+        return self.control.shape_cache_stats()
+
+    def add_provider_signature(self, **kwargs: Any) -> bool:
+        return self.control.add_provider_signature(**kwargs)
+
+    def list_provider_signatures(self, **kwargs: Any) -> list[ProviderSignature]:
+        return self.control.list_provider_signatures(**kwargs)
+
+    def set_provider_signature_status(self, **kwargs: Any) -> bool:
+        return self.control.set_provider_signature_status(**kwargs)
+
+    def get_provider_signatures_revision(self) -> str | None:
+        return self.control.get_provider_signatures_revision()
+
+    # Action runs (stored on the event's shard)
+
+    def create_action_run(self, *, event_row_id: int, **kwargs: Any) -> int:
+        index, local_id = self._split(event_row_id)
+        return self._global(index, self.shard(index).create_action_run(event_row_id=local_id, **kwargs))
+
+    def get_action_run(self, *, run_id: int) -> dict[str, Any] | None:
+        index, local_id = self._split(run_id)
+        return self._row_out(index, self.shard(index).get_action_run(run_id=local_id), "id", "event_row_id")
+
+    def get_action_run_for_event_action(self, *, event_row_id: int, action: str) -> dict[str, Any] | None:
+        index, local_id = self._split(event_row_id)
+        row = self.shard(index).get_action_run_for_event_action(event_row_id=local_id, action=action)
+        return self._row_out(index, row, "id", "event_row_id")
+
+    def restart_action_run(self, *, run_id: int) -> None:
+        index, local_id = self._split(run_id)
+        self.shard(index).restart_action_run(run_id=local_id)
+
+    def finish_action_run(self, *, run_id: int, **kwargs: Any) -> None:
+        index, local_id = self._split(run_id)
+        self.shard(index).finish_action_run(run_id=local_id, **kwargs)
+
+    def list_action_runs_for_event(self, *, event_row_id: int, limit: int = 20) -> list[dict[str, Any]]:
+        index, local_id = self._split(event_row_id)
+        rows = self.shard(index).list_action_runs_for_event(event_row_id=local_id, limit=limit)
+        return [self._row_out(index, r, "id", "event_row_id") for r in rows]
+
+    # Routing config (base database)
+
+    def upsert_provider_mapping(self, **kwargs: Any) -> None:
+        self.control.upsert_provider_mapping(**kwargs)
+
+    def get_provider_mapping(self, **kwargs: Any) -> ProviderMapping | None:
+        return self.control.get_provider_mapping(**kwargs)
+
+    def upsert_routing_rule(self, **kwargs: Any) -> None:
+        self.control.upsert_routing_rule(**kwargs)
+
+    def list_routing_rules(self, **kwargs: Any) -> list[RoutingRule]:
+        return self.control.list_routing_rules(**kwargs)
+
+    def get_routing_rules_revision(self) -> str | None:
+        return self.control.get_routing_rules_revision()
+
+    # Handler limits (base database, keyed by global event ids so every shard shares one budget)
+
+    def upsert_handler_limit(self, **kwargs: Any) -> None:
+        self.control.upsert_handler_limit(**kwargs)
+
+    def list_handler_limits(self) -> list[HandlerLimit]:
+        return self.control.list_handler_limits()
+
+    def acquire_handler_permit(self, **kwargs: Any) -> PermitDecision | None:
+        return self.control.acquire_handler_permit(**kwargs)
+
+    def renew_handler_permits(self, **kwargs: Any) -> int:
+        return self.control.renew_handler_permits(**kwargs)
+
+    def release_handler_permits(self, **kwargs: Any) -> None:
+        self.control.release_handler_permits(**kwargs)
+
+    # Circuit breakers (base database)
+
+    def list_circuit_breakers(self) -> list[CircuitBreaker]:
+        return self.control.list_circuit_breakers()
+
+    def check_circuit(self, **kwargs: Any) -> float | None:
+        return self.control.check_circuit(**kwargs)
+
+    def record_circuit_result(self, **kwargs: Any) -> CircuitBreaker | None:
+        return self.control.record_circuit_result(**kwargs)
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import json
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from .notify import open_wakeup_channel
+from .worker import run_worker_pool
+
+
+HEARTBEAT_INTERVAL = 1.0
+# A child that stays up this long is considered healthy again: its next crash restarts without backoff.
+STABLE_AFTER_SECONDS = 60.0
+
+
+@dataclass
+class ChildState:
+    slot: int
+    process: Any = None
+    started_at: float = 0.0
+    restarts: int = 0
+    last_exit: int | None = None
+    restart_at: float = 0.0
+    backoff: float = 0.0
+
+
+def _child_main(slot: int, heartbeats: Any, worker_kwargs: dict[str, Any], concurrency: int) -> None:
+    """
+    Body of one worker process: a `run_worker_pool` that drains on SIGTERM, plus a heartbeat thread.
+    """
+    stop = threading.Event()
+    wakeup = open_wakeup_channel()
+
+    def drain(signum: int, frame: Any) -> None:
+        stop.set()
+        if wakeup is not None:
+            wakeup.notify()
+
+    signal.signal(signal.SIGTERM, drain)
+    # Ctrl-C reaches the whole process group; the supervisor turns it into SIGTERM.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    def beat() -> None:
+        while not stop.is_set():
+            heartbeats[slot] = time.time()
+            stop.wait(HEARTBEAT_INTERVAL)
+
+    heartbeats[slot] = time.time()
+    threading.Thread(target=beat, daemon=True, name="supervisor-heartbeat").start()
+    kwargs = dict(worker_kwargs)
+    if slot != 0:
+        kwargs["retention_interval"] = 0.0
+    run_worker_pool(concurrency=concurrency, stop_event=stop, wakeup=wakeup, **kwargs)
+
+
+class WorkerSupervisor:
+    """
+    Runs `processes` worker processes and keeps them running.
+
+    - A child that exits or crashes (including native crashes in handler code) is restarted, with
+      exponential backoff from `backoff_base` to `backoff_max` while it keeps failing fast.
+    - Each child heartbeats through shared memory; one silent for `liveness_timeout` seconds (a hung
+      interpreter) is killed and restarted.
+    - `stop()` (SIGTERM or Ctrl-C under `run()`) drains: children get SIGTERM, stop claiming, hand back
+      unstarted events, finish the event in hand and exit. Stragglers are killed after `drain_timeout`.
+    - `status()` reports per-child liveness; with `status_path` it is also written there as JSON every
+      second, for container health checks.
+    """
+
+    def __init__(
+        self,
+        *,
+        processes: int,
+        worker_kwargs: dict[str, Any],
+        concurrency: int = 1,
+        liveness_timeout: float = 60.0,
+        drain_timeout: float = 120.0,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        status_path: str | None = None,
+    ) -> None:
+        self.processes = max(1, processes)
+        self.worker_kwargs = worker_kwargs
+        self.concurrency = concurrency
+        self.liveness_timeout = liveness_timeout
+        self.drain_timeout = drain_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.status_path = Path(status_path) if status_path else None
+        self._ctx = multiprocessing.get_context("fork")
+        self._heartbeats = self._ctx.Array("d", self.processes, lock=False)
+        self._children = [ChildState(slot=i) for i in range(self.processes)]
+        self._stop = threading.Event()
+        self._draining = False
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def status(self) -> dict[str, Any]:
+        now = time.time()
+        children = []
+        for child in self._children:
+            proc = child.process
+            alive = proc is not None and proc.is_alive()
+            beat = self._heartbeats[child.slot]
+            children.append(
+                {
+                    "slot": child.slot,
+                    "pid": proc.pid if proc is not None else None,
+                    "alive": alive,
+                    "heartbeat_age": round(now - beat, 1) if alive and beat else None,
+                    "uptime": round(now - child.started_at, 1) if alive else None,
+                    "restarts": child.restarts,
+                    "last_exit": child.last_exit,
+                }
+            )
+        return {"supervisor_pid": os.getpid(), "draining": self._draining, "children": children}
+
+    def run(self) -> None:
+        """
+        Supervise until `stop()` (or SIGTERM/SIGINT when called from the main thread), then drain.
+        """
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+            signal.signal(signal.SIGINT, lambda signum, frame: self.stop())
+
+        for child in self._children:
+            self._start(child)
+        last_status = 0.0
+        while not self._stop.wait(0.2):
+            now = time.time()
+            for child in self._children:
+                self._check(child, now)
+            if now - last_status >= 1.0:
+                self._write_status()
+                last_status = now
+        self._drain()
+
+    def _start(self, child: ChildState) -> None:
+        self._heartbeats[child.slot] = 0.0
+        proc = self._ctx.Process(
+            target=_child_main,
+            args=(child.slot, self._heartbeats, self.worker_kwargs, self.concurrency),
+            name=f"worker-proc-{child.slot}",
+        )
+        proc.start()
+        child.process = proc
+        child.started_at = time.time()
+        print(f"[supervisor] started slot={child.slot} pid={proc.pid}")
+
+    def _check(self, child: ChildState, now: float) -> None:
+        proc = child.process
+        if proc is None:
+            if now >= child.restart_at:
+                child.restarts += 1
+                self._start(child)
+            return
+
+        if proc.is_alive():
+            beat = self._heartbeats[child.slot]
+            if beat and now - beat > self.liveness_timeout:
+                print(f"[supervisor] slot={child.slot} pid={proc.pid} silent for {now - beat:.0f}s; killing")
+                proc.kill()
+                proc.join(5)
+            else:
+                return
+
+        proc.join(0)
+        child.last_exit = proc.exitcode
+        child.process = None
+        if now - child.started_at >= STABLE_AFTER_SECONDS:
+            child.backoff = 0.0
+        child.backoff = min(self.backoff_max, child.backoff * 2 if child.backoff else self.backoff_base)
+        child.restart_at = now + child.backoff
+        print(
+            f"[supervisor] slot={child.slot} pid={proc.pid} exited code={proc.exitcode}; "
+            f"restarting in {child.backoff:.0f}s"
+        )
+
+    def _drain(self) -> None:
+        self._draining = True
+        running = [c.process for c in self._children if c.process is not None and c.process.is_alive()]
+        print(f"[supervisor] draining {len(running)} worker process(es)")
+        for proc in running:
+            proc.terminate()
+        deadline = time.monotonic() + self.drain_timeout
+        for proc in running:
+            proc.join(max(0.0, deadline - time.monotonic()))
+            if proc.is_alive():
+                print(f"[supervisor] pid={proc.pid} did not drain in {self.drain_timeout:.0f}s; killing")
+                proc.kill()
+                proc.join(5)
+        for child in self._children:
+            if child.process is not None:
+                child.last_exit = child.process.exitcode
+        self._write_status()
+
+    def _write_status(self) -> None:
+        if self.status_path is None:
+            return
+        tmp = self.status_path.with_suffix(self.status_path.suffix + ".tmp")
+        tmp.parent.mkdir(parents=True, exist_ok=True)
+        tmp.write_text(json.dumps(self.status(), indent=2), encoding="utf-8")
+        tmp.replace(self.status_path)
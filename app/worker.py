@@ -1,13 +1,20 @@
 from __future__ import annotations
 
 import argparse
+import os
+import socket
 import threading
 import time
 import traceback
 from datetime import datetime, timedelta, timezone
+from typing import Any
 
-from .db import claim_next_event, init_db, mark_done, mark_error, mark_retry, open_db
-from .processor import process_event
+from .db import Event, retry_backoff_seconds
+from .fair_share import parse_weights
+from .processor import HandlerDeferred, process_event
+from .notify import WakeupChannel, WakeupListener, open_wakeup_channel
+from .queue_store import QueueStore, open_queue_store
+from .retention import start_store_retention
 from .settings import get_settings
 
 
@@ -19,8 +26,164 @@ def _utc_now() -> datetime:
 
 
 def _next_attempt_time(attempt_count: int) -> str:
-    delay_seconds = min(60, 2 ** min(attempt_count, 6))
-    return (_utc_now() + timedelta(seconds=delay_seconds)).isoformat()
+    return (_utc_now() + timedelta(seconds=retry_backoff_seconds(attempt_count))).isoformat()
+
+
+def default_lease_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+class LeaseHeartbeat:
+    """
+    Background thread that keeps renewing the leases of events this worker holds.
+
+    Uses its own store connection so renewals never wait on the handler that is running.
+    """
+
+    def __init__(self, *, db_path: str, lease_owner: str, lease_seconds: float, shards: str | None = None) -> None:
+        self._db_path = db_path
+        self._shards = shards
+        self._lease_owner = lease_owner
+        self._lease_seconds = lease_seconds
+        self._held: set[int] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, daemon=True, name="lease-heartbeat")
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def hold(self, event_ids: list[int]) -> None:
+        with self._lock:
+            self._held.update(event_ids)
+
+    def drop(self, event_id: int) -> None:
+        with self._lock:
+            self._held.discard(event_id)
+
+    def _run(self) -> None:
+        store = open_queue_store(db_path=self._db_path, shards=self._shards)
+        try:
+            interval = max(1.0, self._lease_seconds / 3)
+            while not self._stop.wait(interval):
+                with self._lock:
+                    held = list(self._held)
+                if not held:
+                    continue
+                try:
+                    renewed = store.renew_leases(
+                        event_ids=held, lease_owner=self._lease_owner, lease_seconds=self._lease_seconds
+                    )
+                except Exception as e:
+                    print(f"[lease] renew failed: {type(e).__name__}: {e}")
+                    continue
+                for lost in set(held) - renewed:
+                    print(f"[lease] lost lease on id={lost}")
+                    self.drop(lost)
+                if renewed:
+                    try:
+                        store.renew_handler_permits(event_ids=renewed, lease_seconds=self._lease_seconds)
+                    except Exception as e:
+                        print(f"[lease] permit renew failed: {type(e).__name__}: {e}")
+        finally:
+            store.close()
+
+
+def _handle_event(store: QueueStore, event: Event, *, max_attempts: int, lease_owner: str | None = None) -> None:
+    try:
+        result = process_event(store, event)
+        _record_success(store, event, result, lease_owner=lease_owner)
+    except HandlerDeferred as deferred:
+        _record_deferral(store, event, deferred, lease_owner=lease_owner)
+    except Exception as e:
+        err = f"{type(e).__name__}: {e}\n{traceback.format_exc(limit=5)}"
+        _record_failure(store, event, err, max_attempts=max_attempts, lease_owner=lease_owner)
+
+
+def _record_success(store: QueueStore, event: Event, result: dict, *, lease_owner: str | None) -> None:
+    if store.mark_done(event_id=event.id, result=result, lease_owner=lease_owner):
+        print(f"[done] id={event.id} source={event.source} event_id={event.event_id}")
+    else:
+        print(f"[lease-lost] id={event.id} source={event.source} result discarded")
+
+
+def _record_deferral(store: QueueStore, event: Event, deferred: HandlerDeferred, *, lease_owner: str | None) -> None:
+    # Backpressure, not a failure: the attempt count is left alone.
+    if not store.defer_event(event_id=event.id, retry_epoch=deferred.retry_epoch, lease_owner=lease_owner):
+        print(f"[lease-lost] id={event.id} source={event.source} deferral discarded")
+        return
+    wait = max(0.0, deferred.retry_epoch - time.time())
+    print(f"[deferred] id={event.id} source={event.source} {deferred.reason}={deferred.key} retry_in={wait:.1f}s")
+
+
+def _record_failure(store: QueueStore, event: Event, err: str, *, max_attempts: int, lease_owner: str | None) -> None:
+    new_attempt_count = event.attempt_count + 1
+    if new_attempt_count >= max_attempts:
+        if not store.mark_error(event_id=event.id, attempt_count=new_attempt_count, error=err, lease_owner=lease_owner):
+            print(f"[lease-lost] id={event.id} source={event.source} error discarded")
+            return
+        print(f"[error] id={event.id} source={event.source} attempts={new_attempt_count}")
+    else:
+        next_attempt_at = _next_attempt_time(new_attempt_count)
+        if not store.mark_retry(
+            event_id=event.id,
+            attempt_count=new_attempt_count,
+            next_attempt_at=next_attempt_at,
+            error=err,
+            lease_owner=lease_owner,
+        ):
+            print(f"[lease-lost] id={event.id} source={event.source} retry discarded")
+            return
+        print(f"[retry] id={event.id} source={event.source} attempts={new_attempt_count} next={next_attempt_at}")
+
+
+def claim_weights(claim_mode: str | None, fair_weights: str | None) -> dict[str, float] | None:
+    """
+    `fair_weights` for `claim_events`: None in fifo mode, else the parsed per-source weights.
+    Unset arguments fall back to `WORKER_CLAIM_MODE` / `WORKER_FAIR_WEIGHTS`.
+    """
+    settings = get_settings()
+    claim_mode = (claim_mode or settings.worker_claim_mode or "fifo").lower()
+    if claim_mode not in {"fifo", "fair"}:
+        raise ValueError(f"unknown claim mode {claim_mode!r} (expected fifo or fair)")
+    if claim_mode == "fifo":
+        return None
+    return parse_weights(settings.worker_fair_weights if fair_weights is None else fair_weights)
+
+
+def _idle_wait(
+    store: QueueStore,
+    listener: WakeupListener | None,
+    *,
+    poll_interval: float,
+    idle_timeout: float,
+    reap_due_in: float,
+    stop_event: threading.Event | None = None,
+) -> None:
+    """
+    Sleep until there may be work: a wakeup notification, the earliest scheduled retry, or the next reaper pass.
+
+    Without a wakeup channel this falls back to polling every `poll_interval` seconds (cut short by `stop_event`).
+    """
+    timeout = idle_timeout if listener is not None else poll_interval
+    ready_at = store.next_ready_at()
+    if ready_at is not None:
+        timeout = min(timeout, ready_at - time.time())
+    # Floor keeps a worker that lost a race for the same event from spinning.
+    timeout = max(0.05, min(timeout, reap_due_in))
+    if listener is None:
+        if stop_event is not None:
+            stop_event.wait(timeout)
+        else:
+            time.sleep(timeout)
+    else:
+        listener.wait(timeout)
 
 
 def run_worker(
@@ -29,46 +192,155 @@ def run_worker(
     poll_interval: float = 1.0,
     run_once: bool = False,
     max_attempts: int = 8,
+    batch_size: int = 1,
+    lease_seconds: float = 120.0,
+    reap_interval: float = 30.0,
+    lease_owner: str | None = None,
+    retention_interval: float = 0.0,
+    shards: str | None = None,
+    wakeup: WakeupChannel | None = None,
+    idle_timeout: float = 30.0,
     stop_event: threading.Event | None = None,
+    claim_mode: str | None = None,
+    fair_weights: str | None = None,
 ) -> None:
-    conn = open_db(db_path)
-    init_db(conn)
+    """
+    Claim and process events until `stop_event` is set (or the queue is empty, with `run_once`).
 
-    while True:
-        if stop_event is not None and stop_event.is_set():
-            return
+    With a `wakeup` channel (default: `open_wakeup_channel()`), an idle worker blocks until an enqueue
+    notifies it or the earliest retry comes due, with `idle_timeout` as a safety net; otherwise it
+    polls every `poll_interval` seconds. Whoever sets `stop_event` should also notify the channel.
+
+    `claim_mode` "fair" (default: `WORKER_CLAIM_MODE`) shares claims between sources by weighted
+    round-robin, using `fair_weights` (default: `WORKER_FAIR_WEIGHTS`, e.g. "stripe=3,cron=0.5").
+    """
+    weights = claim_weights(claim_mode, fair_weights)
+    store = open_queue_store(db_path=db_path, shards=shards)
+    store.init()
+    wakeup = wakeup or open_wakeup_channel()
+    listener = wakeup.listen() if wakeup is not None and not run_once else None
+
+    retention_stop = threading.Event()
+    if retention_interval > 0 and not run_once:
+        start_store_retention(
+            backend=store.backend, db_path=db_path, shards=shards, interval=retention_interval, stop_event=retention_stop
+        )
+
+    owner = lease_owner or default_lease_owner()
+    heartbeat = LeaseHeartbeat(db_path=db_path, lease_owner=owner, lease_seconds=lease_seconds, shards=shards)
+    heartbeat.start()
+    last_reap = 0.0
+
+    try:
+        while True:
+            if stop_event is not None and stop_event.is_set():
+                return
+
+            if time.monotonic() - last_reap >= reap_interval:
+                reaped = store.reap_expired_leases(max_attempts=max_attempts, stale_after_seconds=lease_seconds)
+                if reaped:
+                    print(f"[reaper] re-queued {reaped} event(s) with expired leases")
+                last_reap = time.monotonic()
+
+            # Claim a whole batch in one write transaction, then drain it before polling again.
+            events = store.claim_events(
+                limit=max(1, batch_size), lease_owner=owner, lease_seconds=lease_seconds, fair_weights=weights
+            )
+            if not events:
+                if run_once:
+                    return
+                _idle_wait(
+                    store,
+                    listener,
+                    poll_interval=poll_interval,
+                    idle_timeout=idle_timeout,
+                    reap_due_in=reap_interval - (time.monotonic() - last_reap),
+                    stop_event=stop_event,
+                )
+                continue
+
+            heartbeat.hold([e.id for e in events])
+            for i, event in enumerate(events):
+                if stop_event is not None and stop_event.is_set():
+                    # Hand unstarted events back instead of waiting for their leases to expire.
+                    store.release_events(event_ids=[e.id for e in events[i:]], lease_owner=owner)
+                    return
+                try:
+                    _handle_event(store, event, max_attempts=max_attempts, lease_owner=owner)
+                finally:
+                    heartbeat.drop(event.id)
 
-        event = claim_next_event(conn)
-        if event is None:
             if run_once:
                 return
-            time.sleep(poll_interval)
-            continue
+    finally:
+        retention_stop.set()
+        heartbeat.stop()
+        if listener is not None:
+            listener.close()
+        store.close()
 
-        try:
-            result = process_event(conn, event)
-            mark_done(conn, event_id=event.id, result=result)
-            print(f"[done] id={event.id} source={event.source} event_id={event.event_id}")
-        except Exception as e:
-            new_attempt_count = event.attempt_count + 1
-            err = f"{type(e).__name__}: {e}\n{traceback.format_exc(limit=5)}"
-
-            if new_attempt_count >= max_attempts:
-                mark_error(conn, event_id=event.id, attempt_count=new_attempt_count, error=err)
-                print(f"[error] id={event.id} source={event.source} attempts={new_attempt_count}")
-            else:
-                next_attempt_at = _next_attempt_time(new_attempt_count)
-                mark_retry(
-                    conn,
-                    event_id=event.id,
-                    attempt_count=new_attempt_count,
-                    next_attempt_at=next_attempt_at,
-                    error=err,
+
+def run_worker_pool(
+    *,
+    concurrency: int,
+    stop_event: threading.Event | None = None,
+    wakeup: WakeupChannel | None = None,
+    retention_interval: float = 0.0,
+    run_once: bool = False,
+    **worker_kwargs: Any,
+) -> None:
+    """
+    Run `concurrency` independent `run_worker` loops on threads, so one slow (I/O-bound) handler
+    does not hold up the queue.
+
+    Each thread opens its own store connection, lease owner and lease heartbeat, and claims on its
+    own. Threads claim one event at a time whatever `batch_size` says: a thread holding a claimed
+    batch would run it serially while idle threads find the queue empty. All of them stop when
+    `stop_event` is set; whoever sets it should also notify `wakeup`. Retention runs on the first
+    thread only. A thread whose loop crashes is restarted after a short backoff. Returns once every
+    thread has exited.
+    """
+    if concurrency <= 1:
+        run_worker(
+            stop_event=stop_event, wakeup=wakeup, retention_interval=retention_interval, run_once=run_once, **worker_kwargs
+        )
+        return
+
+    stop_event = stop_event or threading.Event()
+    worker_kwargs = {**worker_kwargs, "batch_size": 1}
+
+    def member(index: int) -> None:
+        backoff = 1.0
+        while not stop_event.is_set():
+            try:
+                run_worker(
+                    stop_event=stop_event,
+                    wakeup=wakeup,
+                    retention_interval=retention_interval if index == 0 else 0.0,
+                    run_once=run_once,
+                    **worker_kwargs,
                 )
-                print(f"[retry] id={event.id} source={event.source} attempts={new_attempt_count} next={next_attempt_at}")
+                return
+            except Exception as e:
+                print(f"[pool] worker-{index} crashed: {type(e).__name__}: {e}; restarting in {backoff:.0f}s")
+                stop_event.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
 
-        if run_once:
-            return
+    threads = [
+        threading.Thread(target=member, args=(i,), daemon=True, name=f"worker-{i}") for i in range(concurrency)
+    ]
+    for t in threads:
+        t.start()
+    try:
+        for t in threads:
+            while t.is_alive():
+                t.join(0.5)
+    except KeyboardInterrupt:
+        stop_event.set()
+        if wakeup is not None:
+            wakeup.notify()
+        for t in threads:
+            t.join()
 
 
 def main() -> None:
@@ -77,14 +349,107 @@ def main() -> None:
     parser.add_argument("--poll-interval", type=float, default=1.0)
     parser.add_argument("--run-once", action="store_true")
     parser.add_argument("--max-attempts", type=int, default=8)
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=get_settings().worker_batch_size,
+        help="Max events claimed per transaction (drained before the next poll).",
+    )
+    parser.add_argument("--lease-seconds", type=float, default=get_settings().worker_lease_seconds)
+    parser.add_argument(
+        "--retention-interval",
+        type=float,
+        default=get_settings().retention_interval_seconds,
+        help="Seconds between background retention passes (0 disables; see app/retention.py).",
+    )
+    parser.add_argument(
+        "--shards",
+        default=None,
+        help="Shards to claim from when QUEUE_SHARDS > 1, e.g. 0,2 or 0-3 (default: WORKER_SHARDS, else all).",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=get_settings().worker_idle_timeout,
+        help="Max seconds an idle worker blocks when WORKER_WAKEUP_DIR is set (enqueues wake it sooner).",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=get_settings().worker_concurrency,
+        help="Worker threads, each with its own connection, claiming and processing independently.",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["thread", "async"],
+        default=get_settings().worker_engine,
+        help="async: one asyncio loop awaiting up to --max-in-flight handlers (asyncio subprocesses, async SDK).",
+    )
+    parser.add_argument("--max-in-flight", type=int, default=get_settings().worker_max_in_flight)
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=get_settings().worker_processes,
+        help="Run a supervisor with this many worker processes (restarted on crash, drained on SIGTERM).",
+    )
+    parser.add_argument(
+        "--status-file",
+        default=get_settings().worker_status_path or None,
+        help="With --processes > 1: write per-child liveness JSON here every second.",
+    )
+    parser.add_argument(
+        "--claim-mode",
+        choices=["fifo", "fair"],
+        default=None,
+        help="fifo: priority, then oldest first; fair: weighted round-robin across sources (default: WORKER_CLAIM_MODE).",
+    )
+    parser.add_argument(
+        "--fair-weights", default=None, help='Per-source weights for --claim-mode fair, e.g. "stripe=3,cron=0.5".'
+    )
     args = parser.parse_args()
+    if args.processes > 1 and args.run_once:
+        parser.error("--run-once cannot be combined with --processes")
+    if args.engine == "async" and args.processes > 1:
+        parser.error("--engine async runs in one process; use --max-in-flight instead of --processes")
 
-    run_worker(
-        db_path=args.db,
-        poll_interval=args.poll_interval,
-        run_once=args.run_once,
-        max_attempts=args.max_attempts,
-    )
+    worker_kwargs = {
+        "db_path": args.db,
+        "poll_interval": args.poll_interval,
+        "max_attempts": args.max_attempts,
+        "batch_size": args.batch_size,
+        "lease_seconds": args.lease_seconds,
+        "retention_interval": args.retention_interval,
+        "shards": args.shards,
+        "idle_timeout": args.idle_timeout,
+        "claim_mode": args.claim_mode,
+        "fair_weights": args.fair_weights,
+    }
+    if args.engine == "async":
+        from .async_worker import run_async_worker_until_signalled
+
+        run_async_worker_until_signalled(
+            max_in_flight=args.max_in_flight,
+            db_threads=get_settings().worker_db_threads,
+            route_threads=get_settings().worker_route_threads,
+            run_once=args.run_once,
+            **worker_kwargs,
+        )
+        return
+
+    if args.processes > 1:
+        from .supervisor import WorkerSupervisor
+
+        WorkerSupervisor(
+            processes=args.processes,
+            concurrency=args.concurrency,
+            worker_kwargs=worker_kwargs,
+            liveness_timeout=get_settings().worker_liveness_timeout,
+            drain_timeout=args.lease_seconds,
+            status_path=args.status_file,
+        ).run()
+        return
+
+    run_worker_pool(concurrency=args.concurrency, run_once=args.run_once, **worker_kwargs)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Benchmark event claim latency as the `events` history grows.
+
+For each history size, builds a fresh SQLite queue with that many finished (`done`) events plus a
+small ready backlog, then times `claim_events` (served from `ready_queue`) against the legacy claim
+that read `events` directly. Both paths claim `--batch-size` events per call in one write transaction
+(pick, then mark `processing` under a lease), and every claimed event is put straight back, untimed,
+so both run against the same `--ready` queue depth.
+
+Examples:
+  python3 scripts/bench_claim_latency.py
+  python3 scripts/bench_claim_latency.py --sizes 10000,1000000 --ready 1000 --claims 500 --batch-size 1
+  python3 scripts/bench_claim_latency.py --sizes 10000000 --db-dir /mnt/scratch
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Iterator
+
+
+def _repo_root() -> Path:
+    return Path(__file__).resolve().parents[1]
+
+
+sys.path.insert(0, str(_repo_root()))
+
+from app.db import claim_events, init_db, mark_retry, open_db, utc_now_iso  # noqa: E402
+
+
+LEGACY_CLAIM_SQL = """
+UPDATE events
+SET status='processing', processing_started_at=?, lease_owner=?, lease_expires_at=?
+WHERE id IN (
+  SELECT id
+  FROM events
+  WHERE status IN ('pending', 'retry') AND next_attempt_at <= ?
+  ORDER BY received_at ASC
+  LIMIT ?
+)
+RETURNING id, source, event_id, received_at, status, attempt_count, next_attempt_at, payload_json
+"""
+
+
+def _legacy_claim(conn, *, limit: int, lease_owner: str) -> list[int]:
+    now = utc_now_iso()
+    conn.execute("BEGIN IMMEDIATE;")
+    try:
+        rows = conn.execute(LEGACY_CLAIM_SQL, (now, lease_owner, now, now, limit)).fetchall()
+        conn.execute("COMMIT;")
+    except Exception:
+        conn.execute("ROLLBACK;")
+        raise
+    return [int(r["id"]) for r in rows]
+
+
+def _claim(conn, *, limit: int, lease_owner: str) -> list[int]:
+    return [e.id for e in claim_events(conn, limit=limit, lease_owner=lease_owner)]
+
+
+def _history_rows(count: int, payload_json: str) -> Iterator[tuple[str, str, str, str]]:
+    start = datetime.now(timezone.utc).replace(microsecond=0) - timedelta(days=365)
+    for i in range(count):
+        ts = (start + timedelta(seconds=i % 31_000_000)).isoformat()
+        yield (f"hist_{i}", ts, ts, payload_json)
+
+
+def _populate(conn, *, history: int, ready: int, payload_bytes: int) -> None:
+    payload_json = json.dumps({"pad": "x" * max(0, payload_bytes - 12)}, separators=(",", ":"))
+    conn.execute("PRAGMA synchronous=OFF;")
+    conn.execute("BEGIN;")
+    conn.executemany(
+        """
+        INSERT INTO events (source, event_id, received_at, status, next_attempt_at, processed_at, payload_json, result_json)
+        VALUES ('bench', ?, ?, 'done', ?, NULL, ?, '{}')
+        """,
+        _history_rows(history, payload_json),
+    )
+    now = utc_now_iso()
+    conn.executemany(
+        """
+        INSERT INTO events (source, event_id, received_at, status, next_attempt_at, payload_json)
+        VALUES ('bench', ?, ?, 'pending', ?, ?)
+        """,
+        ((f"ready_{i}", now, now, payload_json) for i in range(ready)),
+    )
+    conn.execute("COMMIT;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("ANALYZE;")
+
+
+def _percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def _bench_size(
+    db_dir: str, *, history: int, ready: int, claims: int, batch_size: int, payload_bytes: int
+) -> dict[str, float]:
+    db_path = str(Path(db_dir) / f"bench_{history}.sqlite3")
+    conn = open_db(db_path)
+    try:
+        init_db(conn)
+        t0 = time.perf_counter()
+        _populate(conn, history=history, ready=ready, payload_bytes=payload_bytes)
+        load_s = time.perf_counter() - t0
+
+        def timed(claim: Callable[..., list[int]]) -> list[float]:
+            samples: list[float] = []
+            for _ in range(claims):
+                t = time.perf_counter()
+                ids = claim(conn, limit=batch_size, lease_owner="bench")
+                samples.append((time.perf_counter() - t) * 1000)
+                # Put the events straight back so the ready backlog stays constant.
+                for event_id in ids:
+                    mark_retry(conn, event_id=event_id, attempt_count=0, next_attempt_at=utc_now_iso(), error="bench")
+            return samples
+
+        claim_ms = timed(_claim)
+        legacy_ms = timed(_legacy_claim)
+    finally:
+        conn.close()
+        for suffix in ("", "-wal", "-shm"):
+            Path(db_path + suffix).unlink(missing_ok=True)
+
+    return {
+        "load_s": load_s,
+        "claim_p50_ms": statistics.median(claim_ms),
+        "claim_p99_ms": _percentile(claim_ms, 99),
+        "legacy_p50_ms": statistics.median(legacy_ms),
+        "legacy_p99_ms": _percentile(legacy_ms, 99),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark claim latency vs. events history size.")
+    parser.add_argument("--sizes", default="10000,1000000,10000000", help="Comma-separated history row counts.")
+    parser.add_argument("--ready", type=int, default=1000, help="Ready (pending) events kept in the queue.")
+    parser.add_argument("--claims", type=int, default=500, help="Claims timed per size and claim path.")
+    parser.add_argument("--batch-size", type=int, default=10, help="Events per claim, as WORKER_BATCH_SIZE.")
+    parser.add_argument("--payload-bytes", type=int, default=256)
+    parser.add_argument("--db-dir", default=None, help="Directory for the scratch databases (default: temp dir).")
+    args = parser.parse_args()
+
+    sizes = [int(x) for x in args.sizes.split(",") if x.strip()]
+    with tempfile.TemporaryDirectory(dir=args.db_dir) as td:
+        print(f"{'history':>12} {'load_s':>8} {'claim_p50':>10} {'claim_p99':>10} {'legacy_p50':>11} {'legacy_p99':>11}")
+        for size in sizes:
+            r = _bench_size(
+                td,
+                history=size,
+                ready=args.ready,
+                claims=args.claims,
+                batch_size=args.batch_size,
+                payload_bytes=args.payload_bytes,
+            )
+            print(
+                f"{size:>12,} {r['load_s']:>8.1f} {r['claim_p50_ms']:>8.3f}ms {r['claim_p99_ms']:>8.3f}ms "
+                f"{r['legacy_p50_ms']:>9.3f}ms {r['legacy_p99_ms']:>9.3f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
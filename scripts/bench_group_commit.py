@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Benchmark `mark_done` throughput with and without the group-commit writer.
+
+Enqueues and claims a backlog, then has N threads finish the events concurrently: either each
+thread committing on its own connection, or all of them submitting through one
+`GroupCommitWriter` and waiting for their batch to commit.
+
+Examples:
+  python3 scripts/bench_group_commit.py
+  python3 scripts/bench_group_commit.py --events 20000 --threads 16
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+
+def _repo_root() -> Path:
+    return Path(__file__).resolve().parents[1]
+
+
+sys.path.insert(0, str(_repo_root()))
+
+from app.db import NewEvent, claim_events, enqueue_events, init_db, mark_done, open_db  # noqa: E402
+from app.group_commit import GroupCommitWriter  # noqa: E402
+
+
+def _prepare(db_path: str, *, events: int) -> list[int]:
+    conn = open_db(db_path)
+    try:
+        init_db(conn)
+        enqueue_events(conn, (NewEvent(source="bench", event_id=f"e{i}", payload={"i": i}) for i in range(events)))
+        claimed = claim_events(conn, limit=events, lease_owner="bench")
+        return [e.id for e in claimed]
+    finally:
+        conn.close()
+
+
+def _run_threads(ids: list[int], threads: int, finish) -> float:
+    chunks = [ids[i::threads] for i in range(threads)]
+    barrier = threading.Barrier(threads + 1)
+
+    def _worker(chunk: list[int]) -> None:
+        barrier.wait()
+        for event_id in chunk:
+            finish(event_id)
+
+    workers = [threading.Thread(target=_worker, args=(c,)) for c in chunks]
+    for w in workers:
+        w.start()
+    barrier.wait()
+    t0 = time.perf_counter()
+    for w in workers:
+        w.join()
+    return time.perf_counter() - t0
+
+
+def bench_direct(db_path: str, ids: list[int], *, threads: int) -> float:
+    local = threading.local()
+    conns = []
+    lock = threading.Lock()
+
+    def _finish(event_id: int) -> None:
+        conn = getattr(local, "conn", None)
+        if conn is None:
+            conn = local.conn = open_db(db_path)
+            with lock:
+                conns.append(conn)
+        mark_done(conn, event_id=event_id, result={"ok": True}, lease_owner="bench")
+
+    try:
+        return _run_threads(ids, threads, _finish)
+    finally:
+        for conn in conns:
+            conn.close()
+
+
+def bench_group_commit(
+    db_path: str, ids: list[int], *, threads: int, max_batch: int, max_delay_ms: float
+) -> tuple[float, GroupCommitWriter]:
+    writer = GroupCommitWriter(db_path, max_batch=max_batch, max_delay=max_delay_ms / 1000).start()
+
+    def _finish(event_id: int) -> None:
+        writer.call(mark_done, event_id=event_id, result={"ok": True}, lease_owner="bench")
+
+    try:
+        return _run_threads(ids, threads, _finish), writer
+    finally:
+        writer.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark group commit vs. per-write commits.")
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--max-batch", type=int, default=100)
+    parser.add_argument("--max-delay-ms", type=float, default=0.0)
+    parser.add_argument("--db-dir", default=None, help="Directory for the scratch databases (default: temp dir).")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.db_dir) as td:
+        direct_path = str(Path(td) / "direct.sqlite3")
+        ids = _prepare(direct_path, events=args.events)
+        direct_s = bench_direct(direct_path, ids, threads=args.threads)
+
+        gc_path = str(Path(td) / "group.sqlite3")
+        ids = _prepare(gc_path, events=args.events)
+        gc_s, writer = bench_group_commit(
+            gc_path,
+            ids,
+            threads=args.threads,
+            max_batch=args.max_batch,
+            max_delay_ms=args.max_delay_ms,
+        )
+
+    print(f"events={args.events} threads={args.threads}")
+    print(f"{'direct':>14}: {args.events / direct_s:>9.0f} events/s")
+    print(
+        f"{'group commit':>14}: {args.events / gc_s:>9.0f} events/s "
+        f"(batches={writer.batches}, avg batch={writer.writes / max(1, writer.batches):.1f})"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Benchmark routing a webhook against 10 .. 10k routing rules for one provider.
+
+Each rule matches one `x-github-event` header value and one `action` in the JSON body (the shape
+of per-event-type rules), plus a few catch-all rules at the end. Events are spread over all rules,
+so half of the rules sit ahead of the average match. Reports microseconds per event for:
+
+  linear   every compiled rule in priority order until one matches (no discriminator index)
+  indexed  `RuleSet.first_match` (discriminator index)
+  route    `route_event` end to end: provider detection, cached rule set, decision
+
+Examples:
+  python3 scripts/bench_routing_rules.py
+  python3 scripts/bench_routing_rules.py --rules 10,1000,10000 --events 2000
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+
+def _repo_root() -> Path:
+    return Path(__file__).resolve().parents[1]
+
+
+sys.path.insert(0, str(_repo_root()))
+
+from app.db import init_db, open_db, upsert_routing_rule  # noqa: E402
+from app.mapper import provider_rule_set, route_event  # noqa: E402
+from app.queue_store import SqliteQueueStore  # noqa: E402
+from app.rule_eval import EventView  # noqa: E402
+from app.settings import Settings  # noqa: E402
+
+ACTIONS = ["opened", "closed", "edited", "labeled"]
+
+
+def _payload(rnd: random.Random, n_rules: int) -> dict:
+    i = rnd.randrange(n_rules)
+    return {
+        "headers": {"X-GitHub-Event": f"event_{i // len(ACTIONS)}", "X-Hub-Signature-256": "sha256=0"},
+        "json": {"action": ACTIONS[i % len(ACTIONS)], "repository": {"full_name": "acme/app"}},
+    }
+
+
+def bench(db_dir: str, *, n_rules: int, events: int) -> tuple[float, float, float]:
+    conn = open_db(str(Path(db_dir) / f"rules_{n_rules}.sqlite3"))
+    init_db(conn)
+    store = SqliteQueueStore(conn)
+    conn.execute("BEGIN IMMEDIATE;")
+    for i in range(n_rules):
+        upsert_routing_rule(
+            conn,
+            provider="github",
+            name=f"rule_{i}",
+            priority=i,
+            conditions={
+                "all": [
+                    {"op": "header_equals", "name": "x-github-event", "value": f"event_{i // len(ACTIONS)}"},
+                    {"op": "json_path_equals", "path": "action", "value": ACTIONS[i % len(ACTIONS)]},
+                    {"op": "json_path_exists", "path": "repository.full_name"},
+                ]
+            },
+            action=f"handle_{i}",
+        )
+    for i in range(3):
+        upsert_routing_rule(
+            conn,
+            provider="github",
+            name=f"catch_all_{i}",
+            priority=n_rules + i,
+            conditions={"op": "header_present", "name": "x-github-event"},
+            action="fallback",
+        )
+    conn.execute("COMMIT;")
+
+    rnd = random.Random(1)
+    payloads = [_payload(rnd, n_rules) for _ in range(events)]
+    views = [EventView.of(p) for p in payloads]
+    rule_set = provider_rule_set(store, "github")
+    predicates = rule_set._predicates
+
+    t0 = time.perf_counter()
+    for view in views:
+        next(pos for pos, pred in enumerate(predicates) if pred(view).matched)
+    linear = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for view in views:
+        rule_set.first_match(view)
+    indexed = time.perf_counter() - t0
+
+    with mock.patch("app.mapper.get_settings", return_value=Settings(mapper_use_ai=False)):
+        t0 = time.perf_counter()
+        for payload in payloads:
+            route_event(store, payload)
+        routed = time.perf_counter() - t0
+
+    conn.close()
+    return tuple(seconds / events * 1e6 for seconds in (linear, indexed, routed))  # type: ignore[return-value]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark routing time vs. number of routing rules.")
+    parser.add_argument("--rules", default="10,1000,10000")
+    parser.add_argument("--events", type=int, default=1000)
+    parser.add_argument("--db-dir", default=None, help="Directory for the scratch databases (default: temp dir).")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.db_dir) as td:
+        print(f"{'rules':>6} {'linear_us':>10} {'indexed_us':>11} {'route_us':>9}")
+        for n_rules in [int(x) for x in args.rules.split(",") if x.strip()]:
+            linear, indexed, routed = bench(td, n_rules=n_rules, events=args.events)
+            print(f"{n_rules:>6} {linear:>10.1f} {indexed:>11.1f} {routed:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
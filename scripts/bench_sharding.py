@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Benchmark enqueue + claim + mark_done throughput against 1..N SQLite shards.
+
+Each process opens its own queue store and, per event, enqueues it (from its own set of
+sources), claims one ready event and marks it done. With sharding enabled the processes spread
+their writes over several files instead of queueing on one write lock.
+
+Examples:
+  python3 scripts/bench_sharding.py
+  python3 scripts/bench_sharding.py --shards 1,2,4,8 --procs 8 --events 2000
+"""
+
+from __future__ import annotations
+
+import argparse
+import multiprocessing
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+def _repo_root() -> Path:
+    return Path(__file__).resolve().parents[1]
+
+
+sys.path.insert(0, str(_repo_root()))
+
+from app.queue_store import open_queue_store  # noqa: E402
+from app.settings import Settings  # noqa: E402
+
+
+def _settings(db_path: str, shards: int) -> Settings:
+    return Settings(app_db_path=db_path, queue_shards=shards)
+
+
+def _writer(db_path: str, shards: int, proc: int, events: int, start) -> None:
+    store = open_queue_store(settings=_settings(db_path, shards))
+    try:
+        start.wait()
+        for i in range(events):
+            source = f"src-{proc}-{i % 4}"
+            store.enqueue_event(source=source, event_id=f"{proc}-{i}", payload={"i": i})
+            for event in store.claim_events(limit=1, lease_owner=f"p{proc}"):
+                store.mark_done(event_id=event.id, result={"ok": True}, lease_owner=f"p{proc}")
+    finally:
+        store.close()
+
+
+def bench(db_dir: str, *, shards: int, procs: int, events: int) -> float:
+    db_path = str(Path(db_dir) / f"bench_{shards}" / "events.sqlite3")
+    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+    store = open_queue_store(settings=_settings(db_path, shards))
+    store.init()
+    store.close()
+
+    ctx = multiprocessing.get_context("spawn")
+    start = ctx.Event()
+    workers = [ctx.Process(target=_writer, args=(db_path, shards, p, events, start)) for p in range(procs)]
+    for w in workers:
+        w.start()
+    time.sleep(1.0)
+    t0 = time.perf_counter()
+    start.set()
+    for w in workers:
+        w.join()
+    return time.perf_counter() - t0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark queue throughput vs. number of SQLite shards.")
+    parser.add_argument("--shards", default="1,2,4")
+    parser.add_argument("--procs", type=int, default=4)
+    parser.add_argument("--events", type=int, default=1000, help="Events per process.")
+    parser.add_argument("--db-dir", default=None, help="Directory for the scratch databases (default: temp dir).")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.db_dir) as td:
+        print(f"{'shards':>6} {'seconds':>8} {'events/s':>9}")
+        for shards in [int(x) for x in args.shards.split(",") if x.strip()]:
+            seconds = bench(td, shards=shards, procs=args.procs, events=args.events)
+            print(f"{shards:>6} {seconds:>8.2f} {args.procs * args.events / seconds:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from app.ai_cache import payload_fingerprint
+from app.db import init_db, open_db
+from app.mapper import route_event
+from app.queue_store import SqliteQueueStore
+from app.settings import Settings
+
+
+def _payload(event_type: str, delivery: str, **extra: object) -> dict:
+    return {
+        "path": "/webhooks/acme",
+        "content_type": "application/json; charset=utf-8",
+        "headers": {"Content-Type": "application/json", "X-Acme-Delivery": delivery},
+        "json": {"kind": event_type, "id": delivery, "data": {"items": [{"sku": "a"}] * len(delivery)}, **extra},
+    }
+
+
+class TestPayloadFingerprint(unittest.TestCase):
+    def test_same_shape_different_values(self) -> None:
+        a = _payload("order.created", "d1")
+        b = _payload("order.paid", "delivery-2")
+        b["headers"] = {"x-acme-delivery": "x", "content-type": "text/plain"}
+        b["content_type"] = "application/json"
+        self.assertEqual(payload_fingerprint(a), payload_fingerprint(b))
+
+    def test_structure_changes_the_fingerprint(self) -> None:
+        base = payload_fingerprint(_payload("order.created", "d1"))
+        self.assertNotEqual(payload_fingerprint(_payload("order.created", "d1", extra=1)), base)
+        other_path = _payload("order.created", "d1")
+        other_path["path"] = "/webhooks/other"
+        self.assertNotEqual(payload_fingerprint(other_path), base)
+        more_headers = _payload("order.created", "d1")
+        more_headers["headers"]["X-Acme-Signature"] = "s"
+        self.assertNotEqual(payload_fingerprint(more_headers), base)
+
+
+class TestCachedClassification(unittest.TestCase):
+    def setUp(self) -> None:
+        self._td = tempfile.TemporaryDirectory()
+        self.addCleanup(self._td.cleanup)
+        conn = open_db(f"{self._td.name}/t.sqlite3")
+        self.addCleanup(conn.close)
+        init_db(conn)
+        self.store = SqliteQueueStore(conn)
+        settings = Settings(mapper_use_ai=True, mapper_ai_cache_ttl_seconds=3600)
+        patcher = mock.patch("app.mapper.get_settings", return_value=settings)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_only_the_first_event_of_a_shape_calls_the_model(self) -> None:
+        answer = {
+            "provider": "acme",
+            "confidence": 0.9,
+            "event_type": "order.created",
+            "event_type_path": "kind",
+            "event_id": "d0",
+            "event_id_path": "id",
+            "notes": "",
+        }
+        with mock.patch("app.mapper.ai_detect_provider", return_value=answer) as ai:
+            decisions = [route_event(self.store, _payload(f"order.e{i}", f"d{i}")) for i in range(5)]
+        self.assertEqual(ai.call_count, 1)
+        self.assertEqual({d.provider for d in decisions}, {"acme"})
+        self.assertEqual([d.event_type for d in decisions], ["order.created"] + [f"order.e{i}" for i in range(1, 5)])
+        self.assertEqual(decisions[3].ai_detection["event_id"], "d3")
+        self.assertIn("ai:cache_hit", decisions[1].reasons)
+        self.assertEqual(self.store.shape_cache_stats(), {"shapes": 1, "expired": 0, "hits": 4, "misses": 1})
+
+    def test_expired_entries_and_failures_call_the_model_again(self) -> None:
+        with mock.patch("app.mapper.ai_detect_provider", side_effect=RuntimeError("sdk down")) as ai:
+            route_event(self.store, _payload("a", "d1"))
+            self.assertIn("ai:error:RuntimeError", route_event(self.store, _payload("b", "d2")).reasons)
+        self.assertEqual(ai.call_count, 2)
+
+        unknown = {"provider": "unknown", "confidence": 0.1, "event_type_path": None, "event_id_path": None}
+        short_ttl = Settings(mapper_use_ai=True, mapper_ai_cache_ttl_seconds=0.2)
+        with mock.patch("app.mapper.ai_detect_provider", return_value=unknown) as ai, mock.patch(
+            "app.mapper.get_settings", return_value=short_ttl
+        ):
+            route_event(self.store, _payload("a", "d1"))
+            time.sleep(0.25)
+            route_event(self.store, _payload("a", "d1"))
+            route_event(self.store, _payload("a", "d1"))
+        self.assertEqual(ai.call_count, 2)
+        (shape,) = self.store.list_shape_classifications()
+        self.assertEqual((shape.provider, shape.hits, shape.misses), ("unknown", 1, 2))
+
+    def test_concurrent_misses_of_a_new_shape_call_the_model_once(self) -> None:
+        answer = {"provider": "acme", "confidence": 0.9, "event_type_path": "kind", "event_id_path": "id"}
+
+        def slow_answer(payload: dict) -> dict:
+            time.sleep(0.2)
+            return answer
+
+        providers: list[str] = []
+
+        def route(i: int) -> None:
+            conn = open_db(f"{self._td.name}/t.sqlite3")
+            try:
+                providers.append(route_event(SqliteQueueStore(conn), _payload(f"order.e{i}", f"d{i}")).provider)
+            finally:
+                conn.close()
+
+        with mock.patch("app.mapper.ai_detect_provider", side_effect=slow_answer) as ai:
+            threads = [threading.Thread(target=route, args=(i,)) for i in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(ai.call_count, 1)
+        self.assertEqual(providers, ["acme"] * 4)
+        self.assertEqual(self.store.shape_cache_stats(), {"shapes": 1, "expired": 0, "hits": 3, "misses": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from app.async_worker import run_async_worker
+from app import processor
+from app.db import enqueue_event, get_event_row, init_db, list_action_runs_for_event, open_db, upsert_provider_mapping
+
+
+class TestAsyncWorker(unittest.TestCase):
+    def test_many_slow_handlers_run_concurrently_on_one_loop(self) -> None:
+        running = 0
+        peak = 0
+
+        async def slow_action(**kwargs):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.3)
+            running -= 1
+            return {"action": kwargs["action"]}
+
+        with tempfile.TemporaryDirectory() as td:
+            db_path = f"{td}/t.sqlite3"
+            conn = open_db(db_path)
+            try:
+                init_db(conn)
+                upsert_provider_mapping(
+                    conn, provider="unknown", action="slow", handler_mode="command", handler_target="slow"
+                )
+                ids = [enqueue_event(conn, source="test", event_id=f"e{i}", payload={"i": i}) for i in range(40)]
+                stop = threading.Event()
+
+                def done() -> bool:
+                    return all(get_event_row(conn, event_row_id=i)["status"] == "done" for i in ids)
+
+                async def main() -> float:
+                    started = time.monotonic()
+                    worker = asyncio.create_task(
+                        run_async_worker(
+                            db_path=db_path, max_in_flight=50, batch_size=20, poll_interval=0.05, stop_event=stop
+                        )
+                    )
+                    while not done() and time.monotonic() - started < 10:
+                        await asyncio.sleep(0.05)
+                    elapsed = time.monotonic() - started
+                    stop.set()
+                    await asyncio.wait_for(worker, timeout=10)
+                    return elapsed
+
+                with mock.patch("app.processor.run_action_async", side_effect=slow_action):
+                    elapsed = asyncio.run(main())
+
+                self.assertTrue(done())
+                # Forty 0.3s handlers one at a time would take 12s.
+                self.assertLess(elapsed, 4.0)
+                self.assertGreaterEqual(peak, 20)
+                runs = list_action_runs_for_event(conn, event_row_id=ids[0])
+                self.assertEqual([r["status"] for r in runs], ["done"])
+            finally:
+                conn.close()
+
+    def test_failed_handler_completes_event_with_error_result(self) -> None:
+        async def broken(**kwargs):
+            raise RuntimeError("boom")
+
+        with tempfile.TemporaryDirectory() as td:
+            db_path = f"{td}/t.sqlite3"
+            conn = open_db(db_path)
+            try:
+                init_db(conn)
+                upsert_provider_mapping(conn, provider="unknown", action="x", handler_mode="command", handler_target="x")
+                row_id = enqueue_event(conn, source="test", event_id="e", payload={})
+                with mock.patch("app.processor.run_action_async", side_effect=broken):
+                    asyncio.run(run_async_worker(db_path=db_path, run_once=True))
+                row = get_event_row(conn, event_row_id=row_id)
+                # The action failure is recorded on the run; the event itself completes with ok=False.
+                self.assertEqual(row["status"], "done")
+                self.assertFalse(json.loads(row["result_json"])["ok"])
+                runs = list_action_runs_for_event(conn, event_row_id=row_id)
+                self.assertEqual(runs[0]["status"], "error")
+            finally:
+                conn.close()
+
+    def test_blocked_routing_does_not_stall_store_calls(self) -> None:
+        release = threading.Event()
+        real_plan_event = processor.plan_event
+
+        def plan_event(store, event):
+            if event.event_id == "slow":
+                # Stands in for a classifier call on a new payload shape.
+                release.wait(10)
+            return real_plan_event(store, event)
+
+        async def action(**kwargs):
+            return {"action": kwargs["action"]}
+
+        with tempfile.TemporaryDirectory() as td:
+            db_path = f"{td}/t.sqlite3"
+            conn = open_db(db_path)
+            try:
+                init_db(conn)
+                upsert_provider_mapping(conn, provider="unknown", action="x", handler_mode="command", handler_target="x")
+                slow_id = enqueue_event(conn, source="test", event_id="slow", payload={})
+                ids = [enqueue_event(conn, source="test", event_id=f"e{i}", payload={"i": i}) for i in range(5)]
+                stop = threading.Event()
+
+                def done(row_ids) -> bool:
+                    return all(get_event_row(conn, event_row_id=i)["status"] == "done" for i in row_ids)
+
+                async def main() -> bool:
+                    worker = asyncio.create_task(
+                        run_async_worker(
+                            db_path=db_path, db_threads=1, route_threads=2, batch_size=10, poll_interval=0.05,
+                            stop_event=stop,
+                        )
+                    )
+                    started = time.monotonic()
+                    while not done(ids) and time.monotonic() - started < 5:
+                        await asyncio.sleep(0.05)
+                    others_done_while_blocked = done(ids) and not release.is_set()
+                    release.set()
+                    stop.set()
+                    await asyncio.wait_for(worker, timeout=10)
+                    return others_done_while_blocked
+
+                with (
+                    mock.patch("app.processor.plan_event", side_effect=plan_event),
+                    mock.patch("app.processor.run_action_async", side_effect=action),
+                ):
+                    others_done_while_blocked = asyncio.run(main())
+
+                # With routing on the single database thread, nothing would be acked until "slow" routed.
+                self.assertTrue(others_done_while_blocked)
+                self.assertTrue(done([slow_id]))
+            finally:
+                conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+import json
+import tempfile
+import unittest
+
+from app.db import (
+    claim_events,
+    create_action_run,
+    enqueue_event,
+    finish_action_run,
+    get_action_run,
+    get_event_row,
+    SCHEMA_MIGRATIONS,
+    init_db,
+    mark_done,
+    open_db,
+)
+from app.blobs import release_json
+from app.migrations import migrate, schema_version
+
+
+class TestBlobStore(unittest.TestCase):
+    def test_payload_and_output_are_stored_once_and_read_back(self) -> None:
+        payload = {"headers": {"x-github-event": "push"}, "json": {"commits": ["a" * 500]}}
+        output = {"summary": "b" * 500}
+
+        with tempfile.TemporaryDirectory() as td:
+            conn = open_db(f"{td}/t.sqlite3")
+            try:
+                init_db(conn)
+                first = enqueue_event(conn, source="webhook", event_id="evt_1", payload=payload)
+                enqueue_event(conn, source="webhook", event_id="evt_2", payload=payload)
+
+                (event,) = claim_events(conn, limit=1)
+                self.assertEqual(event.payload, payload)
+
+                run_id = create_action_run(
+                    conn,
+                    event_row_id=first,
+                    provider="github",
+                    action="handle",
+                    handler_mode="noop",
+                    handler_target=None,
+                    input_obj={"router": {"provider": "github"}, "payload": payload},
+                )
+                finish_action_run(conn, run_id=run_id, status="done", output_obj=output)
+                mark_done(conn, event_id=first, result={"ok": True, "result": output})
+
+                row = get_event_row(conn, event_row_id=first)
+                self.assertEqual(json.loads(row["payload_json"]), payload)
+                self.assertEqual(json.loads(row["result_json"]), {"ok": True, "result": output})
+                run = get_action_run(conn, run_id=run_id)
+                self.assertEqual(json.loads(run["input_json"])["payload"], payload)
+                self.assertEqual(json.loads(run["output_json"]), output)
+
+                # One blob for the payload (shared by both events and the run input), one for the output.
+                big = conn.execute("SELECT COUNT(*) FROM blobs WHERE size > 400").fetchone()[0]
+                self.assertEqual(big, 2)
+                self.assertEqual(
+                    conn.execute("SELECT codec FROM blobs WHERE size > 400 LIMIT 1").fetchone()[0], "zlib"
+                )
+            finally:
+                conn.close()
+
+    def test_marking_an_event_done_again_releases_the_earlier_result(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            conn = open_db(f"{td}/t.sqlite3")
+            try:
+                init_db(conn)
+                row_id = enqueue_event(conn, source="webhook", event_id="evt_1", payload={})
+                first = {"ok": True, "result": {"summary": "a" * 500}}
+                second = {"ok": True, "result": {"summary": "b" * 500}}
+
+                mark_done(conn, event_id=row_id, result=first)
+                first_hash = get_event_row(conn, event_row_id=row_id)["result_hash"]
+                mark_done(conn, event_id=row_id, result=second)
+                mark_done(conn, event_id=row_id, result=second)
+
+                self.assertIsNone(conn.execute("SELECT 1 FROM blobs WHERE hash = ?", (first_hash,)).fetchone())
+                self.assertEqual(json.loads(get_event_row(conn, event_row_id=row_id)["result_json"]), second)
+                # Marking it done with the same result again keeps one reference per blob, not two.
+                self.assertEqual(conn.execute("SELECT MAX(refs) FROM blobs").fetchone()[0], 1)
+                release_json(conn, [get_event_row(conn, event_row_id=row_id)["result_hash"]])
+                self.assertEqual(conn.execute("SELECT COUNT(*) FROM blobs WHERE size > 400").fetchone()[0], 0)
+            finally:
+                conn.close()
+
+    def test_upgrade_counts_blobs_shared_before_refs_existed(self) -> None:
+        payload = {"headers": {"x-github-event": "push"}, "json": {"commits": ["a" * 500]}}
+
+        with tempfile.TemporaryDirectory() as td:
+            conn = open_db(f"{td}/t.sqlite3")
+            try:
+                init_db(conn)
+                ids = [enqueue_event(conn, source="webhook", event_id=f"evt_{i}", payload=payload) for i in range(3)]
+                run_id = create_action_run(
+                    conn,
+                    event_row_id=ids[0],
+                    provider="github",
+                    action="handle",
+                    handler_mode="noop",
+                    handler_target=None,
+                    input_obj={"router": {"provider": "github"}, "payload": payload},
+                )
+                finish_action_run(conn, run_id=run_id, status="done", output_obj={"ok": True})
+                (payload_hash,) = {r[0] for r in conn.execute("SELECT payload_hash FROM events")}
+                expected = dict(conn.execute("SELECT hash, refs FROM blobs").fetchall())
+                # Three events and the run input's manifest share the payload blob.
+                self.assertEqual(expected[payload_hash], 4)
+
+                # A database from before reference counting: no `refs` column, no schema version.
+                conn.execute("ALTER TABLE blobs DROP COLUMN refs;")
+                conn.execute("PRAGMA user_version = 0;")
+                migrate(conn, SCHEMA_MIGRATIONS, batch_size=1)
+                self.assertEqual(schema_version(conn), SCHEMA_MIGRATIONS[-1].version)
+                self.assertEqual(dict(conn.execute("SELECT hash, refs FROM blobs").fetchall()), expected)
+
+                conn.execute("DELETE FROM events WHERE id = ?", (ids[1],))
+                self.assertEqual(release_json(conn, [payload_hash]), 0)
+                (event,) = [e for e in claim_events(conn, limit=3) if e.id == ids[2]]
+                self.assertEqual(event.payload, payload)
+            finally:
+                conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from app.circuit_breaker import CLOSED, HALF_OPEN, OPEN, admit_call, record_call
+from app.db import enqueue_event, get_event_row, init_db, list_circuit_breakers, open_db, upsert_provider_mapping
+from app.worker import run_worker
+
+LIMITS = {"failure_threshold": 3, "open_seconds": 10.0, "max_open_seconds": 25.0}
+
+
+def _record(breaker, *, ok: bool, event_row_id: int = 1, now: float = 100.0):
+    updated = record_call(
+        breaker, handler_mode="agent", handler_target="mcp", ok=ok, event_row_id=event_row_id, now=now, **LIMITS
+    )
+    return updated if updated is not None else breaker
+
+
+class TestCircuitBreakerStates(unittest.TestCase):
+    def test_trips_after_consecutive_failures_then_probes_once(self) -> None:
+        b = None
+        for i in range(2):
+            b = _record(b, ok=False, event_row_id=i)
+        self.assertEqual((b.state, b.consecutive_failures), (CLOSED, 2))
+        # A success in between resets the streak.
+        self.assertEqual(_record(b, ok=True).consecutive_failures, 0)
+
+        b = _record(b, ok=False, event_row_id=3)
+        self.assertEqual((b.state, b.open_until), (OPEN, 110.0))
+        self.assertEqual(admit_call(b, event_row_id=4, now=105.0, probe_lease=60), (110.0, None))
+
+        retry_at, probe = admit_call(b, event_row_id=4, now=110.0, probe_lease=60)
+        self.assertIsNone(retry_at)
+        self.assertEqual((probe.state, probe.probe_event_row_id), (HALF_OPEN, 4))
+        # Only the probe runs while half-open; a redelivered probe is let through again.
+        self.assertIsNotNone(admit_call(probe, event_row_id=5, now=111.0, probe_lease=60)[0])
+        self.assertEqual(admit_call(probe, event_row_id=4, now=111.0, probe_lease=60), (None, None))
+        # A probe whose worker went away is replaced once its lease is over.
+        self.assertIsNone(admit_call(probe, event_row_id=5, now=171.0, probe_lease=60)[0])
+
+        failed = _record(probe, ok=False, event_row_id=4, now=112.0)
+        self.assertEqual((failed.state, failed.open_seconds, failed.open_until), (OPEN, 20.0, 132.0))
+        again = _record(admit_call(failed, event_row_id=6, now=132.0, probe_lease=60)[1], ok=False, event_row_id=6, now=133.0)
+        self.assertEqual(again.open_seconds, 25.0)
+
+        closed = _record(probe, ok=True, event_row_id=4)
+        self.assertEqual((closed.state, closed.consecutive_failures, closed.open_seconds), (CLOSED, 0, 0.0))
+
+    def test_late_failures_do_not_extend_an_open_breaker(self) -> None:
+        b = None
+        for i in range(3):
+            b = _record(b, ok=False, event_row_id=i)
+        late = _record(b, ok=False, event_row_id=9, now=104.0)
+        self.assertEqual((late.state, late.open_until, late.consecutive_failures), (OPEN, 110.0, 4))
+
+
+class TestWorkerCircuitBreaker(unittest.TestCase):
+    def test_open_breaker_defers_without_running_the_handler(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            db_path = f"{td}/t.sqlite3"
+            conn = open_db(db_path)
+            try:
+                init_db(conn)
+                upsert_provider_mapping(conn, provider="unknown", action="enrich", handler_mode="agent", handler_target="mcp")
+                ids = [enqueue_event(conn, source="test", event_id=f"e{i}", payload={}) for i in range(6)]
+
+                down = subprocess.TimeoutExpired(["agent"], 90)
+                with mock.patch("app.processor.get_settings") as settings, mock.patch(
+                    "app.processor.run_action", side_effect=down
+                ) as run_action:
+                    settings.return_value.circuit_failure_threshold = 2
+                    settings.return_value.circuit_open_seconds = 60.0
+                    settings.return_value.circuit_max_open_seconds = 600.0
+                    run_worker(db_path=db_path, run_once=True, batch_size=6)
+
+                self.assertEqual(run_action.call_count, 2)
+                (breaker,) = list_circuit_breakers(conn)
+                self.assertEqual((breaker.handler_mode, breaker.handler_target, breaker.state), ("agent", "mcp", OPEN))
+                self.assertIn("TimeoutExpired", breaker.last_error)
+                rows = [get_event_row(conn, event_row_id=i) for i in ids]
+                # The two calls that ran failed; their events are done with ok=false like any handler error.
+                self.assertEqual([r["status"] for r in rows[:2]], ["done", "done"])
+                for row in rows[2:]:
+                    self.assertEqual((row["status"], row["attempt_count"]), ("pending", 0))
+            finally:
+                conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+from app.fair_share import parse_weights, pick_fair
+
+
+class TestPickFair(unittest.TestCase):
+    def test_weights_set_each_sources_share(self) -> None:
+        candidates = {"noisy": [(i, 100) for i in range(100)], "quiet": [(1000 + i, 100) for i in range(100)]}
+        picked, credits = pick_fair(candidates, {}, weights={"noisy": 3}, limit=40)
+        self.assertEqual(sum(1 for i in picked if i < 1000), 30)
+
+        # Credits carried between calls keep the rotation going one claim at a time.
+        one_by_one: list[int] = []
+        credits = {}
+        for _ in range(8):
+            (event_id,), credits = pick_fair(
+                {s: [r for r in rows if r[0] not in one_by_one] for s, rows in candidates.items()},
+                credits,
+                weights={"noisy": 3},
+                limit=1,
+            )
+            one_by_one.append(event_id)
+        self.assertEqual(sum(1 for i in one_by_one if i >= 1000), 2)
+
+    def test_lower_priority_lane_still_wins(self) -> None:
+        candidates = {"a": [(1, 100), (2, 100)], "b": [(3, 0), (4, 100)]}
+        picked, _ = pick_fair(candidates, {}, weights={}, limit=4)
+        self.assertEqual(picked[0], 3)
+        self.assertEqual(sorted(picked[1:3]), [1, 4])
+
+    def test_parse_weights(self) -> None:
+        self.assertEqual(parse_weights(" stripe=3, cron=0.5 ,"), {"stripe": 3.0, "cron": 0.5})
+        self.assertEqual(parse_weights(""), {})
+        with self.assertRaises(ValueError):
+            parse_weights("stripe")
+        with self.assertRaises(ValueError):
+            parse_weights("stripe=0")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import tempfile
+import threading
+import unittest
+
+from app.db import claim_events, enqueue_event, get_event_row, init_db, open_db
+from app.group_commit import GroupCommitWriter
+from app.queue_store import SqliteQueueStore
+
+
+def _insert_mapping(conn, *, provider: str) -> str:
+    conn.execute(
+        "INSERT INTO provider_mappings (provider, action, handler_mode, enabled, updated_at) VALUES (?, 'a', 'noop', 1, '')",
+        (provider,),
+    )
+    return provider
+
+
+class TestGroupCommitWriter(unittest.TestCase):
+    def test_concurrent_writes_share_commits(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            db_path = f"{td}/t.sqlite3"
+            conn = open_db(db_path)
+            try:
+                init_db(conn)
+                writer = GroupCommitWriter(db_path, max_batch=50, max_delay=0.02).start()
+                barrier = threading.Barrier(8)
+                results: list[str] = []
+
+                def _worker(n: int) -> None:
+                    barrier.wait()
+                    futures = [writer.submit(_insert_mapping, provider=f"p{n}_{i}") for i in range(25)]
+                    results.extend(f.result() for f in futures)
+
+                threads = [threading.Thread(target=_worker, args=(n,)) for n in range(8)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                writer.stop()
+
+                self.assertEqual(len(results), 200)
+                self.assertEqual(writer.writes, 200)
+                self.assertLess(writer.batches, 200)
+                self.assertEqual(conn.execute("SELECT COUNT(*) FROM provider_mappings").fetchone()[0], 200)
+            finally:
+                conn.close()
+
+    def test_failed_write_is_rolled_back_alone(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            db_path = f"{td}/t.sqlite3"
+            conn = open_db(db_path)
+            try:
+                init_db(conn)
+                writer = GroupCommitWriter(db_path, max_delay=0.05).start()
+                ok = writer.submit(_insert_mapping, provider="a")
+                dup = writer.submit(_insert_mapping, provider="a")
+                other = writer.submit(_insert_mapping, provider="b")
+                writer.stop()
+
+                self.assertEqual(ok.result(), "a")
+                self.assertEqual(other.result(), "b")
+                with self.assertRaises(Exception):
+                    dup.result()
+                rows = [r[0] for r in conn.execute("SELECT provider FROM provider_mappings ORDER BY provider")]
+                self.assertEqual(rows, ["a", "b"])
+            finally:
+                conn.close()
+
+    def test_store_routes_state_transitions_through_writer(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            db_path = f"{td}/t.sqlite3"
+            writer = GroupCommitWriter(db_path).start()
+            store = SqliteQueueStore.open(db_path, writer=writer, wait_for_commit=False)
+            try:
+                store.init()
+                row_id = enqueue_event(store.conn, source="test", event_id="e1", payload={})
+                [event] = claim_events(store.conn, limit=1, lease_owner="w1")
+                run_id = store.create_action_run(
+                    event_row_id=event.id,
+                    provider="p",
+                    action="a",
+                    handler_mode="noop",
+                    handler_target=None,
+                    input_obj={},
+                )
+                store.finish_action_run(run_id=run_id, status="done", output_obj={"ok": True})
+                self.assertTrue(store.mark_done(event_id=row_id, result={"ok": True}, lease_owner="w1"))
+                writer.stop()
+
+                self.assertEqual(get_event_row(store.conn, event_row_id=row_id)["status"], "done")
+                self.assertEqual(store.get_action_run(run_id=run_id)["status"], "done")
+            finally:
+                store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
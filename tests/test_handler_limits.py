@@ -0,0 +1,113 @@
+import json
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from app.config import apply_config, load_config
+from app.db import enqueue_event, get_event_row, init_db, list_action_runs_for_event, open_db
+from app.handler_limits import HandlerLimit, decide_permit, limit_keys, parse_limits
+from app.processor import HandlerDeferred
+from app.worker import _record_deferral, run_worker
+
+
+class TestDecidePermit(unittest.TestCase):
+    def test_rate_limit_spreads_a_backlog_over_reserved_slots(self) -> None:
+        limit = HandlerLimit(limit_key="firecrawl", rate_per_sec=2, burst=2)
+        tats: dict[str, float] = {}
+        ready: list[float] = []
+        for _ in range(5):
+            d = decide_permit([limit], tats=tats, running={}, reservations={}, now=100.0)
+            tats.update(d.tats)
+            ready.append(100.0 if d.admitted else d.retry_at)
+        # Two back to back (the burst), then one every half second.
+        self.assertEqual(ready, [100.0, 100.0, 100.5, 101.0, 101.5])
+
+        # Coming back with a reservation does not take another token.
+        d = decide_permit([limit], tats=tats, running={}, reservations={"firecrawl": 100.5}, now=100.5)
+        self.assertTrue(d.admitted)
+        self.assertEqual(d.tats, {})
+
+    def test_concurrency_limit_and_all_or_nothing(self) -> None:
+        limits = [HandlerLimit(limit_key="slack", max_concurrency=2), HandlerLimit(limit_key="p/a", rate_per_sec=1)]
+        d = decide_permit(limits, tats={}, running={"slack": 2}, reservations={}, now=50.0)
+        self.assertFalse(d.admitted)
+        self.assertEqual(d.blocked_by, "slack")
+        # The rate token it was granted is kept as a reservation rather than lost.
+        self.assertEqual(d.reservations, {"p/a": 50.0})
+        self.assertTrue(decide_permit(limits, tats={}, running={"slack": 1}, reservations={}, now=50.0).admitted)
+
+    def test_concurrency_waiters_recheck_in_turn(self) -> None:
+        limit = HandlerLimit(limit_key="slack", max_concurrency=2)
+        waiting: dict[str, float] = {}
+        rechecks: list[float] = []
+        for _ in range(4):
+            d = decide_permit([limit], tats={}, running={"slack": 2}, reservations={}, now=50.0, waiting=waiting)
+            waiting.update(d.waits)
+            rechecks.append(d.retry_at)
+        # Two re-checks per second, in arrival order.
+        self.assertEqual(rechecks, [51.0, 51.5, 52.0, 52.5])
+
+    def test_parse_limits_and_keys(self) -> None:
+        limits = parse_limits({"echo": {"max_concurrency": 4, "rate_per_sec": 2}, "cron/run_job": {}})
+        self.assertEqual(limits[0], HandlerLimit(limit_key="echo", max_concurrency=4, rate_per_sec=2.0))
+        self.assertEqual(limits[0].bucket_size, 2.0)
+        for bad in ({"x": {"max_concurrency": 0}}, {"x": {"rate_per_sec": -1}}, {"x": {"burst": 3}}, {"x": {"rps": 1}}):
+            with self.assertRaises(ValueError):
+                parse_limits(bad)
+        self.assertEqual(limit_keys(handler_target="echo", provider="unknown", action="a"), ["echo", "unknown/a"])
+
+
+class TestWorkerHandlerLimits(unittest.TestCase):
+    def test_over_limit_events_are_deferred_without_using_attempts(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            db_path = f"{td}/t.sqlite3"
+            config_path = Path(td) / "config.json"
+            config_path.write_text(
+                json.dumps(
+                    {
+                        "mappings": [
+                            {"provider": "unknown", "action": "scrape", "handler_mode": "command", "handler_target": "firecrawl"}
+                        ],
+                        "limits": {"firecrawl": {"rate_per_sec": 1, "burst": 1}},
+                    }
+                ),
+                encoding="utf-8",
+            )
+            conn = open_db(db_path)
+            try:
+                init_db(conn)
+                apply_config(conn, load_config(str(config_path)))
+                ids = [enqueue_event(conn, source="test", event_id=f"e{i}", payload={"i": i}) for i in range(3)]
+
+                started = time.time()
+                with mock.patch("app.processor.run_action", return_value={"ok": True}) as run_action:
+                    run_worker(db_path=db_path, run_once=True, batch_size=3)
+                self.assertEqual(run_action.call_count, 1)
+
+                first, second, third = (get_event_row(conn, event_row_id=i) for i in ids)
+                self.assertEqual(first["status"], "done")
+                for row in (second, third):
+                    self.assertEqual((row["status"], row["attempt_count"]), ("pending", 0))
+                    self.assertGreater(row["next_attempt_at"], first["received_at"])
+                # Each waiting event got its own slot, a second apart.
+                self.assertLess(second["next_attempt_at"], third["next_attempt_at"])
+                self.assertEqual(list_action_runs_for_event(conn, event_row_id=ids[1]), [])
+                self.assertEqual(conn.execute("SELECT COUNT(*) FROM handler_permits WHERE state='running'").fetchone()[0], 0)
+                self.assertLess(time.time() - started, 5)
+            finally:
+                conn.close()
+
+    def test_deferral_is_only_logged_when_the_lease_was_held(self) -> None:
+        store = mock.Mock()
+        store.defer_event.return_value = False
+        event = mock.Mock(id=7, source="test")
+        with mock.patch("builtins.print") as printed:
+            _record_deferral(store, event, HandlerDeferred("slack", time.time() + 1, reason="limit"), lease_owner="w1")
+        (line,) = [c.args[0] for c in printed.call_args_list]
+        self.assertTrue(line.startswith("[lease-lost] id=7"), line)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import tempfile
+import threading
+import unittest
+
+from app.db import SCHEMA_MIGRATIONS, enqueue_event, init_db, mark_error, open_db
+from app.migrations import Backfill, Migration, migrate, schema_version
+
+
+def _create_items(conn) -> None:
+    conn.execute("CREATE TABLE IF NOT EXISTS items (id INTEGER PRIMARY KEY, n INTEGER NOT NULL);")
+
+
+def _add_doubled(conn) -> None:
+    cols = {str(r[1]) for r in conn.execute("PRAGMA table_info(items);").fetchall()}
+    if "doubled" not in cols:
+        conn.execute("ALTER TABLE items ADD COLUMN doubled INTEGER;")
+
+
+class TestMigrations(unittest.TestCase):
+    def test_current_schema_skips_all_ddl(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            conn = open_db(f"{td}/t.sqlite3")
+            try:
+                init_db(conn)
+                self.assertEqual(schema_version(conn), SCHEMA_MIGRATIONS[-1].version)
+
+                statements: list[str] = []
+                conn.set_trace_callback(statements.append)
+                init_db(conn)
+                conn.set_trace_callback(None)
+                self.assertEqual(statements, ["PRAGMA user_version;"])
+            finally:
+                conn.close()
+
+    def test_baseline_backfills_derived_tables_in_batches(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            conn = open_db(f"{td}/t.sqlite3")
+            try:
+                init_db(conn)
+                ids = [enqueue_event(conn, source="test", event_id=f"e{i}", payload={"i": i}) for i in range(5)]
+                mark_error(conn, event_id=ids[0], attempt_count=8, error="boom")
+                # Simulate a database from before versioning without the derived tables.
+                conn.execute("DELETE FROM ready_queue;")
+                conn.execute("DELETE FROM dead_letters;")
+                conn.execute("PRAGMA user_version = 0;")
+
+                self.assertEqual(migrate(conn, SCHEMA_MIGRATIONS, batch_size=2), [m.version for m in SCHEMA_MIGRATIONS])
+                ready = [int(r[0]) for r in conn.execute("SELECT event_row_id FROM ready_queue ORDER BY 1")]
+                self.assertEqual(ready, ids[1:])
+                self.assertEqual([int(r[0]) for r in conn.execute("SELECT event_row_id FROM dead_letters")], ids[:1])
+                self.assertEqual(conn.execute("SELECT COUNT(*) FROM schema_backfills").fetchone()[0], 0)
+            finally:
+                conn.close()
+
+    def test_interrupted_backfill_resumes(self) -> None:
+        calls: list[tuple[int, int]] = []
+
+        def double(conn, after_id: int, up_to_id: int) -> None:
+            calls.append((after_id, up_to_id))
+            if len(calls) == 2:
+                raise RuntimeError("killed")
+            conn.execute("UPDATE items SET doubled = n * 2 WHERE id > ? AND id <= ?", (after_id, up_to_id))
+
+        migrations = (
+            Migration(version=1, name="items", apply=_create_items),
+            Migration(
+                version=2, name="doubled", apply=_add_doubled, backfills=(Backfill("doubled", "items", double),)
+            ),
+        )
+        with tempfile.TemporaryDirectory() as td:
+            conn = open_db(f"{td}/t.sqlite3")
+            try:
+                migrate(conn, migrations[:1])
+                conn.executemany("INSERT INTO items (n) VALUES (?)", [(i,) for i in range(1, 6)])
+
+                with self.assertRaises(RuntimeError):
+                    migrate(conn, migrations, batch_size=2)
+                self.assertEqual(schema_version(conn), 1)
+
+                self.assertEqual(migrate(conn, migrations, batch_size=2), [2])
+                self.assertEqual(calls, [(0, 2), (2, 4), (2, 4), (4, 5)])
+                self.assertEqual([r[0] for r in conn.execute("SELECT doubled FROM items ORDER BY id")], [2, 4, 6, 8, 10])
+            finally:
+                conn.close()
+
+    def test_concurrent_startup_migrates_once(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            db_path = f"{td}/t.sqlite3"
+            errors: list[BaseException] = []
+
+            def start() -> None:
+                conn = open_db(db_path)
+                try:
+                    init_db(conn)
+                except BaseException as e:  # pragma: no cover - reported below
+                    errors.append(e)
+                finally:
+                    conn.close()
+
+            threads = [threading.Thread(target=start) for _ in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(errors, [])
+
+            conn = open_db(db_path)
+            try:
+                self.assertEqual(schema_version(conn), SCHEMA_MIGRATIONS[-1].version)
+                enqueue_event(conn, source="test", event_id="e", payload={})
+                self.assertEqual(conn.execute("SELECT COUNT(*) FROM ready_queue").fetchone()[0], 1)
+            finally:
+                conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
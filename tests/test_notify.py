@@ -0,0 +1,88 @@
+import tempfile
+import threading
+import time
+import unittest
+
+from app.db import claim_events, enqueue_event, get_event_row, init_db, mark_retry, next_ready_at, open_db
+from app.notify import InProcessChannel, UnixSocketChannel
+from app.worker import run_worker
+
+
+class TestWakeupChannels(unittest.TestCase):
+    def _check_channel(self, channel) -> None:
+        listener = channel.listen()
+        try:
+            self.assertFalse(listener.wait(0.05))
+
+            # A notification sent before `wait` is not lost.
+            channel.notify()
+            channel.notify()
+            self.assertTrue(listener.wait(1.0))
+            self.assertFalse(listener.wait(0.05))
+
+            threading.Timer(0.05, channel.notify).start()
+            t0 = time.monotonic()
+            self.assertTrue(listener.wait(5.0))
+            self.assertLess(time.monotonic() - t0, 1.0)
+        finally:
+            listener.close()
+
+    def test_in_process_channel(self) -> None:
+        self._check_channel(InProcessChannel())
+
+    def test_unix_socket_channel(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            channel = UnixSocketChannel(f"{td}/wake")
+            self._check_channel(channel)
+
+            stale = channel.listen()
+            stale._sock.close()
+            channel.notify()
+            self.assertFalse(stale.path.exists())
+
+
+class TestWorkerWakeup(unittest.TestCase):
+    def test_next_ready_at_tracks_earliest_retry(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            conn = open_db(f"{td}/t.sqlite3")
+            try:
+                init_db(conn)
+                self.assertIsNone(next_ready_at(conn))
+                row_id = enqueue_event(conn, source="test", event_id="e1", payload={})
+                claim_events(conn, limit=1)
+                self.assertIsNone(next_ready_at(conn))
+                mark_retry(conn, event_id=row_id, attempt_count=1, next_attempt_at="2100-01-01T00:00:00+00:00", error="x")
+                self.assertEqual(next_ready_at(conn), 4102444800.0)
+            finally:
+                conn.close()
+
+    def test_idle_worker_wakes_on_notify_and_stops(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            db_path = f"{td}/t.sqlite3"
+            conn = open_db(db_path)
+            init_db(conn)
+            channel = InProcessChannel()
+            stop = threading.Event()
+            worker = threading.Thread(
+                target=run_worker,
+                kwargs={"db_path": db_path, "wakeup": channel, "idle_timeout": 30.0, "stop_event": stop},
+            )
+            worker.start()
+            try:
+                time.sleep(0.2)
+                row_id = enqueue_event(conn, source="test", event_id="e1", payload={})
+                channel.notify()
+                deadline = time.monotonic() + 3.0
+                while get_event_row(conn, event_row_id=row_id)["status"] != "done" and time.monotonic() < deadline:
+                    time.sleep(0.02)
+                self.assertEqual(get_event_row(conn, event_row_id=row_id)["status"], "done")
+            finally:
+                stop.set()
+                channel.notify()
+                worker.join(timeout=5)
+                conn.close()
+            self.assertFalse(worker.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from app.ai_cache import INSTALLED, PROPOSED, ProviderSignature, payload_shape, signature_conditions
+from app.db import init_db, open_db
+from app.detect_provider import SignatureSet
+from app.mapper import route_event
+from app.queue_store import SqliteQueueStore
+from app.settings import Settings
+
+
+ANSWER = {
+    "provider": "acme",
+    "confidence": 0.95,
+    "event_type": "order.created",
+    "event_type_path": "kind",
+    "event_id": "d0",
+    "event_id_path": "id",
+    "notes": "",
+}
+
+
+def _payload(i: int) -> dict:
+    return {
+        "path": "/webhooks/acme",
+        "content_type": "application/json",
+        "headers": {"Content-Type": "application/json", "User-Agent": "acme/1", "X-Acme-Delivery": f"d{i}"},
+        "json": {"kind": f"order.e{i}", "id": f"d{i}", "data": {}},
+    }
+
+
+class TestSignatureConditions(unittest.TestCase):
+    def test_uses_path_content_type_distinctive_headers_and_json_keys(self) -> None:
+        conditions = signature_conditions(payload_shape(_payload(1)), event_type_path="kind", event_id_path="id")
+        self.assertEqual(
+            conditions["all"],
+            [
+                {"op": "path_equals", "value": "/webhooks/acme"},
+                {"op": "content_type_equals", "value": "application/json"},
+                {"op": "header_present", "name": "x-acme-delivery"},
+                {"op": "json_path_exists", "path": "kind"},
+                {"op": "json_path_exists", "path": "id"},
+                {"op": "json_path_exists", "path": "data"},
+            ],
+        )
+
+    def test_generic_shapes_are_not_promoted(self) -> None:
+        shape = payload_shape({"headers": {"Content-Type": "application/json", "X-Forwarded-For": "1"}, "json": {"type": "x"}})
+        self.assertIsNone(signature_conditions(shape, event_type_path="type", event_id_path=None))
+        # A common envelope is not enough without a distinctive header.
+        envelope = payload_shape({"path": "/hooks", "json": {"id": "1", "type": "x", "data": {}}})
+        self.assertIsNone(signature_conditions(envelope, event_type_path="type", event_id_path="id"))
+        wide = payload_shape({"path": "/hooks", "json": {"id": "1", "type": "x", "data": {}, "account": "a", "ts": 1}})
+        self.assertIsNotNone(signature_conditions(wide, event_type_path="type", event_id_path="id"))
+
+    def test_signature_does_not_match_other_paths(self) -> None:
+        signature = ProviderSignature(
+            name="acme",
+            provider="acme",
+            confidence=0.95,
+            conditions=signature_conditions(payload_shape(_payload(1)), event_type_path="kind", event_id_path="id"),
+            event_type_path="kind",
+            status=INSTALLED,
+        )
+        signatures = SignatureSet([signature])
+        self.assertIsNotNone(signatures.match(_payload(2)))
+        other = _payload(3)
+        other["path"] = "/webhooks/other"
+        self.assertIsNone(signatures.match(other))
+
+
+class TestSignaturePromotion(unittest.TestCase):
+    def setUp(self) -> None:
+        self._td = tempfile.TemporaryDirectory()
+        self.addCleanup(self._td.cleanup)
+        conn = open_db(f"{self._td.name}/t.sqlite3")
+        self.addCleanup(conn.close)
+        init_db(conn)
+        self.store = SqliteQueueStore(conn)
+
+    def route(self, i: int, *, install: bool, verify_interval: float = 0.2):
+        settings = Settings(
+            mapper_use_ai=True,
+            mapper_promote_min_agreements=2,
+            mapper_promote_min_events=3,
+            mapper_promote_install=install,
+            mapper_promote_verify_interval_seconds=verify_interval,
+        )
+        with mock.patch("app.mapper.get_settings", return_value=settings), mock.patch(
+            "app.mapper.ai_detect_provider", return_value=ANSWER
+        ) as ai, mock.patch("builtins.print"):
+            decision = route_event(self.store, _payload(i))
+        return decision, ai.call_count
+
+    def test_stable_classification_is_installed_and_skips_the_model(self) -> None:
+        calls = sum(self.route(i, install=True)[1] for i in range(3))
+        self.assertEqual(calls, 1)
+        self.assertEqual(self.store.list_provider_signatures(), [])  # one answer is not "consistent" yet
+
+        # Once the verify interval has passed, the next cached event is classified again.
+        time.sleep(0.25)
+        self.assertEqual(self.route(3, install=True)[1], 1)
+        (signature,) = self.store.list_provider_signatures()
+        self.assertEqual((signature.provider, signature.status, signature.event_type_path), ("acme", INSTALLED, "kind"))
+
+        decision, calls = self.route(4, install=True)
+        self.assertEqual(calls, 0)
+        self.assertEqual((decision.provider, decision.event_type), ("acme", "order.e4"))
+        self.assertIn(f"signature:{signature.name}", decision.reasons)
+        self.assertIsNone(decision.ai_detection)
+
+    def test_cache_hits_alone_do_not_add_agreements(self) -> None:
+        calls = sum(self.route(i, install=True, verify_interval=3600)[1] for i in range(50))
+        self.assertEqual(calls, 1)
+        self.assertEqual(self.store.list_provider_signatures(), [])
+        (shape,) = self.store.list_shape_classifications()
+        self.assertEqual((shape.hits, shape.misses, shape.agreements), (49, 1, 1))
+
+    def test_proposed_signature_is_used_once_installed(self) -> None:
+        for i in range(3):
+            self.route(i, install=False)
+        time.sleep(0.25)
+        self.route(3, install=False)
+        (signature,) = self.store.list_provider_signatures(status=PROPOSED)
+        self.assertEqual(self.route(4, install=False)[1], 0)  # still answered by the cache, not the signature
+        # A promoted shape is not re-verified any more.
+        time.sleep(0.25)
+        self.assertNotIn(f"signature:{signature.name}", self.route(5, install=False)[0].reasons)
+
+        self.assertTrue(self.store.set_provider_signature_status(name=signature.name, status=INSTALLED))
+        decision, _ = self.route(6, install=False)
+        self.assertIn(f"signature:{signature.name}", decision.reasons)
+        # Event 3 found the entry and re-verified it, so it counts as a hit and a miss.
+        self.assertEqual(self.store.shape_cache_stats(), {"shapes": 1, "expired": 0, "hits": 5, "misses": 2})
+
+if __name__ == "__main__":
+    unittest.main()
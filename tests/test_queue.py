@@ -0,0 +1,263 @@
+import json
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from app.db import (
+    claim_events,
+    claim_next_event,
+    enqueue_event,
+    get_event_row,
+    get_queue_stats,
+    init_db,
+    list_dead_letters,
+    mark_done,
+    mark_error,
+    mark_retry,
+    open_db,
+    reap_expired_leases,
+    release_events,
+    renew_leases,
+)
+from app.queue_store import SqliteQueueStore
+from app.worker import _record_failure, run_worker, run_worker_pool
+
+
+class TestBatchClaim(unittest.TestCase):
+    def test_claim_events_claims_oldest_first_up_to_limit(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            conn = open_db(f"{td}/t.sqlite3")
+            try:
+                init_db(conn)
+                ids = [enqueue_event(conn, source="test", event_id=f"evt_{i}", payload={"i": i}) for i in range(5)]
+
+                batch = claim_events(conn, limit=3)
+                self.assertEqual([e.id for e in batch], ids[:3])
+                self.assertTrue(all(e.status == "processing" for e in batch))
+                self.assertEqual([e.payload["i"] for e in batch], [0, 1, 2])
+
+                rest = claim_events(conn, limit=10)
+                self.assertEqual([e.id for e in rest], ids[3:])
+                self.assertEqual(claim_events(conn, limit=10), [])
+                self.assertIsNone(claim_next_event(conn))
+            finally:
+                conn.close()
+
+    def test_run_worker_drains_a_batch_per_poll(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            db_path = f"{td}/t.sqlite3"
+            conn = open_db(db_path)
+            try:
+                init_db(conn)
+                ids = [enqueue_event(conn, source="test", event_id=f"evt_{i}", payload={"i": i}) for i in range(4)]
+
+                run_worker(db_path=db_path, run_once=True, batch_size=3)
+
+                statuses = [get_event_row(conn, event_row_id=i)["status"] for i in ids]
+                self.assertEqual(statuses, ["done", "done", "done", "pending"])
+            finally:
+                conn.close()
+
+    def test_ready_queue_tracks_only_claimable_events(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            conn = open_db(f"{td}/t.sqlite3")
+            try:
+                init_db(conn)
+                a = enqueue_event(conn, source="test", event_id="evt_a", payload={})
+                b = enqueue_event(conn, source="test", event_id="evt_b", payload={})
+
+                def ready_ids() -> list[int]:
+                    return [int(r[0]) for r in conn.execute("SELECT event_row_id FROM ready_queue ORDER BY event_row_id")]
+
+                self.assertEqual(ready_ids(), [a, b])
+                (event,) = claim_events(conn, limit=1)
+                self.assertEqual(ready_ids(), [b])
+
+                # A retry scheduled in the future is queued but not yet claimable.
+                mark_retry(conn, event_id=event.id, attempt_count=1, next_attempt_at="2999-01-01T00:00:00+00:00", error="x")
+                self.assertEqual(ready_ids(), [a, b])
+                self.assertEqual([e.id for e in claim_events(conn, limit=10)], [b])
+            finally:
+                conn.close()
+
+    def test_ready_queue_without_priority_is_rebuilt(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            conn = open_db(f"{td}/t.sqlite3")
+            try:
+                init_db(conn)
+                a = enqueue_event(conn, source="test", event_id="evt_a", payload={})
+                b = enqueue_event(conn, source="test", event_id="evt_b", payload={}, priority=1)
+                # Simulate a database created before priority lanes existed.
+                conn.execute("DROP TRIGGER events_ready_insert;")
+                conn.execute("DROP TRIGGER events_ready_update;")
+                conn.execute("DROP TABLE ready_queue;")
+                conn.execute(
+                    "CREATE TABLE ready_queue (event_row_id INTEGER PRIMARY KEY, received_epoch INTEGER NOT NULL, "
+                    "ready_epoch INTEGER NOT NULL);"
+                )
+                conn.execute("PRAGMA user_version = 0;")
+
+                init_db(conn)
+                self.assertEqual([e.id for e in claim_events(conn, limit=10)], [b, a])
+            finally:
+                conn.close()
+
+
+class TestWorkerPool(unittest.TestCase):
+    def test_pool_threads_process_slow_events_concurrently(self) -> None:
+        def slow(store, event):
+            time.sleep(0.3)
+            return {"thread": threading.current_thread().name}
+
+        with tempfile.TemporaryDirectory() as td:
+            db_path = f"{td}/t.sqlite3"
+            conn = open_db(db_path)
+            try:
+                init_db(conn)
+                ids = [enqueue_event(conn, source="test", event_id=f"e{i}", payload={}) for i in range(6)]
+                stop = threading.Event()
+                with mock.patch("app.worker.process_event", side_effect=slow):
+                    pool = threading.Thread(
+                        target=run_worker_pool,
+                        kwargs={
+                            "concurrency": 3,
+                            "db_path": db_path,
+                            "poll_interval": 0.05,
+                            # `railway_service` passes WORKER_BATCH_SIZE, 10 by default.
+                            "batch_size": 10,
+                            "stop_event": stop,
+                        },
+                    )
+                    started = time.monotonic()
+                    pool.start()
+                    deadline = started + 5.0
+                    while time.monotonic() < deadline and any(
+                        get_event_row(conn, event_row_id=i)["status"] != "done" for i in ids
+                    ):
+                        time.sleep(0.02)
+                    elapsed = time.monotonic() - started
+                    stop.set()
+                    pool.join(timeout=5)
+
+                self.assertFalse(pool.is_alive())
+                rows = [get_event_row(conn, event_row_id=i) for i in ids]
+                self.assertTrue(all(r["status"] == "done" for r in rows))
+                # Six 0.3s events on three threads: about two rounds, not six.
+                self.assertLess(elapsed, 1.5)
+                self.assertGreater(len({json.loads(r["result_json"])["thread"] for r in rows}), 1)
+            finally:
+                conn.close()
+
+
+class TestLeases(unittest.TestCase):
+    def test_expired_lease_is_reaped_and_reclaimed_by_another_worker(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            conn = open_db(f"{td}/t.sqlite3")
+            try:
+                init_db(conn)
+                row_id = enqueue_event(conn, source="test", event_id="evt_1", payload={})
+
+                (event,) = claim_events(conn, limit=1, lease_owner="worker-a", lease_seconds=-1)
+                self.assertEqual(event.lease_owner, "worker-a")
+                self.assertEqual(renew_leases(conn, event_ids=[row_id], lease_owner="worker-b"), set())
+
+                self.assertEqual(reap_expired_leases(conn, max_attempts=8), 1)
+                row = get_event_row(conn, event_row_id=row_id)
+                self.assertEqual(row["status"], "retry")
+                self.assertEqual(row["attempt_count"], 1)
+                self.assertIsNone(row["lease_owner"])
+                # The expiry is a failed attempt and backs off like one instead of being reclaimed at once.
+                self.assertGreater(row["next_attempt_at"], row["processing_started_at"])
+                self.assertEqual(claim_events(conn, limit=1, lease_owner="worker-b"), [])
+
+                conn.execute("UPDATE events SET next_attempt_at=? WHERE id=?", (row["processing_started_at"], row_id))
+                (again,) = claim_events(conn, limit=1, lease_owner="worker-b")
+                self.assertEqual(again.id, row_id)
+
+                # The original owner lost the lease, so its late result is rejected.
+                self.assertFalse(mark_done(conn, event_id=row_id, result={"late": True}, lease_owner="worker-a"))
+                self.assertTrue(mark_done(conn, event_id=row_id, result={"ok": True}, lease_owner="worker-b"))
+            finally:
+                conn.close()
+
+    def test_reaper_errors_event_after_max_attempts(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            conn = open_db(f"{td}/t.sqlite3")
+            try:
+                init_db(conn)
+                row_id = enqueue_event(conn, source="test", event_id="evt_1", payload={})
+                claim_events(conn, limit=1, lease_owner="worker-a", lease_seconds=-1)
+
+                self.assertEqual(reap_expired_leases(conn, max_attempts=1), 1)
+                self.assertEqual(get_event_row(conn, event_row_id=row_id)["status"], "error")
+                [dead] = list_dead_letters(conn)
+                self.assertEqual(dead["event_row_id"], row_id)
+                self.assertTrue(dead["error"].startswith("lease expired"))
+            finally:
+                conn.close()
+
+    def test_failure_after_a_lost_lease_is_discarded_not_logged(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            conn = open_db(f"{td}/t.sqlite3")
+            try:
+                init_db(conn)
+                store = SqliteQueueStore(conn)
+                row_id = enqueue_event(conn, source="test", event_id="evt_1", payload={})
+                (event,) = claim_events(conn, limit=1, lease_owner="worker-a", lease_seconds=-1)
+                reap_expired_leases(conn, max_attempts=8)
+
+                for max_attempts, kind in ((8, "retry"), (1, "error")):
+                    with mock.patch("builtins.print") as printed:
+                        _record_failure(store, event, "boom", max_attempts=max_attempts, lease_owner="worker-a")
+                    (line,) = [c.args[0] for c in printed.call_args_list]
+                    self.assertEqual(line, f"[lease-lost] id={row_id} source=test {kind} discarded")
+                row = get_event_row(conn, event_row_id=row_id)
+                self.assertEqual((row["status"], row["lease_owner"], row["attempt_count"]), ("retry", None, 1))
+            finally:
+                conn.close()
+
+    def test_release_returns_events_without_counting_an_attempt(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            conn = open_db(f"{td}/t.sqlite3")
+            try:
+                init_db(conn)
+                row_id = enqueue_event(conn, source="test", event_id="evt_1", payload={})
+                claim_events(conn, limit=1, lease_owner="worker-a")
+
+                self.assertEqual(release_events(conn, event_ids=[row_id], lease_owner="worker-a"), 1)
+                row = get_event_row(conn, event_row_id=row_id)
+                self.assertEqual((row["status"], row["attempt_count"]), ("pending", 0))
+            finally:
+                conn.close()
+
+
+class TestQueueStats(unittest.TestCase):
+    def test_counters_follow_every_transition(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            conn = open_db(f"{td}/t.sqlite3")
+            try:
+                init_db(conn)
+                ids = [enqueue_event(conn, source=f"s{i % 2}", event_id=f"e{i}", payload={}) for i in range(6)]
+                first = conn.execute("SELECT received_at FROM events WHERE id = ?", (ids[0],)).fetchone()[0]
+                self.assertEqual(get_queue_stats(conn)["oldest_ready_received_at"], first)
+
+                a, b, c = claim_events(conn, limit=3)
+                mark_done(conn, event_id=a.id, result={})
+                mark_error(conn, event_id=b.id, attempt_count=8, error="boom")
+                mark_retry(conn, event_id=c.id, attempt_count=1, next_attempt_at="2100-01-01T00:00:00+00:00", error="x")
+                conn.execute("DELETE FROM events WHERE id = ?", (a.id,))
+
+                stats = get_queue_stats(conn)
+                expected: dict[str, dict[str, int]] = {}
+                for row in conn.execute("SELECT source, status, COUNT(*) FROM events GROUP BY source, status"):
+                    expected.setdefault(row[0], {})[row[1]] = row[2]
+                self.assertEqual(stats["by_source"], expected)
+                self.assertEqual(stats["totals"], {"pending": 3, "error": 1, "retry": 1})
+            finally:
+                conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,389 @@
+import os
+import tempfile
+import time
+import unittest
+import uuid
+
+from app.ai_cache import ProviderSignature
+from app.db import NewEvent
+from app.queue_store import QueueStore, SqliteQueueStore, open_queue_store
+from app.settings import Settings
+
+
+class QueueStoreContract:
+    """
+    Behaviour every `QueueStore` backend must share. Subclasses provide `open_store()`.
+    """
+
+    store: QueueStore
+
+    def open_store(self) -> QueueStore:
+        raise NotImplementedError
+
+    def setUp(self) -> None:
+        self.store = self.open_store()
+        self.store.init()
+
+    def tearDown(self) -> None:
+        self.store.close()
+
+    def test_enqueue_claim_and_mark_done(self) -> None:
+        ids = [self.store.enqueue_event(source="test", event_id=f"evt_{i}", payload={"i": i}) for i in range(3)]
+
+        batch = self.store.claim_events(limit=2, lease_owner="w1")
+        self.assertEqual([e.id for e in batch], ids[:2])
+        self.assertEqual([e.payload["i"] for e in batch], [0, 1])
+        self.assertTrue(all(e.status == "processing" and e.lease_owner == "w1" for e in batch))
+
+        self.assertFalse(self.store.mark_done(event_id=ids[0], result={"ok": True}, lease_owner="w2"))
+        self.assertTrue(self.store.mark_done(event_id=ids[0], result={"ok": True}, lease_owner="w1"))
+
+        row = self.store.get_event_row(event_row_id=ids[0])
+        self.assertEqual(row["status"], "done")
+        self.assertIn('"ok"', row["result_json"])
+        self.assertIn('"i"', row["payload_json"])
+
+        rest = self.store.claim_events(limit=10, lease_owner="w1")
+        self.assertEqual([e.id for e in rest], ids[2:])
+
+    def test_duplicate_event_id_is_rejected(self) -> None:
+        self.store.enqueue_event(source="test", event_id="dup", payload={})
+        with self.assertRaises(Exception):
+            self.store.enqueue_event(source="test", event_id="dup", payload={})
+
+    def test_enqueue_events_returns_new_or_existing_ids(self) -> None:
+        existing = self.store.enqueue_event(source="ff", event_id="m1", payload={"n": 1})
+
+        results = self.store.enqueue_events(
+            [
+                NewEvent(source="ff", event_id="m1", payload={"n": 1}),
+                NewEvent(source="ff", event_id="m2", payload={"n": 2}),
+                NewEvent(source="ff", event_id="m2", payload={"n": 2}),
+                NewEvent(source="ff", event_id=None, payload={"n": 3}),
+            ]
+        )
+
+        self.assertEqual([r.inserted for r in results], [False, True, False, True])
+        self.assertEqual(results[0].row_id, existing)
+        self.assertEqual(results[1].row_id, results[2].row_id)
+        self.assertEqual(self.store.get_event_row(event_row_id=results[3].row_id)["event_id"], None)
+        self.assertEqual(len(self.store.claim_events(limit=10)), 3)
+
+    def test_priority_lanes_claim_before_fifo(self) -> None:
+        bulk = [self.store.enqueue_event(source="test", event_id=f"bulk_{i}", payload={"i": i}) for i in range(3)]
+        urgent = self.store.enqueue_event(source="test", event_id="urgent", payload={}, priority=0)
+        (late,) = self.store.enqueue_events([NewEvent(source="test", event_id="late", payload={}, priority=200)])
+
+        batch = self.store.claim_events(limit=10)
+        self.assertEqual([e.id for e in batch], [urgent, *bulk, late.row_id])
+        self.assertEqual([e.priority for e in batch], [0, 100, 100, 100, 200])
+
+    def test_fair_share_claims_interleave_sources(self) -> None:
+        for i in range(5):
+            self.store.enqueue_event(source="noisy", event_id=f"n{i}", payload={})
+        quiet = self.store.enqueue_event(source="quiet", event_id="q", payload={})
+
+        order = [e.id for _ in range(6) for e in self.store.claim_events(limit=1, fair_weights={})]
+        self.assertEqual(len(order), 6)
+        # FIFO would claim it last; with round-robin it comes within the first rotation.
+        self.assertLess(order.index(quiet), 3)
+
+    def test_queue_stats(self) -> None:
+        ids = [self.store.enqueue_event(source=f"s{i % 2}", event_id=f"e{i}", payload={}) for i in range(4)]
+        [event] = self.store.claim_events(limit=1)
+        self.store.mark_done(event_id=event.id, result={})
+
+        stats = self.store.get_queue_stats()
+        self.assertEqual(stats["totals"], {"pending": 3, "done": 1})
+        self.assertEqual(stats["by_source"][event.source], {"pending": 1, "done": 1})
+        ready = [self.store.get_event_row(event_row_id=i)["received_at"] for i in ids if i != event.id]
+        self.assertEqual(stats["oldest_ready_received_at"], min(ready))
+
+    def test_dead_letters_filter_and_requeue(self) -> None:
+        ids = [self.store.enqueue_event(source=f"s{i % 2}", event_id=f"e{i}", payload={}) for i in range(4)]
+        for event in self.store.claim_events(limit=4):
+            error = "Timeout: agent" if event.source == "s0" else "HTTP 500"
+            self.store.mark_error(event_id=event.id, attempt_count=8, error=error)
+
+        self.assertEqual(self.store.count_dead_letters(), 4)
+        self.assertEqual(self.store.count_dead_letters(until="2000-01-01T00:00:00+00:00"), 0)
+        timeouts = self.store.list_dead_letters(error_prefix="Timeout")
+        self.assertEqual(sorted(r["event_row_id"] for r in timeouts), [ids[0], ids[2]])
+        self.assertEqual({r["source"] for r in self.store.list_dead_letters(source="s1")}, {"s1"})
+
+        self.assertEqual(self.store.requeue_dead_letters(event_ids=[r["event_row_id"] for r in timeouts]), 2)
+        self.assertEqual(self.store.count_dead_letters(), 2)
+        self.assertEqual(self.store.count_dead_letters(error_prefix="Timeout"), 0)
+        requeued = self.store.claim_events(limit=10)
+        self.assertEqual(sorted(e.id for e in requeued), [ids[0], ids[2]])
+        self.assertTrue(all(e.attempt_count == 0 for e in requeued))
+
+    def test_release_and_reap(self) -> None:
+        a = self.store.enqueue_event(source="test", event_id="a", payload={})
+        b = self.store.enqueue_event(source="test", event_id="b", payload={})
+        self.store.claim_events(limit=2, lease_owner="w1", lease_seconds=60)
+
+        self.assertEqual(self.store.renew_leases(event_ids=[a, b], lease_owner="w1", lease_seconds=60), {a, b})
+        self.assertEqual(self.store.release_events(event_ids=[b], lease_owner="w1"), 1)
+        self.assertEqual(self.store.get_event_row(event_row_id=b)["status"], "pending")
+
+        self.assertEqual(self.store.renew_leases(event_ids=[a], lease_owner="w1", lease_seconds=-1), {a})
+        self.assertEqual(self.store.reap_expired_leases(max_attempts=1), 1)
+        self.assertEqual(self.store.get_event_row(event_row_id=a)["status"], "error")
+
+        # Below max_attempts the expired lease is retried, after the first retry backoff (2s).
+        self.assertEqual([e.id for e in self.store.claim_events(limit=1, lease_owner="w2", lease_seconds=-1)], [b])
+        self.assertEqual(self.store.reap_expired_leases(max_attempts=8), 1)
+        self.assertEqual(self.store.get_event_row(event_row_id=b)["status"], "retry")
+        self.assertEqual(self.store.claim_events(limit=1, lease_owner="w3"), [])
+        self.assertGreater(self.store.next_ready_at(), time.time())
+
+    def test_handler_limits_defer_without_counting_attempts(self) -> None:
+        self.assertIsNone(self.store.acquire_handler_permit(limit_keys=["slack"], event_row_id=1))
+        self.store.upsert_handler_limit(limit_key="slack", max_concurrency=1)
+        a = self.store.enqueue_event(source="test", event_id="a", payload={})
+        b = self.store.enqueue_event(source="test", event_id="b", payload={})
+        c = self.store.enqueue_event(source="test", event_id="c", payload={})
+        self.store.claim_events(limit=3, lease_owner="w1")
+
+        self.assertTrue(self.store.acquire_handler_permit(limit_keys=["slack", "p/x"], event_row_id=a).admitted)
+        blocked = self.store.acquire_handler_permit(limit_keys=["slack"], event_row_id=b)
+        self.assertFalse(blocked.admitted)
+        self.assertEqual(blocked.blocked_by, "slack")
+        # The next waiter re-checks one slot later, not at the same time.
+        behind = self.store.acquire_handler_permit(limit_keys=["slack"], event_row_id=c)
+        self.assertAlmostEqual(behind.retry_at - blocked.retry_at, 1.0, delta=0.1)
+
+        self.assertTrue(self.store.defer_event(event_id=b, retry_epoch=blocked.retry_at, lease_owner="w1"))
+        row = self.store.get_event_row(event_row_id=b)
+        self.assertEqual((row["status"], row["attempt_count"]), ("pending", 0))
+        self.assertEqual(self.store.claim_events(limit=1, lease_owner="w1"), [])
+
+        self.assertEqual(self.store.renew_handler_permits(event_ids=[a]), 1)
+        self.store.release_handler_permits(event_row_id=a)
+        self.assertTrue(self.store.acquire_handler_permit(limit_keys=["slack"], event_row_id=b).admitted)
+        self.assertEqual([limit.limit_key for limit in self.store.list_handler_limits()], ["slack"])
+
+    def test_circuit_breaker_opens_and_probes(self) -> None:
+        key = {"handler_mode": "agent", "handler_target": "mcp"}
+        limits = {"failure_threshold": 2, "open_seconds": 60.0, "max_open_seconds": 600.0}
+        self.assertIsNone(self.store.check_circuit(event_row_id=1, **key))
+        self.assertIsNone(self.store.record_circuit_result(event_row_id=1, ok=False, **key, **limits))
+        opened = self.store.record_circuit_result(event_row_id=2, ok=False, error="boom", **key, **limits)
+        self.assertEqual(opened.state, "open")
+        self.assertIsNotNone(self.store.check_circuit(event_row_id=3, **key))
+        breakers = [(b.handler_target, b.state, b.last_error) for b in self.store.list_circuit_breakers()]
+        self.assertEqual(breakers, [("mcp", "open", "boom")])
+        self.assertEqual(self.store.record_circuit_result(event_row_id=4, ok=True, **key, **limits).state, "closed")
+        self.assertIsNone(self.store.check_circuit(event_row_id=3, **key))
+
+    def test_route_decisions_are_kept_until_rerouted(self) -> None:
+        event_row_id = self.store.enqueue_event(source="test", event_id="e", payload={})
+        self.assertIsNone(self.store.get_route_decision(event_row_id=event_row_id))
+        self.assertIsNone(self.store.get_config_version())
+        self.store.set_config_version(version=3)
+        self.assertEqual(self.store.get_config_version(), 3)
+
+        decision = {"provider": "github", "action": "triage", "reasons": ["rule:push"]}
+        self.store.save_route_decision(event_row_id=event_row_id, decision=decision, config_version=3)
+        stored = self.store.get_route_decision(event_row_id=event_row_id)
+        self.assertEqual((stored["decision"], stored["config_version"]), (decision, 3))
+
+        (event,) = self.store.claim_events(limit=1)
+        self.store.mark_error(event_id=event.id, attempt_count=8, error="HTTP 500")
+        self.assertEqual(self.store.requeue_dead_letters(event_ids=[event_row_id]), 1)
+        self.assertIsNotNone(self.store.get_route_decision(event_row_id=event_row_id))
+        (event,) = self.store.claim_events(limit=1)
+        self.store.mark_error(event_id=event.id, attempt_count=8, error="HTTP 500")
+        self.assertEqual(self.store.requeue_dead_letters(event_ids=[event_row_id], reroute=True), 1)
+        self.assertIsNone(self.store.get_route_decision(event_row_id=event_row_id))
+
+    def test_shape_classification_cache(self) -> None:
+        self.assertIsNone(self.store.lookup_shape_classification(fingerprint="f1"))
+        self.store.save_shape_classification(
+            fingerprint="f1", provider="acme", confidence=0.9, event_type_path="type", ttl_seconds=60
+        )
+        self.store.save_shape_classification(fingerprint="f2", provider="unknown", confidence=0.1, ttl_seconds=-1)
+        shape = self.store.lookup_shape_classification(fingerprint="f1")
+        self.assertEqual((shape.provider, shape.event_type_path, shape.event_id_path, shape.hits), ("acme", "type", None, 1))
+        self.assertIsNone(self.store.lookup_shape_classification(fingerprint="f2"))
+        self.assertEqual([s.fingerprint for s in self.store.list_shape_classifications()], ["f1", "f2"])
+        self.assertEqual(self.store.shape_cache_stats(), {"shapes": 2, "expired": 1, "hits": 1, "misses": 2})
+
+    def test_provider_signatures(self) -> None:
+        self.assertIsNone(self.store.get_provider_signatures_revision())
+        saved = self.store.save_shape_classification(
+            fingerprint="f1", provider="acme", confidence=0.9, event_type_path="type", ttl_seconds=60, shape={"headers": []}
+        )
+        again = self.store.save_shape_classification(
+            fingerprint="f1", provider="acme", confidence=0.95, event_type_path="type", ttl_seconds=60
+        )
+        self.assertEqual((saved.agreements, again.agreements, again.misses, again.shape), (1, 2, 2, {"headers": []}))
+        # Answers within the interval of the last agreement (workers missing a shape at once) add none.
+        for _ in range(2):
+            again = self.store.save_shape_classification(
+                fingerprint="f1", provider="acme", confidence=0.95, event_type_path="type", ttl_seconds=60,
+                agreement_interval_seconds=60,
+            )
+        self.assertEqual((again.agreements, again.misses), (2, 4))
+        self.assertGreater(again.verify_after_epoch, again.agreed_epoch)
+        self.assertFalse(self.store.claim_shape_verification(fingerprint="f1", interval_seconds=60))
+        self.store.save_shape_classification(
+            fingerprint="f1", provider="acme", confidence=0.95, event_type_path="type", ttl_seconds=60
+        )
+        self.assertEqual(
+            [self.store.claim_shape_verification(fingerprint="f1", interval_seconds=60) for _ in range(2)], [True, False]
+        )
+
+        signature = ProviderSignature(
+            name="acme-f1",
+            provider="acme",
+            confidence=0.95,
+            conditions={"all": [{"op": "header_present", "name": "x-acme"}]},
+            event_type_path="type",
+            fingerprint="f1",
+        )
+        self.assertTrue(self.store.add_provider_signature(signature=signature))
+        self.assertFalse(self.store.add_provider_signature(signature=signature))
+        self.assertTrue(self.store.lookup_shape_classification(fingerprint="f1").promoted)
+        (listed,) = self.store.list_provider_signatures(status="proposed")
+        self.assertEqual((listed.conditions, listed.event_type_path), (signature.conditions, "type"))
+
+        self.assertTrue(self.store.set_provider_signature_status(name="acme-f1", status="installed"))
+        revision = self.store.get_provider_signatures_revision()
+        self.assertIsNotNone(revision)
+        self.assertFalse(self.store.set_provider_signature_status(name="acme-f1", status="installed"))
+        self.assertEqual(self.store.get_provider_signatures_revision(), revision)
+        self.assertEqual(self.store.list_provider_signatures(status="proposed"), [])
+
+    def test_action_runs_and_routing_config(self) -> None:
+        event_row_id = self.store.enqueue_event(source="test", event_id="e", payload={"x": 1})
+        run_id = self.store.create_action_run(
+            event_row_id=event_row_id,
+            provider="github",
+            action="triage",
+            handler_mode="noop",
+            handler_target=None,
+            input_obj={"payload": {"x": 1}},
+        )
+        again = self.store.create_action_run(
+            event_row_id=event_row_id,
+            provider="github",
+            action="triage",
+            handler_mode="noop",
+            handler_target=None,
+            input_obj={"payload": {"x": 1}},
+        )
+        self.assertEqual(run_id, again)
+
+        self.store.finish_action_run(run_id=run_id, status="done", output_obj={"y": 2})
+        run = self.store.get_action_run_for_event_action(event_row_id=event_row_id, action="triage")
+        self.assertEqual(run["status"], "done")
+        self.assertIn('"y"', run["output_json"])
+        self.assertEqual([r["id"] for r in self.store.list_action_runs_for_event(event_row_id=event_row_id)], [run_id])
+
+        self.store.upsert_provider_mapping(provider="github", action="triage")
+        self.assertIsNone(self.store.get_provider_mapping(provider="github").queue_priority)
+        self.store.upsert_provider_mapping(provider="github", action="triage", queue_priority=5)
+        self.assertEqual(self.store.get_provider_mapping(provider="github").queue_priority, 5)
+        self.store.upsert_routing_rule(
+            provider="github",
+            name="push",
+            priority=10,
+            conditions={"all": [{"op": "header_present", "name": "x-github-event"}]},
+            action="on_push",
+        )
+        self.assertEqual(self.store.get_provider_mapping(provider="github").action, "triage")
+        revision = self.store.get_routing_rules_revision()
+        self.assertIsNotNone(revision)
+        self.store.upsert_routing_rule(
+            provider="github", name="push", priority=10, conditions={"op": "header_present", "name": "x-github-event"}, action="on_push"
+        )
+        self.assertNotEqual(self.store.get_routing_rules_revision(), revision)
+        rules = self.store.list_routing_rules(provider="github")
+        self.assertEqual([r.name for r in rules], ["push"])
+        self.assertTrue(rules[0].enabled)
+
+
+class TestSqliteQueueStore(QueueStoreContract, unittest.TestCase):
+    def open_store(self) -> QueueStore:
+        self._td = tempfile.TemporaryDirectory()
+        self.addCleanup(self._td.cleanup)
+        return SqliteQueueStore.open(f"{self._td.name}/t.sqlite3")
+
+
+class TestShardedQueueStore(QueueStoreContract, unittest.TestCase):
+    def open_store(self) -> QueueStore:
+        self._td = tempfile.TemporaryDirectory()
+        self.addCleanup(self._td.cleanup)
+        return open_queue_store(settings=Settings(app_db_path=f"{self._td.name}/t.sqlite3", queue_shards=3))
+
+
+@unittest.skipUnless(os.getenv("TEST_DATABASE_URL"), "TEST_DATABASE_URL not set")
+class TestPostgresQueueStore(QueueStoreContract, unittest.TestCase):
+    def open_store(self) -> QueueStore:
+        from app.pg_store import PostgresQueueStore
+
+        store = PostgresQueueStore.connect(os.environ["TEST_DATABASE_URL"])
+        schema = f"test_{uuid.uuid4().hex[:12]}"
+        store.conn.execute(f"CREATE SCHEMA {schema}")
+        store.conn.execute(f"SET search_path TO {schema}")
+        self._schema = schema
+        return store
+
+    def tearDown(self) -> None:
+        self.store.conn.execute(f"DROP SCHEMA {self._schema} CASCADE")
+        super().tearDown()
+
+    def _second_connection(self):
+        from app.pg_store import PostgresQueueStore
+
+        other = PostgresQueueStore.connect(os.environ["TEST_DATABASE_URL"])
+        self.addCleanup(other.close)
+        other.conn.execute(f"SET search_path TO {self._schema}")
+        return other
+
+    def test_init_on_a_current_schema_takes_no_table_locks(self) -> None:
+        from app.pg_store import PG_SCHEMA_MIGRATIONS
+
+        self.assertEqual(self.store.schema_version(), PG_SCHEMA_MIGRATIONS[-1].version)
+        # A claim in flight holds a row lock on `events`; ALTER TABLE would queue behind it.
+        self.store.enqueue_event(source="test", event_id="e1", payload={})
+        with self.store.conn.transaction():
+            self.store.conn.execute("SELECT id FROM events FOR UPDATE").fetchall()
+            other = self._second_connection()
+            other.conn.execute("SET lock_timeout = '200ms'")
+            other.init()
+            self.assertEqual(other.schema_version(), PG_SCHEMA_MIGRATIONS[-1].version)
+
+    def test_init_upgrades_an_unversioned_schema(self) -> None:
+        from app.pg_store import PG_SCHEMA_MIGRATIONS
+
+        # A database created before the schema was versioned: tables and data, no schema_migrations.
+        self.store.enqueue_event(source="test", event_id="e1", payload={})
+        self.store.conn.execute("DROP TABLE schema_migrations")
+        self.store.conn.execute("DROP INDEX events_ready_priority_idx")
+        self.store.conn.execute("ALTER TABLE ai_shape_cache DROP COLUMN agreements, DROP COLUMN verify_after_epoch")
+        self.assertEqual(self.store.schema_version(), 0)
+
+        self.store.init()
+        self.assertEqual(self.store.schema_version(), PG_SCHEMA_MIGRATIONS[-1].version)
+        (event,) = self.store.claim_events(limit=1)
+        self.assertEqual(event.event_id, "e1")
+        valid = self.store.conn.execute(
+            "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = 'events_ready_priority_idx' AND c.relnamespace = current_schema()::regnamespace"
+        ).fetchone()
+        self.assertTrue(valid["indisvalid"])
+        columns = {
+            r["column_name"]
+            for r in self.store.conn.execute(
+                "SELECT column_name FROM information_schema.columns "
+                "WHERE table_schema = current_schema() AND table_name = 'ai_shape_cache'"
+            ).fetchall()
+        }
+        self.assertLessEqual({"agreements", "verify_after_epoch"}, columns)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,182 @@
+import io
+import json
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+from app.db import (
+    claim_events,
+    create_action_run,
+    enqueue_event,
+    finish_action_run,
+    get_event_row,
+    init_db,
+    list_action_runs_for_event,
+    mark_done,
+    mark_error,
+    open_db,
+    requeue_dead_letters,
+)
+from app.queue_store import open_queue_store
+from app import retention
+from app.retention import (
+    archive_finished_events,
+    get_archived_event,
+    reclaim_space,
+    shard_archive_dir,
+    start_store_retention,
+)
+from app.settings import Settings
+
+
+class TestRetention(unittest.TestCase):
+    def test_archives_old_finished_events_and_frees_blobs(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            conn = open_db(f"{td}/t.sqlite3")
+            archive_dir = f"{td}/archive"
+            try:
+                init_db(conn)
+                old = enqueue_event(conn, source="webhook", event_id="evt_old", payload={"n": "x" * 300})
+                recent = enqueue_event(conn, source="webhook", event_id="evt_recent", payload={"n": "y" * 300})
+                pending = enqueue_event(conn, source="webhook", event_id="evt_pending", payload={"n": "z" * 300})
+                claim_events(conn, limit=2)
+
+                run_id = create_action_run(
+                    conn,
+                    event_row_id=old,
+                    provider="p",
+                    action="a",
+                    handler_mode="noop",
+                    handler_target=None,
+                    input_obj={"router": {}, "payload": {"n": "x" * 300}},
+                )
+                finish_action_run(conn, run_id=run_id, status="done", output_obj={"out": 1})
+                mark_done(conn, event_id=old, result={"ok": True})
+                mark_done(conn, event_id=recent, result={"ok": True})
+                conn.execute("UPDATE events SET processed_at='2020-01-05T00:00:00+00:00' WHERE id=?", (old,))
+
+                result = archive_finished_events(conn, archive_dir=archive_dir, older_than_days=30, chunk_size=1)
+                reclaim_space(conn)
+
+                self.assertEqual((result.archived_events, result.archived_action_runs), (1, 1))
+                self.assertIsNone(get_event_row(conn, event_row_id=old))
+                self.assertIsNotNone(get_event_row(conn, event_row_id=recent))
+                self.assertIsNotNone(get_event_row(conn, event_row_id=pending))
+                self.assertEqual(conn.execute("SELECT COUNT(*) FROM action_runs").fetchone()[0], 0)
+                # Only the blobs still referenced by the remaining events survive.
+                self.assertEqual(conn.execute("SELECT COUNT(*) FROM blobs WHERE size > 300").fetchone()[0], 2)
+
+                record = get_archived_event(archive_dir, event_row_id=old)
+                self.assertIsNotNone(record)
+                self.assertEqual(json.loads(record["event"]["payload_json"]), {"n": "x" * 300})
+                self.assertEqual(json.loads(record["action_runs"][0]["output_json"]), {"out": 1})
+                self.assertIsNone(get_archived_event(archive_dir, event_row_id=recent))
+            finally:
+                conn.close()
+
+    def test_event_requeued_after_it_was_picked_is_kept(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            conn = open_db(f"{td}/t.sqlite3")
+            archive_dir = f"{td}/archive"
+            try:
+                init_db(conn)
+                dead = enqueue_event(conn, source="webhook", event_id="evt_dead", payload={"n": "x" * 300})
+                done = enqueue_event(conn, source="webhook", event_id="evt_done", payload={"n": "y" * 300})
+                claim_events(conn, limit=2)
+                run_id = create_action_run(
+                    conn,
+                    event_row_id=dead,
+                    provider="p",
+                    action="a",
+                    handler_mode="noop",
+                    handler_target=None,
+                    input_obj={"payload": {"n": "x" * 300}},
+                )
+                finish_action_run(conn, run_id=run_id, status="error", output_obj={"err": "z" * 300})
+                mark_error(conn, event_id=dead, attempt_count=8, error="boom")
+                mark_done(conn, event_id=done, result={"ok": True})
+                conn.execute("UPDATE events SET processed_at='2020-01-05T00:00:00+00:00'")
+
+                fetch_chunk = retention._fetch_chunk
+
+                def requeue_after_fetch(c, ids):
+                    fetched = fetch_chunk(c, ids)
+                    requeue_dead_letters(conn, event_ids=[dead])
+                    return fetched
+
+                with mock.patch("app.retention._fetch_chunk", side_effect=requeue_after_fetch):
+                    result = archive_finished_events(conn, archive_dir=archive_dir, older_than_days=30)
+
+                self.assertEqual((result.archived_events, result.archived_action_runs), (1, 0))
+                self.assertIsNone(get_event_row(conn, event_row_id=done))
+                row = get_event_row(conn, event_row_id=dead)
+                self.assertEqual(row["status"], "pending")
+                self.assertEqual(json.loads(row["payload_json"]), {"n": "x" * 300})
+                # The requeued event's run and its blobs are still there.
+                (run,) = list_action_runs_for_event(conn, event_row_id=dead)
+                self.assertEqual(json.loads(run["input_json"]), {"payload": {"n": "x" * 300}})
+                self.assertEqual(json.loads(run["output_json"]), {"err": "z" * 300})
+                self.assertIsNone(get_archived_event(archive_dir, event_row_id=dead))
+                self.assertIsNotNone(get_archived_event(archive_dir, event_row_id=done))
+            finally:
+                conn.close()
+
+    def test_sharded_queue_runs_retention_per_assigned_shard(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            settings = Settings(
+                app_db_path=f"{td}/events.sqlite3", queue_shards=2, retention_archive_dir=f"{td}/archive"
+            )
+            store = open_queue_store(settings=settings)
+            stop = threading.Event()
+            threads: list[threading.Thread] = []
+            try:
+                store.init()
+                ids = [store.enqueue_event(source=f"s{i}", event_id="e", payload={"i": i}) for i in range(6)]
+                store.claim_events(limit=6, lease_owner="w")
+                for row_id in ids:
+                    store.mark_done(event_id=row_id, result={"ok": True}, lease_owner="w")
+                for i in range(2):
+                    store.shard(i).conn.execute("UPDATE events SET processed_at='2020-01-05T00:00:00+00:00'")
+
+                threads = start_store_retention(
+                    backend=store.backend,
+                    db_path=settings.app_db_path,
+                    shards="1",
+                    interval=0.01,
+                    stop_event=stop,
+                    settings=settings,
+                )
+                self.assertEqual([t.name for t in threads], ["retention-shard-1"])
+                on_shard_1 = [row_id for row_id in ids if row_id % 2 == 1]
+                self.assertTrue(on_shard_1)
+                deadline = time.monotonic() + 5
+                while store.get_event_row(event_row_id=on_shard_1[0]) is not None and time.monotonic() < deadline:
+                    time.sleep(0.01)
+
+                for row_id in ids:
+                    archived = get_archived_event(
+                        shard_archive_dir(settings.retention_archive_dir, row_id % 2), event_row_id=row_id // 2
+                    )
+                    self.assertEqual(archived is not None, row_id % 2 == 1)
+                    self.assertEqual(store.get_event_row(event_row_id=row_id) is None, row_id % 2 == 1)
+            finally:
+                stop.set()
+                for t in threads:
+                    t.join()
+                store.close()
+
+    def test_backends_without_retention_say_so(self) -> None:
+        out = io.StringIO()
+        with redirect_stdout(out):
+            threads = start_store_retention(
+                backend="postgres", db_path="", shards=None, interval=60, stop_event=threading.Event()
+            )
+        self.assertEqual(threads, [])
+        self.assertIn("[retention] disabled: backend=postgres", out.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
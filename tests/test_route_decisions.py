@@ -0,0 +1,54 @@
+import tempfile
+import unittest
+from unittest import mock
+
+from app.db import enqueue_event, init_db, open_db, upsert_provider_mapping
+from app.mapper import route_event, route_stored_event
+from app.queue_store import SqliteQueueStore
+from app.settings import Settings
+
+
+class TestRouteStoredEvent(unittest.TestCase):
+    def setUp(self) -> None:
+        self._td = tempfile.TemporaryDirectory()
+        self.addCleanup(self._td.cleanup)
+        self.conn = open_db(f"{self._td.name}/t.sqlite3")
+        self.addCleanup(self.conn.close)
+        init_db(self.conn)
+        self.store = SqliteQueueStore(self.conn)
+        upsert_provider_mapping(self.conn, provider="unknown", action="first", handler_mode="noop", handler_target=None)
+        self.event_row_id = enqueue_event(self.conn, source="test", event_id="e", payload={"x": 1})
+
+    def route(self, *, reroute: bool = False):
+        with mock.patch("app.mapper.get_settings") as settings, mock.patch(
+            "app.mapper.route_event", wraps=route_event
+        ) as routed:
+            settings.return_value = Settings(mapper_use_ai=False, mapper_reroute_on_config_change=reroute)
+            decision = route_stored_event(self.store, event_row_id=self.event_row_id, payload={"x": 1})
+        return decision, routed.call_count
+
+    def test_decision_is_reused_on_retry(self) -> None:
+        first, calls = self.route()
+        self.assertEqual((first.action, calls), ("first", 1))
+
+        upsert_provider_mapping(self.conn, provider="unknown", action="second", handler_mode="noop", handler_target=None)
+        again, calls = self.route()
+        self.assertEqual((again.action, calls), ("first", 0))
+        self.assertEqual(again.reasons[-1], "route:stored")
+        self.assertEqual(again.detection, first.detection)
+
+    def test_config_version_change_reroutes_when_enabled(self) -> None:
+        self.store.set_config_version(version=1)
+        self.route()
+        upsert_provider_mapping(self.conn, provider="unknown", action="second", handler_mode="noop", handler_target=None)
+        self.store.set_config_version(version=2)
+
+        self.assertEqual(self.route()[0].action, "first")
+        decision, calls = self.route(reroute=True)
+        self.assertEqual((decision.action, calls), ("second", 1))
+        self.assertEqual(self.store.get_route_decision(event_row_id=self.event_row_id)["config_version"], 2)
+        self.assertEqual(self.route(reroute=True)[1], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,166 @@
+import random
+import re
+import tempfile
+import unittest
+from unittest import mock
+
+from app.db import RoutingRule, init_db, open_db, upsert_routing_rule
+from app.mapper import provider_rule_set, route_event
+from app.queue_store import SqliteQueueStore
+from app.rule_eval import EventView, RuleSet, compile_conditions, rule_matches
+from app.settings import Settings
+
+
+PAYLOAD = {
+    "path": "/webhooks/github",
+    "content_type": "application/json; charset=utf-8",
+    "headers": {"X-GitHub-Event": "pull_request", "Content-Type": "application/json"},
+    "json": {"action": "opened", "pull_request": {"labels": [{"name": "bug"}]}},
+}
+
+
+class TestCompiledConditions(unittest.TestCase):
+    def test_matches_and_reasons(self) -> None:
+        cases = [
+            ({"op": "header_present", "name": "x-github-event"}, True, ["header_present:x-github-event"]),
+            ({"op": "header_equals", "name": "X-GitHub-Event", "value": "push"}, False, ["header_mismatch:x-github-event"]),
+            ({"op": "json_path_equals", "path": "pull_request.labels.0.name", "value": "bug"}, True, None),
+            ({"op": "json_path_exists", "path": "pull_request.labels.1"}, False, None),
+            ({"op": "json_path_regex", "path": "action", "pattern": "^(opened|reopened)$"}, True, None),
+            ({"op": "path_equals", "value": "/webhooks/github"}, True, ["path_equals:/webhooks/github"]),
+            ({"op": "path_equals", "value": "/webhooks/acme"}, False, ["path_mismatch:/webhooks/acme"]),
+            ({"op": "content_type_equals", "value": "Application/JSON"}, True, ["content_type_equals:application/json"]),
+            ({"op": "nope"}, False, ["unknown_op:nope"]),
+            ({"all": [{"op": "header_present", "name": "content-type"}, "bad"]}, False, ["invalid_condition"]),
+            (
+                {"any": [{"op": "header_present", "name": "x-a"}, {"op": "json_path_exists", "path": "action"}]},
+                True,
+                ["missing_header:x-a", "json_path_exists:action"],
+            ),
+            ({"something": 1}, False, ["invalid_rule_conditions"]),
+        ]
+        view = EventView.of(PAYLOAD)
+        for conditions, matched, reasons in cases:
+            with self.subTest(conditions=conditions):
+                match = compile_conditions(conditions)(view)
+                self.assertEqual(match.matched, matched)
+                if reasons is not None:
+                    self.assertEqual(match.reasons, reasons)
+                self.assertEqual(rule_matches(PAYLOAD, conditions), match)
+
+    def test_bad_pattern_fails_only_when_evaluated_against_a_value(self) -> None:
+        predicate = compile_conditions({"op": "json_path_regex", "path": "action", "pattern": "("})
+        self.assertFalse(predicate(EventView.of({"json": {}})).matched)
+        with self.assertRaises(re.error):
+            predicate(EventView.of(PAYLOAD))
+
+
+def _rule(pos: int, conditions: dict, *, priority: int, enabled: bool = True) -> RoutingRule:
+    return RoutingRule(
+        id=pos,
+        provider="github",
+        name=f"r{pos}",
+        priority=priority,
+        conditions=conditions,
+        action=f"a{pos}",
+        handler_mode="noop",
+        handler_target=None,
+        enabled=enabled,
+        updated_at="",
+    )
+
+
+class TestRuleSetIndex(unittest.TestCase):
+    def test_indexed_lookup_matches_linear_scan(self) -> None:
+        rnd = random.Random(7)
+        events = ["push", "issues", "pull_request", "release"]
+        actions = ["opened", "closed", 1, True, None]
+
+        def condition() -> dict:
+            return rnd.choice(
+                [
+                    {"op": "header_equals", "name": "X-GitHub-Event", "value": rnd.choice(events)},
+                    {"op": "json_path_equals", "path": "action", "value": rnd.choice(actions)},
+                    {"op": "json_path_equals", "path": "repo.owner", "value": {"login": "x"}},
+                    {"op": "json_path_exists", "path": "sender"},
+                    {"op": "header_present", "name": "x-hub-signature"},
+                ]
+            )
+
+        rules = []
+        for pos in range(300):
+            shape = rnd.random()
+            if shape < 0.6:
+                conditions = {"all": [condition() for _ in range(rnd.randint(1, 3))]}
+            elif shape < 0.8:
+                conditions = condition()
+            else:
+                conditions = {"any": [condition(), condition()]}
+            rules.append(_rule(pos, conditions, priority=rnd.randint(0, 50), enabled=rnd.random() > 0.1))
+        rules.sort(key=lambda r: (not r.enabled, r.priority, r.id))
+        rule_set = RuleSet(rules)
+        enabled = [r for r in rules if r.enabled]
+
+        for _ in range(300):
+            headers = {"X-GitHub-Event": rnd.choice(events)} if rnd.random() < 0.9 else {}
+            if rnd.random() < 0.5:
+                headers["X-Hub-Signature"] = "sha1=0"
+            body = {"action": rnd.choice(actions + ["missing"]), "sender": {}} if rnd.random() < 0.9 else None
+            if body is not None and body["action"] == "missing":
+                del body["action"]
+            payload = {"headers": headers, "json": body}
+            view = EventView.of(payload)
+
+            expected = next((r for r in enabled if rule_matches(payload, r.conditions).matched), None)
+            found = rule_set.first_match(view)
+            self.assertEqual(found[0] if found else None, expected, payload)
+
+    def test_only_candidate_rules_are_evaluated(self) -> None:
+        rules = [
+            _rule(i, {"all": [{"op": "header_equals", "name": "x-github-event", "value": f"e{i}"}]}, priority=i)
+            for i in range(1000)
+        ]
+        rules.append(_rule(1000, {"op": "header_present", "name": "x-github-event"}, priority=2000))
+        rule_set = RuleSet(rules)
+        self.assertEqual(rule_set.candidates(EventView.of({"headers": {"X-GitHub-Event": "e500"}})), [500, 1000])
+        self.assertEqual(rule_set.first_match(EventView.of({"headers": {"X-GitHub-Event": "zzz"}}))[0].name, "r1000")
+
+
+class TestRuleSetCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self._td = tempfile.TemporaryDirectory()
+        self.addCleanup(self._td.cleanup)
+        conn = open_db(f"{self._td.name}/t.sqlite3")
+        self.addCleanup(conn.close)
+        init_db(conn)
+        self.store = SqliteQueueStore(conn)
+
+    def add_rule(self, name: str, priority: int, event: str, action: str) -> None:
+        upsert_routing_rule(
+            self.store.conn,
+            provider="github",
+            name=name,
+            priority=priority,
+            conditions={"all": [{"op": "header_equals", "name": "x-github-event", "value": event}]},
+            action=action,
+        )
+
+    def test_compiled_rules_are_reused_until_a_rule_changes(self) -> None:
+        self.add_rule("pr", 10, "pull_request", "review")
+        with mock.patch.object(self.store, "list_routing_rules", wraps=self.store.list_routing_rules) as listed:
+            first = provider_rule_set(self.store, "github")
+            self.assertIs(provider_rule_set(self.store, "github"), first)
+            self.assertEqual(listed.call_count, 1)
+
+            self.add_rule("pr-first", 1, "pull_request", "triage")
+            self.assertEqual([r.name for r in provider_rule_set(self.store, "github").rules], ["pr-first", "pr"])
+            self.assertEqual(listed.call_count, 2)
+
+        with mock.patch("app.mapper.get_settings", return_value=Settings(mapper_use_ai=False)):
+            decision = route_event(self.store, PAYLOAD)
+        self.assertEqual((decision.matched_rule, decision.action), ("pr-first", "triage"))
+        self.assertIn("header_equals:x-github-event", decision.reasons)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+
+from app.db import NewEvent
+from app.queue_store import open_queue_store
+from app.settings import Settings
+from app.sharding import parse_shard_list, shard_paths
+
+
+class TestShardedQueue(unittest.TestCase):
+    def test_events_spread_across_shard_files_and_route_by_id(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            settings = Settings(app_db_path=f"{td}/events.sqlite3", queue_shards=4)
+            store = open_queue_store(settings=settings)
+            try:
+                store.init()
+                sources = [f"src{i}" for i in range(16)]
+                results = store.enqueue_events(NewEvent(source=s, event_id="e1", payload={"s": s}) for s in sources)
+                used = {store.shard_for(source=s, event_id="e1", payload={}) for s in sources}
+                self.assertGreater(len(used), 1)
+                self.assertEqual({r.row_id % 4 for r in results}, used)
+
+                for source, res in zip(sources, results):
+                    self.assertEqual(store.get_event_row(event_row_id=res.row_id)["source"], source)
+
+                store.upsert_provider_mapping(provider="github", action="triage")
+                self.assertEqual(store.get_provider_mapping(provider="github").action, "triage")
+
+                claimed = store.claim_events(limit=100, lease_owner="w")
+                self.assertEqual(sorted(e.id for e in claimed), sorted(r.row_id for r in results))
+                for event in claimed:
+                    run_id = store.create_action_run(
+                        event_row_id=event.id,
+                        provider="github",
+                        action="triage",
+                        handler_mode="noop",
+                        handler_target=None,
+                        input_obj={},
+                    )
+                    self.assertEqual(store.get_action_run(run_id=run_id)["event_row_id"], event.id)
+                    self.assertTrue(store.mark_done(event_id=event.id, result={}, lease_owner="w"))
+            finally:
+                store.close()
+
+            for path in shard_paths(settings.app_db_path, 4):
+                self.assertTrue(os.path.exists(path))
+
+    def test_worker_claims_only_assigned_shards(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            settings = Settings(app_db_path=f"{td}/events.sqlite3", queue_shards=2)
+            writer = open_queue_store(settings=settings)
+            reader = open_queue_store(settings=settings, shards="1")
+            try:
+                writer.init()
+                ids = [writer.enqueue_event(source=f"src{i}", event_id=None, payload={}) for i in range(10)]
+                claimed = reader.claim_events(limit=100)
+                self.assertTrue(claimed)
+                self.assertEqual({e.id for e in claimed}, {i for i in ids if i % 2 == 1})
+            finally:
+                writer.close()
+                reader.close()
+
+    def test_parse_shard_list(self) -> None:
+        self.assertIsNone(parse_shard_list("", 4))
+        self.assertEqual(parse_shard_list("0, 2-3", 4), [0, 2, 3])
+        with self.assertRaises(ValueError):
+            parse_shard_list("4", 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
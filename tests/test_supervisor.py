@@ -0,0 +1,77 @@
+import json
+import os
+import signal
+import tempfile
+import threading
+import time
+import unittest
+
+from app.db import enqueue_event, get_event_row, init_db, open_db
+from app.supervisor import WorkerSupervisor
+
+
+def _wait_for(predicate, timeout: float = 10.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+class TestWorkerSupervisor(unittest.TestCase):
+    def test_restarts_crashed_child_and_drains_on_stop(self) -> None:
+        with tempfile.TemporaryDirectory() as td:
+            db_path = f"{td}/t.sqlite3"
+            status_path = f"{td}/status.json"
+            conn = open_db(db_path)
+            init_db(conn)
+            ids = [enqueue_event(conn, source="test", event_id=f"e{i}", payload={}) for i in range(4)]
+
+            supervisor = WorkerSupervisor(
+                processes=2,
+                worker_kwargs={"db_path": db_path, "poll_interval": 0.05},
+                backoff_base=0.1,
+                drain_timeout=10.0,
+                status_path=status_path,
+            )
+            runner = threading.Thread(target=supervisor.run)
+            runner.start()
+            try:
+                self.assertTrue(
+                    _wait_for(lambda: all(get_event_row(conn, event_row_id=i)["status"] == "done" for i in ids))
+                )
+                self.assertTrue(_wait_for(lambda: all(c["alive"] for c in supervisor.status()["children"])))
+
+                victim = supervisor.status()["children"][0]["pid"]
+                os.kill(victim, signal.SIGKILL)
+                self.assertTrue(
+                    _wait_for(
+                        lambda: supervisor.status()["children"][0]["restarts"] == 1
+                        and supervisor.status()["children"][0]["alive"]
+                    )
+                )
+                child = supervisor.status()["children"][0]
+                self.assertNotEqual(child["pid"], victim)
+                self.assertEqual(child["last_exit"], -signal.SIGKILL)
+
+                # The restarted child keeps draining the queue.
+                late = enqueue_event(conn, source="test", event_id="late", payload={})
+                self.assertTrue(_wait_for(lambda: get_event_row(conn, event_row_id=late)["status"] == "done"))
+                self.assertTrue(_wait_for(lambda: os.path.exists(status_path)))
+            finally:
+                supervisor.stop()
+                runner.join(timeout=15)
+                conn.close()
+
+            self.assertFalse(runner.is_alive())
+            status = supervisor.status()
+            self.assertTrue(status["draining"])
+            self.assertFalse(any(c["alive"] for c in status["children"]))
+            # SIGTERM drains: children exit cleanly instead of being killed.
+            self.assertEqual([c["last_exit"] for c in status["children"]], [0, 0])
+            self.assertTrue(json.loads(open(status_path, encoding="utf-8").read())["draining"])
+
+
+if __name__ == "__main__":
+    unittest.main()